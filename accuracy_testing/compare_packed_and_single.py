@@ -0,0 +1,68 @@
+import time
+from os import environ
+
+import openai
+
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.detection.detect_violence import OpenAIClassificationBackend, create_classification_cache, request_classification
+from src.detection.packed_classification import PACKED_PROMPT_HASH, PACKED_PROMPT_NAME, PackedClassifier
+
+# Run from the repository's root with `python -m accuracy_testing.compare_packed_and_single`
+
+def cohen_kappa(firstPredictions: list[int], secondPredictions: list[int]) -> float:
+    """Returns the agreement of two binary classifiers corrected for the agreement expected by chance."""
+    count = len(firstPredictions)
+    observedAgreement = sum(first == second for first, second in zip(firstPredictions, secondPredictions)) / count
+    firstPositiveRate, secondPositiveRate = sum(firstPredictions) / count, sum(secondPredictions) / count
+    expectedAgreement = firstPositiveRate * secondPositiveRate + (1 - firstPositiveRate) * (1 - secondPositiveRate)
+    return 1.0 if expectedAgreement == 1 else (observedAgreement - expectedAgreement) / (1 - expectedAgreement)
+
+
+def compare_packed_and_single(tableName: str, VDdb: ViolenceDetectionDatabase, client: openai.OpenAI, maxPackSize: int = 10) -> None:
+    """
+    Classifies the labelled transcripts of a table with packed requests and compares the answers with the single-clip
+    predictions stored in the table (the table itself isn't updated).
+
+    Args:
+        tableName (str): The name of the labelled table.
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        client (openai.OpenAI): The OpenAI API client.
+        maxPackSize (int): The maximum number of transcripts in a packed request.
+    """
+    data = list(VDdb.iter_rows(tableName, ["episode_timeframe", "transcript", "violence", "llm_violence_prediction"],
+                               "transcript IS NOT ? AND violence IS NOT ?", (None, None)))
+    labels = {instance[0]: instance[2] for instance in data}
+
+    # The clips that weren't classified one by one yet are classified now (without updating the table)
+    singleCache = create_classification_cache(VDdb)
+    singleBackend = OpenAIClassificationBackend(client)
+    singlePredictions = {}
+    for instance in data:
+        singlePredictions[instance[0]] = instance[3] if instance[3] is not None else request_classification(instance[1], singleBackend, singleCache)[0]
+
+    classifier = PackedClassifier(client, maxPackSize, singleCache=singleCache,
+                                  packedCache=create_classification_cache(VDdb, promptName=PACKED_PROMPT_NAME, promptHash=PACKED_PROMPT_HASH))
+    startTime = time.perf_counter()
+    packedPredictions = classifier.classify({instance[0]: instance[1] for instance in data})
+    elapsedTime = time.perf_counter() - startTime
+
+    keys = [key for key in labels if singlePredictions[key] is not None and packedPredictions[key] is not None]
+    if not keys:
+        print("There are no labelled clips to compare.")
+        return
+    single, packed, actual = [singlePredictions[key] for key in keys], [packedPredictions[key] for key in keys], [labels[key] for key in keys]
+
+    print(f"Compared {len(keys)} of the {len(labels)} labelled clips (packed classification took {elapsedTime:.1f}s).")
+    print(classifier.summary())
+    print(f"Agreement between packed and single-clip answers: {sum(s == p for s, p in zip(single, packed)) / len(keys) * 100:.1f}% "
+          f"(Cohen's kappa {cohen_kappa(single, packed):.3f})")
+    print(f"Single-clip accuracy: {sum(s == a for s, a in zip(single, actual)) / len(keys) * 100:.1f}%")
+    print(f"Packed accuracy: {sum(p == a for p, a in zip(packed, actual)) / len(keys) * 100:.1f}%")
+    for key in keys:
+        if singlePredictions[key] != packedPredictions[key]:
+            print(f"  {key}: single {singlePredictions[key]}, packed {packedPredictions[key]}, label {labels[key]}")
+
+
+if __name__ == "__main__":
+    with ViolenceDetectionDatabase() as VDdb:
+        compare_packed_and_single("YalıÇapkını", VDdb, openai.OpenAI(api_key=environ.get("OPEN_AI_API_KEY"), max_retries=0))
@@ -1,4 +1,5 @@
 from src.database import ViolenceDetectionDatabase
+from src.database.violence_detection_database import CLIP_KEY_COLUMNS, PREDICTION_SOURCE_COLUMNS, TOKEN_USAGE_COLUMNS
 from src.download_and_transcription.add_clips_to_database import process_videos_in_parallel
 from src.detection.detect_violence import analyse_transcripts_in_parallel
 from src.download_and_transcription.transcribe import transcribe_audio_in_parallel
@@ -23,7 +24,18 @@ if __name__ == "__main__":
                         link="TEXT NOT NULL",
                         transcript="TEXT",
                         violence="INT",
-                        llm_violence_prediction="INT")
+                        llm_violence_prediction="INT",
+                        peak_count="INT",
+                        peak_times="TEXT",
+                        **CLIP_KEY_COLUMNS,
+                        **TOKEN_USAGE_COLUMNS,
+                        **PREDICTION_SOURCE_COLUMNS)
+
+        # Index the clips by their episode and start/end seconds (and fill the index for the rows of older runs)
+        VDdb.migrate_clip_keys(tableName)
+
+        # Track the progress of every clip, so that a stopped run picks up where it left
+        VDdb.migrate_clip_states(tableName)
 
         # Add clips to the database and download them for transcription
         process_videos_in_parallel(tableName, links, VDdb)
@@ -1,24 +1,19 @@
 from src.database.violence_detection_database import ViolenceDetectionDatabase
 
 def evaluate_accuracy(tableName, VDdb):
-    # Get the data 
-    data = VDdb.select_all(tableName, "llm_violence_prediction IS NOT ? AND violence IS NOT ?", (None, None))
+    # Compare the predictions with the labels in the database (only the counts are read)
+    statistics = VDdb.accuracy_statistics(tableName)
+    print(f"True positives: {statistics['true_positive']}, false positives: {statistics['false_positive']}, "
+          f"true negatives: {statistics['true_negative']}, false negatives: {statistics['false_negative']}")
+    print(f"Precision: {statistics['precision']}, recall: {statistics['recall']}, F1: {statistics['f1']}")
 
-    correctPredictions = 0
-
-    for instance in data:
-        # Extract the important values
-        llmPrediction = instance[4]
-        actualValue = instance[3]
-        
-        if llmPrediction == actualValue:
-            correctPredictions += 1
-    
-    accuracy = correctPredictions / len(data) * 100
+    accuracy = statistics["accuracy"] * 100
     return accuracy
 
 
 if __name__ == "__main__":
     with ViolenceDetectionDatabase() as VDdb:
         accuracy = evaluate_accuracy("YalıÇapkını", VDdb)
+        for episode, episodeStatistics in VDdb.accuracy_statistics("YalıÇapkını", byEpisode=True).items():
+            print(f"Episode {episode}: accuracy {episodeStatistics['accuracy'] * 100:.1f}%")
     print(f"The model's accuracy was {accuracy}%")
@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+
+from src.database.violence_detection_database import PRE_CLASSIFIER_PREDICTION, PREDICTION_SOURCE_COLUMNS, ViolenceDetectionDatabase
+from src.detection.pre_classifier import PRE_CLASSIFIER_PATH, PreClassifier, load_labelled_transcripts
+
+# Run from the repository's root with `python -m accuracy_testing.evaluate_pre_classifier`
+
+THRESHOLDS = [0.02, 0.05, 0.1, 0.2, 0.3]
+FOLD_COUNT = 5
+
+
+def out_of_fold_probabilities(transcripts: list[str], labels: list[int], foldCount: int = FOLD_COUNT) -> np.ndarray:
+    """Scores every transcript with a model trained on the other folds, so that no clip is scored by a model that saw its label."""
+    probabilities = np.zeros(len(transcripts))
+    folds = np.arange(len(transcripts)) % foldCount
+    for fold in range(foldCount):
+        trainIndices, testIndices = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+        model = PreClassifier().fit([transcripts[i] for i in trainIndices], [labels[i] for i in trainIndices])
+        probabilities[testIndices] = model.predict_proba([transcripts[i] for i in testIndices])
+    return probabilities
+
+
+def evaluate_pre_classifier(tableName: str, VDdb: ViolenceDetectionDatabase, thresholds: list[float] = THRESHOLDS) -> None:
+    """
+    Compares the LLM-only predictions of a labelled table with the predictions made when the clips the pre-classifier scores
+    below each threshold are marked as non-violent, then trains the pre-classifier on every labelled clip and saves it.
+    The predictions that a pre-classifier made in an earlier run are left out of the LLM-only ones.
+
+    Args:
+        tableName (str): The name of the labelled table.
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        thresholds (list[float]): The thresholds to compare.
+    """
+    keys, transcripts, labels = load_labelled_transcripts(VDdb, tableName)
+    if len(set(labels)) < 2:
+        print("Both violent and non-violent clips need to be labelled to train the pre-classifier.")
+        return
+    VDdb.create_table(tableName, **PREDICTION_SOURCE_COLUMNS) # Adds the column to the tables labelled before the source was recorded
+    llmPredictions = dict(VDdb.iter_rows(tableName, ["episode_timeframe", "llm_violence_prediction"],
+                                         "llm_violence_prediction IS NOT ? AND prediction_source IS NOT ?", (None, PRE_CLASSIFIER_PREDICTION)))
+
+    probabilities = out_of_fold_probabilities(transcripts, labels)
+    labels = np.array(labels)
+    hasLlmPrediction = np.array([key in llmPredictions for key in keys])
+    llm = np.array([llmPredictions.get(key, 0) for key in keys])
+
+    print(f"{len(keys)} labelled clips ({labels.sum()} violent), {hasLlmPrediction.sum()} of them with an LLM prediction "
+          f"({VDdb.prediction_statistics(tableName)['pre_classified']} predictions of the pre-classifier left out).")
+    if hasLlmPrediction.any():
+        print(f"LLM only: accuracy {np.mean(llm[hasLlmPrediction] == labels[hasLlmPrediction]) * 100:.1f}%")
+    for threshold in thresholds:
+        isSkipped = probabilities < threshold
+        combined = np.where(isSkipped, 0, llm)
+        line = (f"Threshold {threshold:.2f}: {isSkipped.sum()} API calls avoided ({isSkipped.mean() * 100:.1f}%), "
+                f"{(isSkipped & (labels == 1)).sum()} violent clips marked as non-violent")
+        if hasLlmPrediction.any():
+            line += f", accuracy {np.mean(combined[hasLlmPrediction] == labels[hasLlmPrediction]) * 100:.1f}%"
+        print(line)
+
+    model = PreClassifier().fit(transcripts, labels.tolist())
+    startTime = time.perf_counter()
+    for transcript in transcripts:
+        model.predict_proba([transcript])
+    print(f"Scoring takes {(time.perf_counter() - startTime) / len(transcripts) * 1000:.2f}ms per clip.")
+    model.save(PRE_CLASSIFIER_PATH)
+    print(f"Saved the model trained on every labelled clip to {PRE_CLASSIFIER_PATH}.")
+
+
+if __name__ == "__main__":
+    with ViolenceDetectionDatabase() as VDdb:
+        evaluate_pre_classifier("YalıÇapkını", VDdb)
@@ -1,25 +1,146 @@
+import concurrent.futures
+import itertools
+import os
 import tkinter as tk
-from src.database import ViolenceDetectionDatabase
 import webbrowser
 
-class LabellingApp(tk.Tk):
-    def __init__(self, tableName):
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.detection.pre_classifier import PRE_CLASSIFIER_PATH, PreClassifier
+
+# Run from the repository's root with `python -m accuracy_testing.manual_labelling_interface`
+
+UNLABELLED_CONDITION = "violence IS ? AND transcript IS NOT ?"
+# The number of clips read from the database at a time, the next page being read while the current one is labelled
+PAGE_SIZE = 50
+# The labels are committed together every few seconds instead of one transaction per click (the pending ones are committed on exit)
+LABEL_FLUSH_INTERVAL = 5.0
+KEY_BINDINGS = "V/1: violent, N/0: non-violent, S/→: skip, U/Backspace: undo, O/Enter: open the video, Esc: quit"
+
+
+def rank_by_uncertainty(VDdb: ViolenceDetectionDatabase, tableName: str, preClassifier: PreClassifier = None,
+                        chunkSize: int = 500) -> list[str]:
+    """
+    Orders the unlabelled clips of a table so that the ones whose classification is least certain are labelled first, which
+    makes every label count the most for the accuracy estimates: the clips the LLM didn't classify or the pre-classifier
+    disagrees with come first, then the ones the pre-classifier scores closest to 0.5. The transcripts are scored a chunk
+    at a time and only their keys are kept.
+
+    Args:
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        tableName (str): The name of the table to label.
+        preClassifier (PreClassifier): The local model that scores the transcripts (without it, the clips the LLM didn't
+            classify come first and the others keep their order).
+        chunkSize (int): The number of transcripts scored at a time.
+
+    Returns:
+        list[str]: The `episode_timeframe` of every unlabelled clip, the least certain first.
+    """
+    rankedClips = []
+    data = VDdb.iter_rows(tableName, ["episode_timeframe", "transcript", "llm_violence_prediction"], UNLABELLED_CONDITION, (None, None), chunkSize)
+    while chunk := list(itertools.islice(data, chunkSize)):
+        if preClassifier is not None:
+            probabilities = preClassifier.predict_proba([instance[1] for instance in chunk])
+        for index, (episodeAndTimeframe, _, llmAnswer) in enumerate(chunk):
+            if preClassifier is None:
+                rankedClips.append(((llmAnswer is not None, 0.0), episodeAndTimeframe))
+                continue
+            probability = float(probabilities[index])
+            agrees = llmAnswer is not None and int(llmAnswer) == int(probability >= 0.5)
+            rankedClips.append(((agrees, abs(probability - 0.5)), episodeAndTimeframe))
+
+    rankedClips.sort(key=lambda rankedClip: rankedClip[0]) # Stable, so the ties keep the order of their keys
+    return [episodeAndTimeframe for _, episodeAndTimeframe in rankedClips]
+
+
+class LabellingQueue():
+    """The clips to label in the given order, read from the database a page at a time with the next page read in the background."""
+    def __init__(self, VDdb: ViolenceDetectionDatabase, tableName: str, keys: list[str], pageSize: int = PAGE_SIZE) -> None:
+        """
+        Args:
+            VDdb (ViolenceDetectionDatabase): The database instance.
+            tableName (str): The name of the table to label.
+            keys (list[str]): The `episode_timeframe` of the clips, in the order they are labelled.
+            pageSize (int): The number of clips read at a time.
+        """
+        self.VDdb = VDdb
+        self.tableName = tableName
+        self.keys = keys
+        self.pageSize = pageSize
+        self.position = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(1) # Reads through its own connection
+        self._pages = {}
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+    def _read_page(self, pageIndex: int) -> dict[str, tuple]:
+        keys = self.keys[pageIndex * self.pageSize:(pageIndex + 1) * self.pageSize]
+        placeholders = ", ".join("?" * len(keys))
+        # A clip labelled elsewhere before its page is read is left out
+        rows = self.VDdb.iter_rows(self.tableName, ["episode_timeframe", "link", "transcript"],
+                                   f"episode_timeframe IN ({placeholders}) AND {UNLABELLED_CONDITION}", tuple(keys) + (None, None), len(keys))
+        return {row[0]: row for row in rows}
+
+    def _page(self, pageIndex: int) -> concurrent.futures.Future:
+        if pageIndex not in self._pages:
+            self._pages[pageIndex] = self._executor.submit(self._read_page, pageIndex)
+        return self._pages[pageIndex]
+
+    def current(self) -> tuple | None:
+        """
+        Returns the clip to label, skipping the ones that are no longer unlabelled.
+
+        Returns:
+            tuple | None: The episode and timeframe, the link and the transcript of the clip, or None once every clip was labelled.
+        """
+        while self.position < len(self.keys):
+            pageIndex = self.position // self.pageSize
+            # The current page is kept for undoing, and the next one is read while this one is labelled
+            self._page(pageIndex + 1)
+            for oldPageIndex in [index for index in self._pages if index < pageIndex - 1]:
+                del self._pages[oldPageIndex]
+
+            instance = self._page(pageIndex).result().get(self.keys[self.position])
+            if instance is not None:
+                return instance
+            self.position += 1
+        return None
+
+    def advance(self) -> None:
+        self.position += 1
+
+    def go_to(self, position: int) -> None:
+        self.position = position
+
+    @property
+    def remainingCount(self) -> int:
+        return len(self.keys) - self.position
 
+
+class LabellingApp(tk.Tk):
+    def __init__(self, tableName: str, VDdb: ViolenceDetectionDatabase, preClassifier: PreClassifier = None) -> None:
+        """
+        Args:
+            tableName (str): The name of the table to label.
+            VDdb (ViolenceDetectionDatabase): The database instance the labels are written through.
+            preClassifier (PreClassifier): The local model whose uncertainty orders the clips (see `rank_by_uncertainty`).
+        """
         # window setup
         super().__init__()
-        self.title("")
+        self.title(tableName)
         self.geometry("1000x400")
 
         # layout
         self.columnconfigure((0, 1), weight=1, uniform="a")
         self.rowconfigure((0, 1, 2, 3), weight=1, uniform="a")
 
-        # label data 
+        # label data
         self.tableName = tableName
-        self.labelData = LabellingApp.get_label_data()
-        self.labelDataIndex = -1
+        self.VDdb = VDdb
+        self.labelQueue = LabellingQueue(VDdb, tableName, rank_by_uncertainty(VDdb, tableName, preClassifier))
+        self.labelledClips = [] # The position and key of the clips labelled in this session, so that the last labels can be undone
 
-        # variables 
+        # variables
         self.transcriptVar = tk.StringVar()
         self.linkVar = tk.StringVar()
         self.timeframeVar = tk.StringVar()
@@ -32,34 +153,59 @@ class LabellingApp(tk.Tk):
         linkLabel = DataInformationLabel(self, self.linkVar, 0, 1, 1, 2)
         DataInformationLabel(self, self.timeframeVar, 0, 2, 1, 2)
         tk.Label(self, textvariable=self.remainingVar, anchor="e").grid(column=1, row=0, sticky="ne")
+        tk.Label(self, text=KEY_BINDINGS, anchor="w").grid(column=0, row=0, sticky="nw")
 
-        linkLabel.bind("<Button-1>", lambda x: webbrowser.open_new_tab(self.linkVar.get()))
+        linkLabel.bind("<Button-1>", lambda x: self.open_link())
+
+        ActionButton(self, "Violent", 0, 3, lambda: self.label(1))
+        ActionButton(self, "Non-Violent", 1, 3, lambda: self.label(0))
+
+        # keyboard controls
+        for keys, command in [(("v", "1"), lambda: self.label(1)), (("n", "0"), lambda: self.label(0)), (("s", "<Right>"), self.skip),
+                              (("u", "<BackSpace>"), self.undo), (("o", "<Return>"), self.open_link), (("<Escape>",), self.quit)]:
+            for key in keys:
+                self.bind(key, lambda event, command=command: command())
 
-        ActionButton(self, "Violent", 0, 3, lambda: self.update_database(1))
-        ActionButton(self, "Non-Violent", 1, 3, lambda: self.update_database(0))
         self.mainloop()
-    
-    def get_label_data(self):
-        with ViolenceDetectionDatabase() as VDdb:
-            return VDdb.select_all(self.tableName, "violence IS ?", (None,))
-    
-    def update_variables(self):
-        self.labelDataIndex += 1
-        if self.labelDataIndex < len(self.labelData): # Check if there are more entries
-            self.transcriptVar.set(self.labelData[self.labelDataIndex][2])
-            self.linkVar.set(self.labelData[self.labelDataIndex][1])
-            self.timeframeVar.set(self.labelData[self.labelDataIndex][0])
-            self.remainingVar.set(len(self.labelData) - self.labelDataIndex)
+        self.labelQueue.close()
+        print(f"{len(self.labelledClips)} clips labelled, {self.labelQueue.remainingCount} left.")
+
+    def update_variables(self) -> None:
+        instance = self.labelQueue.current()
+        if instance is not None: # Check if there are more entries
+            self.transcriptVar.set(instance[2])
+            self.linkVar.set(instance[1])
+            self.timeframeVar.set(instance[0])
+            self.remainingVar.set(self.labelQueue.remainingCount)
 
         else:
             print("All data labeled.")
-            self.quit()  # Optionally close the app when finished
-    
-    def update_database(self, isViolent):
-        with ViolenceDetectionDatabase() as VDdb:
-            VDdb.update_case(self.timeframeVar.get(), violence=isViolent)
+            self.after_idle(self.quit)  # Closes the app once it is finished, even before the main loop has started
+
+    def label(self, isViolent: int) -> None:
+        # Queued to the database's writer, which commits the labels in batches
+        self.VDdb.update_case(self.tableName, self.timeframeVar.get(), violence=isViolent)
+        self.labelledClips.append((self.labelQueue.position, self.timeframeVar.get()))
+        self.labelQueue.advance()
+        self.update_variables()
+
+    def skip(self) -> None:
+        self.labelQueue.advance()
         self.update_variables()
 
+    def undo(self) -> None:
+        """Removes the last label and shows its clip again (the clips skipped since then are shown again too)."""
+        if not self.labelledClips:
+            return
+        position, episodeAndTimeframe = self.labelledClips.pop()
+        # Queued after the label, so a page read again from the database (which commits the pending writes first) sees the clip unlabelled
+        self.VDdb.update_case(self.tableName, episodeAndTimeframe, violence=None)
+        self.labelQueue.go_to(position)
+        self.update_variables()
+
+    def open_link(self) -> None:
+        webbrowser.open_new_tab(self.linkVar.get())
+
 
 class DataInformationLabel(tk.Label):
     def __init__(self, parent, var, column, row, rowspan, columnspan):
@@ -74,4 +220,10 @@ class ActionButton(tk.Button):
 
 
 if __name__ == "__main__":
-    l = LabellingApp("YalıÇapkını")
\ No newline at end of file
+    tableName = "YalıÇapkını"
+    preClassifier = PreClassifier.load() if os.path.exists(PRE_CLASSIFIER_PATH) else None
+    if preClassifier is None:
+        print(f"No pre-classifier at {PRE_CLASSIFIER_PATH}, so only the clips the LLM didn't classify are moved to the front.")
+
+    with ViolenceDetectionDatabase(batchSize=PAGE_SIZE, flushInterval=LABEL_FLUSH_INTERVAL) as VDdb:
+        LabellingApp(tableName, VDdb, preClassifier)
@@ -0,0 +1,64 @@
+import concurrent.futures
+import os
+import sqlite3 as sq
+import tempfile
+import threading
+import time
+
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+
+# Run from the repository's root with `python -m benchmarks.database_write_benchmark`
+
+ROW_COUNT = 5000
+THREAD_COUNT = 16
+COLUMNS = {"episode_timeframe": "TEXT NOT NULL PRIMARY KEY", "link": "TEXT NOT NULL", "transcript": "TEXT", "llm_violence_prediction": "INT"}
+
+
+def _case_identifier(index: int) -> str:
+    return f"{index // 100}:{index % 100:02d}:00:00:{index % 100:02d}:01:30"
+
+
+def benchmark_commit_per_row(dbPath: str) -> float:
+    """The previous layer: one shared cursor behind a global lock and a commit after every insert and update."""
+    conn = sq.connect(dbPath, check_same_thread=False)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE TABLE Benchmark ({', '.join(f'{name} {type}' for name, type in COLUMNS.items())})")
+    lock = threading.Lock()
+
+    def write_row(index: int) -> None:
+        with lock:
+            cursor.execute("INSERT INTO Benchmark (episode_timeframe, link) VALUES (?, ?)", (_case_identifier(index), "link"))
+            conn.commit()
+        with lock:
+            cursor.execute("UPDATE Benchmark SET transcript = ? WHERE episode_timeframe = ?", ("Speaker A: ...", _case_identifier(index)))
+            conn.commit()
+
+    startTime = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(THREAD_COUNT) as executor:
+        list(executor.map(write_row, range(ROW_COUNT)))
+    elapsedTime = time.perf_counter() - startTime
+    conn.close()
+    return elapsedTime
+
+
+def benchmark_single_writer(dbPath: str) -> float:
+    """The current layer: every write is queued to the writer thread and committed in batches."""
+    with ViolenceDetectionDatabase(dbPath) as VDdb:
+        VDdb.create_table("Benchmark", **COLUMNS)
+
+        def write_row(index: int) -> None:
+            VDdb.add_case("Benchmark", _case_identifier(index), "link")
+            VDdb.update_case("Benchmark", _case_identifier(index), transcript="Speaker A: ...")
+
+        startTime = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(THREAD_COUNT) as executor:
+            list(executor.map(write_row, range(ROW_COUNT)))
+        VDdb.flush()
+        return time.perf_counter() - startTime
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        for name, benchmark in [("Commit per row", benchmark_commit_per_row), ("Single batched writer", benchmark_single_writer)]:
+            elapsedTime = benchmark(os.path.join(directory, f"{benchmark.__name__}.db"))
+            print(f"{name}: {ROW_COUNT} inserts + {ROW_COUNT} updates in {elapsedTime:.2f}s ({2 * ROW_COUNT / elapsedTime:.0f} rows/s)")
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from src.backends.fakes import (FakeClassificationBackend, FakeDownloadBackend, FakeMetadataBackend, FakeSeries, FakeServiceProfile,
+                                FakeTranscriptionBackend)
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.detection.detect_violence import analyse_transcripts_in_parallel
+from src.download_and_transcription.add_clips_to_database import process_videos_in_parallel
+from src.download_and_transcription.transcribe import transcribe_audio_in_parallel
+from src.pipeline.violence_detection_pipeline import run_violence_detection_pipeline
+from src.utils.metrics import get_metrics
+
+# Run from the repository's root with `python -m benchmarks.pipeline_benchmark` (see `--help` for the settings)
+
+TABLE_NAME = "Benchmark"
+
+
+def _percentile(values: list[float], percentile: float) -> float | None:
+    values = sorted(values)
+    return values[min(int(len(values) * percentile / 100), len(values) - 1)] if values else None
+
+
+def _create_backends(series: FakeSeries, arguments: argparse.Namespace) -> dict:
+    def profile(latency: float) -> FakeServiceProfile:
+        return FakeServiceProfile(latency, errorRate=arguments.error_rate, requestsPerMinute=arguments.requests_per_minute)
+
+    return {"metadataBackend": FakeMetadataBackend(series, profile(arguments.latency / 4)),
+            "downloadBackend": FakeDownloadBackend(profile(arguments.latency / 2), arguments.seed),
+            "transcriptionBackend": FakeTranscriptionBackend(profile(arguments.latency * 4), arguments.seed),
+            "classificationBackend": FakeClassificationBackend(profile(arguments.latency), arguments.seed)}
+
+
+def run_benchmark(mode: str, arguments: argparse.Namespace) -> dict:
+    """
+    Runs the whole pipeline on a fake series in a temporary directory, either as a stream or one stage after the other.
+
+    Args:
+        mode (str): "streaming" or "sequential".
+        arguments (argparse.Namespace): The settings of the benchmark.
+
+    Returns:
+        dict: The throughput, the latencies of every stage and the peak memory of the run.
+    """
+    series = FakeSeries(arguments.episodes, arguments.episode_minutes, arguments.seed)
+    backends = _create_backends(series, arguments)
+    workingDirectory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with ViolenceDetectionDatabase(os.path.join(directory, "benchmark.db")) as VDdb:
+                VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+                VDdb.migrate_clip_keys(TABLE_NAME)
+                VDdb.migrate_clip_states(TABLE_NAME)
+
+                tracemalloc.start()
+                startTime = time.perf_counter()
+                if mode == "streaming":
+                    report = run_violence_detection_pipeline(TABLE_NAME, series.links, VDdb, None, None, **backends)
+                    stageLatencies = report.stageLatencies
+                else:
+                    process_videos_in_parallel(TABLE_NAME, series.links, VDdb, fetcher=backends["metadataBackend"],
+                                               downloader=backends["downloadBackend"])
+                    VDdb.flush()
+                    transcribe_audio_in_parallel(None, TABLE_NAME, VDdb, backends["transcriptionBackend"])
+                    VDdb.flush()
+                    analyse_transcripts_in_parallel(None, TABLE_NAME, VDdb, backend=backends["classificationBackend"])
+                    VDdb.flush()
+                    stageLatencies = {}
+                elapsedTime = time.perf_counter() - startTime
+                _, peakTracedMemory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                classifiedCount = VDdb.count_rows(TABLE_NAME, "llm_violence_prediction IS NOT ?", (None,))
+        finally:
+            os.chdir(workingDirectory)
+
+    # The latencies of the fake services themselves, which are the same in both modes
+    serviceLatencies = {name: backend.service.latencies for name, backend in backends.items()}
+    return {
+        "mode": mode,
+        "episodes": arguments.episodes,
+        "classifiedClips": classifiedCount,
+        "seconds": elapsedTime,
+        "clipsPerSecond": classifiedCount / elapsedTime if elapsedTime else 0.0,
+        "stageLatencies": {name: {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95), "count": len(latencies)}
+                           for name, latencies in {**stageLatencies, **serviceLatencies}.items()},
+        "rateLimitedRequests": {name: backend.service.rateLimiter.rateLimitedCount for name, backend in backends.items()},
+        "peakTracedMemoryMb": peakTracedMemory / 2 ** 20,
+        "maxResidentMemoryMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10, # In kilobytes on Linux
+    }
+
+
+def _print_result(result: dict) -> None:
+    print(f"{result['mode']}: {result['classifiedClips']} clips of {result['episodes']} episodes classified in {result['seconds']:.2f}s "
+          f"({result['clipsPerSecond']:.1f} clips/s), peak traced memory {result['peakTracedMemoryMb']:.1f}MB, "
+          f"max RSS {result['maxResidentMemoryMb']:.0f}MB")
+    for name, latencies in result["stageLatencies"].items():
+        if latencies["count"]:
+            print(f"  {name}: {latencies['count']} calls, p50 {latencies['p50'] * 1000:.0f}ms, p95 {latencies['p95'] * 1000:.0f}ms"
+                  + (f", {result['rateLimitedRequests'][name]} rate limited" if name in result["rateLimitedRequests"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the throughput of the pipeline against local fake backends.")
+    parser.add_argument("--episodes", type=int, default=10, help="The number of episodes of the fake series.")
+    parser.add_argument("--episode-minutes", type=int, default=120, help="The length of every episode in minutes.")
+    parser.add_argument("--mode", choices=["streaming", "sequential", "both"], default="both")
+    parser.add_argument("--latency", type=float, default=0.05, help="The latency of a classification request in seconds "
+                                                                    "(transcriptions take four times as long).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="The probability of a fake request failing.")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="The server-side rate limit of every fake backend.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="The path to write the results to as JSON.")
+    parser.add_argument("--metrics", help="The path to export the metrics of every run to ('.json' for a snapshot, Prometheus text otherwise).")
+    arguments = parser.parse_args()
+
+    results = [run_benchmark(mode, arguments) for mode in (["streaming", "sequential"] if arguments.mode == "both" else [arguments.mode])]
+    for result in results:
+        _print_result(result)
+    if arguments.json:
+        with open(arguments.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if arguments.metrics:
+        get_metrics().export(arguments.metrics)
@@ -0,0 +1,53 @@
+import os
+import random
+import tempfile
+import time
+
+from src.backends.fakes import NON_VIOLENT_SENTENCES, VIOLENT_SENTENCES
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+
+# Run from the repository's root with `python -m benchmarks.utterance_search_benchmark`
+
+TABLE_COUNT = 5
+CLIPS_PER_TABLE = 4000
+UTTERANCES_PER_CLIP = 12
+QUERIES = [("döverim", False), ("canımı yakıyorsun", True), ("öldür*", False), ("düğün* AND konak*", False)]
+
+
+def _fill_tables(VDdb: ViolenceDetectionDatabase) -> None:
+    """Adds clips whose transcripts are made of the fake backends' sentences, with their utterances."""
+    sentenceRandom = random.Random(0)
+    for tableIndex in range(TABLE_COUNT):
+        tableName = f"Series{tableIndex}"
+        VDdb.create_table(tableName, **SERIES_TABLE_COLUMNS)
+        for clipIndex in range(CLIPS_PER_TABLE):
+            episodeAndTimeframe = f"{clipIndex // 50 + 1}:{clipIndex % 50:02d}:00:00:{clipIndex % 50:02d}:01:30"
+            utterances = [{"speaker": "AB"[index % 2], "text": sentenceRandom.choice(VIOLENT_SENTENCES if sentenceRandom.random() < 0.02 else NON_VIOLENT_SENTENCES),
+                           "start": index * 3000, "end": index * 3000 + 2500} for index in range(UTTERANCES_PER_CLIP)]
+            VDdb.add_case(tableName, episodeAndTimeframe, "link",
+                          transcript=" | ".join(f"Speaker {utterance['speaker']}: {utterance['text']}" for utterance in utterances))
+            VDdb.store_utterances(tableName, utterances, episodeAndTimeframe)
+    VDdb.flush()
+
+
+def _like_search(VDdb: ViolenceDetectionDatabase, text: str) -> int:
+    """The previous way of searching: a `LIKE` scan of the flattened transcripts of every table."""
+    return sum(VDdb.count_rows(f"Series{tableIndex}", "transcript LIKE ?", (f"%{text}%",)) for tableIndex in range(TABLE_COUNT))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        with ViolenceDetectionDatabase(os.path.join(directory, "search.db")) as VDdb:
+            startTime = time.perf_counter()
+            _fill_tables(VDdb)
+            print(f"Stored {TABLE_COUNT * CLIPS_PER_TABLE * UTTERANCES_PER_CLIP} utterances in {time.perf_counter() - startTime:.1f}s")
+
+            for query, phrase in QUERIES:
+                startTime = time.perf_counter()
+                matches = VDdb.search_utterances(query, phrase=phrase, limit=1000)
+                searchTime = time.perf_counter() - startTime
+                print(f"FTS5 '{query}'{' (phrase)' if phrase else ''}: {len(matches)} utterances in {searchTime * 1000:.1f}ms")
+
+            startTime = time.perf_counter()
+            matchCount = _like_search(VDdb, "döverim")
+            print(f"LIKE '%döverim%' over the flattened transcripts: {matchCount} clips in {(time.perf_counter() - startTime) * 1000:.1f}ms")
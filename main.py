@@ -1,8 +1,16 @@
-from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
 from src.download_and_transcription.add_clips_to_database import process_videos_in_parallel
 from src.detection.detect_violence import analyse_transcripts_in_parallel
-from src.download_and_transcription.transcribe import transcribe_audio_in_parallel
+from src.detection.batch_classification import classify_transcripts_in_batch
+from src.detection.packed_classification import analyse_transcripts_packed
+from src.detection.pre_classifier import PRE_CLASSIFIER_PATH, PreClassifier
+from src.download_and_transcription.preprocess_audio import AudioPreprocessor, preprocess_audio_in_parallel
+from src.download_and_transcription.transcribe import transcribe_audio_asynchronously
+from src.pipeline.resume import resume_unfinished_clips
+from src.pipeline.violence_detection_pipeline import run_violence_detection_pipeline
+from src.utils.metrics import METRICS_PATH, MetricsExporter, get_metrics
 from os import environ
+import contextlib
 
 def main():
     # Initialize the connection with the database
@@ -28,29 +36,79 @@ def main():
         tableName = "SenAnlatKaradeniz"
 
         # Create table
-        VDdb.create_table(tableName, 
-                        episode_timeframe="TEXT NOT NULL PRIMARY KEY",
-                        link="TEXT NOT NULL",
-                        transcript="TEXT",
-                        llm_violence_prediction="INT")
-
-        # Add clips to the database and download them for transcription
-        process_videos_in_parallel(tableName, links, VDdb)
-
-        # Transcribe the clips
-        transcribe_audio_in_parallel(aaiApiKey, tableName, VDdb)
-
-        # Detect the percentage of violent clips (toward women)
-        analyse_transcripts_in_parallel(openAiApiKey, tableName, VDdb)
-
-        # Calculate Percentage
-        data = VDdb.select_all(tableName, "llm_violence_prediction IS NOT ?", (None,))
-        violentCount = 0
-        for instance in data:
-            if instance[3] == 1: # Check if the llm_violence_prediction is violent for the instance
-                violentCount += 1
-        violentPercentage = violentCount / len(data) * 100
-        print(f"Violent Percentage: {violentPercentage}%")
+        VDdb.create_table(tableName, **SERIES_TABLE_COLUMNS)
+
+        # Index the clips by their episode and start/end seconds (and fill the index for the rows of older runs)
+        VDdb.migrate_clip_keys(tableName)
+
+        # Track the progress of every clip, so that a crashed or stopped run can be resumed (failed clips are retried up to
+        # `VDdb.retryPolicy.maxAttempts` times, with an exponential backoff)
+        VDdb.migrate_clip_states(tableName)
+
+        # Store the utterances of the clips transcribed before they were kept, so that every transcript can be searched
+        # (e.g., `VDdb.search_utterances("döverim OR öldürürüm")`)
+        VDdb.migrate_utterances(tableName)
+
+        # Set to True to mark the clearly non-violent transcripts without asking the LLM, with the model trained by
+        # `accuracy_testing/evaluate_pre_classifier.py` (it is used in every classification mode)
+        usePreClassifier = False
+        # The clips scored below this probability of being violent skip the LLM (raise it to skip more clips, see the
+        # accuracy of every threshold printed by `accuracy_testing/evaluate_pre_classifier.py`)
+        preClassifierThreshold = 0.1
+
+        # Set to False to run the stages one after the other (each stage then waits for the previous one to finish)
+        streaming = True
+        # How the transcripts are classified when the stages are run one after the other: "parallel" (one request per clip),
+        # "packed" (several clips per request) or "batch" (a single batch job)
+        classificationMode = "parallel"
+
+        # Set to False to upload the clips as they were downloaded, instead of converting them to mono 16 kHz speech at a low
+        # bitrate and trimming their leading and trailing silence on the local cores first
+        preprocessAudio = True
+
+        # Set to False to skip finishing the clips that a previous run left behind before processing the links
+        resume = True
+
+        preClassifier = PreClassifier.load(PRE_CLASSIFIER_PATH, threshold=preClassifierThreshold) if usePreClassifier else None
+
+        # Export the latency, counters and queue depths of every stage to ./data/metrics.prom every minute and at the end of the run
+        # (a path ending with '.json' exports a JSON snapshot instead)
+        with MetricsExporter(get_metrics(), METRICS_PATH, interval=60), \
+             AudioPreprocessor() if preprocessAudio else contextlib.nullcontext() as preprocessor:
+            if resume:
+                resume_unfinished_clips(tableName, VDdb, aaiApiKey, openAiApiKey, preClassifier=preClassifier, preprocessor=preprocessor)
+
+            if streaming:
+                # Download, transcribe and classify the clips as a stream, each clip moving on as soon as it is ready
+                report = run_violence_detection_pipeline(tableName, links, VDdb, aaiApiKey, openAiApiKey, preClassifier=preClassifier,
+                                                         preprocessor=preprocessor)
+                print(report.summary())
+
+            else:
+                # Add clips to the database and download them for transcription
+                process_videos_in_parallel(tableName, links, VDdb)
+
+                # Shrink the downloaded clips before they are uploaded
+                if preprocessor is not None:
+                    preprocess_audio_in_parallel(tableName, VDdb, preprocessor)
+
+                # Transcribe the clips (every clip is submitted at once and the jobs are polled from a single loop)
+                transcribe_audio_asynchronously(aaiApiKey, tableName, VDdb)
+
+                # Detect the percentage of violent clips (toward women)
+                if classificationMode == "batch":
+                    classify_transcripts_in_batch(openAiApiKey, tableName, VDdb, preClassifier=preClassifier)
+                elif classificationMode == "packed":
+                    analyse_transcripts_packed(openAiApiKey, tableName, VDdb, preClassifier=preClassifier)
+                else:
+                    analyse_transcripts_in_parallel(openAiApiKey, tableName, VDdb, preClassifier=preClassifier)
+
+        print(get_metrics().summary())
+
+        # Calculate Percentage (each clip counts once for every heatmap peak that it covers)
+        statistics = VDdb.prediction_statistics(tableName)
+        print(f"Violent Percentage: {statistics['violent_percentage']}% ({statistics['violent']} of {statistics['classified']} classified clips, "
+              f"{statistics['pre_classified']} of them marked as non-violent by the pre-classifier)")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
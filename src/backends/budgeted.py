@@ -0,0 +1,63 @@
+from src.backends.interfaces import ClassificationBackend, DownloadBackend, MetadataBackend, TranscriptionBackend
+from src.detection.token_budget import TokenUsage
+from src.utils.resource_budget import FairSemaphore
+from src.utils.video_metadata import VideoMetadata
+
+# Wrappers that hold a slot of a shared `ResourceBudget` for every request of a series, so that several series can be
+# processed at the same time without their total use of a resource going over the budget.
+
+
+class BudgetedMetadataBackend():
+    """Scrapes a video while holding a scrape slot."""
+    def __init__(self, backend: MetadataBackend, semaphore: FairSemaphore, owner: str) -> None:
+        self.backend = backend
+        self.semaphore = semaphore
+        self.owner = owner
+
+    def fetch(self, videoLink: str) -> VideoMetadata:
+        with self.semaphore.slot(self.owner):
+            return self.backend.fetch(videoLink)
+
+
+class BudgetedDownloadBackend():
+    """Downloads the clips of a video while holding a download slot (the clips of the video share the slot)."""
+    def __init__(self, backend: DownloadBackend, semaphore: FairSemaphore, owner: str) -> None:
+        self.backend = backend
+        self.semaphore = semaphore
+        self.owner = owner
+
+    def download_ranges(self, tableName: str, videoLink: str, fileType: str,
+                        sectionsToDownload: list[tuple[str]]) -> dict[tuple[str], tuple[str, str | None]]:
+        with self.semaphore.slot(self.owner):
+            return self.backend.download_ranges(tableName, videoLink, fileType, sectionsToDownload)
+
+
+class BudgetedTranscriptionBackend():
+    """Transcribes a clip while holding a transcription slot."""
+    def __init__(self, backend: TranscriptionBackend, semaphore: FairSemaphore, owner: str) -> None:
+        self.backend = backend
+        self.semaphore = semaphore
+        self.owner = owner
+        # Part of the key of the transcript cache
+        self.languageCode = backend.languageCode
+        self.speakerLabels = backend.speakerLabels
+
+    def transcribe(self, audioPath: str) -> list[dict]:
+        with self.semaphore.slot(self.owner):
+            return self.backend.transcribe(audioPath)
+
+
+class BudgetedClassificationBackend():
+    """Classifies a transcript while holding a classification slot."""
+    def __init__(self, backend: ClassificationBackend, semaphore: FairSemaphore, owner: str) -> None:
+        self.backend = backend
+        self.semaphore = semaphore
+        self.owner = owner
+
+    def classify(self, transcript: str) -> int | None:
+        with self.semaphore.slot(self.owner):
+            return self.backend.classify(transcript)
+
+    def classify_with_usage(self, transcript: str) -> tuple[int | None, TokenUsage]:
+        with self.semaphore.slot(self.owner):
+            return self.backend.classify_with_usage(transcript)
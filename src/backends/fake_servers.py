@@ -0,0 +1,428 @@
+import email.parser
+import email.policy
+import http.server
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from src.backends.fakes import VIOLENT_KEYWORDS, fake_utterances
+
+# Local HTTP stand-ins for the services the pipeline talks to over the network, so that the code paths that make real
+# HTTP requests (ffmpeg reading a resolved stream, the asynchronous transcription engine, the batch classification, ...) can be tested and benchmarked without network access or API costs.
+
+
+class _QuietHandler(http.server.BaseHTTPRequestHandler):
+    """A request handler that doesn't log every request and counts them on its server."""
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def owner(self) -> "_LocalServer":
+        return self.server.owner
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send(self, statusCode: int, body: bytes = b"", headers: dict = None) -> None:
+        self.send_response(statusCode)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        # A client closing the connection early (e.g., ffmpeg once it has read the range it needs) isn't an error of the server
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _LocalServer():
+    """An HTTP server on a free local port, serving from a background thread until it is closed."""
+    def __init__(self, handlerClass: type[_QuietHandler]) -> None:
+        self.server = _HTTPServer(("127.0.0.1", 0), handlerClass)
+        self.server.owner = self
+        self.requestCounts = Counter() # By method and path
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self, method: str, path: str) -> None:
+        with self._lock:
+            self.requestCounts[(method, path)] += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _MediaHandler(_QuietHandler):
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        path = self.path.split("?")[0]
+        self.owner.count_request(self.command, path)
+        if any(self.headers.get(key) != value for key, value in self.owner.requiredHeaders.items()):
+            return self._send(403, b"Forbidden")
+        filePath = os.path.join(self.owner.directory, os.path.basename(path))
+        if not os.path.isfile(filePath):
+            return self._send(404, b"Not Found")
+
+        with open(filePath, "rb") as file:
+            content = file.read()
+        # ffmpeg seeks into a stream with byte ranges, as it does on the real media servers
+        rangeMatch = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if rangeMatch is None:
+            return self._send(200, content, {"Content-Type": "application/octet-stream", "Accept-Ranges": "bytes"})
+        start = int(rangeMatch.group(1))
+        end = min(int(rangeMatch.group(2)) if rangeMatch.group(2) else len(content) - 1, len(content) - 1)
+        if start >= len(content):
+            return self._send(416, headers={"Content-Range": f"bytes */{len(content)}"})
+        self._send(206, content[start:end + 1], {"Content-Type": "application/octet-stream", "Accept-Ranges": "bytes",
+                                                 "Content-Range": f"bytes {start}-{end}/{len(content)}"})
+
+
+class LocalMediaServer(_LocalServer):
+    """
+    Serves the media files of a directory the way a resolved stream URL is served: with byte ranges, and only to the
+    requests that send the HTTP headers yt-dlp resolved along with the URL.
+    """
+    def __init__(self, directory: str, requiredHeaders: dict[str, str] = None) -> None:
+        """
+        Args:
+            directory (str): The directory of the media files (served as `/<file name>`).
+            requiredHeaders (dict[str, str]): The headers a request must send (others get a 403 response).
+        """
+        self.directory = directory
+        self.requiredHeaders = requiredHeaders or {}
+        super().__init__(_MediaHandler)
+
+    def file_url(self, fileName: str) -> str:
+        return f"{self.url}/{fileName}"
+
+
+class _JSONHandler(_QuietHandler):
+    """A request handler of a JSON API."""
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send_json(self, statusCode: int, content: dict, headers: dict = None) -> None:
+        self._send(statusCode, json.dumps(content).encode(), {"Content-Type": "application/json", **(headers or {})})
+
+
+class _AssemblyAIHandler(_JSONHandler):
+    def _refused(self) -> bool:
+        """Sends the response of a request that isn't served (a wrong API key or a rate limit), if it isn't."""
+        if self.headers.get("authorization") != self.owner.apiKey:
+            self._send_json(401, {"error": "Authentication error, API token missing/invalid"})
+            return True
+        if self.owner.take_rate_limit():
+            self._send_json(429, {"error": "Too Many Requests"}, {"Retry-After": "0.05"})
+            return True
+        return False
+
+    def do_POST(self) -> None:
+        self.owner.count_request(self.command, self.path)
+        body = self._read_body()
+        if self._refused():
+            return
+        if self.path == "/v2/upload":
+            uploadId = self.owner.store_upload(body)
+            return self._send_json(200, {"upload_url": f"{self.owner.url}/v2/uploads/{uploadId}"})
+        if self.path == "/v2/transcript":
+            request = json.loads(body)
+            uploadId = request.get("audio_url", "").rsplit("/", 1)[-1]
+            if uploadId not in self.owner.uploads:
+                return self._send_json(400, {"error": "The audio URL isn't reachable"})
+            return self._send_json(200, {"id": self.owner.create_job(uploadId), "status": "queued"})
+        self._send_json(404, {"error": "Not found"})
+
+    def do_GET(self) -> None:
+        transcriptId = self.path.removeprefix("/v2/transcript/")
+        self.owner.count_request(self.command, "/v2/transcript/<id>" if transcriptId != self.path else self.path)
+        if self._refused():
+            return
+        transcript = self.owner.job_status(transcriptId)
+        if transcript is None:
+            return self._send_json(404, {"error": "Transcript not found"})
+        self._send_json(200, transcript)
+
+
+class FakeAssemblyAIServer(_LocalServer):
+    """
+    Serves the part of AssemblyAI's API the transcription engine uses (uploading a file, submitting its transcription and
+    polling its status), transcribing every file into the utterances `FakeTranscriptionBackend` gives it. Files whose
+    content starts with one of the markers below fail in the ways the real service (or the network) can fail.
+    """
+    # The job fails as the audio can't be decoded
+    UNREADABLE_AUDIO = b"unreadable"
+    # The job is lost: its status is never found
+    LOST_AUDIO = b"lost"
+    # The status responses of the job have no status
+    MALFORMED_AUDIO = b"malformed"
+    # The job never finishes
+    STUCK_AUDIO = b"stuck"
+
+    def __init__(self, apiKey: str = "test-key", processingSeconds: float = 0.05, uploadSeconds: float = 0.0,
+                 rateLimitedRequests: int = 0, violentShare: float = 0.15) -> None:
+        """
+        Args:
+            apiKey (str): The API key every request must send in its `authorization` header (others get a 401 response).
+            processingSeconds (float): Seconds after its submission after which a job is completed.
+            uploadSeconds (float): Seconds an upload takes, so that concurrent uploads overlap.
+            rateLimitedRequests (int): The number of first requests that get a 429 response.
+            violentShare (float): The share of files transcribed with a violent sentence.
+        """
+        self.apiKey = apiKey
+        self.processingSeconds = processingSeconds
+        self.uploadSeconds = uploadSeconds
+        self.rateLimitedRequests = rateLimitedRequests
+        self.violentShare = violentShare
+        self.uploads = {}
+        self.jobs = {}
+        self.activeUploads = 0
+        self.peakUploads = 0
+        self.openJobs = 0 # Submitted and not yet seen finished by a status check
+        self.peakOpenJobs = 0
+        self._ids = itertools.count(1)
+        super().__init__(_AssemblyAIHandler)
+
+    def take_rate_limit(self) -> bool:
+        with self._lock:
+            if self.rateLimitedRequests <= 0:
+                return False
+            self.rateLimitedRequests -= 1
+            return True
+
+    def store_upload(self, content: bytes) -> str:
+        with self._lock:
+            self.activeUploads += 1
+            self.peakUploads = max(self.peakUploads, self.activeUploads)
+        time.sleep(self.uploadSeconds)
+        with self._lock:
+            self.activeUploads -= 1
+            uploadId = f"upload-{next(self._ids)}"
+            self.uploads[uploadId] = content
+        return uploadId
+
+    def create_job(self, uploadId: str) -> str:
+        with self._lock:
+            transcriptId = f"transcript-{next(self._ids)}"
+            self.jobs[transcriptId] = {"content": self.uploads[uploadId], "submitted": time.monotonic(), "finished": False}
+            self.openJobs += 1
+            self.peakOpenJobs = max(self.peakOpenJobs, self.openJobs)
+        return transcriptId
+
+    def job_status(self, transcriptId: str) -> dict | None:
+        """Returns the transcript of a job as the status endpoint gives it (None if the job isn't found)."""
+        with self._lock:
+            job = self.jobs.get(transcriptId)
+            if job is None or job["content"].startswith(self.LOST_AUDIO):
+                return None
+            if job["content"].startswith(self.MALFORMED_AUDIO):
+                return {"id": transcriptId}
+            if job["content"].startswith(self.STUCK_AUDIO) or time.monotonic() - job["submitted"] < self.processingSeconds:
+                return {"id": transcriptId, "status": "processing"}
+
+            if not job["finished"]:
+                job["finished"] = True
+                self.openJobs -= 1
+            if job["content"].startswith(self.UNREADABLE_AUDIO):
+                return {"id": transcriptId, "status": "error", "error": "Transcoding failed. File does not appear to contain audio."}
+            utterances = fake_utterances(job["content"], self.violentShare)
+            return {"id": transcriptId, "status": "completed", "text": " ".join(utterance["text"] for utterance in utterances),
+                    "utterances": utterances}
+
+
+class _OpenAIHandler(_JSONHandler):
+    def _refused(self) -> bool:
+        if self.headers.get("authorization") != f"Bearer {self.owner.apiKey}":
+            self._send_json(401, {"error": {"message": "Incorrect API key provided", "type": "invalid_request_error"}})
+            return True
+        return False
+
+    def do_POST(self) -> None:
+        self.owner.count_request(self.command, self.path)
+        body = self._read_body()
+        if self._refused():
+            return
+        if self.path == "/v1/files":
+            # The file is sent as multipart form data along with its purpose
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            parts = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            fileObject = self.owner.store_file(parts["file"].get_content(), parts["file"].get_filename(), parts["purpose"].get_content())
+            return self._send_json(200, fileObject)
+        if self.path == "/v1/chat/completions":
+            return self._send_json(200, self.owner.chat_completion(json.loads(body)), self.owner.RATE_LIMIT_HEADERS)
+        if self.path == "/v1/batches":
+            request = json.loads(body)
+            if request.get("input_file_id") not in self.owner.files:
+                return self._send_json(400, {"error": {"message": "The input file doesn't exist", "type": "invalid_request_error"}})
+            return self._send_json(200, self.owner.create_batch(request))
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_GET(self) -> None:
+        pathMatch = re.fullmatch(r"/v1/(batches|files)/([^/]+)(/content)?", self.path)
+        self.owner.count_request(self.command, f"/v1/{pathMatch.group(1)}/<id>{pathMatch.group(3) or ''}" if pathMatch else self.path)
+        if self._refused():
+            return
+        if pathMatch and pathMatch.group(1) == "batches" and not pathMatch.group(3):
+            batch = self.owner.batch_status(pathMatch.group(2))
+            if batch is not None:
+                return self._send_json(200, batch)
+        elif pathMatch and pathMatch.group(1) == "files" and pathMatch.group(3) and pathMatch.group(2) in self.owner.files:
+            return self._send(200, self.owner.files[pathMatch.group(2)]["content"], {"Content-Type": "application/octet-stream"})
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+
+class FakeOpenAIServer(_LocalServer):
+    """
+    Serves the part of OpenAI's API the classification uses: the chat completions of the single-clip and the packed
+    prompts, and the batches (uploading the input file, creating the batch, polling it and downloading its output and
+    error files). Every transcript is classified as violent if it contains one of the violent keywords, like
+    `FakeClassificationBackend` without noise, and the transcripts that contain `FAILING_MARKER` get no classification.
+    The usage of every answer counts a token per four characters, the system message being cached after its first request.
+    """
+    FAILING_MARKER = "[fail]"
+    # The limits of the account, sent with every answer as OpenAI does (high, so that the tests aren't slowed down by the default limits)
+    RATE_LIMIT_HEADERS = {"x-ratelimit-limit-requests": "30000", "x-ratelimit-limit-tokens": "150000000"}
+
+    def __init__(self, apiKey: str = "test-key", processingSeconds: float = 0.05, processedLimit: int | None = None) -> None:
+        """
+        Args:
+            apiKey (str): The API key every request must send as a bearer token (others get a 401 response).
+            processingSeconds (float): Seconds after its creation after which a batch is finished.
+            processedLimit (int | None): The number of requests of a batch processed before it expires (None processes them all).
+        """
+        self.apiKey = apiKey
+        self.processingSeconds = processingSeconds
+        self.processedLimit = processedLimit
+        self.files = {}
+        self.batches = {}
+        self.requestBodies = [] # The body of every request the batches contained
+        self.chatRequestBodies = [] # The body of every chat completion request
+        self.chatUsages = [] # The usage of every chat completion answer
+        self.batchUsages = {} # The usage of every answered batch request, by its custom ID
+        self._cachedPrefixes = set()
+        self._ids = itertools.count(1)
+        super().__init__(_OpenAIHandler)
+
+    @property
+    def baseUrl(self) -> str:
+        return f"{self.url}/v1"
+
+    def store_file(self, content: bytes, fileName: str, purpose: str) -> dict:
+        with self._lock:
+            fileId = f"file-{next(self._ids)}"
+            fileObject = {"id": fileId, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                          "filename": fileName, "purpose": purpose, "status": "processed"}
+            self.files[fileId] = {"content": content, "object": fileObject}
+        return fileObject
+
+    def create_batch(self, request: dict) -> dict:
+        with self._lock:
+            batchId = f"batch-{next(self._ids)}"
+            requestCount = len(self.files[request["input_file_id"]]["content"].splitlines())
+            self.batches[batchId] = {"id": batchId, "object": "batch", "endpoint": request["endpoint"], "errors": None,
+                                     "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                                     "status": "validating", "output_file_id": None, "error_file_id": None,
+                                     "created_at": int(time.time()), "metadata": request.get("metadata"),
+                                     "request_counts": {"total": requestCount, "completed": 0, "failed": 0}}
+            self.batches[batchId]["submitted"] = time.monotonic()
+        return self._public_batch(batchId)
+
+    def _public_batch(self, batchId: str) -> dict:
+        return {key: value for key, value in self.batches[batchId].items() if key != "submitted"}
+
+    def batch_status(self, batchId: str) -> dict | None:
+        """Returns a batch as the batch endpoint gives it, running its requests once it is due (None if it isn't found)."""
+        with self._lock:
+            batch = self.batches.get(batchId)
+            if batch is None:
+                return None
+            if batch["status"] in {"validating", "in_progress"}:
+                if time.monotonic() - batch["submitted"] < self.processingSeconds:
+                    batch["status"] = "in_progress"
+                else:
+                    self._run_batch(batch)
+            return self._public_batch(batchId)
+
+    def _answer(self, body: dict) -> dict:
+        """Builds the body of the answer to a chat completion request (with the lock held)."""
+        systemMessage, transcript = body["messages"][0]["content"], body["messages"][-1]["content"]
+        toolName = body["tool_choice"]["function"]["name"]
+        if toolName == "insert_violence_data_batch":
+            # A packed request: every transcript follows its clip_id line
+            clips = re.split(r"(?:^|\n\n)clip_id: (\d+)\n", transcript)[1:]
+            arguments = {"classifications": [{"clip_id": clipId, "classification": int(any(keyword in clipTranscript for keyword in VIOLENT_KEYWORDS))}
+                                             for clipId, clipTranscript in zip(clips[::2], clips[1::2]) if self.FAILING_MARKER not in clipTranscript]}
+        elif self.FAILING_MARKER in transcript:
+            arguments = {}
+        else:
+            arguments = {"classification": int(any(keyword in transcript for keyword in VIOLENT_KEYWORDS))}
+
+        argumentsText = json.dumps(arguments)
+        promptTokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        cachedTokens = len(systemMessage) // 4 if systemMessage in self._cachedPrefixes else 0
+        self._cachedPrefixes.add(systemMessage)
+        usage = {"prompt_tokens": promptTokens, "completion_tokens": len(argumentsText) // 4 + 1,
+                 "total_tokens": promptTokens + len(argumentsText) // 4 + 1, "prompt_tokens_details": {"cached_tokens": cachedTokens}}
+        toolCall = {"id": f"call-{next(self._ids)}", "type": "function", "function": {"name": toolName, "arguments": argumentsText}}
+        return {"id": f"chatcmpl-{next(self._ids)}", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": None, "tool_calls": [toolCall]}, "finish_reason": "stop"}],
+                "usage": usage}
+
+    def chat_completion(self, body: dict) -> dict:
+        with self._lock:
+            answer = self._answer(body)
+            self.chatRequestBodies.append(body)
+            self.chatUsages.append(answer["usage"])
+        return answer
+
+    def _run_batch(self, batch: dict) -> None:
+        outputLines, errorLines = [], []
+        requests = [json.loads(line) for line in self.files[batch["input_file_id"]]["content"].splitlines() if line.strip()]
+        if self.processedLimit is not None:
+            requests = requests[:self.processedLimit]
+        for request in requests:
+            self.requestBodies.append(request["body"])
+            transcript = request["body"]["messages"][-1]["content"]
+            if self.FAILING_MARKER in transcript:
+                errorLines.append({"id": f"response-{next(self._ids)}", "custom_id": request["custom_id"], "response": None,
+                                   "error": {"code": "server_error", "message": "The request couldn't be processed."}})
+                continue
+            answer = self._answer(request["body"])
+            self.batchUsages[request["custom_id"]] = answer["usage"]
+            outputLines.append({"id": f"response-{next(self._ids)}", "custom_id": request["custom_id"], "error": None,
+                                "response": {"status_code": 200, "body": answer}})
+
+        for lines, fileKey in [(outputLines, "output_file_id"), (errorLines, "error_file_id")]:
+            if lines:
+                content = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode()
+                fileId = f"file-{next(self._ids)}"
+                self.files[fileId] = {"content": content, "object": None}
+                batch[fileKey] = fileId
+        batch["request_counts"] = {**batch["request_counts"], "completed": len(outputLines), "failed": len(errorLines)}
+        batch["status"] = "expired" if len(requests) < batch["request_counts"]["total"] else "completed"
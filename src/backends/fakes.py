@@ -0,0 +1,214 @@
+import hashlib
+import os
+import random
+import threading
+import time
+import wave
+from collections import deque
+from dataclasses import dataclass
+
+from src.detection.token_budget import TokenUsage, count_tokens
+from src.utils.rate_limiter import AdaptiveRateLimiter
+from src.utils.video_metadata import VideoMetadata, extract_video_id, parse_video_page
+
+# Local stand-ins for YouTube, yt-dlp, AssemblyAI and OpenAI, used by `benchmarks/pipeline_benchmark.py` to measure the
+# pipeline without network access or API costs. Every answer is derived from a seed, so two runs with the same seed match.
+
+NON_VIOLENT_SENTENCES = ["Bu akşam yemeğe kim geliyor?", "Annem seni çok özledi.", "Yarın sabah erkenden yola çıkacağız.",
+                         "Konaktaki herkes düğünü konuşuyor.", "Bana doğruyu söylemen lazım.", "Çay demlendi, gel otur."]
+VIOLENT_SENTENCES = ["Bir daha sesini yükseltirsen seni döverim!", "Kolumu bırak, canımı yakıyorsun!",
+                     "Sus! Bu evden adımını atarsan seni öldürürüm."]
+VIOLENT_KEYWORDS = ["döverim", "canımı yakıyorsun", "öldürürüm"]
+
+
+class FakeBackendError(RuntimeError):
+    """Raised by a fake backend for the requests it was set up to fail."""
+
+
+class FakeRateLimitError(FakeBackendError):
+    """Raised by a fake backend when its server-side rate limit is exceeded, with the headers of a 429 response."""
+    def __init__(self, retryAfter: float) -> None:
+        super().__init__(f"Rate limit exceeded, retry after {retryAfter:.2f}s")
+        self.headers = {"retry-after": f"{retryAfter:.3f}"}
+
+
+@dataclass
+class FakeServiceProfile:
+    """
+    How a fake backend behaves.
+
+    Attributes:
+        latency (float): The average number of seconds a request takes.
+        latencyJitter (float): The share of the latency that varies randomly between requests (0-1).
+        errorRate (float): The probability of a request failing with a `FakeBackendError`.
+        requestsPerMinute (float | None): The server-side rate limit (None means no limit).
+    """
+    latency: float = 0.0
+    latencyJitter: float = 0.5
+    errorRate: float = 0.0
+    requestsPerMinute: float | None = None
+
+
+class _FakeService():
+    """Simulates the latency, the failures and the rate limit of a remote service, and retries its 429s like the real clients."""
+    def __init__(self, name: str, profile: FakeServiceProfile, seed: int, maxRateLimitRetries: int = 20) -> None:
+        self.name = name
+        self.profile = profile
+        self.maxRateLimitRetries = maxRateLimitRetries
+        self.rateLimiter = AdaptiveRateLimiter(f"fake {name}", profile.requestsPerMinute or 1_000_000)
+        self.latencies = []
+        self._random = random.Random(f"{name}:{seed}")
+        self._requestTimes = deque()
+        self._lock = threading.Lock()
+
+    def _admit(self) -> None:
+        """Accepts a request or raises a `FakeRateLimitError`, as the server would."""
+        if self.profile.requestsPerMinute is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._requestTimes and self._requestTimes[0] <= now - 60:
+                self._requestTimes.popleft()
+            if len(self._requestTimes) >= self.profile.requestsPerMinute:
+                raise FakeRateLimitError(self._requestTimes[0] + 60 - now)
+            self._requestTimes.append(now)
+
+    def request(self) -> None:
+        """Waits for the rate limiter, then blocks for the latency of one request, raising the errors the profile calls for."""
+        for _ in range(self.maxRateLimitRetries):
+            self.rateLimiter.wait()
+            try:
+                self._admit()
+                break
+            except FakeRateLimitError as e:
+                self.rateLimiter.on_rate_limited(e.headers)
+        else:
+            raise FakeRateLimitError(0)
+
+        with self._lock:
+            latency = self.profile.latency * (1 + self.profile.latencyJitter * (2 * self._random.random() - 1))
+            isFailed = self._random.random() < self.profile.errorRate
+        startTime = time.perf_counter()
+        time.sleep(max(latency, 0))
+        with self._lock:
+            self.latencies.append(time.perf_counter() - startTime)
+        if isFailed:
+            raise FakeBackendError(f"The fake {self.name} backend failed the request.")
+
+
+class FakeSeries():
+    """A made-up series whose episodes have deterministic links, titles, durations and heatmaps."""
+    def __init__(self, episodeCount: int, episodeMinutes: int = 120, seed: int = 0) -> None:
+        """
+        Args:
+            episodeCount (int): The number of episodes.
+            episodeMinutes (int): The length of every episode in minutes.
+            seed (int): The seed the heatmaps are generated from.
+        """
+        self.episodeCount = episodeCount
+        self.duration = episodeMinutes * 60
+        self.seed = seed
+        self.links = [f"https://www.youtube.com/watch?v={self.video_id(episodeNumber)}" for episodeNumber in range(1, episodeCount + 1)]
+
+    def video_id(self, episodeNumber: int) -> str:
+        return hashlib.sha256(f"{self.seed}:{episodeNumber}".encode()).hexdigest()[:11]
+
+    def episode_number(self, videoId: str) -> int:
+        return next(episodeNumber for episodeNumber in range(1, self.episodeCount + 1) if self.video_id(episodeNumber) == videoId)
+
+    def page_html(self, videoLink: str) -> str:
+        """Returns a watch page with the title, the duration and the rendered heatmap path of the episode."""
+        episodeNumber = self.episode_number(extract_video_id(videoLink))
+        episodeRandom = random.Random(f"heatmap:{self.seed}:{episodeNumber}")
+        points = [(5 + index * 10, 100 - episodeRandom.random() ** 3 * 100) for index in range(100)]
+        heatMapPath = "M 0.0,100.0 " + " ".join(f"C {x - 5:.1f},{y:.1f} {x - 5:.1f},{y:.1f} {x:.1f},{y:.1f}" for x, y in points)
+        return (f"<html><head><title>Sahte Dizi {episodeNumber}. Bölüm</title></head><body>"
+                f'<script>var ytInitialPlayerResponse = {{"videoDetails":{{"lengthSeconds":"{self.duration}"}}}};</script>'
+                f'<svg><path class="ytp-heat-map-path" d="{heatMapPath}"></path></svg></body></html>')
+
+
+class FakeMetadataBackend():
+    """Serves the pages of a `FakeSeries` and parses them like real watch pages."""
+    def __init__(self, series: FakeSeries, profile: FakeServiceProfile = None) -> None:
+        self.series = series
+        self.service = _FakeService("metadata", profile or FakeServiceProfile(), series.seed)
+
+    def fetch(self, videoLink: str) -> VideoMetadata:
+        self.service.request()
+        return parse_video_page(self.series.page_html(videoLink), extract_video_id(videoLink))
+
+
+class FakeDownloadBackend():
+    """Writes a short deterministic WAV file for every requested interval instead of downloading it."""
+    def __init__(self, profile: FakeServiceProfile = None, seed: int = 0, clipSeconds: float = 0.5, sampleRate: int = 8000) -> None:
+        self.service = _FakeService("download", profile or FakeServiceProfile(), seed)
+        self.clipSeconds = clipSeconds
+        self.sampleRate = sampleRate
+
+    def _write_clip(self, path: str, seed: str) -> None:
+        clipRandom = random.Random(seed)
+        frames = bytes(clipRandom.getrandbits(8) for _ in range(int(self.clipSeconds * self.sampleRate)))
+        with wave.open(path, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(1)
+            file.setframerate(self.sampleRate)
+            file.writeframes(frames)
+
+    def download_ranges(self, tableName: str, videoLink: str, fileType: str,
+                        sectionsToDownload: list[tuple[str]]) -> dict[tuple[str], tuple[str, str | None]]:
+        directory = f"audios/{tableName}Audios"
+        os.makedirs(directory, exist_ok=True)
+        videoId = extract_video_id(videoLink)
+        results = {}
+        for section in sectionsToDownload:
+            path = os.path.normpath(f"{directory}/{videoId}{section[0].replace(':', '')}.wav")
+            try:
+                self.service.request()
+                self._write_clip(path, f"{videoId}:{section[0]}:{section[1]}")
+                results[section] = (path, None)
+            except FakeBackendError as e:
+                results[section] = (path, str(e))
+        return results
+
+
+class FakeTranscriptionBackend():
+    """Turns every audio file into a few Turkish utterances chosen from the hash of its content."""
+    def __init__(self, profile: FakeServiceProfile = None, seed: int = 0, violentShare: float = 0.15) -> None:
+        self.service = _FakeService("transcription", profile or FakeServiceProfile(), seed)
+        self.violentShare = violentShare
+        self.languageCode = "tr"
+        self.speakerLabels = True
+
+    def transcribe(self, audioPath: str) -> list[dict]:
+        with open(audioPath, "rb") as file:
+            content = file.read()
+        self.service.request()
+        return fake_utterances(content, self.violentShare)
+
+
+def fake_utterances(content: bytes, violentShare: float = 0.15) -> list[dict]:
+    """Returns the few Turkish utterances the fake transcription services give an audio file, chosen from the hash of its content."""
+    clipRandom = random.Random(hashlib.sha256(content).hexdigest())
+    sentences = clipRandom.sample(NON_VIOLENT_SENTENCES, 3)
+    if clipRandom.random() < violentShare:
+        sentences.insert(clipRandom.randrange(len(sentences) + 1), clipRandom.choice(VIOLENT_SENTENCES))
+    return [{"speaker": "AB"[index % 2], "text": sentence, "start": index * 3000, "end": index * 3000 + 2500}
+            for index, sentence in enumerate(sentences)]
+
+
+class FakeClassificationBackend():
+    """Classifies a transcript as violent if it contains one of the violent keywords, flipping a share of the answers."""
+    def __init__(self, profile: FakeServiceProfile = None, seed: int = 0, noise: float = 0.05) -> None:
+        self.service = _FakeService("classification", profile or FakeServiceProfile(), seed)
+        self.noise = noise
+
+    def classify(self, transcript: str) -> int | None:
+        self.service.request()
+        classification = int(any(keyword in transcript for keyword in VIOLENT_KEYWORDS))
+        if random.Random(transcript).random() < self.noise:
+            classification = 1 - classification
+        return classification
+
+    def classify_with_usage(self, transcript: str) -> tuple[int | None, TokenUsage]:
+        # Counted as an answer of a few tokens to a prompt of the transcript alone
+        return self.classify(transcript), TokenUsage(count_tokens(transcript, "gpt-4o"), 10)
@@ -0,0 +1,42 @@
+from typing import Protocol
+
+from src.detection.token_budget import TokenUsage
+from src.utils.video_metadata import VideoMetadata
+
+
+class MetadataBackend(Protocol):
+    """Gets the heatmap, duration and title of a video (e.g., `VideoMetadataFetcher`)."""
+    def fetch(self, videoLink: str) -> VideoMetadata:
+        ...
+
+
+class DownloadBackend(Protocol):
+    """Downloads time intervals of a video's audio (e.g., `YtDlpDownloadBackend`)."""
+    def download_ranges(self, tableName: str, videoLink: str, fileType: str,
+                        sectionsToDownload: list[tuple[str]]) -> dict[tuple[str], tuple[str, str | None]]:
+        """Returns the path each interval was saved to and its error message (None if it was downloaded successfully)."""
+        ...
+
+
+class TranscriptionBackend(Protocol):
+    """
+    Transcribes audio files (e.g., `AssemblyAITranscriptionBackend`).
+    `languageCode` and `speakerLabels` are part of the key of the transcript cache.
+    """
+    languageCode: str
+    speakerLabels: bool
+
+    def transcribe(self, audioPath: str) -> list[dict]:
+        """Returns the utterances ('speaker', 'text', 'start' and 'end') of the audio, raising an error if the transcription fails."""
+        ...
+
+
+class ClassificationBackend(Protocol):
+    """Classifies transcripts as violent toward women or not (e.g., `OpenAIClassificationBackend`)."""
+    def classify(self, transcript: str) -> int | None:
+        """Returns 1 for violent, 0 for non-violent, or None if no classification was given."""
+        ...
+
+    def classify_with_usage(self, transcript: str) -> tuple[int | None, TokenUsage]:
+        """Returns the classification and the tokens that its request used."""
+        ...
@@ -0,0 +1,34 @@
+import time
+from dataclasses import dataclass
+
+# The stages a clip goes through, in order. A clip is 'failed' when its last attempt at the next stage failed; the stage to
+# retry follows from the columns that are still empty (the audio, then the transcript, then the prediction).
+PLANNED = "planned"
+DOWNLOADED = "downloaded"
+TRANSCRIBED = "transcribed"
+CLASSIFIED = "classified"
+FAILED = "failed"
+CLIP_STATES = (PLANNED, DOWNLOADED, TRANSCRIBED, CLASSIFIED, FAILED)
+
+# The columns that track the progress of every clip (added at the end of the series tables)
+CLIP_STATE_COLUMNS = {"state": "TEXT", "attempts": "INT NOT NULL DEFAULT 0", "last_error": "TEXT", "state_updated_at": "REAL"}
+
+
+@dataclass
+class RetryPolicy:
+    """
+    When a failed clip is tried again.
+
+    Attributes:
+        maxAttempts (int): The number of failed attempts at a stage after which the clip is given up on.
+        backoffSeconds (float): The time to wait after the first failure, doubled after every following one.
+    """
+    maxAttempts: int = 3
+    backoffSeconds: float = 60.0
+
+    def retryable_clause(self) -> tuple[str, tuple]:
+        """
+        Returns the SQL condition (and its parameters) of the clips that are either not failed or due to be retried.
+        """
+        return ("(state IS NULL OR state != ? OR (attempts < ? AND state_updated_at <= ? - ? * (1 << (attempts - 1))))",
+                (FAILED, self.maxAttempts, time.time(), self.backoffSeconds))
@@ -0,0 +1,257 @@
+import itertools
+import queue
+import sqlite3 as sq
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+from src.utils.metrics import get_metrics
+
+
+class _WriteRequest():
+    """
+    A statement waiting in the writer's queue (a request without a query only marks a flush point).
+    An atomic request holds one or more statements, each with a list of parameter sets, that are written all together or
+    not at all (its query is the first of them).
+    """
+    __slots__ = ("query", "params", "statements", "future")
+
+    def __init__(self, query: str | None, params: tuple = (), statements: list[tuple[str, list[tuple]]] = None) -> None:
+        self.query = query
+        self.params = params
+        self.statements = statements
+        self.future = Future()
+
+    @property
+    def atomic(self) -> bool:
+        return self.statements is not None
+
+    def resolve(self, error: BaseException | None = None) -> None:
+        """Resolves the future with the error (or its success), unless the caller already cancelled it."""
+        try:
+            if error is None:
+                self.future.set_result(None)
+            else:
+                self.future.set_exception(error)
+        except InvalidStateError:
+            pass
+
+
+class DatabaseWriter():
+    """
+    The single thread that writes to an SQLite database.
+
+    Writes are queued from any thread and grouped into transactions, consecutive statements with the same SQL being
+    executed together with `executemany`. A transaction is committed when `batchSize` statements are collected, when
+    `flushInterval` seconds have passed since the first of them was queued, or when a flush is requested.
+    An unexpected error only fails the statements of its transaction, and once the thread stops (when it is closed or if
+    it dies) every waiting and later request fails with a `RuntimeError` instead of waiting forever.
+    """
+    def __init__(self, dbPath: str, batchSize: int = 500, flushInterval: float = 0.05) -> None:
+        """
+        Args:
+            dbPath (str): The path of the SQLite database.
+            batchSize (int): The maximum number of statements committed in one transaction.
+            flushInterval (float): The maximum time in seconds a statement waits in the queue before being committed.
+        """
+        self.dbPath = dbPath
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self._queue = queue.Queue()
+        self._stopReason = None # Why the writer thread stopped (None while it is running)
+        self._stateLock = threading.Lock()
+        # The connection is opened here so that an invalid path fails right away, and only used by the writer thread after that
+        self._conn = sq.connect(dbPath, isolation_level=None, check_same_thread=False) # Transactions are started and committed explicitly
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Readers are not blocked while a transaction is written
+        self._conn.execute("PRAGMA synchronous=NORMAL") # In WAL mode only the checkpoints need to be synced
+        self._thread = threading.Thread(target=self._run, name="DatabaseWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str, params: tuple = ()) -> Future:
+        """
+        Queues a statement to be written.
+
+        Args:
+            query (str): The SQL statement.
+            params (tuple): The values of the statement's placeholders.
+
+        Returns:
+            Future: Resolved once the statement is committed (or with the error that made it fail).
+        """
+        return self._put(_WriteRequest(query, tuple(params)))
+
+    def submit_many(self, query: str, paramsList: list[tuple]) -> list[Future]:
+        """Queues the same statement once for every set of values (the statements end up in the same `executemany`)."""
+        return [self.submit(query, params) for params in paramsList]
+
+    def submit_atomic(self, query: str, paramsList: list[tuple]) -> Future:
+        """
+        Queues the same statement for every set of values, to be written in the same transaction, all or nothing.
+
+        Args:
+            query (str): The SQL statement.
+            paramsList (list[tuple]): The values of the statement's placeholders for every row.
+
+        Returns:
+            Future: Resolved once every row is committed (or with the error that made them all fail).
+        """
+        return self.submit_transaction([(query, paramsList)])
+
+    def submit_transaction(self, statements: list[tuple[str, list[tuple]]]) -> Future:
+        """
+        Queues several statements to be written one after the other in the same transaction, all or nothing (e.g., deleting
+        the old rows of something and inserting its new ones, so that a failed insert doesn't leave it without rows).
+
+        Args:
+            statements (list[tuple[str, list[tuple]]]): Every SQL statement with the values of its placeholders for every row
+                (a statement with no rows is skipped).
+
+        Returns:
+            Future: Resolved once every statement is committed (or with the error that made them all fail).
+        """
+        statements = [(query, [tuple(params) for params in paramsList]) for query, paramsList in statements]
+        return self._put(_WriteRequest(statements[0][0], statements=statements))
+
+    def flush(self) -> None:
+        """Blocks until every statement queued before the call is committed."""
+        self._put(_WriteRequest(None)).result()
+
+    def _put(self, request: _WriteRequest) -> Future:
+        """Queues a request, raising a `RuntimeError` if the writer thread has stopped (nothing would ever resolve it)."""
+        with self._stateLock:
+            if self._stopReason is not None:
+                raise RuntimeError(f"The database writer has stopped: {self._stopReason}")
+            self._queue.put(request)
+        return request.future
+
+    def _stop(self, reason: str) -> None:
+        """Marks the writer as stopped and fails the requests that are still queued."""
+        with self._stateLock:
+            self._stopReason = reason
+        error = RuntimeError(f"The database writer has stopped: {reason}")
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request.resolve(error)
+
+    def close(self) -> None:
+        """Commits the remaining statements and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _collect_batch(self, batch: list[_WriteRequest]) -> bool:
+        """
+        Adds the requests to commit together with the first one to the batch (which is filled in place, so that no request
+        taken from the queue is lost if anything fails), returning whether the writer should stop.
+        """
+        deadline = time.monotonic() + self.flushInterval
+        while len(batch) < self.batchSize and batch[-1].query is not None:
+            try:
+                request = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                return True
+            batch.append(request)
+        return False
+
+    def _run(self) -> None:
+        conn = self._conn
+        stop = False
+        stopReason = "it was closed"
+        batch = []
+        try:
+            while not stop:
+                request = self._queue.get()
+                if request is None:
+                    break
+                batch = [request]
+                try:
+                    stop = self._collect_batch(batch)
+                    get_metrics().set_gauge("queue_depth", self._queue.qsize(), queue="database_writer")
+                    with get_metrics().time("stage_duration_seconds", stage="db_write"):
+                        self._write_batch(conn, batch)
+                    get_metrics().increment("db_statements_total", sum(request.query is not None for request in batch))
+                except Exception as e:
+                    # Only the requests of this batch fail (the committed ones were already resolved), and the writer keeps serving
+                    print(f"Failed to write to the database. Error: {e!r}")
+                    for request in batch:
+                        request.resolve(e)
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+        except BaseException as e:
+            stopReason = f"the writer thread died ({e!r})"
+            for request in batch:
+                request.resolve(RuntimeError(f"The database writer has stopped: {stopReason}"))
+            raise
+        finally:
+            self._stop(stopReason)
+            conn.close()
+
+    def _write_batch(self, conn: sq.Connection, batch: list[_WriteRequest]) -> None:
+        """Writes the requests in a single transaction and resolves their futures once it is committed."""
+        results = []
+        try:
+            conn.execute("BEGIN")
+            for (query, atomic), group in itertools.groupby(batch, key=lambda request: (request.query, request.atomic)):
+                group = list(group)
+                if query is None:
+                    results.extend((request, None) for request in group)
+                    continue
+                if atomic:
+                    results.extend((request, self._write_atomic(conn, request)) for request in group)
+                    continue
+                try:
+                    conn.execute("SAVEPOINT grouped_write")
+                    if len(group) == 1: # (executemany only accepts DML statements)
+                        conn.execute(query, group[0].params)
+                    else:
+                        conn.executemany(query, [request.params for request in group])
+                    conn.execute("RELEASE grouped_write")
+                    results.extend((request, None) for request in group)
+                except sq.Error:
+                    # Retry the statements one by one so that only the failing ones are rejected
+                    conn.execute("ROLLBACK TO grouped_write")
+                    conn.execute("RELEASE grouped_write")
+                    results.extend((request, self._write_single(conn, request)) for request in group)
+            conn.execute("COMMIT")
+        except sq.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(request, e) for request in batch]
+
+        for request, error in results:
+            if error is not None and request.query is not None:
+                print(f"Failed to write to the database. Error: {error}")
+            request.resolve(error)
+
+    @staticmethod
+    def _write_atomic(conn: sq.Connection, request: _WriteRequest) -> sq.Error | None:
+        """Executes every statement of an atomic request inside a single savepoint, returning the error if any of them fails."""
+        conn.execute("SAVEPOINT atomic_write")
+        try:
+            for query, paramsList in request.statements:
+                conn.executemany(query, paramsList)
+        except sq.Error as e:
+            conn.execute("ROLLBACK TO atomic_write")
+            return e
+        finally:
+            conn.execute("RELEASE atomic_write")
+        return None
+
+    @staticmethod
+    def _write_single(conn: sq.Connection, request: _WriteRequest) -> sq.Error | None:
+        """Executes a single statement inside its own savepoint, returning the error if it fails."""
+        conn.execute("SAVEPOINT single_write")
+        try:
+            conn.execute(request.query, request.params)
+        except sq.Error as e:
+            conn.execute("ROLLBACK TO single_write")
+            return e
+        finally:
+            conn.execute("RELEASE single_write")
+        return None
@@ -1,29 +1,268 @@
+import json
 import os
+import re
 import sqlite3 as sq
+import threading
+import time
+import zlib
+from collections.abc import Iterator
+from concurrent.futures import Future
+
+from src.database.clip_state import CLIP_STATE_COLUMNS, CLASSIFIED, DOWNLOADED, FAILED, TRANSCRIBED, RetryPolicy
+from src.database.database_writer import DatabaseWriter
+
+# Name of the table that caches the scraped metadata of the videos (shared by every series table)
+VIDEO_METADATA_CACHE_TABLE = "video_metadata_cache"
+# Name of the table that caches the transcripts by the hash of the audio and of the transcription config (shared by every series table)
+TRANSCRIPT_CACHE_TABLE = "transcript_cache"
+# Name of the table that caches the classifications of the LLM by model, prompt and transcript (shared by every series table)
+CLASSIFICATION_CACHE_TABLE = "classification_cache"
+# Name of the table that keeps the utterances of every transcript with their speaker and timestamps (shared by every series table)
+UTTERANCES_TABLE = "utterances"
+# Name of the FTS5 index of the utterances' text
+UTTERANCE_SEARCH_TABLE = "utterance_search"
+
+
+
+def compress_text(text: str, threshold: int | None) -> str | bytes:
+    """Returns the text zlib-compressed if it is longer than the threshold (in bytes), and as it is otherwise (or if the threshold is None)."""
+    encodedText = text.encode("utf-8")
+    if threshold is None or len(encodedText) <= threshold:
+        return text
+    return zlib.compress(encodedText)
+
+def decompress_text(value: str | bytes | None) -> str | None:
+    """Returns the text stored by `compress_text`, whether it was compressed or not."""
+    return zlib.decompress(value).decode("utf-8") if isinstance(value, bytes) else value
+
+def _decompress_rows(description: tuple, rows: list) -> list:
+    """Returns the rows of a query with the values of its `COMPRESSED_COLUMNS` (named in the cursor's description) as text."""
+    compressedIndexes = {index for index, column in enumerate(description) if column[0] in COMPRESSED_COLUMNS}
+    if not compressedIndexes:
+        return rows
+    return [tuple(decompress_text(value) if index in compressedIndexes else value for index, value in enumerate(row)) for row in rows]
+
+def parse_flattened_transcript(transcript: str) -> list[dict]:
+    """Splits a flattened transcript ('Speaker A: ... | Speaker B: ...') back into utterances, without their timestamps."""
+    utterances = []
+    for part in transcript.split(" | "):
+        match = re.match(r"Speaker (\S+): (.*)", part, re.DOTALL)
+        if match is not None:
+            utterances.append({"speaker": match.group(1), "text": match.group(2), "start": None, "end": None})
+        elif utterances:
+            utterances[-1]["text"] += " | " + part # A separator that was part of the text
+    return utterances
+
+
+# Columns that identify a clip with indexed integers instead of the `episode_timeframe` string
+CLIP_KEY_COLUMNS = {"episode": "INT", "start_second": "INT", "end_second": "INT", "audio_path": "TEXT"}
+
+# The size (in bytes) and the length (in seconds) of the clips before and after their audio was preprocessed for the transcription
+AUDIO_PREPROCESSING_COLUMNS = {"original_audio_bytes": "INT", "audio_bytes": "INT", "original_audio_seconds": "REAL", "audio_seconds": "REAL"}
+
+# The prompt, answer and cached prompt tokens of the requests that classified the clips
+TOKEN_USAGE_COLUMNS = {"prompt_tokens": "INT", "completion_tokens": "INT", "cached_prompt_tokens": "INT"}
+
+# The milliseconds of silence trimmed from the start of a clip when it was preprocessed, which its utterances' timestamps are shifted by
+AUDIO_OFFSET_COLUMNS = {"audio_offset_ms": "INT"}
+
+# Where the `llm_violence_prediction` of a clip came from: the LLM (or its cached answer) or the local pre-classifier
+# (NULL for the clips classified before the source was recorded)
+PREDICTION_SOURCE_COLUMNS = {"prediction_source": "TEXT"}
+LLM_PREDICTION = "llm"
+PRE_CLASSIFIER_PREDICTION = "pre_classifier"
+
+# Why the audio of a clip couldn't be preprocessed, so that it is transcribed as it was downloaded instead of being decoded again
+PREPROCESSING_ERROR_COLUMNS = {"preprocessing_error": "TEXT"}
+
+# The columns of the series tables whose long values are stored zlib-compressed with a `compressionThreshold`, and read back as
+# text by `select_all`, `select_page` and `iter_rows` (the utterances' text isn't compressed, as their FTS5 index reads it)
+COMPRESSED_COLUMNS = ("transcript",)
+
+# The columns of the table of a series (new columns are added at the end so that migrated tables keep the same column order)
+SERIES_TABLE_COLUMNS = {"episode_timeframe": "TEXT NOT NULL PRIMARY KEY", "link": "TEXT NOT NULL", "transcript": "TEXT",
+                        "llm_violence_prediction": "INT", "peak_count": "INT", "peak_times": "TEXT", **CLIP_KEY_COLUMNS,
+                        **CLIP_STATE_COLUMNS, **AUDIO_PREPROCESSING_COLUMNS, **TOKEN_USAGE_COLUMNS, **AUDIO_OFFSET_COLUMNS,
+                        **PREDICTION_SOURCE_COLUMNS, **PREPROCESSING_ERROR_COLUMNS}
+
+def parse_clip_key(episodeAndTimeframe: str) -> tuple[int, int, int]:
+    """
+    Splits a clip identifier into its episode number, start second and end second.
+
+    Args:
+        episodeAndTimeframe (str): The episode and timeframe of the clip (e.g., '1:00:58:45:00:59:50').
+
+    Returns:
+        tuple[int, int, int]: The episode number, start second and end second of the clip (e.g., (1, 3525, 3590)).
+    """
+    episode, startHours, startMinutes, startSeconds, endHours, endMinutes, endSeconds = map(int, episodeAndTimeframe.split(":"))
+    return episode, startHours * 3600 + startMinutes * 60 + startSeconds, endHours * 3600 + endMinutes * 60 + endSeconds
+
+def classification_metrics(confusionMatrix: dict[str, int]) -> dict[str, float | None]:
+    """
+    Calculates the accuracy, precision, recall and F1 score of a confusion matrix.
+
+    Args:
+        confusionMatrix (dict[str, int]): The 'true_positive', 'false_positive', 'true_negative' and 'false_negative' counts.
+
+    Returns:
+        dict[str, float | None]: The scores (0-1), each None when its denominator is zero.
+    """
+    truePositive, falsePositive = confusionMatrix["true_positive"], confusionMatrix["false_positive"]
+    trueNegative, falseNegative = confusionMatrix["true_negative"], confusionMatrix["false_negative"]
+    total = truePositive + falsePositive + trueNegative + falseNegative
+    precision = truePositive / (truePositive + falsePositive) if truePositive + falsePositive else None
+    recall = truePositive / (truePositive + falseNegative) if truePositive + falseNegative else None
+    return {"accuracy": (truePositive + trueNegative) / total if total else None, "precision": precision, "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision and recall else None}
 
 class ViolenceDetectionDatabase():
     """
     A database class specifically created for the detection of violence toward women in TV series 
     via the extraction and analysis of transcripts.
     """
-    def __init__(self, dbPath: str = "./data/violeneDetection.db") -> None:
-        self.conn = sq.connect(dbPath, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+    def __init__(self, dbPath: str = "./data/violeneDetection.db", batchSize: int = 500, flushInterval: float = 0.05,
+                 retryPolicy: RetryPolicy = None, compressionThreshold: int | None = None) -> None:
+        """
+        Args:
+            dbPath (str): The path of the SQLite database.
+            batchSize (int): The maximum number of writes committed in one transaction.
+            flushInterval (float): The maximum time in seconds a write waits before being committed.
+            retryPolicy (RetryPolicy): When the clips whose last attempt at a stage failed are tried again.
+            compressionThreshold (int | None): The size in bytes above which the transcripts of the clips (the `COMPRESSED_COLUMNS`)
+                and the cached transcripts and heatmaps are stored zlib-compressed (None stores them as text). Values written
+                with either setting can be read with both.
+        """
+        self.dbPath = dbPath
+        self.retryPolicy = retryPolicy or RetryPolicy()
+        self.compressionThreshold = compressionThreshold
+        # Every write goes through a single writer thread, and every thread reads through its own connection
+        self.writer = DatabaseWriter(dbPath, batchSize, flushInterval)
+        self._readerConnections = threading.local()
+        self._allReaderConnections = []
+        self._readerConnectionsLock = threading.Lock()
+        self._indexedTables = set() # The tables whose statistics indexes were created by this instance
+        self._clipStateTables = {} # Whether each table has the `CLIP_STATE_COLUMNS`
+        self._audioOffsetTables = {} # Whether each table has the `AUDIO_OFFSET_COLUMNS`
+        self._create_cache_tables()
+        self.searchEnabled = self._create_utterance_tables()
         
     def __enter__(self) -> "ViolenceDetectionDatabase":
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
-        self.conn.close()
+        self.close()
+
+    @property
+    def conn(self) -> sq.Connection:
+        """The calling thread's own read connection."""
+        conn = getattr(self._readerConnections, "conn", None)
+        if conn is None:
+            # check_same_thread is only disabled so that close() can close the connections of the other threads
+            conn = sq.connect(self.dbPath, check_same_thread=False, timeout=30)
+            self._readerConnections.conn = conn
+            with self._readerConnectionsLock:
+                self._allReaderConnections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        """Commits the pending writes and closes every connection."""
+        self.writer.close()
+        with self._readerConnectionsLock:
+            for conn in self._allReaderConnections:
+                conn.close()
+            self._allReaderConnections.clear()
+
+    def flush(self) -> None:
+        """Blocks until every write queued so far is committed."""
+        self.writer.flush()
+
+    def _read(self, query: str, params: tuple = ()) -> list:
+        """Runs a read query on the calling thread's connection after the pending writes are committed."""
+        self.flush()
+        return self.conn.execute(query, params).fetchall()
+
+    def _read_text(self, query: str, params: tuple = ()) -> list:
+        """Runs a read query like `_read`, with the values of the `COMPRESSED_COLUMNS` decompressed."""
+        self.flush()
+        cursor = self.conn.execute(query, params)
+        return _decompress_rows(cursor.description, cursor.fetchall())
+
+    def _compress_fields(self, fields: dict) -> dict:
+        """Returns the columns to write with the values of the `COMPRESSED_COLUMNS` compressed as the `compressionThreshold` allows."""
+        if self.compressionThreshold is None:
+            return fields
+        return {column: compress_text(value, self.compressionThreshold) if column in COMPRESSED_COLUMNS and isinstance(value, str) else value
+                for column, value in fields.items()}
 
     def db_console(self) -> None:
         """A function to interact with the database via the console."""
         query = input("Query: ")
-        self.cursor.execute(query)
-        resultList = self.cursor.fetchall()
+        self.flush()
+        resultList = self.conn.execute(query).fetchall()
         self.conn.commit()
         print(resultList)
 
+    def _create_cache_tables(self) -> None:
+        """Creates the tables that cache the results of the expensive pipeline steps if they don't exist."""
+        self.writer.submit(f"""CREATE TABLE IF NOT EXISTS {VIDEO_METADATA_CACHE_TABLE} (
+                                video_id TEXT NOT NULL PRIMARY KEY,
+                                heatmap_raw TEXT,
+                                heatmap_points TEXT,
+                                duration INT NOT NULL,
+                                title TEXT NOT NULL,
+                                fetched_at REAL NOT NULL);""")
+        self.writer.submit(f"""CREATE TABLE IF NOT EXISTS {TRANSCRIPT_CACHE_TABLE} (
+                                audio_hash TEXT NOT NULL,
+                                config_hash TEXT NOT NULL,
+                                utterances TEXT NOT NULL,
+                                created_at REAL NOT NULL,
+                                PRIMARY KEY (audio_hash, config_hash));""")
+        self.writer.submit(f"""CREATE TABLE IF NOT EXISTS {CLASSIFICATION_CACHE_TABLE} (
+                                cache_key TEXT NOT NULL PRIMARY KEY,
+                                model TEXT NOT NULL,
+                                prompt_hash TEXT NOT NULL,
+                                temperature REAL NOT NULL,
+                                transcript_hash TEXT NOT NULL,
+                                classification INT NOT NULL,
+                                last_used_at REAL NOT NULL,
+                                prompt_name TEXT NOT NULL DEFAULT 'single');""")
+        self._add_missing_columns(CLASSIFICATION_CACHE_TABLE, {"prompt_name": "TEXT NOT NULL DEFAULT 'single'"})
+        self.writer.submit(f"CREATE INDEX IF NOT EXISTS {CLASSIFICATION_CACHE_TABLE}_last_used_at ON {CLASSIFICATION_CACHE_TABLE} (last_used_at)")
+        self.flush()
+
+    def _create_utterance_tables(self) -> bool:
+        """
+        Creates the table of the utterances and its FTS5 index (kept in sync by triggers) if they don't exist.
+        Returns whether the search index is available (SQLite may be built without FTS5).
+        """
+        self.writer.submit(f"""CREATE TABLE IF NOT EXISTS {UTTERANCES_TABLE} (
+                                id INTEGER PRIMARY KEY,
+                                table_name TEXT NOT NULL,
+                                episode_timeframe TEXT NOT NULL,
+                                utterance_index INT NOT NULL,
+                                speaker TEXT,
+                                start_ms INT,
+                                end_ms INT,
+                                text TEXT NOT NULL,
+                                UNIQUE (table_name, episode_timeframe, utterance_index));""")
+        try:
+            # The index only keeps the tokens and reads the text from the utterances table
+            self.writer.submit(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {UTTERANCE_SEARCH_TABLE} USING fts5(text, content='{UTTERANCES_TABLE}',
+                                    content_rowid='id', tokenize='unicode61 remove_diacritics 2')""").result()
+        except sq.OperationalError as e:
+            print(f"The utterances can't be searched, as SQLite was built without FTS5: {e}")
+            return False
+        self.writer.submit(f"""CREATE TRIGGER IF NOT EXISTS {UTTERANCES_TABLE}_insert AFTER INSERT ON {UTTERANCES_TABLE} BEGIN
+                                INSERT INTO {UTTERANCE_SEARCH_TABLE} (rowid, text) VALUES (new.id, new.text); END""")
+        self.writer.submit(f"""CREATE TRIGGER IF NOT EXISTS {UTTERANCES_TABLE}_delete AFTER DELETE ON {UTTERANCES_TABLE} BEGIN
+                                INSERT INTO {UTTERANCE_SEARCH_TABLE} ({UTTERANCE_SEARCH_TABLE}, rowid, text) VALUES ('delete', old.id, old.text); END""")
+        self.writer.submit(f"""CREATE TRIGGER IF NOT EXISTS {UTTERANCES_TABLE}_update AFTER UPDATE ON {UTTERANCES_TABLE} BEGIN
+                                INSERT INTO {UTTERANCE_SEARCH_TABLE} ({UTTERANCE_SEARCH_TABLE}, rowid, text) VALUES ('delete', old.id, old.text);
+                                INSERT INTO {UTTERANCE_SEARCH_TABLE} (rowid, text) VALUES (new.id, new.text); END""")
+        self.flush()
+        return True
+
     def create_table(self, tableName: str, **kwargs) -> None:
         """
         A function to create a table with the specified table name and columns in the database.
@@ -31,6 +270,7 @@ class ViolenceDetectionDatabase():
         Args:
             tableName (str): The name of the table to be created.
             **kwargs: Column names of the table and their SQL types (e.g., `columnName='TEXT NOT NULL'`).
+                If the table already exists, the columns it is missing are added to it.
 
         """
         # Create the audio directory for the table if it doesn't exist
@@ -40,11 +280,23 @@ class ViolenceDetectionDatabase():
         # SQL code to create a table
         columns = ", ".join([f"{item[0]} {item[1]}" for item in kwargs.items()])
         query = f"""CREATE TABLE IF NOT EXISTS {tableName} ({columns});"""
-        self.cursor.execute(query)
+        self.writer.submit(query)
+
+        self._add_missing_columns(tableName, kwargs)
+        self.flush()
+
+    def _add_missing_columns(self, tableName: str, columns: dict[str, str]) -> None:
+        """Adds the columns that a table created by an older version of the schema is missing."""
+        existingColumns = {column[1] for column in self._read(f"PRAGMA table_info({tableName})")}
+        self._audioOffsetTables.pop(tableName, None)
+        for columnName, columnType in columns.items():
+            if columnName not in existingColumns:
+                self.writer.submit(f"ALTER TABLE {tableName} ADD COLUMN {columnName} {columnType}")
     
-    def add_case(self, tableName: str, episodeAndTimeframe: str, link: str, **kwargs) -> None:
+    def add_case(self, tableName: str, episodeAndTimeframe: str, link: str, **kwargs) -> Future:
         """
         A method to add an element to the specified table of the database.
+        The element is queued to the writer thread, and the returned future resolves once it is committed.
 
         Args:
             tableName (str): The name of the table of the case to be added.
@@ -53,17 +305,18 @@ class ViolenceDetectionDatabase():
             **kwargs: Columns to be added and their values (e.g., `columnName=value`).
         
         """
+        kwargs = self._compress_fields(kwargs)
         # Extract the query's elements
         columnsToInsert = "(" + ", ".join(["episode_timeframe", "link"] + [key for key in kwargs.keys()]) + ")"
         values = (episodeAndTimeframe, link) + tuple(kwargs.values())
         placeHolders = "(" + ", ".join(["?" for _ in range(2 + len(kwargs))]) + ")"
         
-        self.cursor.execute(f"""INSERT INTO {tableName} {columnsToInsert} VALUES {placeHolders}""", values)
-        self.conn.commit()
+        return self.writer.submit(f"""INSERT INTO {tableName} {columnsToInsert} VALUES {placeHolders}""", values)
     
-    def update_case(self, tableName: str, episodeAndTimeframe: str, **kwargs) -> None:
+    def update_case(self, tableName: str, episodeAndTimeframe: str, **kwargs) -> Future:
         """
         A method to update an element from the stated table's columns to the values given.
+        The update is queued to the writer thread, and the returned future resolves once it is committed.
         
         Args:
             tableName (str): The name of the table of the case to be updated.
@@ -71,10 +324,75 @@ class ViolenceDetectionDatabase():
             **kwargs: Columns to be updated and their new values (e.g., `columnName=value`).
 
         """
+        kwargs = self._compress_fields(kwargs)
         valuesToUpdate = ", ".join([f"{key} = ?" for key in kwargs.keys()])
         
-        self.cursor.execute(f"""UPDATE {tableName} SET {valuesToUpdate} WHERE episode_timeframe LIKE (?)""", list(kwargs.values()) + [f"{episodeAndTimeframe}%"])
-        self.conn.commit()
+        return self.writer.submit(f"""UPDATE {tableName} SET {valuesToUpdate} WHERE episode_timeframe = ?""", list(kwargs.values()) + [episodeAndTimeframe])
+
+    def update_cases(self, tableName: str, updates: dict[str, dict]) -> Future:
+        """
+        A method to update many elements with the same columns in a single transaction: either every update is committed or none of them is.
+
+        Args:
+            tableName (str): The name of the table of the cases to be updated.
+            updates (dict[str, dict]): The columns to be updated and their new values (e.g., `{columnName: value}`),
+                by the episode and timeframe of the instance. Every instance must update the same columns.
+
+        Returns:
+            Future: Resolved once every update is committed.
+        """
+        columns = list(next(iter(updates.values()), {}))
+        if any(list(values) != columns for values in updates.values()):
+            raise ValueError("Every case must update the same columns.")
+
+        valuesToUpdate = ", ".join([f"{key} = ?" for key in columns])
+        paramsList = [tuple(self._compress_fields(values).values()) + (episodeAndTimeframe,) for episodeAndTimeframe, values in updates.items()]
+
+        return self.writer.submit_atomic(f"""UPDATE {tableName} SET {valuesToUpdate} WHERE episode_timeframe = ?""", paramsList)
+
+    def update_case_by_audio_path(self, tableName: str, audioPath: str, **kwargs) -> Future:
+        """
+        A method to update the element whose clip was saved to the given audio file.
+        The update is queued to the writer thread, and the returned future resolves once it is committed.
+
+        Args:
+            tableName (str): The name of the table of the case to be updated.
+            audioPath (str): The path of the clip's audio file (as stored in the `audio_path` column).
+            **kwargs: Columns to be updated and their new values (e.g., `columnName=value`).
+        """
+        kwargs = self._compress_fields(kwargs)
+        valuesToUpdate = ", ".join([f"{key} = ?" for key in kwargs.keys()])
+
+        return self.writer.submit(f"""UPDATE {tableName} SET {valuesToUpdate} WHERE audio_path = ?""", list(kwargs.values()) + [os.path.normpath(audioPath)])
+
+    def migrate_clip_keys(self, tableName: str) -> None:
+        """
+        A method to index the clips of a table by their episode number, start second and end second.
+        The table must have the `CLIP_KEY_COLUMNS`. The integer columns of the rows added before they existed are filled from
+        `episode_timeframe`, and their `audio_path` from the files found in the table's audio directory.
+
+        Args:
+            tableName (str): The name of the table to migrate.
+        """
+        self.writer.submit(f"CREATE UNIQUE INDEX IF NOT EXISTS {tableName}_clip_key ON {tableName} (episode, start_second, end_second)")
+        self.writer.submit(f"CREATE INDEX IF NOT EXISTS {tableName}_audio_path ON {tableName} (audio_path)")
+
+        rowsToMigrate = self._read(f"SELECT episode_timeframe FROM {tableName} WHERE episode IS NULL")
+        self.writer.submit_many(f"UPDATE {tableName} SET episode = ?, start_second = ?, end_second = ? WHERE episode_timeframe = ?",
+                                [parse_clip_key(row[0]) + (row[0],) for row in rowsToMigrate])
+
+        # The files of the old rows are named '<title><start time>.<extension>', with the episode number being the first number of the title
+        audioDirectory = os.path.join("audios", f"{tableName}Audios")
+        if os.path.isdir(audioDirectory) and self._read(f"SELECT 1 FROM {tableName} WHERE audio_path IS NULL LIMIT 1"):
+            for fileName in os.listdir(audioDirectory):
+                stem = os.path.splitext(fileName)[0]
+                episodeMatch, startMatch = re.search(r"\d+", stem), re.search(r"(\d+)\D(\d{2})\D(\d{2})$", stem)
+                if episodeMatch is None or startMatch is None:
+                    continue
+                hours, minutes, seconds = map(int, startMatch.groups())
+                self.writer.submit(f"UPDATE {tableName} SET audio_path = ? WHERE episode = ? AND start_second = ? AND audio_path IS NULL",
+                                   (os.path.join(audioDirectory, fileName), int(episodeMatch.group()), hours * 3600 + minutes * 60 + seconds))
+        self.flush()
     
     def select_all(self, tableName: str, whereClause: str = None, params: tuple = ()) -> list:
         """
@@ -88,12 +406,523 @@ class ViolenceDetectionDatabase():
         """
         if whereClause:
             query = f"SELECT * FROM {tableName} WHERE {whereClause} ORDER BY episode_timeframe ASC"
-            self.cursor.execute(query, params)
+            resultList = self._read_text(query, params)
         
         else:
-            self.cursor.execute(f"SELECT * FROM {tableName} ORDER BY episode_timeframe ASC")
+            resultList = self._read_text(f"SELECT * FROM {tableName} ORDER BY episode_timeframe ASC")
         
-        resultList = self.cursor.fetchall()
         return resultList
 
-    
+    def _select_query(self, tableName: str, columns: list[str] | None, whereClause: str | None) -> str:
+        """Builds the query of the projected columns (every column if None) matching the where clause, in the order of the clip key."""
+        query = f"SELECT {', '.join(columns) if columns else '*'} FROM {tableName}"
+        return query + (f" WHERE {whereClause}" if whereClause else "")
+
+    def select_page(self, tableName: str, columns: list[str] = None, whereClause: str = None, params: tuple = (),
+                    afterKey: str = None, limit: int = 500) -> tuple[list, str | None]:
+        """
+        A method to select the next page of the rows that align with the where clause, ordered by `episode_timeframe`.
+        The page starts right after the given key instead of at an offset, so every page is read from the primary key's index
+        no matter how deep it is, and rows changed between two pages are neither skipped nor repeated.
+
+        Args:
+            tableName (str): The name of the table.
+            columns (list[str]): The columns to select (every column if not given).
+            whereClause (str): The constraints of the rows (e.g., whereClause='columnName=?').
+            params (tuple): The values of the constraints in order.
+            afterKey (str): The `episode_timeframe` of the last row of the previous page (None for the first page).
+            limit (int): The maximum number of rows of the page.
+
+        Returns:
+            tuple[list, str | None]: The rows of the page, and the key to pass as `afterKey` for the next page (None after the last page).
+        """
+        conditions = [f"({whereClause})"] if whereClause else []
+        if afterKey is not None:
+            conditions.append("episode_timeframe > ?")
+            params = tuple(params) + (afterKey,)
+        # The key is selected first so that the next page can start after it, whatever the projected columns are
+        query = self._select_query(tableName, ["episode_timeframe"] + (columns or ["*"]), " AND ".join(conditions) or None)
+        rows = self._read_text(f"{query} ORDER BY episode_timeframe ASC LIMIT ?", tuple(params) + (limit,))
+        nextKey = rows[-1][0] if len(rows) == limit else None
+        return [row[1:] for row in rows], nextKey
+
+    def iter_rows(self, tableName: str, columns: list[str] = None, whereClause: str = None, params: tuple = (),
+                  chunkSize: int = 500, keyset: bool = True) -> Iterator[tuple]:
+        """
+        A method to go through the rows that align with the where clause, ordered by `episode_timeframe`, reading `chunkSize`
+        rows at a time, so that the first rows can be processed while the rest are still in the database.
+
+        Args:
+            tableName (str): The name of the table.
+            columns (list[str]): The columns to select (every column if not given).
+            whereClause (str): The constraints of the rows (e.g., whereClause='columnName=?').
+            params (tuple): The values of the constraints in order.
+            chunkSize (int): The number of rows read at a time.
+            keyset (bool): Whether to read every chunk with its own query (see `select_page`), which doesn't keep a read
+                transaction open between chunks and sees the rows changed in the meantime. Otherwise, a single query is
+                read with `fetchmany`, from a snapshot of the table taken when the iteration starts.
+
+        Yields:
+            tuple: The selected columns of every row.
+        """
+        if keyset:
+            afterKey = None
+            while True:
+                rows, afterKey = self.select_page(tableName, columns, whereClause, params, afterKey, chunkSize)
+                yield from rows
+                if afterKey is None:
+                    return
+
+        self.flush()
+        cursor = self.conn.execute(self._select_query(tableName, columns, whereClause) + " ORDER BY episode_timeframe ASC", params)
+        try:
+            while rows := cursor.fetchmany(chunkSize):
+                yield from _decompress_rows(cursor.description, rows)
+        finally:
+            cursor.close()
+
+    def count_rows(self, tableName: str, whereClause: str = None, params: tuple = ()) -> int:
+        """
+        A method to count the rows that align with the where clause without reading them.
+
+        Args:
+            tableName (str): The name of the table.
+            whereClause (str): The constraints of the rows (e.g., whereClause='columnName=?').
+            params (tuple): The values of the constraints in order.
+        """
+        return self._read(self._select_query(tableName, ["COUNT(*)"], whereClause), params)[0][0]
+
+    def get_cached_video_metadata(self, videoId: str, maxAge: float = None) -> tuple | None:
+        """
+        A method to get the cached metadata of a video if it was scraped recently enough.
+
+        Args:
+            videoId (str): The YouTube video ID.
+            maxAge (float): The maximum age of the cached entry in seconds (entries never expire if not given).
+
+        Returns:
+            tuple | None: The (heatmap_raw, heatmap_points, duration, title) of the video, `heatmap_points` being a
+            list of (x, y) pairs, or None if the video isn't cached or its entry is older than `maxAge`.
+        """
+        rows = self._read(f"""SELECT heatmap_raw, heatmap_points, duration, title, fetched_at
+                               FROM {VIDEO_METADATA_CACHE_TABLE} WHERE video_id = ?""", (videoId,))
+        row = rows[0] if rows else None
+        if row is None or (maxAge is not None and time.time() - row[4] > maxAge):
+            return None
+        return decompress_text(row[0]), json.loads(decompress_text(row[1])), row[2], row[3]
+
+    def cache_video_metadata(self, videoId: str, heatMapRaw: str, heatMapPoints: list[tuple[float]], duration: int, title: str) -> None:
+        """
+        A method to store (or refresh) the scraped metadata of a video.
+
+        Args:
+            videoId (str): The YouTube video ID.
+            heatMapRaw (str): The heatmap as it was scraped.
+            heatMapPoints (list[tuple[float]]): The parsed (x, y) points of the heatmap.
+            duration (int): The duration of the video in seconds.
+            title (str): The title of the video.
+        """
+        self.writer.submit(f"""INSERT OR REPLACE INTO {VIDEO_METADATA_CACHE_TABLE}
+                               (video_id, heatmap_raw, heatmap_points, duration, title, fetched_at) VALUES (?, ?, ?, ?, ?, ?)""",
+                           (videoId, compress_text(heatMapRaw, self.compressionThreshold) if heatMapRaw is not None else None,
+                            compress_text(json.dumps(heatMapPoints), self.compressionThreshold), duration, title, time.time()))
+
+    def get_untranscribed_audio_paths(self, tableName: str) -> list[str]:
+        """
+        A method to get the audio files of the clips of a table that don't have a transcript yet (leaving out the failed clips
+        that aren't due to be retried).
+
+        Args:
+            tableName (str): The name of the table.
+
+        Returns:
+            list[str]: The audio paths of the clips without a transcript.
+        """
+        pendingClause, pendingParams = self.pending_clip_clause(tableName)
+        rows = self._read(f"""SELECT audio_path FROM {tableName} WHERE transcript IS NULL AND audio_path IS NOT NULL AND {pendingClause}
+                              ORDER BY episode_timeframe ASC""", pendingParams)
+        return [row[0] for row in rows]
+
+    def get_cached_transcript(self, audioHash: str, configHash: str) -> list[dict] | None:
+        """
+        A method to get the cached transcript of an audio file.
+
+        Args:
+            audioHash (str): The hash of the audio file's content.
+            configHash (str): The hash of the transcription config the audio was transcribed with.
+
+        Returns:
+            list[dict] | None: The utterances of the transcript ('speaker', 'text', 'start' and 'end'), or None if it isn't cached.
+        """
+        rows = self._read(f"SELECT utterances FROM {TRANSCRIPT_CACHE_TABLE} WHERE audio_hash = ? AND config_hash = ?", (audioHash, configHash))
+        return json.loads(decompress_text(rows[0][0])) if rows else None
+
+    def cache_transcript(self, audioHash: str, configHash: str, utterances: list[dict]) -> Future:
+        """
+        A method to store the transcript of an audio file.
+
+        Args:
+            audioHash (str): The hash of the audio file's content.
+            configHash (str): The hash of the transcription config the audio was transcribed with.
+            utterances (list[dict]): The utterances of the transcript ('speaker', 'text', 'start' and 'end').
+        """
+        return self.writer.submit(f"""INSERT OR REPLACE INTO {TRANSCRIPT_CACHE_TABLE} (audio_hash, config_hash, utterances, created_at)
+                                      VALUES (?, ?, ?, ?)""", (audioHash, configHash, compress_text(json.dumps(utterances, ensure_ascii=False),
+                                                                                     self.compressionThreshold), time.time()))
+
+    def get_cached_classification(self, cacheKey: str) -> int | None:
+        """
+        A method to get a cached classification and mark it as recently used.
+
+        Args:
+            cacheKey (str): The key of the classification (see `ClassificationCache`).
+
+        Returns:
+            int | None: The cached classification, or None if it isn't cached.
+        """
+        rows = self._read(f"SELECT classification FROM {CLASSIFICATION_CACHE_TABLE} WHERE cache_key = ?", (cacheKey,))
+        if not rows:
+            return None
+        self.writer.submit(f"UPDATE {CLASSIFICATION_CACHE_TABLE} SET last_used_at = ? WHERE cache_key = ?", (time.time(), cacheKey))
+        return rows[0][0]
+
+    def cache_classification(self, cacheKey: str, model: str, promptName: str, promptHash: str, temperature: float, transcriptHash: str,
+                             classification: int) -> Future:
+        """
+        A method to store a classification of the LLM.
+
+        Args:
+            cacheKey (str): The key of the classification.
+            model (str): The name of the model.
+            promptName (str): The name of the prompt (the current version of a prompt replaces the older versions with the same name).
+            promptHash (str): The hash of the system prompt and the tool schema.
+            temperature (float): The sampling temperature.
+            transcriptHash (str): The hash of the classified transcript.
+            classification (int): The classification.
+        """
+        return self.writer.submit(f"""INSERT OR REPLACE INTO {CLASSIFICATION_CACHE_TABLE}
+                                      (cache_key, model, prompt_name, prompt_hash, temperature, transcript_hash, classification, last_used_at)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                  (cacheKey, model, promptName, promptHash, temperature, transcriptHash, classification, time.time()))
+
+    def evict_classifications(self, maxEntries: int) -> Future:
+        """
+        A method to delete the least recently used classifications until at most `maxEntries` of them are left.
+
+        Args:
+            maxEntries (int): The number of classifications to keep.
+        """
+        return self.writer.submit(f"""DELETE FROM {CLASSIFICATION_CACHE_TABLE} WHERE cache_key IN
+                                      (SELECT cache_key FROM {CLASSIFICATION_CACHE_TABLE} ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)""", (maxEntries,))
+
+    def invalidate_classifications(self, promptName: str = None, keptPromptHash: str = None) -> Future:
+        """
+        A method to delete the cached classifications made with an older version of a prompt (or every one of them if no prompt is given).
+
+        Args:
+            promptName (str): The name of the prompt whose older versions are deleted.
+            keptPromptHash (str): The hash of the current version of the prompt, whose classifications are kept.
+        """
+        if promptName is None:
+            return self.writer.submit(f"DELETE FROM {CLASSIFICATION_CACHE_TABLE}")
+        return self.writer.submit(f"DELETE FROM {CLASSIFICATION_CACHE_TABLE} WHERE prompt_name = ? AND prompt_hash != ?", (promptName, keptPromptHash))
+
+    def _table_columns(self, tableName: str) -> list[str]:
+        """Returns the names of the columns of a table."""
+        return [row[1] for row in self._read(f"PRAGMA table_info({tableName})")]
+
+    def create_statistics_indexes(self, tableName: str) -> None:
+        """
+        A method to index the prediction and label columns of a table, so that the statistics are counted from the indexes
+        without reading the transcripts.
+
+        Args:
+            tableName (str): The name of the table.
+        """
+        columns = self._table_columns(tableName)
+        if "llm_violence_prediction" in columns:
+            indexColumns = [column for column in ("llm_violence_prediction", "peak_count", "episode") if column in columns]
+            self.writer.submit(f"CREATE INDEX IF NOT EXISTS {tableName}_prediction ON {tableName} ({', '.join(indexColumns)})")
+            if "violence" in columns:
+                self.writer.submit(f"CREATE INDEX IF NOT EXISTS {tableName}_label ON {tableName} (violence, llm_violence_prediction)")
+        self.flush()
+        self._indexedTables.add(tableName)
+
+    def _episode_expression(self, columns: list[str]) -> str:
+        """Returns the SQL expression of a clip's episode number (taken from `episode_timeframe` in the tables without the clip keys)."""
+        fromIdentifier = "CAST(substr(episode_timeframe, 1, instr(episode_timeframe, ':') - 1) AS INT)"
+        return f"COALESCE(episode, {fromIdentifier})" if "episode" in columns else fromIdentifier
+
+    def prediction_statistics(self, tableName: str, byEpisode: bool = False) -> dict:
+        """
+        A method to count the classified and violent clips of a table with a single aggregate query.
+        The violent percentage counts each clip once for every heatmap peak it covers (once for the clips without a peak count).
+
+        Args:
+            tableName (str): The name of the table.
+            byEpisode (bool): Whether to break the counts down by episode.
+
+        Returns:
+            dict: The 'clips', 'classified', 'pre_classified' (marked as non-violent by the pre-classifier, without asking the
+            LLM), 'violent', 'violent_percentage' and 'clip_violent_percentage' (unweighted) of the table, or a dictionary of
+            them for every episode number if `byEpisode` is True.
+        """
+        if tableName not in self._indexedTables:
+            self.create_statistics_indexes(tableName)
+        columns = self._table_columns(tableName)
+        weight = "COALESCE(peak_count, 1)" if "peak_count" in columns else "1"
+        preClassified = "prediction_source = ?" if "prediction_source" in columns else "0"
+        groupExpression = self._episode_expression(columns) if byEpisode else "NULL"
+        rows = self._read(f"""SELECT {groupExpression} AS group_key, COUNT(*), COUNT(llm_violence_prediction),
+                                     COALESCE(SUM(llm_violence_prediction IS NOT NULL AND {preClassified}), 0),
+                                     COALESCE(SUM(llm_violence_prediction = 1), 0),
+                                     COALESCE(SUM(CASE WHEN llm_violence_prediction IS NOT NULL THEN {weight} END), 0),
+                                     COALESCE(SUM(CASE WHEN llm_violence_prediction = 1 THEN {weight} END), 0)
+                              FROM {tableName} GROUP BY group_key ORDER BY group_key""",
+                          (PRE_CLASSIFIER_PREDICTION,) if "prediction_source" in columns else ())
+
+        statistics = {}
+        for groupKey, clipCount, classifiedCount, preClassifiedCount, violentCount, classifiedWeight, violentWeight in rows:
+            statistics[groupKey] = {"clips": clipCount, "classified": classifiedCount, "pre_classified": preClassifiedCount, "violent": violentCount,
+                                    "violent_percentage": violentWeight / classifiedWeight * 100 if classifiedWeight else None,
+                                    "clip_violent_percentage": violentCount / classifiedCount * 100 if classifiedCount else None}
+        if byEpisode:
+            return statistics
+        return statistics.get(None, {"clips": 0, "classified": 0, "pre_classified": 0, "violent": 0, "violent_percentage": None,
+                                     "clip_violent_percentage": None})
+
+    def accuracy_statistics(self, tableName: str, byEpisode: bool = False, labelColumn: str = "violence", llmOnly: bool = False) -> dict:
+        """
+        A method to compare the predictions of a labelled table with its labels with a single aggregate query.
+
+        Args:
+            tableName (str): The name of the labelled table.
+            byEpisode (bool): Whether to break the comparison down by episode.
+            labelColumn (str): The column of the manual labels.
+            llmOnly (bool): Whether to leave out the clips that the pre-classifier marked as non-violent (see `PREDICTION_SOURCE_COLUMNS`).
+
+        Returns:
+            dict: The 'true_positive', 'false_positive', 'true_negative' and 'false_negative' counts, and the 'accuracy',
+            'precision', 'recall' and 'f1' scores (see `classification_metrics`) of the clips that have both a prediction and
+            a label, or a dictionary of them for every episode number if `byEpisode` is True.
+        """
+        if tableName not in self._indexedTables:
+            self.create_statistics_indexes(tableName)
+        columns = self._table_columns(tableName)
+        groupExpression = self._episode_expression(columns) if byEpisode else "NULL"
+        sourceCondition, params = "", ()
+        if llmOnly and "prediction_source" in columns:
+            sourceCondition, params = "AND prediction_source IS NOT ?", (PRE_CLASSIFIER_PREDICTION,)
+        rows = self._read(f"""SELECT {groupExpression} AS group_key,
+                                     SUM(llm_violence_prediction = 1 AND {labelColumn} = 1), SUM(llm_violence_prediction = 1 AND {labelColumn} = 0),
+                                     SUM(llm_violence_prediction = 0 AND {labelColumn} = 0), SUM(llm_violence_prediction = 0 AND {labelColumn} = 1)
+                              FROM {tableName} WHERE llm_violence_prediction IS NOT NULL AND {labelColumn} IS NOT NULL {sourceCondition}
+                              GROUP BY group_key ORDER BY group_key""", params)
+
+        statistics = {}
+        for groupKey, *counts in rows:
+            confusionMatrix = dict(zip(("true_positive", "false_positive", "true_negative", "false_negative"), counts))
+            statistics[groupKey] = {**confusionMatrix, **classification_metrics(confusionMatrix)}
+        if byEpisode:
+            return statistics
+        emptyMatrix = {"true_positive": 0, "false_positive": 0, "true_negative": 0, "false_negative": 0}
+        return statistics.get(None, {**emptyMatrix, **classification_metrics(emptyMatrix)})
+
+    def series_statistics(self, tableNames: list[str]) -> dict[str, dict]:
+        """
+        A method to compare the prediction statistics of several series.
+
+        Args:
+            tableNames (list[str]): The names of the tables of the series.
+
+        Returns:
+            dict[str, dict]: The `prediction_statistics` of every table.
+        """
+        return {tableName: self.prediction_statistics(tableName) for tableName in tableNames}
+
+    def migrate_clip_states(self, tableName: str) -> None:
+        """
+        A method to track the progress of the clips of a table with the `CLIP_STATE_COLUMNS`, adding the columns if they are missing.
+        The rows added before the states existed are set to the furthest stage they reached (rows used to be added once downloaded).
+
+        Args:
+            tableName (str): The name of the table to migrate.
+        """
+        self._add_missing_columns(tableName, CLIP_STATE_COLUMNS)
+        self.writer.submit(f"CREATE INDEX IF NOT EXISTS {tableName}_state ON {tableName} (state)")
+        self.writer.submit(f"""UPDATE {tableName} SET state_updated_at = ?, state = CASE WHEN llm_violence_prediction IS NOT NULL THEN ?
+                               WHEN transcript IS NOT NULL THEN ? ELSE ? END WHERE state IS NULL""", (time.time(), CLASSIFIED, TRANSCRIBED, DOWNLOADED))
+        self.flush()
+        self._clipStateTables[tableName] = True
+
+    def _has_clip_states(self, tableName: str) -> bool:
+        if tableName not in self._clipStateTables:
+            self._clipStateTables[tableName] = "state" in self._table_columns(tableName)
+        return self._clipStateTables[tableName]
+
+    def clip_state_fields(self, tableName: str, state: str) -> dict:
+        """
+        A method to get the columns that move a clip to a new state, to be written in the same statement as the stage's result
+        (e.g., `update_case(tableName, key, transcript=text, **clip_state_fields(tableName, TRANSCRIBED))`), so that a crash
+        can't separate the two. The tables without the `CLIP_STATE_COLUMNS` get no columns.
+
+        Args:
+            tableName (str): The name of the table.
+            state (str): The new state of the clip (see `src/database/clip_state.py`).
+
+        Returns:
+            dict: The columns and their values.
+        """
+        if not self._has_clip_states(tableName):
+            return {}
+        return {"state": state, "attempts": 0, "last_error": None, "state_updated_at": time.time()}
+
+    def record_clip_failure(self, tableName: str, error: str, episodeAndTimeframe: str = None, audioPath: str = None) -> Future | None:
+        """
+        A method to mark a clip as failed, counting the attempt and keeping the error for the retry policy and the reports.
+
+        Args:
+            tableName (str): The name of the table.
+            error (str): The error message.
+            episodeAndTimeframe (str): The episode and timeframe of the clip.
+            audioPath (str): The path of the clip's audio file (if the episode and timeframe aren't given).
+
+        Returns:
+            Future | None: Resolved once the failure is committed (None for the tables without the `CLIP_STATE_COLUMNS`).
+        """
+        if not self._has_clip_states(tableName):
+            return None
+        whereClause, whereValue = ("episode_timeframe = ?", episodeAndTimeframe) if episodeAndTimeframe is not None else \
+                                  ("audio_path = ?", os.path.normpath(audioPath))
+        return self.writer.submit(f"""UPDATE {tableName} SET state = ?, attempts = attempts + 1, last_error = ?, state_updated_at = ?
+                                      WHERE {whereClause}""", (FAILED, str(error), time.time(), whereValue))
+
+    def pending_clip_clause(self, tableName: str) -> tuple[str, tuple]:
+        """
+        A method to get the SQL condition (and its parameters) that leaves out the failed clips that the retry policy doesn't
+        allow to be tried again yet (or ever).
+
+        Args:
+            tableName (str): The name of the table.
+
+        Returns:
+            tuple[str, tuple]: The condition and its parameters (an always true condition for the tables without the `CLIP_STATE_COLUMNS`).
+        """
+        if not self._has_clip_states(tableName):
+            return "1", ()
+        return self.retryPolicy.retryable_clause()
+
+    def count_clip_states(self, tableName: str) -> dict[str, int]:
+        """
+        A method to count the clips of a table in every state (the clips that were given up on are counted as 'given_up').
+
+        Args:
+            tableName (str): The name of the table.
+
+        Returns:
+            dict[str, int]: The number of clips by state.
+        """
+        rows = self._read(f"""SELECT CASE WHEN state = ? AND attempts >= ? THEN 'given_up' ELSE state END AS clip_state, COUNT(*)
+                              FROM {tableName} GROUP BY clip_state""", (FAILED, self.retryPolicy.maxAttempts))
+        return dict(rows)
+
+    def _has_audio_offsets(self, tableName: str) -> bool:
+        if tableName not in self._audioOffsetTables:
+            self._audioOffsetTables[tableName] = "audio_offset_ms" in self._table_columns(tableName)
+        return self._audioOffsetTables[tableName]
+
+    def store_utterances(self, tableName: str, utterances: list[dict], episodeAndTimeframe: str = None, audioPath: str = None) -> Future:
+        """
+        A method to replace the utterances of a clip with the ones of its transcript. The old utterances are deleted and the
+        new ones inserted in the same transaction, so a failed insert keeps the old utterances instead of leaving none.
+        The timestamps of the transcript are relative to the transcribed audio, so they are shifted by the silence trimmed
+        from the start of the clip (its `audio_offset_ms`) to be relative to the clip.
+
+        Args:
+            tableName (str): The name of the clip's table.
+            utterances (list[dict]): The utterances of the transcript ('speaker', 'text', 'start' and 'end' in milliseconds).
+            episodeAndTimeframe (str): The episode and timeframe of the clip.
+            audioPath (str): The path of the clip's audio file (if the episode and timeframe aren't given).
+
+        Returns:
+            Future: Resolved once the utterances are committed.
+        """
+        offsetColumn = "COALESCE(audio_offset_ms, 0)" if self._has_audio_offsets(tableName) else "0"
+        if episodeAndTimeframe is not None:
+            clipCondition, clipValue = "episode_timeframe = ?", episodeAndTimeframe
+        else:
+            clipCondition, clipValue = "audio_path = ?", os.path.normpath(audioPath)
+        clipSelection = f"SELECT episode_timeframe, {offsetColumn} AS offset_ms FROM {tableName} WHERE {clipCondition}"
+
+        return self.writer.submit_transaction([
+            (f"""DELETE FROM {UTTERANCES_TABLE} WHERE table_name = ? AND episode_timeframe IN
+                 (SELECT episode_timeframe FROM {tableName} WHERE {clipCondition})""", [(tableName, clipValue)]),
+            (f"""INSERT INTO {UTTERANCES_TABLE} (table_name, episode_timeframe, utterance_index, speaker, start_ms, end_ms, text)
+                 SELECT ?, episode_timeframe, ?, ?, ? + offset_ms, ? + offset_ms, ? FROM ({clipSelection})""",
+             [(tableName, index, utterance.get("speaker"), utterance.get("start"), utterance.get("end"), utterance["text"], clipValue)
+              for index, utterance in enumerate(utterances)])])
+
+    def get_utterances(self, tableName: str, episodeAndTimeframe: str) -> list[dict]:
+        """
+        A method to get the utterances of a clip in order.
+
+        Args:
+            tableName (str): The name of the clip's table.
+            episodeAndTimeframe (str): The episode and timeframe of the clip.
+
+        Returns:
+            list[dict]: The 'speaker', 'text', 'start' and 'end' (in milliseconds, None for the migrated transcripts) of every utterance.
+        """
+        rows = self._read(f"""SELECT speaker, text, start_ms, end_ms FROM {UTTERANCES_TABLE} WHERE table_name = ? AND episode_timeframe = ?
+                              ORDER BY utterance_index""", (tableName, episodeAndTimeframe))
+        return [{"speaker": speaker, "text": text, "start": start, "end": end} for speaker, text, start, end in rows]
+
+    def search_utterances(self, query: str, tableNames: list[str] = None, phrase: bool = False, limit: int = 50) -> list[dict]:
+        """
+        A method to find the utterances that match a full-text query across every series table, the best matches first.
+
+        Args:
+            query (str): The FTS5 query (e.g., 'döverim OR öldürürüm', 'sus*'), diacritics being ignored.
+            tableNames (list[str]): The tables to search in (every table if not given).
+            phrase (bool): Whether to match the query as an exact phrase instead of with the FTS5 syntax.
+            limit (int): The maximum number of utterances returned.
+
+        Returns:
+            list[dict]: The 'table_name', 'episode_timeframe', 'speaker', 'start_ms', 'end_ms' and 'text' of every matching utterance.
+        """
+        if not self.searchEnabled:
+            raise RuntimeError("The utterances can't be searched, as SQLite was built without FTS5.")
+        if phrase:
+            query = '"' + query.replace('"', '""') + '"'
+
+        tableFilter, params = "", (query,)
+        if tableNames:
+            tableFilter = f"AND utterance.table_name IN ({', '.join('?' for _ in tableNames)})"
+            params += tuple(tableNames)
+        columns = ["table_name", "episode_timeframe", "speaker", "start_ms", "end_ms", "text"]
+        rows = self._read(f"""SELECT {', '.join('utterance.' + column for column in columns)} FROM {UTTERANCE_SEARCH_TABLE}
+                              JOIN {UTTERANCES_TABLE} AS utterance ON utterance.id = {UTTERANCE_SEARCH_TABLE}.rowid
+                              WHERE {UTTERANCE_SEARCH_TABLE} MATCH ? {tableFilter} ORDER BY {UTTERANCE_SEARCH_TABLE}.rank LIMIT ?""",
+                          params + (limit,))
+        return [dict(zip(columns, row)) for row in rows]
+
+    def migrate_utterances(self, tableName: str) -> int:
+        """
+        A method to fill the utterances of the clips that were transcribed before the utterances were stored, by splitting their
+        flattened transcripts (their timestamps are unknown).
+
+        Args:
+            tableName (str): The name of the table to migrate.
+
+        Returns:
+            int: The number of clips whose utterances were added.
+        """
+        migratedCount = 0
+        for episodeAndTimeframe, transcript in self.iter_rows(tableName, ["episode_timeframe", "transcript"],
+                                                              f"""transcript IS NOT NULL AND episode_timeframe NOT IN
+                                                                  (SELECT episode_timeframe FROM {UTTERANCES_TABLE} WHERE table_name = ?)""",
+                                                              (tableName,)):
+            self.store_utterances(tableName, parse_flattened_transcript(transcript), episodeAndTimeframe)
+            migratedCount += 1
+        self.flush()
+        return migratedCount
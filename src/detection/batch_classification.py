@@ -0,0 +1,225 @@
+import json
+import os
+import tempfile
+import time
+
+import openai
+
+from src.database.clip_state import CLASSIFIED
+from src.database.violence_detection_database import LLM_PREDICTION, PRE_CLASSIFIER_PREDICTION, ViolenceDetectionDatabase
+from src.detection.classification_cache import ClassificationCache
+from src.detection.detect_violence import (MODEL, TEMPERATURE, TOOL_CHOICE, TOOLS, build_messages, create_classification_cache, pre_classify,
+                                           record_token_usage)
+from src.detection.pre_classifier import PreClassifier
+from src.detection.token_budget import TokenBudget, TokenUsage
+from src.utils.metrics import get_metrics
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Separates the episode and timeframe of a clip from the index of a part in the custom IDs of a split transcript's requests
+PART_SEPARATOR = "#"
+# Statuses after which a batch job doesn't change anymore
+_FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_request(customId: str, transcript: str) -> dict:
+    """
+    Builds the line of the batch input file that classifies a transcript (the same request `_run_conversation` sends).
+
+    Args:
+        customId (str): The custom ID of the request (the episode and timeframe of the clip, see `part_custom_id`).
+        transcript (str): The transcript content (or a part of it).
+
+    Returns:
+        dict: The batch request.
+    """
+    return {"custom_id": customId, "method": "POST", "url": BATCH_ENDPOINT,
+            "body": {"model": MODEL, "messages": build_messages(transcript), "tools": TOOLS, "tool_choice": TOOL_CHOICE, "temperature": TEMPERATURE}}
+
+
+def parse_batch_output(outputText: str) -> tuple[dict[str, int], dict[str, str]]:
+    """
+    Extracts the classifications from the content of a batch output file.
+
+    Args:
+        outputText (str): The JSONL content of the output file.
+
+    Returns:
+        tuple[dict[str, int], dict[str, str]]: The classification of every successful request and the error of every failed one,
+        by their custom ID.
+    """
+    classifications, errors = {}, {}
+    for line in outputText.splitlines():
+        if not line.strip():
+            continue
+        output = json.loads(line)
+        customId = output["custom_id"]
+        try:
+            if output.get("error"):
+                raise ValueError(output["error"].get("message", output["error"]))
+            response = output["response"]
+            if response["status_code"] != 200:
+                raise ValueError(f"Status code {response['status_code']}")
+            function = response["body"]["choices"][0]["message"]["tool_calls"][0]["function"]
+            llmAnswer = json.loads(function["arguments"]).get("classification", None)
+            if llmAnswer is None:
+                raise ValueError("The assistant didn't give a classification")
+            classifications[customId] = int(llmAnswer)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            errors[customId] = str(e)
+    return classifications, errors
+
+
+def parse_batch_usage(outputText: str) -> dict[str, TokenUsage]:
+    """
+    Extracts the tokens that every request of a batch output file used.
+
+    Args:
+        outputText (str): The JSONL content of the output file.
+
+    Returns:
+        dict[str, TokenUsage]: The usage of every request that got a response, by its custom ID.
+    """
+    usages = {}
+    for line in outputText.splitlines():
+        if not line.strip():
+            continue
+        output = json.loads(line)
+        body = (output.get("response") or {}).get("body")
+        if isinstance(body, dict):
+            usages[output["custom_id"]] = TokenUsage.from_dict(body.get("usage"))
+    return usages
+
+
+def part_custom_id(episodeAndTimeframe: str, partIndex: int, partCount: int) -> str:
+    """Returns the custom ID of a part of a transcript (the episode and timeframe itself if the transcript wasn't split)."""
+    return episodeAndTimeframe if partCount == 1 else f"{episodeAndTimeframe}{PART_SEPARATOR}{partIndex}"
+
+
+def _wait_for_batch(client: openai.OpenAI, batchId: str, pollInterval: float):
+    """Polls a batch job until it finishes, printing its progress."""
+    while True:
+        batch = client.batches.retrieve(batchId)
+        if batch.status in _FINAL_BATCH_STATUSES:
+            return batch
+        if batch.request_counts is not None:
+            print(f"Batch {batchId} is {batch.status}: {batch.request_counts.completed}/{batch.request_counts.total} requests completed.")
+        time.sleep(pollInterval)
+
+
+def classify_transcripts_in_batch(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase, baseUrl: str = None,
+                                  pollInterval: float = 60, completionWindow: str = "24h", cache: ClassificationCache = None,
+                                  preClassifier: PreClassifier = None, tokenBudget: TokenBudget = None) -> dict[str, int]:
+    """
+    Classifies every transcript that doesn't have a prediction yet with a single batch job: the requests are written to a JSONL
+    file, submitted together, and the classifications in the result file are applied to the database in one transaction,
+    with the tokens that every clip used.
+    A transcript longer than the token budget is split (or trimmed) like in the other modes: every part is a request of its
+    own (with the custom ID '<episode and timeframe>#<part index>'), and the clip is violent if any of its parts is.
+    The parts that are in the cache, and the transcripts that the pre-classifier marks as non-violent, aren't sent.
+
+    Args:
+        apiKey (str): The API key for the OpenAI service.
+        tableName (str): The name of the database table.
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        baseUrl (str): The URL of the API (a local stand-in can be used for testing).
+        pollInterval (float): Seconds between two status checks of the batch job.
+        completionWindow (str): The time frame within which the batch should be processed.
+        cache (ClassificationCache): The cache of the previous classifications (the default cache is used if not given).
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a request (the `TokenBudget` defaults if not given).
+
+    Returns:
+        dict[str, int]: The classification of every transcript that was classified, by its episode and timeframe.
+    """
+    client = openai.OpenAI(api_key=apiKey, base_url=baseUrl)
+    cache = cache or create_classification_cache(VDdb)
+    tokenBudget = tokenBudget or TokenBudget(model=MODEL)
+
+    # Getting the data from the database (the failed clips that aren't due to be retried are left out)
+    pendingClause, pendingParams = VDdb.pending_clip_clause(tableName)
+    transcripts = dict(VDdb.iter_rows(tableName, ["episode_timeframe", "transcript"], f"llm_violence_prediction IS ? AND transcript IS NOT ? AND {pendingClause}",
+                                      (None, None) + pendingParams))
+
+    classifications = {}
+    usages = {}
+    preClassifiedKeys = set()
+    pendingParts = {} # The parts to send, by their custom ID
+    clipParts = {} # The custom IDs of the parts sent for every clip
+    for episodeAndTimeframe, transcript in transcripts.items():
+        if pre_classify(transcript, preClassifier):
+            classifications[episodeAndTimeframe] = 0
+            preClassifiedKeys.add(episodeAndTimeframe)
+            continue
+        parts = tokenBudget.fit(transcript)
+        cachedAnswers = [cache.get(part) for part in parts]
+        if 1 in cachedAnswers or None not in cachedAnswers:
+            classifications[episodeAndTimeframe] = int(1 in cachedAnswers)
+            continue
+        if len(parts) > 1 or parts[0] != transcript:
+            get_metrics().increment("oversized_transcripts_total", overflow=tokenBudget.overflow)
+        # The parts cached as non-violent don't change the classification, so only the others are sent
+        clipParts[episodeAndTimeframe] = []
+        for partIndex, (part, cachedAnswer) in enumerate(zip(parts, cachedAnswers)):
+            if cachedAnswer is None:
+                customId = part_custom_id(episodeAndTimeframe, partIndex, len(parts))
+                pendingParts[customId] = part
+                clipParts[episodeAndTimeframe].append(customId)
+
+    if pendingParts:
+        # Write the requests to a JSONL file and submit it as one batch job
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", encoding="utf-8", delete=False) as inputFile:
+            for customId, part in pendingParts.items():
+                inputFile.write(json.dumps(build_batch_request(customId, part), ensure_ascii=False) + "\n")
+        try:
+            with open(inputFile.name, "rb") as file:
+                batchInput = client.files.create(file=file, purpose="batch")
+        finally:
+            os.remove(inputFile.name)
+
+        batch = client.batches.create(input_file_id=batchInput.id, endpoint=BATCH_ENDPOINT, completion_window=completionWindow,
+                                      metadata={"table": tableName})
+        print(f"Submitted batch {batch.id} with {len(pendingParts)} requests for {len(clipParts)} transcripts.")
+        with get_metrics().time("stage_duration_seconds", stage="batch_classification"):
+            batch = _wait_for_batch(client, batch.id, pollInterval)
+        print(f"Batch {batch.id} finished with the status '{batch.status}'.")
+
+        # The requests that didn't finish before the batch expired or was cancelled are left for the next run
+        partClassifications, partErrors, partUsages = {}, {}, {}
+        if batch.output_file_id:
+            outputText = client.files.content(batch.output_file_id).text
+            partClassifications, partErrors = parse_batch_output(outputText)
+            partUsages = parse_batch_usage(outputText)
+        if batch.error_file_id:
+            partErrors.update(parse_batch_output(client.files.content(batch.error_file_id).text)[1])
+        for customId, llmAnswer in partClassifications.items():
+            cache.put(pendingParts[customId], llmAnswer)
+        record_token_usage(sum(partUsages.values(), TokenUsage()))
+
+        # A clip is violent if any of its parts is, and non-violent once every part sent was classified as non-violent
+        errors = {}
+        for episodeAndTimeframe, customIds in clipParts.items():
+            answers = [partClassifications.get(customId) for customId in customIds]
+            usages[episodeAndTimeframe] = sum((partUsages.get(customId, TokenUsage()) for customId in customIds), TokenUsage())
+            if 1 in answers or None not in answers:
+                classifications[episodeAndTimeframe] = int(1 in answers)
+            elif any(customId in partErrors for customId in customIds):
+                errors[episodeAndTimeframe] = "; ".join(partErrors[customId] for customId in customIds if customId in partErrors)
+        for episodeAndTimeframe, error in errors.items():
+            print(f"Error processing transcript for {episodeAndTimeframe}: {error}")
+            VDdb.record_clip_failure(tableName, error, episodeAndTimeframe)
+        classifiedCount = sum(episodeAndTimeframe in classifications for episodeAndTimeframe in clipParts)
+        get_metrics().increment("stage_items_total", classifiedCount, stage="batch_classification", outcome="success")
+        get_metrics().increment("stage_items_total", len(errors), stage="batch_classification", outcome="failure")
+
+    if classifications:
+        # Apply every classification in a single transaction
+        VDdb.update_cases(tableName, {episodeAndTimeframe: {"llm_violence_prediction": llmAnswer,
+                                                            "prediction_source": PRE_CLASSIFIER_PREDICTION if episodeAndTimeframe in preClassifiedKeys else LLM_PREDICTION,
+                                                            **usages.get(episodeAndTimeframe, TokenUsage()).database_fields(),
+                                                            **VDdb.clip_state_fields(tableName, CLASSIFIED)}
+                                      for episodeAndTimeframe, llmAnswer in classifications.items()}).result()
+    print(f"Updated the database for {len(classifications)} of the {len(transcripts)} pending instances.")
+    print(cache.summary())
+    if preClassifier is not None:
+        print(preClassifier.summary())
+    return classifications
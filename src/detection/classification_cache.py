@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.utils.metrics import get_metrics
+
+
+def hash_prompt(systemMessage: str, tools: list[dict], toolChoice: dict) -> str:
+    """
+    Hashes everything that is sent to the LLM besides the transcript, so that editing the prompt or the tool schema
+    invalidates the classifications made with the previous version.
+
+    Args:
+        systemMessage (str): The system message.
+        tools (list[dict]): The tool schema.
+        toolChoice (dict): The forced tool choice.
+
+    Returns:
+        str: The SHA-256 hash of the prompt.
+    """
+    prompt = json.dumps({"system": systemMessage, "tools": tools, "tool_choice": toolChoice}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class ClassificationCache():
+    """
+    A persistent cache of the LLM's classifications, keyed by the model, the prompt, the temperature and the transcript text
+    that was sent (the whole transcript, or the part of it that fit the token budget of the request).
+    The entries are kept in the database (so they are shared by every table and every run), and the least recently used
+    ones are evicted once there are more than `maxEntries` of them.
+    """
+    def __init__(self, VDdb: ViolenceDetectionDatabase, model: str, promptName: str, promptHash: str, temperature: float,
+                 maxEntries: int | None = 100_000, evictionInterval: int = 100) -> None:
+        """
+        Args:
+            VDdb (ViolenceDetectionDatabase): The database holding the cache.
+            model (str): The name of the model the classifications are made with.
+            promptName (str): The name of the prompt (e.g., 'single' or 'packed'), whose older versions are invalidated together.
+            promptHash (str): The hash of the system prompt and the tool schema (see `hash_prompt`).
+            temperature (float): The sampling temperature.
+            maxEntries (int | None): The maximum number of cached classifications (None means no limit).
+            evictionInterval (int): The number of new entries after which the least recently used ones are evicted.
+        """
+        self.VDdb = VDdb
+        self.model = model
+        self.promptName = promptName
+        self.promptHash = promptHash
+        self.temperature = temperature
+        self.maxEntries = maxEntries
+        self.evictionInterval = evictionInterval
+        self.hits = 0
+        self.misses = 0
+        self._newEntries = 0
+        self._lock = threading.Lock()
+
+    def key(self, transcript: str) -> tuple[str, str]:
+        """Returns the cache key of a transcript and the hash of the transcript."""
+        transcriptHash = hashlib.sha256(transcript.encode()).hexdigest()
+        keyData = json.dumps([self.model, self.promptHash, self.temperature, transcriptHash])
+        return hashlib.sha256(keyData.encode()).hexdigest(), transcriptHash
+
+    def get(self, transcript: str) -> int | None:
+        """
+        Returns the cached classification of a transcript, counting the lookup as a hit or a miss.
+
+        Args:
+            transcript (str): The transcript.
+
+        Returns:
+            int | None: The classification, or None if the transcript wasn't classified with the same model and prompt.
+        """
+        classification = self.VDdb.get_cached_classification(self.key(transcript)[0])
+        get_metrics().increment("cache_lookups_total", cache=f"classification_{self.promptName}",
+                                result="miss" if classification is None else "hit")
+        with self._lock:
+            if classification is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return classification
+
+    def put(self, transcript: str, classification: int) -> None:
+        """
+        Stores the classification of a transcript.
+
+        Args:
+            transcript (str): The transcript.
+            classification (int): Its classification.
+        """
+        cacheKey, transcriptHash = self.key(transcript)
+        self.VDdb.cache_classification(cacheKey, self.model, self.promptName, self.promptHash, self.temperature, transcriptHash, int(classification))
+        with self._lock:
+            self._newEntries += 1
+            evict = self.maxEntries is not None and self._newEntries % self.evictionInterval == 0
+        if evict:
+            self.VDdb.evict_classifications(self.maxEntries)
+
+    def invalidate_stale_prompts(self) -> None:
+        """Deletes the classifications that were made with an older version of the prompt or tool schema."""
+        self.VDdb.invalidate_classifications(self.promptName, self.promptHash)
+
+    def clear(self) -> None:
+        """Deletes every cached classification."""
+        self.VDdb.invalidate_classifications()
+
+    def stats(self) -> dict[str, float]:
+        """Returns the number of hits and misses since the cache was created and the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def summary(self) -> str:
+        """Returns the hit and miss counts as a human readable line."""
+        stats = self.stats()
+        return f"Classification cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} of the requests were saved)"
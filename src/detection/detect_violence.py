@@ -1,7 +1,14 @@
 import concurrent.futures
 import json
 import openai
-from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.backends.interfaces import ClassificationBackend
+from src.database.clip_state import CLASSIFIED
+from src.database.violence_detection_database import LLM_PREDICTION, PRE_CLASSIFIER_PREDICTION, ViolenceDetectionDatabase
+from src.detection.classification_cache import ClassificationCache, hash_prompt
+from src.detection.pre_classifier import PreClassifier
+from src.detection.token_budget import TokenBudget, TokenUsage, count_request_tokens, count_tokens
+from src.utils.metrics import get_metrics
+from src.utils.rate_limiter import get_rate_limiter
 
 from tenacity import (
   retry,
@@ -10,10 +17,127 @@ from tenacity import (
 )  # for exponential backoff
 
 import concurrent
-import threading
 
 
-@retry(wait=wait_random_exponential(min=1, max=75), stop=stop_after_attempt(10))
+# The model and the prompt the transcripts are classified with
+MODEL = "gpt-4o"
+TEMPERATURE = 0.4 # Lower temperature for more deterministic behavior
+
+# The tokens reserved for the answer of a request when the rate limiter counts its tokens
+COMPLETION_TOKENS_ESTIMATE = 50
+
+# Define the system message to properly instruct the assistant
+SYSTEM_MESSAGE = "Türk dizilerinden alınmış transkriptleri kadına yönelik şiddet içeren (1) veya şiddet içermeyen (0) olarak sınıflandıran bir asistansın. Şiddet fiziksel, \
+                psikolojik, vb. türlerden olabilir. Belirsizliğe mahal vermeyen ve net noktalarda şiddet var diyeceksin."
+
+TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "insert_violence_data",
+        "description": "Kadına yönelik şiddet içeren (1) ya da içermeyen (0) olarak aldığı \
+        yanıtları database'e göderir.",
+        "parameters": {
+        "type": "object",
+        "properties": {
+            "classification": {
+                "type": "integer",
+                "description": "Transkriptin şiddet içerme durumu (1 ya da 0)"
+            }
+        },
+        "required": ["classification"]
+    }
+  }
+}]
+
+TOOL_CHOICE = {"type": "function", "function": {"name": "insert_violence_data"}}
+
+# Changes whenever the system message or the tool schema is edited, which invalidates the cached classifications
+PROMPT_NAME = "single"
+PROMPT_HASH = hash_prompt(SYSTEM_MESSAGE, TOOLS, TOOL_CHOICE)
+
+
+def create_classification_cache(VDdb: ViolenceDetectionDatabase, maxEntries: int | None = 100_000, promptName: str = PROMPT_NAME,
+                                promptHash: str = PROMPT_HASH) -> ClassificationCache:
+    """
+    Creates the cache of the classifications made with the current model and prompt, dropping the ones made with an older version of the prompt.
+
+    Args:
+        VDdb (ViolenceDetectionDatabase): The database holding the cache.
+        maxEntries (int | None): The maximum number of cached classifications.
+        promptName (str): The name of the prompt.
+        promptHash (str): The hash of the current version of the prompt.
+
+    Returns:
+        ClassificationCache: The cache.
+    """
+    cache = ClassificationCache(VDdb, MODEL, promptName, promptHash, TEMPERATURE, maxEntries)
+    cache.invalidate_stale_prompts()
+    return cache
+
+
+def build_messages(content: str) -> list[dict]:
+    """
+    Builds the messages that ask the assistant to classify a transcript. The system message comes first, so that it and
+    the tool schema form the same prefix in every request, which the provider can serve from its prompt cache.
+
+    Args:
+        content (str): The transcript content to be classified.
+
+    Returns:
+        list[dict]: The messages of the conversation.
+    """
+    return [{"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": content}]
+
+
+def estimate_tokens(text: str) -> int:
+    """Counts the tokens of a text with the tokenizer of the model (estimated from its length if tiktoken isn't installed)."""
+    return count_tokens(text, MODEL)
+
+
+def wait_before_retry(retryState) -> float:
+    """
+    Retries a rate limited request right away, since the shared rate limiter already holds it back until the backend accepts
+    requests again, and backs off exponentially after the other errors.
+    """
+    get_metrics().increment("retries_total", backend="openai")
+    if isinstance(retryState.outcome.exception(), openai.RateLimitError):
+        return 0
+    return wait_random_exponential(min=1, max=75)(retryState)
+
+
+def create_chat_completion(client: openai.OpenAI, messages: list[dict], tools: list[dict], toolChoice: dict):
+    """
+    Sends a chat completion request once the OpenAI rate limiter allows it, and adjusts the limiter to the rate-limit
+    headers of the response.
+
+    Args:
+        client (openai.OpenAI): The OpenAI API client.
+        messages (list[dict]): The messages of the conversation.
+        tools (list[dict]): The tool schema.
+        toolChoice (dict): The forced tool choice.
+
+    Returns:
+        The API response.
+    """
+    rateLimiter = get_rate_limiter("openai")
+    rateLimiter.wait(count_request_tokens(messages, tools, MODEL) + COMPLETION_TOKENS_ESTIMATE)
+    try:
+        rawResponse = client.chat.completions.with_raw_response.create(
+            model=MODEL,
+            messages=messages,
+            tools=tools,
+            tool_choice=toolChoice,
+            temperature=TEMPERATURE
+        )
+    except openai.RateLimitError as e:
+        rateLimiter.on_rate_limited(e.response.headers)
+        raise
+    rateLimiter.update_from_headers(rawResponse.headers)
+    return rawResponse.parse()
+
+
+@retry(wait=wait_before_retry, stop=stop_after_attempt(10))
 def _run_conversation(client: openai.OpenAI, content: str) -> dict:
     """
     Sends a transcript to the OpenAI API for classification.
@@ -25,111 +149,235 @@ def _run_conversation(client: openai.OpenAI, content: str) -> dict:
     Returns:
         dict: The API response containing the classification result.
     """
-    # Define the system message to properly instruct the assistant 
-    systemMessage = "Türk dizilerinden alınmış transkriptleri kadına yönelik şiddet içeren (1) veya şiddet içermeyen (0) olarak sınıflandıran bir asistansın. Şiddet fiziksel, \
-                psikolojik, vb. türlerden olabilir. Belirsizliğe mahal vermeyen ve net noktalarda şiddet var diyeceksin."
-    
-    messages = [{"role": "user", "content": content}, 
-               {"role": "system", "content": systemMessage}]
-    
-    tools = [{
-        "type": "function",
-        "function": {
-            "name": "insert_violence_data",
-            "description": "Kadına yönelik şiddet içeren (1) ya da içermeyen (0) olarak aldığı \
-            yanıtları database'e göderir.",
-            "parameters": {
-            "type": "object",
-            "properties": {
-                "classification": {
-                    "type": "integer",
-                    "description": "Transkriptin şiddet içerme durumu (1 ya da 0)"
-                }
-            },
-            "required": ["classification"]
-        }
-      }
-    }]
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        tools=tools,
-        tool_choice= {"type": "function", "function": {"name": "insert_violence_data"}},
-        temperature=0.4  # Lower temperature for more deterministic behavior  
-    )
-
-    return response
-
-
-def _update_database(llmAnswer: str, VDdb: ViolenceDetectionDatabase, tableName: str, episodeAndTimeframe: str, lock: threading.Lock) -> None:
-    """
-    Updates the database with the classification result.
+    return create_chat_completion(client, build_messages(content), TOOLS, TOOL_CHOICE)
+
+
+def _update_database(llmAnswer: str, VDdb: ViolenceDetectionDatabase, tableName: str, episodeAndTimeframe: str, usage: TokenUsage,
+                     source: str = LLM_PREDICTION) -> None:
+    """
+    Updates the database with the classification result, where it came from and the tokens it used.
 
     Args:
         llmAnswer (str): The classification result from the assistant.
         VDdb (ViolenceDetectionDatabase): The database instance.
         tableName (str): The name of the database table.
         episodeAndTimeframe (str): The unique identifier for the episode and timeframe.
-        lock (threading.Lock): A threading lock to ensure thread safety.
+        usage (TokenUsage): The tokens of the requests that classified the clip (none if it came from a cache or the pre-classifier).
+        source (str): Where the classification came from (`LLM_PREDICTION` or `PRE_CLASSIFIER_PREDICTION`).
     """
-    with lock:
-        VDdb.update_case(tableName, episodeAndTimeframe, llm_violence_prediction=int(llmAnswer))
+    VDdb.update_case(tableName, episodeAndTimeframe, llm_violence_prediction=int(llmAnswer), prediction_source=source,
+                     **usage.database_fields(), **VDdb.clip_state_fields(tableName, CLASSIFIED))
 
 
-def _process_transcript(transcript: str, VDdb: ViolenceDetectionDatabase, tableName: str, episodeAndTimeframe: str, lock: threading.Lock, client: openai.OpenAI) -> None:
+def pre_classify(transcript: str, preClassifier: PreClassifier | None) -> bool:
     """
-    Processes a single transcript by sending it to the OpenAI API and updating the database.
+    Tells whether a transcript can be marked as non-violent without asking the LLM, counting the skipped clips.
 
     Args:
         transcript (str): The transcript content.
-        VDdb (ViolenceDetectionDatabase): The database instance.
-        tableName (str): The name of the database table.
-        episodeAndTimeframe (str): The unique identifier for the episode and timeframe.
-        lock (threading.Lock): A threading lock to ensure thread safety.
-        client (openai.OpenAI): The OpenAI API client.
+        preClassifier (PreClassifier | None): The local model that marks the clearly non-violent transcripts (nothing is skipped without it).
+
+    Returns:
+        bool: True if the pre-classifier scores the transcript below its threshold.
     """
-    try:
-        response = _run_conversation(client, transcript)
-        print(response)
-        
+    if preClassifier is None or not preClassifier.is_clearly_non_violent(transcript):
+        return False
+    get_metrics().increment("pre_classifier_skips_total")
+    return True
+
+
+class OpenAIClassificationBackend():
+    """Classifies transcripts with the OpenAI API, retrying through the shared rate limiter."""
+    def __init__(self, client: openai.OpenAI) -> None:
+        """
+        Args:
+            client (openai.OpenAI): The OpenAI API client.
+        """
+        self.client = client
+
+    def classify(self, transcript: str) -> int | None:
+        return self.classify_with_usage(transcript)[0]
+
+    def classify_with_usage(self, transcript: str) -> tuple[int | None, TokenUsage]:
+        response = _run_conversation(self.client, transcript)
+
         # Extract the return value from function call
         function = response.choices[0].message.tool_calls[0].function
         arguments = json.loads(function.arguments)
-        
+
         llmAnswer = arguments.get("classification", None)
-        
+        return (int(llmAnswer) if llmAnswer is not None else None), TokenUsage.from_response(response)
+
+
+def record_token_usage(usage: TokenUsage) -> None:
+    """Adds the tokens of the requests that were sent to the `llm_tokens_total` metric."""
+    get_metrics().increment("llm_tokens_total", usage.promptTokens, kind="prompt")
+    get_metrics().increment("llm_tokens_total", usage.cachedPromptTokens, kind="cached_prompt")
+    get_metrics().increment("llm_tokens_total", usage.completionTokens, kind="completion")
+
+
+def _classify_parts(parts: list[str], backend: ClassificationBackend, cache: ClassificationCache = None) -> tuple[int | None, TokenUsage]:
+    """
+    Classifies the parts of a transcript one after the other, stopping at the first violent part, since the clip is violent
+    if any of its parts is. The clip is non-violent only if every part was classified as non-violent.
+    Every answer is cached under the part it was given for, as soon as it is received.
+    """
+    usage, llmAnswer = TokenUsage(), 0
+    for part in parts:
+        partAnswer, partUsage = backend.classify_with_usage(part)
+        usage += partUsage
+        if partAnswer is not None and cache is not None:
+            cache.put(part, partAnswer)
+        if partAnswer == 1:
+            return 1, usage
+        if partAnswer is None:
+            llmAnswer = None
+    return llmAnswer, usage
+
 
-        if llmAnswer is not None:
-            # Update the database 
-            _update_database(llmAnswer, VDdb, tableName, episodeAndTimeframe, lock)
-            print(f"Updated the database for the instance {episodeAndTimeframe}.")
+def request_classification(transcript: str, backend: ClassificationBackend, cache: ClassificationCache = None,
+                           tokenBudget: TokenBudget = None) -> tuple[int | None, TokenUsage]:
+    """
+    Classifies a single transcript with the backend (unless it is in the cache), raising any error that occurs.
+    A transcript longer than the token budget is split (or trimmed), and its parts are classified separately.
+    The classifications are cached by the text that was sent, so a transcript sent whole and the parts it was split or
+    trimmed into under a budget don't share an entry.
+
+    Args:
+        transcript (str): The transcript content.
+        backend (ClassificationBackend): The backend that classifies the transcript (e.g., `OpenAIClassificationBackend`).
+        cache (ClassificationCache): The cache of the previous classifications.
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a request (the whole transcript is sent if not given).
+
+    Returns:
+        tuple[int | None, TokenUsage]: The classification (1 for violent, 0 for non-violent, or None if the assistant didn't
+        give one) and the tokens of the requests that were sent.
+    """
+    parts = tokenBudget.fit(transcript) if tokenBudget is not None else [transcript]
+    isOversized = len(parts) > 1 or parts[0] != transcript
+    if cache is not None:
+        cachedAnswers = [cache.get(part) for part in parts]
+        if 1 in cachedAnswers or None not in cachedAnswers:
+            return int(1 in cachedAnswers), TokenUsage()
+        # The parts cached as non-violent don't change the classification, so only the others are sent
+        parts = [part for part, cachedAnswer in zip(parts, cachedAnswers) if cachedAnswer is None]
+
+    if isOversized:
+        get_metrics().increment("oversized_transcripts_total", overflow=tokenBudget.overflow)
+    try:
+        with get_metrics().time("stage_duration_seconds", stage="classification"):
+            llmAnswer, usage = _classify_parts(parts, backend, cache)
+    except Exception:
+        get_metrics().increment("stage_items_total", stage="classification", outcome="failure")
+        raise
+    get_metrics().increment("stage_items_total", stage="classification", outcome="success" if llmAnswer is not None else "no_answer")
+    record_token_usage(usage)
+    if llmAnswer is None:
+        return None, usage
+    return int(llmAnswer), usage
+
+
+def classify_transcript(transcript: str, VDdb: ViolenceDetectionDatabase, tableName: str, episodeAndTimeframe: str,
+                        backend: ClassificationBackend, cache: ClassificationCache = None, preClassifier: PreClassifier = None,
+                        tokenBudget: TokenBudget = None) -> int | None:
+    """
+    Classifies a single transcript with the backend (unless it is in the cache, or the pre-classifier marks it as non-violent)
+    and updates the database with the classification, where it came from and the tokens it used.
+    Any error that occurs (or a missing answer) is recorded as a failure of the clip, and the error is raised.
+
+    Args:
+        transcript (str): The transcript content.
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        tableName (str): The name of the database table.
+        episodeAndTimeframe (str): The unique identifier for the episode and timeframe.
+        backend (ClassificationBackend): The backend that classifies the transcript.
+        cache (ClassificationCache): The cache of the previous classifications.
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a request (the whole transcript is sent if not given).
+
+    Returns:
+        int | None: The classification (1 for violent, 0 for non-violent), or None if the assistant didn't give one.
+    """
+    if pre_classify(transcript, preClassifier):
+        _update_database(0, VDdb, tableName, episodeAndTimeframe, TokenUsage(), PRE_CLASSIFIER_PREDICTION)
+        return 0
+
+    try:
+        llmAnswer, usage = request_classification(transcript, backend, cache, tokenBudget)
+    except Exception as e:
+        VDdb.record_clip_failure(tableName, e, episodeAndTimeframe)
+        raise
+
+    if llmAnswer is not None:
+        # Update the database 
+        _update_database(llmAnswer, VDdb, tableName, episodeAndTimeframe, usage)
+        print(f"Updated the database for the instance {episodeAndTimeframe}.")
+    else:
+        VDdb.record_clip_failure(tableName, "No classification was given.", episodeAndTimeframe)
+    return llmAnswer
+
+
+def _process_transcript(transcript: str, VDdb: ViolenceDetectionDatabase, tableName: str, episodeAndTimeframe: str,
+                        backend: ClassificationBackend, cache: ClassificationCache, preClassifier: PreClassifier, tokenBudget: TokenBudget) -> None:
+    """
+    Processes a single transcript by sending it to the classification backend and updating the database.
+
+    Args:
+        transcript (str): The transcript content.
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        tableName (str): The name of the database table.
+        episodeAndTimeframe (str): The unique identifier for the episode and timeframe.
+        backend (ClassificationBackend): The backend that classifies the transcript.
+        cache (ClassificationCache): The cache of the previous classifications.
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a request.
+    """
+    try:
+        classify_transcript(transcript, VDdb, tableName, episodeAndTimeframe, backend, cache, preClassifier, tokenBudget)
 
     except Exception as e:
         print(f"Error processing transcript for {episodeAndTimeframe}: {str(e)}")
 
 
-def analyse_transcripts_in_parallel(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase) -> None:
+def analyse_transcripts_in_parallel(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase, cacheSize: int | None = 100_000,
+                                    preClassifier: PreClassifier = None, backend: ClassificationBackend = None, chunkSize: int = 500,
+                                    tokenBudget: TokenBudget = None) -> None:
     """
     Analyzes transcripts in parallel by classifying them and updating the database.
+    The transcripts that were already classified with the same model and prompt are taken from the cache.
 
     Args:
         apiKey (str): The API key for the OpenAI service.
         tableName (str): The name of the database table.
         VDdb (ViolenceDetectionDatabase): The database instance.
+        cacheSize (int | None): The maximum number of cached classifications.
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        backend (ClassificationBackend): The backend that classifies the transcripts (the OpenAI API by default).
+        chunkSize (int): The number of transcripts read from the database at a time.
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a request (the `TokenBudget` defaults if not given).
     """
-    # Initializing OpenAI API
-    client = openai.OpenAI(api_key=apiKey)
-
-    # Defining the threading lock
-    lock = threading.Lock()
+    tokenBudget = tokenBudget or TokenBudget(model=MODEL)
+    if backend is None:
+        # Initializing OpenAI API
+        client = openai.OpenAI(api_key=apiKey, max_retries=0) # Retried by `_run_conversation` through the rate limiter
+        backend = OpenAIClassificationBackend(client)
+    cache = create_classification_cache(VDdb, cacheSize)
 
-    # Getting the data from the database
-    data = VDdb.select_all(tableName, "llm_violence_prediction IS ?", (None,))
+    # Reading the transcripts chunk by chunk, the classification starting with the first chunk
+    # (the failed clips that aren't due to be retried are left out)
+    pendingClause, pendingParams = VDdb.pending_clip_clause(tableName)
+    data = VDdb.iter_rows(tableName, ["episode_timeframe", "transcript"], f"llm_violence_prediction IS ? AND transcript IS NOT ? AND {pendingClause}",
+                          (None, None) + pendingParams, chunkSize)
 
     with concurrent.futures.ThreadPoolExecutor() as executer:
-        for instance in data:
-            executer.submit(_process_transcript, instance[2], VDdb, tableName, instance[0], lock, client)
-    
-
+        runningTasks = set()
+        for episodeAndTimeframe, transcript in data:
+            # Only a chunk's worth of transcripts waits in the executor, so that memory stays flat on large tables
+            if len(runningTasks) >= chunkSize:
+                _, runningTasks = concurrent.futures.wait(runningTasks, return_when=concurrent.futures.FIRST_COMPLETED)
+            runningTasks.add(executer.submit(_process_transcript, transcript, VDdb, tableName, episodeAndTimeframe, backend, cache, preClassifier, tokenBudget))
 
+    print(cache.summary())
+    if preClassifier is not None:
+        print(preClassifier.summary())
+    print(get_rate_limiter("openai").summary())
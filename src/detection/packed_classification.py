@@ -0,0 +1,344 @@
+import concurrent.futures
+import json
+import threading
+from collections import deque
+from collections.abc import Iterable
+
+import openai
+from tenacity import retry, stop_after_attempt
+
+from src.database.clip_state import CLASSIFIED
+from src.database.violence_detection_database import LLM_PREDICTION, PRE_CLASSIFIER_PREDICTION, ViolenceDetectionDatabase
+from src.detection.classification_cache import ClassificationCache, hash_prompt
+from src.detection.detect_violence import (MODEL, SYSTEM_MESSAGE, OpenAIClassificationBackend, wait_before_retry, create_chat_completion,
+                                           create_classification_cache, estimate_tokens, pre_classify, record_token_usage, request_classification)
+from src.detection.pre_classifier import PreClassifier
+from src.detection.token_budget import TokenBudget, TokenUsage
+from src.utils.metrics import get_metrics
+from src.utils.rate_limiter import get_rate_limiter
+
+# The prompt that classifies several transcripts in one request (the instructions of the single-clip prompt are kept as they are)
+PACKED_SYSTEM_MESSAGE = SYSTEM_MESSAGE + " Sana birden fazla transkript verilecek ve her transkript kendi clip_id'si ile başlayacak. \
+                Her transkripti diğerlerinden bağımsız olarak değerlendir ve hepsinin sınıflandırmasını tek bir fonksiyon çağrısıyla gönder."
+
+PACKED_TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "insert_violence_data_batch",
+        "description": "Her transkript için kadına yönelik şiddet içeren (1) ya da içermeyen (0) olarak aldığı yanıtları database'e göderir.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "classifications": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "clip_id": {
+                                "type": "string",
+                                "description": "Transkriptin clip_id'si"
+                            },
+                            "classification": {
+                                "type": "integer",
+                                "description": "Transkriptin şiddet içerme durumu (1 ya da 0)"
+                            }
+                        },
+                        "required": ["clip_id", "classification"]
+                    }
+                }
+            },
+            "required": ["classifications"]
+        }
+    }
+}]
+
+PACKED_TOOL_CHOICE = {"type": "function", "function": {"name": "insert_violence_data_batch"}}
+
+PACKED_PROMPT_NAME = "packed"
+PACKED_PROMPT_HASH = hash_prompt(PACKED_SYSTEM_MESSAGE, PACKED_TOOLS, PACKED_TOOL_CHOICE)
+
+# The tokens of the clip_id line in the prompt and of the clip's entry in the answer
+TOKENS_PER_PACKED_CLIP = 20
+
+
+def build_packed_content(transcripts: list[str]) -> str:
+    """Builds the user message of a packed request, the clip IDs being the positions of the transcripts in the pack."""
+    return "\n\n".join(f"clip_id: {clipId}\n{transcript}" for clipId, transcript in enumerate(transcripts))
+
+
+def parse_packed_classifications(response, clipCount: int) -> dict[int, int]:
+    """
+    Extracts the classifications from the answer to a packed request, leaving out every malformed entry.
+
+    Args:
+        response: The API response.
+        clipCount (int): The number of transcripts in the pack.
+
+    Returns:
+        dict[int, int]: The classification of every clip that was answered properly, by its position in the pack.
+    """
+    try:
+        function = response.choices[0].message.tool_calls[0].function
+        entries = json.loads(function.arguments)["classifications"]
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    classifications, conflictingIds = {}, set()
+    for entry in entries:
+        try:
+            clipId, classification = int(entry["clip_id"]), int(entry["classification"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not 0 <= clipId < clipCount or classification not in (0, 1):
+            continue
+        if classifications.get(clipId, classification) != classification:
+            conflictingIds.add(clipId)
+        classifications[clipId] = classification
+    return {clipId: classification for clipId, classification in classifications.items() if clipId not in conflictingIds}
+
+
+@retry(wait=wait_before_retry, stop=stop_after_attempt(10))
+def _run_packed_conversation(client: openai.OpenAI, transcripts: list[str]):
+    """
+    Sends several transcripts to the OpenAI API to be classified in a single request.
+
+    Args:
+        client (openai.OpenAI): The OpenAI API client.
+        transcripts (list[str]): The transcripts to be classified.
+
+    Returns:
+        The API response containing the classification results.
+    """
+    # The system message comes first, so that it and the tool schema are a prefix the provider can cache
+    messages = [{"role": "system", "content": PACKED_SYSTEM_MESSAGE},
+                {"role": "user", "content": build_packed_content(transcripts)}]
+
+    return create_chat_completion(client, messages, PACKED_TOOLS, PACKED_TOOL_CHOICE)
+
+
+class PackedClassifier():
+    """
+    Classifies transcripts by packing several of them into each request, so that the system prompt and the tool schema are
+    sent once per pack instead of once per clip.
+
+    The packs are filled up to `maxPackSize` transcripts and `maxPackTokens` estimated tokens. The pack size shrinks by half
+    (down to two clips) whenever an answer is malformed or leaves out some clips, and grows back by one clip after every
+    complete answer.
+    The clips missing from an answer are classified with single-clip requests.
+
+    The token budget is applied to every transcript before it is packed: a trimmed transcript is packed like the others,
+    and a transcript that is split is classified on its own (part by part). The usage of a packed request is shared by
+    its clips in proportion to their tokens.
+    """
+    def __init__(self, client: openai.OpenAI, maxPackSize: int = 10, maxPackTokens: int = 6000, maxWorkers: int = 8,
+                 packedCache: ClassificationCache = None, singleCache: ClassificationCache = None, tokenBudget: TokenBudget = None) -> None:
+        """
+        Args:
+            client (openai.OpenAI): The OpenAI API client.
+            maxPackSize (int): The maximum number of transcripts in a request.
+            maxPackTokens (int): The maximum number of estimated transcript tokens in a request.
+            maxWorkers (int): The number of requests sent at the same time.
+            packedCache (ClassificationCache): The cache of the classifications made with the packed prompt.
+            singleCache (ClassificationCache): The cache of the classifications made with the single-clip prompt (for the fallbacks).
+            tokenBudget (TokenBudget): The maximum number of tokens of a transcript in a request (the whole transcripts are sent if not given).
+        """
+        self.client = client
+        self.singleBackend = OpenAIClassificationBackend(client)
+        self.maxPackSize = maxPackSize
+        self.maxPackTokens = maxPackTokens
+        self.maxWorkers = maxWorkers
+        self.packedCache = packedCache
+        self.singleCache = singleCache
+        self.tokenBudget = tokenBudget
+        self.packSize = maxPackSize
+        self.packedRequests = 0
+        self.fallbackRequests = 0
+        self.cachedClips = 0
+        self.tokenUsage = TokenUsage()
+        self._lock = threading.Lock()
+
+    def classify(self, transcripts: dict[str, str] | Iterable[tuple[str, str]], onResult=None) -> dict[str, int | None]:
+        """
+        Classifies the transcripts. They are read from the iterable as the packs are made, so that only the transcripts of
+        the packs being sent (and of the next ones) are held in memory, whatever the number of clips.
+
+        Args:
+            transcripts (dict[str, str] | Iterable[tuple[str, str]]): The transcripts by the identifier of their clip, or
+                the identifier and the transcript of every clip (e.g., the rows of `ViolenceDetectionDatabase.iter_rows`).
+            onResult (Callable): Called with the identifier, the classification and the `TokenUsage` of each clip as soon as
+                it is classified (no tokens if it came from the cache).
+
+        Returns:
+            dict[str, int | None]: The classification of every clip (None if it couldn't be classified).
+        """
+        results = {}
+        clips = iter(transcripts.items() if isinstance(transcripts, dict) else transcripts)
+        pendingClips = deque()
+
+        def add_result(clipKey: str, classification: int | None, usage: TokenUsage) -> None:
+            results[clipKey] = classification
+            if onResult is not None:
+                onResult(clipKey, classification, usage)
+
+        def read_clips() -> None:
+            # Enough transcripts to fill a pack for every worker, the cached ones being answered as they are read
+            while len(pendingClips) < self.maxWorkers * self.maxPackSize:
+                clip = next(clips, None)
+                if clip is None:
+                    return
+                clipKey, transcript = clip
+                text, isPackable = self._fit(transcript)
+                classification = self.packedCache.get(text) if self.packedCache is not None and isPackable else None
+                if classification is None:
+                    pendingClips.append((clipKey, text, isPackable))
+                else:
+                    self.cachedClips += 1
+                    add_result(clipKey, classification, TokenUsage())
+
+        # The packs are made as the earlier ones are answered, so that they follow the current pack size
+        with concurrent.futures.ThreadPoolExecutor(self.maxWorkers) as executor:
+            runningPacks = set()
+            read_clips()
+            while pendingClips or runningPacks:
+                while pendingClips and len(runningPacks) < self.maxWorkers:
+                    runningPacks.add(executor.submit(self._classify_pack, self._next_pack(pendingClips)))
+                    read_clips()
+                donePacks, runningPacks = concurrent.futures.wait(runningPacks, return_when=concurrent.futures.FIRST_COMPLETED)
+                for donePack in donePacks:
+                    for clipKey, (classification, usage) in donePack.result().items():
+                        add_result(clipKey, classification, usage)
+                read_clips()
+        return results
+
+    def _fit(self, transcript: str) -> tuple[str, bool]:
+        """Returns the text of a transcript to send within the token budget, and whether it can be packed (it isn't split)."""
+        if self.tokenBudget is None:
+            return transcript, True
+        parts = self.tokenBudget.fit(transcript)
+        if len(parts) > 1: # Counted as oversized when it is classified on its own
+            return transcript, False
+        if parts[0] != transcript:
+            get_metrics().increment("oversized_transcripts_total", overflow=self.tokenBudget.overflow)
+        return parts[0], True
+
+    def _next_pack(self, pendingClips: deque[tuple[str, str, bool]]) -> list[tuple[str, str, bool]]:
+        """Takes the next transcripts from the pending ones, within the current pack size and the token budget."""
+        if not pendingClips[0][2]: # A transcript that is split makes a pack of its own
+            return [pendingClips.popleft()]
+        pack, packTokens = [], 0
+        while pendingClips and len(pack) < self.packSize and pendingClips[0][2]:
+            clipTokens = estimate_tokens(pendingClips[0][1]) + TOKENS_PER_PACKED_CLIP
+            if pack and packTokens + clipTokens > self.maxPackTokens:
+                break
+            pack.append(pendingClips.popleft())
+            packTokens += clipTokens
+        return pack
+
+    def _classify_pack(self, pack: list[tuple[str, str, bool]]) -> dict[str, tuple[int | None, TokenUsage]]:
+        """
+        Classifies a pack with one request, then the clips missing from the answer with single-clip requests, returning the
+        classification and the tokens used for every clip.
+        """
+        transcripts = [transcript for _, transcript, _ in pack]
+        classifications = {}
+        usages = [TokenUsage() for _ in pack]
+        if len(pack) > 1:
+            try:
+                with get_metrics().time("stage_duration_seconds", stage="packed_classification"):
+                    response = _run_packed_conversation(self.client, transcripts)
+                classifications = parse_packed_classifications(response, len(pack))
+                packUsage = TokenUsage.from_response(response)
+                record_token_usage(packUsage)
+                usages = packUsage.split([estimate_tokens(transcript) for transcript in transcripts])
+            except Exception as e:
+                print(f"Error processing a pack of {len(pack)} transcripts: {str(e)}")
+            with self._lock:
+                self.packedRequests += 1
+                get_metrics().increment("stage_items_total", len(classifications), stage="packed_classification", outcome="success")
+                get_metrics().increment("stage_items_total", len(pack) - len(classifications), stage="packed_classification", outcome="fallback")
+                if len(classifications) == len(pack):
+                    self.packSize = min(self.packSize + 1, self.maxPackSize)
+                else:
+                    self.packSize = max(self.packSize // 2, min(2, self.maxPackSize))
+
+        results = {}
+        for clipId, (clipKey, transcript, _) in enumerate(pack):
+            if clipId in classifications:
+                results[clipKey] = (classifications[clipId], usages[clipId])
+                if self.packedCache is not None:
+                    self.packedCache.put(transcript, classifications[clipId])
+                continue
+
+            with self._lock:
+                self.fallbackRequests += 1
+            try:
+                # The clip's share of the packed request was spent as well
+                classification, usage = request_classification(transcript, self.singleBackend, self.singleCache, tokenBudget=self.tokenBudget)
+                results[clipKey] = (classification, usages[clipId] + usage)
+            except Exception as e:
+                print(f"Error processing transcript for {clipKey}: {str(e)}")
+                results[clipKey] = (None, usages[clipId])
+
+        with self._lock:
+            for _, usage in results.values():
+                self.tokenUsage += usage
+        return results
+
+    def summary(self) -> str:
+        """Returns the number of requests that were sent as a human readable line."""
+        return (f"Packed classification: {self.packedRequests} packed requests, {self.fallbackRequests} single-clip requests, "
+                f"{self.cachedClips} clips from the cache, {self.tokenUsage.promptTokens} prompt tokens "
+                f"({self.tokenUsage.cachedPromptTokens} cached) and {self.tokenUsage.completionTokens} completion tokens")
+
+
+def analyse_transcripts_packed(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase, maxPackSize: int = 10,
+                               maxPackTokens: int = 6000, cacheSize: int | None = 100_000, tokenBudget: TokenBudget = None,
+                               baseUrl: str = None, preClassifier: PreClassifier = None) -> None:
+    """
+    Analyzes the transcripts that don't have a prediction yet by classifying several of them per request and updating the
+    database with the classification and the tokens of every clip.
+    The transcripts that the pre-classifier marks as non-violent are left out of the packs.
+
+    Args:
+        apiKey (str): The API key for the OpenAI service.
+        tableName (str): The name of the database table.
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        maxPackSize (int): The maximum number of transcripts in a request.
+        maxPackTokens (int): The maximum number of estimated transcript tokens in a request.
+        cacheSize (int | None): The maximum number of cached classifications.
+        tokenBudget (TokenBudget): The maximum number of tokens of a transcript in a request (the `TokenBudget` defaults if not given).
+        baseUrl (str): The URL of the API (a local stand-in can be used for testing).
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+    """
+    client = openai.OpenAI(api_key=apiKey, base_url=baseUrl, max_retries=0) # Retried through the rate limiter
+    classifier = PackedClassifier(client, maxPackSize, maxPackTokens,
+                                  packedCache=create_classification_cache(VDdb, cacheSize, PACKED_PROMPT_NAME, PACKED_PROMPT_HASH),
+                                  singleCache=create_classification_cache(VDdb, cacheSize), tokenBudget=tokenBudget or TokenBudget(model=MODEL))
+
+    # Getting the data from the database (the failed clips that aren't due to be retried are left out)
+    pendingClause, pendingParams = VDdb.pending_clip_clause(tableName)
+    data = VDdb.iter_rows(tableName, ["episode_timeframe", "transcript"], f"llm_violence_prediction IS ? AND transcript IS NOT ? AND {pendingClause}",
+                          (None, None) + pendingParams)
+
+    def write_result(episodeAndTimeframe: str, llmAnswer: int | None, usage: TokenUsage, source: str = LLM_PREDICTION) -> None:
+        if llmAnswer is not None:
+            VDdb.update_case(tableName, episodeAndTimeframe, llm_violence_prediction=llmAnswer, prediction_source=source,
+                             **usage.database_fields(), **VDdb.clip_state_fields(tableName, CLASSIFIED))
+            print(f"Updated the database for the instance {episodeAndTimeframe}.")
+        else:
+            VDdb.record_clip_failure(tableName, "No classification was given.", episodeAndTimeframe)
+
+    def unclear_transcripts() -> Iterable[tuple[str, str]]:
+        for episodeAndTimeframe, transcript in data:
+            if pre_classify(transcript, preClassifier):
+                write_result(episodeAndTimeframe, 0, TokenUsage(), PRE_CLASSIFIER_PREDICTION)
+            else:
+                yield episodeAndTimeframe, transcript
+
+    classifier.classify(unclear_transcripts(), write_result)
+    print(classifier.summary())
+    if preClassifier is not None:
+        print(preClassifier.summary())
+    print(get_rate_limiter("openai").summary())
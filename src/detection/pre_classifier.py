@@ -0,0 +1,196 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+
+# Where `accuracy_testing/evaluate_pre_classifier.py` saves the model trained on the labelled table
+PRE_CLASSIFIER_PATH = "./data/pre_classifier.npz"
+
+
+def normalize_transcript(transcript: str) -> str:
+    """Lowercases a transcript with the Turkish dotted and dotless i's, and removes the speaker labels."""
+    transcript = re.sub(r"Speaker \w+:", " ", transcript)
+    return transcript.replace("I", "ı").replace("İ", "i").lower()
+
+
+class HashedNgramFeaturizer():
+    """
+    Turns a transcript into a sparse vector of hashed word unigrams, word bigrams and character n-grams (which cope with
+    Turkish suffixes), weighted by sublinear term frequency and L2 normalized.
+    """
+    def __init__(self, featureCount: int = 2 ** 18, characterNgramRange: tuple[int, int] = (3, 5)) -> None:
+        """
+        Args:
+            featureCount (int): The number of hash buckets.
+            characterNgramRange (tuple[int, int]): The smallest and largest character n-grams.
+        """
+        self.featureCount = featureCount
+        self.characterNgramRange = characterNgramRange
+
+    def _ngrams(self, transcript: str) -> list[str]:
+        words = re.findall(r"\w+", normalize_transcript(transcript))
+        ngrams = [f"w:{word}" for word in words] + [f"b:{first} {second}" for first, second in zip(words, words[1:])]
+        for word in words:
+            paddedWord = f" {word} "
+            for n in range(self.characterNgramRange[0], self.characterNgramRange[1] + 1):
+                ngrams.extend(f"c:{paddedWord[i:i + n]}" for i in range(len(paddedWord) - n + 1))
+        return ngrams
+
+    def transform(self, transcripts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Featurizes the transcripts.
+
+        Args:
+            transcripts (list[str]): The transcripts.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The row pointers, the feature indices and the values of the
+            sparse matrix of the transcripts (in the CSR layout).
+        """
+        rowPointers, indices, values = [0], [], []
+        for transcript in transcripts:
+            buckets = np.array([zlib.crc32(ngram.encode()) % self.featureCount for ngram in self._ngrams(transcript)], dtype=np.int64)
+            uniqueBuckets, counts = np.unique(buckets, return_counts=True)
+            weights = 1 + np.log(counts)
+            weights /= max(np.linalg.norm(weights), 1e-12)
+            indices.append(uniqueBuckets)
+            values.append(weights)
+            rowPointers.append(rowPointers[-1] + len(uniqueBuckets))
+        return (np.array(rowPointers, dtype=np.int64), np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+                np.concatenate(values) if values else np.zeros(0))
+
+
+class PreClassifier():
+    """
+    A linear model over hashed n-grams that scores how likely a transcript is to be violent, so that the clearly
+    non-violent clips don't have to be sent to the LLM. It runs on the CPU in a few milliseconds per clip.
+    """
+    def __init__(self, threshold: float = 0.1, featureCount: int = 2 ** 18) -> None:
+        """
+        Args:
+            threshold (float): The clips scored below this probability of being violent are marked as non-violent.
+            featureCount (int): The number of hash buckets.
+        """
+        self.threshold = threshold
+        self.featurizer = HashedNgramFeaturizer(featureCount)
+        self.weights = np.zeros(featureCount)
+        self.bias = 0.0
+        self.skippedCount = 0
+        self.passedCount = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scores(rowPointers: np.ndarray, indices: np.ndarray, values: np.ndarray, weights: np.ndarray, bias: float) -> np.ndarray:
+        rowIds = np.repeat(np.arange(len(rowPointers) - 1), np.diff(rowPointers))
+        return np.bincount(rowIds, weights=weights[indices] * values, minlength=len(rowPointers) - 1) + bias
+
+    def fit(self, transcripts: list[str], labels: list[int], regularization: float = 1e-5, iterations: int = 300,
+            learningRate: float = 0.2) -> "PreClassifier":
+        """
+        Trains the model with full-batch Adam on the class-balanced logistic loss.
+
+        Args:
+            transcripts (list[str]): The labelled transcripts.
+            labels (list[int]): Their labels (1 for violent, 0 for non-violent).
+            regularization (float): The strength of the L2 regularization.
+            iterations (int): The number of gradient steps.
+            learningRate (float): The size of the gradient steps.
+
+        Returns:
+            PreClassifier: The trained model.
+        """
+        rowPointers, indices, values = self.featurizer.transform(transcripts)
+        labels = np.asarray(labels, dtype=float)
+        rowIds = np.repeat(np.arange(len(labels)), np.diff(rowPointers))
+        # Both classes weigh the same in the loss, since violent clips are much rarer
+        positiveCount = max(labels.sum(), 1)
+        negativeCount = max(len(labels) - labels.sum(), 1)
+        sampleWeights = np.where(labels == 1, 0.5 / positiveCount, 0.5 / negativeCount)
+
+        parameters = np.zeros(self.featurizer.featureCount + 1) # The weights, then the bias
+        firstMoment, secondMoment = np.zeros_like(parameters), np.zeros_like(parameters)
+        for step in range(1, iterations + 1):
+            probabilities = 1 / (1 + np.exp(-self._scores(rowPointers, indices, values, parameters[:-1], parameters[-1])))
+            residuals = (probabilities - labels) * sampleWeights
+            gradient = np.append(np.bincount(indices, weights=residuals[rowIds] * values, minlength=self.featurizer.featureCount)
+                                 + regularization * parameters[:-1], residuals.sum())
+            firstMoment = 0.9 * firstMoment + 0.1 * gradient
+            secondMoment = 0.999 * secondMoment + 0.001 * gradient ** 2
+            parameters -= learningRate * (firstMoment / (1 - 0.9 ** step)) / (np.sqrt(secondMoment / (1 - 0.999 ** step)) + 1e-8)
+
+        self.weights, self.bias = parameters[:-1], float(parameters[-1])
+        return self
+
+    def predict_proba(self, transcripts: list[str]) -> np.ndarray:
+        """Returns the probability of each transcript being violent."""
+        scores = self._scores(*self.featurizer.transform(transcripts), self.weights, self.bias)
+        return 1 / (1 + np.exp(-scores))
+
+    def is_clearly_non_violent(self, transcript: str) -> bool:
+        """
+        Tells whether a transcript scores below the threshold, counting the clips that skip the LLM.
+
+        Args:
+            transcript (str): The transcript.
+
+        Returns:
+            bool: True if the clip can be marked as non-violent without asking the LLM.
+        """
+        isSkipped = bool(self.predict_proba([transcript])[0] < self.threshold)
+        with self._lock:
+            if isSkipped:
+                self.skippedCount += 1
+            else:
+                self.passedCount += 1
+        return isSkipped
+
+    def summary(self) -> str:
+        """Returns the number of API calls that were avoided as a human readable line."""
+        with self._lock:
+            total = self.skippedCount + self.passedCount
+            share = self.skippedCount / total if total else 0.0
+            return f"Pre-classifier: {self.skippedCount} of {total} clips marked as non-violent without an API call ({share:.0%})"
+
+    def save(self, path: str = PRE_CLASSIFIER_PATH) -> None:
+        """Saves the model (only the non-zero weights are stored)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        nonZeroIndices = np.flatnonzero(self.weights)
+        np.savez_compressed(path, indices=nonZeroIndices, weights=self.weights[nonZeroIndices], bias=self.bias,
+                            featureCount=self.featurizer.featureCount, threshold=self.threshold)
+
+    @classmethod
+    def load(cls, path: str = PRE_CLASSIFIER_PATH, threshold: float = None) -> "PreClassifier":
+        """
+        Loads a saved model.
+
+        Args:
+            path (str): The path of the model.
+            threshold (float): The threshold to use instead of the saved one.
+
+        Returns:
+            PreClassifier: The model.
+        """
+        with np.load(path) as model:
+            preClassifier = cls(float(model["threshold"]) if threshold is None else threshold, int(model["featureCount"]))
+            preClassifier.weights[model["indices"]] = model["weights"]
+            preClassifier.bias = float(model["bias"])
+        return preClassifier
+
+
+def load_labelled_transcripts(VDdb: ViolenceDetectionDatabase, tableName: str) -> tuple[list[str], list[str], list[int]]:
+    """
+    Returns the clips of a table that were labelled with `accuracy_testing/manual_labelling_interface.py`.
+
+    Args:
+        VDdb (ViolenceDetectionDatabase): The database instance.
+        tableName (str): The name of the labelled table.
+
+    Returns:
+        tuple[list[str], list[str], list[int]]: The episode and timeframe, the transcript and the label of every clip.
+    """
+    data = list(VDdb.iter_rows(tableName, ["episode_timeframe", "transcript", "violence"], "transcript IS NOT ? AND violence IS NOT ?", (None, None)))
+    return [instance[0] for instance in data], [instance[1] for instance in data], [int(instance[2]) for instance in data]
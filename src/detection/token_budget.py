@@ -0,0 +1,185 @@
+import functools
+import itertools
+import json
+import os
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+except ImportError: # A dependency of the project, but the tokens can still be estimated from the length of the text without it
+    tiktoken = None
+
+# Where tiktoken keeps the encoding files that it downloads on first use, so that the tokens are counted offline afterwards
+# (the `TIKTOKEN_CACHE_DIR` environment variable takes precedence). Run `python -m src.detection.token_budget` once while
+# online to fill it, or copy the files of another machine's cache into it.
+TIKTOKEN_CACHE_DIR = "./data/tiktoken_cache"
+
+# Turkish text averages a little over 3 characters per token, so the estimate slightly overestimates the size of a text
+CHARACTERS_PER_TOKEN = 3
+# The tokens that the chat format adds for every message (its role and separators) and for the start of the answer
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REQUEST = 3
+# The separator between the utterances of a flattened transcript (see `transcribe._flatten_utterances`)
+UTTERANCE_SEPARATOR = " | "
+
+
+@functools.lru_cache
+def _encoding(model: str):
+    """
+    Returns the tokenizer of the model from the encoding cache (downloading it if it isn't there yet), or None if tiktoken
+    isn't installed or can't load it (e.g., offline with an empty cache). The fallback is reported once per model.
+    """
+    if tiktoken is None:
+        print(f"Estimating the tokens of {model} from the length of the text, as tiktoken isn't installed.")
+        return None
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.abspath(TIKTOKEN_CACHE_DIR))
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Estimating the tokens of {model} from the length of the text, as its tokenizer isn't in "
+              f"{os.environ['TIKTOKEN_CACHE_DIR']} and couldn't be downloaded: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Counts the tokens of a text with the model's tokenizer, or estimates them without it."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // CHARACTERS_PER_TOKEN + 1
+    return len(encoding.encode(text))
+
+
+@functools.lru_cache
+def _count_schema_tokens(schema: str, model: str) -> int:
+    return count_tokens(schema, model)
+
+
+def count_request_tokens(messages: list[dict], tools: list[dict], model: str) -> int:
+    """Counts the prompt tokens of a chat completion request (the messages and the tool schema)."""
+    schemaTokens = _count_schema_tokens(json.dumps(tools, ensure_ascii=False), model) if tools else 0
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message["content"], model) for message in messages) + schemaTokens + TOKENS_PER_REQUEST
+
+
+def _truncate(text: str, maxTokens: int, model: str) -> str:
+    """Keeps the first `maxTokens` tokens of a text."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:maxTokens * CHARACTERS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:maxTokens])
+
+
+def split_transcript(transcript: str, maxTokens: int, model: str) -> list[str]:
+    """
+    Splits a flattened transcript into parts of at most `maxTokens` tokens, between its utterances (an utterance longer
+    than the budget is cut to it).
+
+    Args:
+        transcript (str): The flattened transcript.
+        maxTokens (int): The maximum number of tokens of a part.
+        model (str): The model whose tokenizer counts the tokens.
+
+    Returns:
+        list[str]: The parts, in order.
+    """
+    parts, currentPart, currentTokens = [], [], 0
+    separatorTokens = count_tokens(UTTERANCE_SEPARATOR, model)
+    for utterance in transcript.split(UTTERANCE_SEPARATOR):
+        utteranceTokens = count_tokens(utterance, model)
+        if utteranceTokens > maxTokens:
+            utterance, utteranceTokens = _truncate(utterance, maxTokens, model), maxTokens
+        if currentPart and currentTokens + separatorTokens + utteranceTokens > maxTokens:
+            parts.append(UTTERANCE_SEPARATOR.join(currentPart))
+            currentPart, currentTokens = [], 0
+        currentTokens += utteranceTokens + (separatorTokens if currentPart else 0)
+        currentPart.append(utterance)
+    if currentPart:
+        parts.append(UTTERANCE_SEPARATOR.join(currentPart))
+    return parts
+
+
+@dataclass
+class TokenBudget:
+    """
+    How many tokens of a transcript are sent in a classification request.
+
+    Attributes:
+        maxTranscriptTokens (int | None): The maximum number of tokens of a transcript in a request (None sends it whole).
+        overflow (str): What is done with a longer transcript: "split" classifies its parts with one request each, the clip
+            being violent if any part is, and "trim" only sends the first part.
+        model (str): The model whose tokenizer counts the tokens.
+    """
+    maxTranscriptTokens: int | None = 4000
+    overflow: str = "split"
+    model: str = "gpt-4o"
+
+    def __post_init__(self) -> None:
+        if self.overflow not in ("split", "trim"):
+            raise ValueError(f"Unknown overflow '{self.overflow}' (expected 'split' or 'trim').")
+
+    def fit(self, transcript: str) -> list[str]:
+        """Returns the parts of the transcript to classify, each within the budget."""
+        if self.maxTranscriptTokens is None or count_tokens(transcript, self.model) <= self.maxTranscriptTokens:
+            return [transcript]
+        parts = split_transcript(transcript, self.maxTranscriptTokens, self.model)
+        return parts if self.overflow == "split" else parts[:1]
+
+
+@dataclass
+class TokenUsage:
+    """
+    The tokens that the classification of a clip used.
+
+    Attributes:
+        promptTokens (int): The tokens of the prompts.
+        completionTokens (int): The tokens of the answers.
+        cachedPromptTokens (int): The prompt tokens that the provider read from its prompt cache.
+    """
+    promptTokens: int = 0
+    completionTokens: int = 0
+    cachedPromptTokens: int = 0
+
+    @classmethod
+    def from_response(cls, response) -> "TokenUsage":
+        """Reads the usage of an OpenAI chat completion response (no tokens if it has no usage)."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return cls()
+        promptDetails = getattr(usage, "prompt_tokens_details", None)
+        return cls(usage.prompt_tokens or 0, usage.completion_tokens or 0, getattr(promptDetails, "cached_tokens", 0) or 0)
+
+    @classmethod
+    def from_dict(cls, usage: dict | None) -> "TokenUsage":
+        """Reads the usage of a chat completion response given as JSON (e.g., in a batch output file)."""
+        if not usage:
+            return cls()
+        return cls(usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0,
+                   (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+
+    def __add__(self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(self.promptTokens + other.promptTokens, self.completionTokens + other.completionTokens,
+                          self.cachedPromptTokens + other.cachedPromptTokens)
+
+    def split(self, weights: list[int]) -> list["TokenUsage"]:
+        """
+        Shares the usage of a request among the clips it classified, in proportion to their weights (e.g., the tokens of
+        their transcripts), the shares adding up to the usage.
+        """
+        weights = weights if sum(weights) > 0 else [1] * len(weights)
+        shares = []
+        for count in (self.promptTokens, self.completionTokens, self.cachedPromptTokens):
+            bounds = [0] + [count * cumulativeWeight // sum(weights) for cumulativeWeight in itertools.accumulate(weights)]
+            shares.append([end - start for start, end in zip(bounds, bounds[1:])])
+        return [TokenUsage(*clipShares) for clipShares in zip(*shares)]
+
+    def database_fields(self) -> dict:
+        """Returns the usage as the `TOKEN_USAGE_COLUMNS` of a series table."""
+        return {"prompt_tokens": self.promptTokens, "completion_tokens": self.completionTokens, "cached_prompt_tokens": self.cachedPromptTokens}
+
+
+if __name__ == "__main__":
+    # Downloads the tokenizer of the model into the encoding cache, so that later runs count the tokens offline
+    if _encoding("gpt-4o") is not None:
+        print(f"The tokenizer of gpt-4o is cached in {os.environ['TIKTOKEN_CACHE_DIR']}.")
@@ -1,48 +1,241 @@
-import threading
 import concurrent
+import contextlib
+import functools
+import json
+import os
 import re
 
+from src.backends.interfaces import DownloadBackend, MetadataBackend
+from src.database.clip_state import DOWNLOADED, PLANNED
 from src.database.violence_detection_database import ViolenceDetectionDatabase
-from src.utils.functions import get_video_title, load_audio, return_search_ranges
+from src.utils.clip_planner import ClipPlan, plan_clips_for_budget
+from src.utils.functions import YtDlpDownloadBackend, convert, plan_clips_from_metadata
+from src.utils.metrics import get_metrics
+from src.utils.video_metadata import VideoMetadata, VideoMetadataFetcher, extract_video_id
 
-def _add_to_database(VDdb: ViolenceDetectionDatabase, episodeNumber: str, range: tuple, videoLink: str, tableName: str, lock: threading.Lock) -> None:
+# How long the scraped metadata of a video is reused before it is scraped again (the heatmap changes slowly)
+DEFAULT_METADATA_CACHE_TTL = 7 * 24 * 60 * 60
+# Search ranges closer than this many seconds are merged into one clip, as long as the clip stays within the maximum length
+DEFAULT_GAP_TOLERANCE = 15
+DEFAULT_MAX_CLIP_LENGTH = 180
+
+def _report_added_case(caseIdentifier: str, future: concurrent.futures.Future) -> None:
     """
-    Adds a new case to the database.
+    Prints whether a case was added to the database, once its write is committed or has failed.
+
+    Args:
+        caseIdentifier (str): The episode and timeframe of the case.
+        future (concurrent.futures.Future): The future of the case's write.
+    """
+    error = future.exception()
+    if error is not None:
+        print(f"Error adding {caseIdentifier} to the database: {error}")
+    else:
+        print(f"Added {caseIdentifier} to the database.")
+
+def _add_to_database(VDdb: ViolenceDetectionDatabase, episodeNumber: str, range: tuple, peakTimes: list[int], videoLink: str, tableName: str) -> None:
+    """
+    Adds a new case to the database as a planned clip, before its audio is downloaded.
 
     Args:
         VDdb (ViolenceDetectionDatabase): The database object.
         episodeNumber (str): Episode number extracted from the video title.
         range (tuple): The time range for the clip (start, end).
+        peakTimes (list[int]): The times (in seconds) of the heatmap peaks that the clip covers.
         videoLink (str): Link to the video.
         tableName (str): Database table name to insert the case.
-        lock (threading.Lock): Lock to ensure thread-safe database access.
     """
     case_identifier = f"{episodeNumber}:{range[0]}:{range[1]}"
+    future = VDdb.add_case(tableName, case_identifier, videoLink, peak_count=len(peakTimes), peak_times=json.dumps(peakTimes),
+                           episode=int(episodeNumber), start_second=convert(range[0]), end_second=convert(range[1]),
+                           **VDdb.clip_state_fields(tableName, PLANNED))
+    future.add_done_callback(functools.partial(_report_added_case, case_identifier))
+
+def _download_clips(VDdb: ViolenceDetectionDatabase, tableName: str, videoLink: str, clipKeys: dict[tuple[str], str],
+                    downloader: DownloadBackend | None) -> list[tuple[str, str]]:
+    """
+    Downloads the planned clips of a video and records the new state of each of them.
+
+    Args:
+        VDdb (ViolenceDetectionDatabase): The database object.
+        tableName (str): Database table name of the clips.
+        videoLink (str): Link to the video.
+        clipKeys (dict[tuple[str], str]): The episode and timeframe of every clip to download, by its (start, end) range.
+        downloader (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
+
+    Returns:
+        list[tuple[str, str]]: The identifier and audio path of each clip that was downloaded.
+    """
+    # Download every clip of the video with a single resolution of its audio stream
+    downloader = downloader or YtDlpDownloadBackend()
+    with get_metrics().time("stage_duration_seconds", stage="download"):
+        downloadResults = downloader.download_ranges(tableName, videoLink, "m4a", list(clipKeys))
+    downloadedClips = []
+    for range, (audioPath, error) in downloadResults.items():
+        if error is None:
+            VDdb.update_case(tableName, clipKeys[range], audio_path=os.path.normpath(audioPath), **VDdb.clip_state_fields(tableName, DOWNLOADED))
+            downloadedClips.append((clipKeys[range], audioPath))
+        else:
+            VDdb.record_clip_failure(tableName, error, clipKeys[range])
+
+    failedCount = len(downloadResults) - len(downloadedClips)
+    get_metrics().increment("stage_items_total", len(downloadedClips), stage="download", outcome="success")
+    get_metrics().increment("stage_items_total", failedCount, stage="download", outcome="failure")
+    if failedCount:
+        print(f"{failedCount} of the {len(clipKeys)} clips of {videoLink} could not be downloaded.")
+    return downloadedClips
+
+def _metadata_backend(fetcher: MetadataBackend | None) -> contextlib.AbstractContextManager:
+    """Returns the given backend as it is, or a new `VideoMetadataFetcher` to be closed at the end of the `with` block."""
+    return contextlib.nullcontext(fetcher) if fetcher is not None else VideoMetadataFetcher()
+
+def _fetch_metadata(videoLink: str, VDdb: ViolenceDetectionDatabase, fetcher: MetadataBackend,
+                    cacheTtl: float | None, forceRefresh: bool) -> VideoMetadata:
+    """
+    Returns the metadata of a video from the database's cache, scraping it only when it isn't cached or has expired.
+
+    Args:
+        videoLink (str): The URL of the video.
+        VDdb (ViolenceDetectionDatabase): The database object holding the cache.
+        fetcher (MetadataBackend): The fetcher used to scrape the video on a cache miss.
+        cacheTtl (float | None): The maximum age of a cached entry in seconds (None means entries never expire).
+        forceRefresh (bool): Whether to ignore the cache and scrape the video again.
+
+    Returns:
+        VideoMetadata: The metadata of the video.
+    """
+    videoId = extract_video_id(videoLink)
+    if not forceRefresh:
+        cachedMetadata = VDdb.get_cached_video_metadata(videoId, cacheTtl)
+        get_metrics().increment("cache_lookups_total", cache="metadata", result="miss" if cachedMetadata is None else "hit")
+        if cachedMetadata is not None:
+            heatMapRaw, heatMapPoints, duration, title = cachedMetadata
+            return VideoMetadata(videoId, title, duration, [point[0] for point in heatMapPoints],
+                                 [point[1] for point in heatMapPoints], heatMapRaw)
+
     try:
-        with lock:
-            VDdb.add_case(tableName, case_identifier, videoLink)
-            print(f"Added {case_identifier} to the database.")
-    except Exception as e:
-        print(f"Failed to add {case_identifier} to the database. Error: {e}")
+        with get_metrics().time("stage_duration_seconds", stage="scrape"):
+            metadata = fetcher.fetch(videoLink)
+    except Exception:
+        get_metrics().increment("stage_items_total", stage="scrape", outcome="failure")
+        raise
+    get_metrics().increment("stage_items_total", stage="scrape", outcome="success")
+    VDdb.cache_video_metadata(videoId, metadata.rawHeatMap, list(zip(metadata.xValues, metadata.yValues)),
+                              metadata.duration, metadata.title)
+    return metadata
 
-def _process_video_link(videoLink: str, VDdb: ViolenceDetectionDatabase, tableName: str, lock: threading.Lock) -> None:
+def process_video_link(videoLink: str, VDdb: ViolenceDetectionDatabase, tableName: str, fetcher: MetadataBackend,
+                        cacheTtl: float | None, forceRefresh: bool, gapTolerance: int, maxClipLength: int | None,
+                        clipPlan: dict[tuple[str], list[int]] = None, downloader: DownloadBackend = None) -> list[tuple[str, str]]:
     """
     Processes a single video link to extract, download audio clips and add it to the database.
 
     Args:
         videoLink (str): The URL of the video to process.
         tableName (str): Database table name to associate the processed data.
+        fetcher (MetadataBackend): The fetcher used to scrape the heatmap, duration and title of the video.
+        cacheTtl (float | None): The maximum age of the cached metadata in seconds.
+        forceRefresh (bool): Whether to scrape the video even if its metadata is cached.
+        gapTolerance (int): The maximum gap in seconds between two search ranges for them to be merged into one clip.
+        maxClipLength (int | None): The maximum length of a merged clip in seconds.
+        clipPlan (dict[tuple[str], list[int]]): The clips to download, if they were already planned for the whole series.
+        downloader (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
+
+    Returns:
+        list[tuple[str, str]]: The identifier and audio path of each clip that was downloaded and added to the table.
     """
-    searchRanges = return_search_ranges(videoLink)
-    title = get_video_title(videoLink)
-    episodeNumber = re.search(r"\d+", title).group()
-    
-    for range in searchRanges:
-        load_audio(tableName, videoLink, "m4a", range)
-        _add_to_database(VDdb, episodeNumber, range, videoLink, tableName, lock)
+    metadata = _fetch_metadata(videoLink, VDdb, fetcher, cacheTtl, forceRefresh)
+    if clipPlan is None:
+        clipPlan = plan_clips_from_metadata(metadata, gapTolerance, maxClipLength)
+    episodeNumber = re.search(r"\d+", metadata.title).group()
+
+    clipKeys = {range: f"{episodeNumber}:{range[0]}:{range[1]}" for range in clipPlan}
 
+    # Plan the clips that aren't in the table yet, so that they are picked up again if the run stops before they are downloaded
+    existingClips = {instance[0] for instance in VDdb.iter_rows(tableName, ["episode_timeframe"], "link = ?", (videoLink,))}
+    for range, clipKey in clipKeys.items():
+        if clipKey not in existingClips:
+            _add_to_database(VDdb, episodeNumber, range, clipPlan[range], videoLink, tableName)
 
-def process_videos_in_parallel(tableName: str, videoLinks: list[str], VDdb: ViolenceDetectionDatabase) -> None:
+    # Download the planned clips, and the failed ones that are due to be retried (the finished clips of a previous run are skipped)
+    pendingClause, pendingParams = VDdb.pending_clip_clause(tableName)
+    pendingClips = {instance[0] for instance in VDdb.iter_rows(tableName, ["episode_timeframe"],
+                                                               f"link = ? AND audio_path IS NULL AND transcript IS NULL AND {pendingClause}",
+                                                               (videoLink,) + pendingParams)}
+    clipKeys = {range: clipKey for range, clipKey in clipKeys.items() if clipKey in pendingClips}
+    if not clipKeys:
+        return []
+    return _download_clips(VDdb, tableName, videoLink, clipKeys, downloader)
+
+
+def download_planned_clips(tableName: str, VDdb: ViolenceDetectionDatabase, downloader: DownloadBackend = None) -> list[tuple[str, str]]:
+    """
+    Downloads the clips of a table that were planned but not downloaded yet (or whose download failed and is due to be retried),
+    without scraping their videos again.
+
+    Args:
+        tableName (str): Database table name of the clips.
+        VDdb (ViolenceDetectionDatabase): The database object.
+        downloader (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
+
+    Returns:
+        list[tuple[str, str]]: The identifier and audio path of each clip that was downloaded.
+    """
+    pendingClause, pendingParams = VDdb.pending_clip_clause(tableName)
+    clipsByLink = {}
+    for clipKey, videoLink, startSecond, endSecond in VDdb.iter_rows(tableName, ["episode_timeframe", "link", "start_second", "end_second"],
+                                                                     f"audio_path IS NULL AND transcript IS NULL AND {pendingClause}", pendingParams):
+        clipsByLink.setdefault(videoLink, {})[(convert(startSecond), convert(endSecond))] = clipKey
+
+    downloadedClips = []
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for videoDownloads in executor.map(lambda item: _download_clips(VDdb, tableName, item[0], item[1], downloader), clipsByLink.items()):
+            downloadedClips.extend(videoDownloads)
+    return downloadedClips
+
+
+def plan_series_for_budget(videoLinks: list[str], VDdb: ViolenceDetectionDatabase, budgetMinutes: float,
+                           cacheTtl: float | None = DEFAULT_METADATA_CACHE_TTL, forceRefresh: bool = False,
+                           gapTolerance: int = DEFAULT_GAP_TOLERANCE, maxClipLength: int | None = DEFAULT_MAX_CLIP_LENGTH,
+                           fetcher: MetadataBackend = None) -> ClipPlan:
+    """
+    Scrapes (or loads from the cache) the heatmaps of a whole series and chooses the clips that fit in the transcription budget,
+    without downloading anything.
+
+    Args:
+        videoLinks (list[str]): List of video URLs of the series.
+        VDdb (ViolenceDetectionDatabase): The database object holding the metadata cache.
+        budgetMinutes (float): The total length of audio (in minutes) that can be transcribed.
+        cacheTtl (float | None): How long (in seconds) the scraped metadata of a video is reused (None means forever).
+        forceRefresh (bool): Whether to scrape every video again, ignoring the cached metadata.
+        gapTolerance (int): Search ranges closer than this many seconds are merged into one clip.
+        maxClipLength (int | None): The maximum length of a merged clip in seconds (None means no limit).
+        fetcher (MetadataBackend): The backend that scrapes the videos (a new `VideoMetadataFetcher` by default).
+
+    Returns:
+        ClipPlan: The chosen clips of each video and their expected cost.
+    """
+    with _metadata_backend(fetcher) as fetcher, concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = {executor.submit(_fetch_metadata, videoLink, VDdb, fetcher, cacheTtl, forceRefresh): videoLink for videoLink in videoLinks}
+
+    metadataList = []
+    for future, videoLink in futures.items():
+        try:
+            metadataList.append(future.result())
+        except Exception as e:
+            print(f"Failed to get the metadata of {videoLink}, it is left out of the plan. Error: {e}")
+
+    plan = plan_clips_for_budget(metadataList, budgetMinutes, 90, gapTolerance, maxClipLength)
+    clipCount = sum(len(videoClips) for videoClips in plan.clips.values())
+    print(f"Planned {clipCount} clips: {plan.audioMinutes:.1f} minutes of audio, ~{plan.estimatedTokens} tokens, "
+          f"{plan.coverage:.1%} of the heatmap weight covered.")
+    return plan
+
+
+def process_videos_in_parallel(tableName: str, videoLinks: list[str], VDdb: ViolenceDetectionDatabase,
+                               cacheTtl: float | None = DEFAULT_METADATA_CACHE_TTL, forceRefresh: bool = False,
+                               gapTolerance: int = DEFAULT_GAP_TOLERANCE, maxClipLength: int | None = DEFAULT_MAX_CLIP_LENGTH,
+                               budgetMinutes: float = None, fetcher: MetadataBackend = None, downloader: DownloadBackend = None) -> None:
     """
     Processes multiple video links in parallel, extracting audio and updating the database.
 
@@ -50,9 +243,33 @@ def process_videos_in_parallel(tableName: str, videoLinks: list[str], VDdb: Viol
         tableName (str): Name of the database table to store processed data.
         videoLinks (list[str]): List of video URLs to process.
         VDdb (ViolenceDetectionDatabase): The database object to update.
+        cacheTtl (float | None): How long (in seconds) the scraped metadata of a video is reused (None means forever).
+        forceRefresh (bool): Whether to scrape every video again, ignoring the cached metadata.
+        gapTolerance (int): Search ranges closer than this many seconds are merged into one clip.
+        maxClipLength (int | None): The maximum length of a merged clip in seconds (None means no limit).
+        budgetMinutes (float): If given, the clips of the whole series are chosen to fit this many minutes of audio
+            (see `plan_series_for_budget`) instead of keeping the top 15% of the peaks of every video.
+        fetcher (MetadataBackend): The backend that scrapes the videos (a new `VideoMetadataFetcher` by default).
+        downloader (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
     """
-    lock = threading.Lock()
-    # Loading all the peak audio clips concurrently
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    seriesPlan = None
+    if budgetMinutes is not None:
+        seriesPlan = plan_series_for_budget(videoLinks, VDdb, budgetMinutes, cacheTtl, forceRefresh, gapTolerance, maxClipLength, fetcher)
+
+    # Loading all the peak audio clips concurrently, sharing one pool of HTTP connections (and browsers) across the threads
+    futures = {}
+    with _metadata_backend(fetcher) as fetcher, concurrent.futures.ThreadPoolExecutor() as executor:
         for videoLink in videoLinks:
-            executor.submit(_process_video_link, videoLink, VDdb, tableName, lock)
\ No newline at end of file
+            clipPlan = None
+            if seriesPlan is not None:
+                clipPlan = seriesPlan.clips.get(extract_video_id(videoLink))
+                if clipPlan is None: # No clip of the video fits in the budget
+                    continue
+            # (the planning step already refreshed the cache, so it is not refreshed a second time)
+            future = executor.submit(process_video_link, videoLink, VDdb, tableName, fetcher, cacheTtl,
+                                     forceRefresh and seriesPlan is None, gapTolerance, maxClipLength, clipPlan, downloader)
+            futures[future] = videoLink
+
+    for future, videoLink in futures.items():
+        if future.exception() is not None:
+            print(f"Failed to process {videoLink}. Error: {future.exception()}")
\ No newline at end of file
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import httpx
+
+from src.utils.metrics import get_metrics
+from src.utils.rate_limiter import AdaptiveRateLimiter, get_rate_limiter
+
+ASSEMBLYAI_BASE_URL = "https://api.assemblyai.com"
+
+# Statuses after which a transcription job doesn't change anymore
+_FINAL_STATUSES = {"completed", "error"}
+# Responses that are worth retrying after a pause
+_RETRIED_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class TranscriptionResult:
+    """
+    The outcome of the transcription of one audio file.
+
+    Attributes:
+        audioPath (str): The path of the transcribed file.
+        transcriptId (str | None): The ID of the transcription job (None if it couldn't be submitted).
+        status (str): 'completed' or 'error'.
+        utterances (list[dict]): The utterances of the transcript ('speaker', 'text', 'start' and 'end' in milliseconds, ...).
+        error (str | None): The error message if the transcription failed.
+    """
+    audioPath: str
+    transcriptId: str | None
+    status: str
+    utterances: list[dict] = field(default_factory=list)
+    error: str | None = None
+
+
+@dataclass
+class _PendingJob:
+    """A submitted job the poller waits for: its future, when it is given up on, and how many status checks failed in a row."""
+    future: asyncio.Future
+    deadline: float | None
+    pollFailures: int = 0
+
+
+class AsyncTranscriptionEngine:
+    """
+    Transcribes many audio files with AssemblyAI without tying up a thread per file: every file is uploaded and submitted,
+    and a single loop polls the status of all the submitted jobs.
+    """
+    def __init__(self, apiKey: str, baseUrl: str = ASSEMBLYAI_BASE_URL, maxConcurrentUploads: int = 4, maxInFlight: int = 100,
+                 pollInterval: float = 3.0, languageCode: str = "tr", speakerLabels: bool = True, maxRetries: int = 5,
+                 rateLimiter: AdaptiveRateLimiter = None, maxPollFailures: int = 5, jobTimeout: float | None = 3600) -> None:
+        """
+        Args:
+            apiKey (str): API key for AssemblyAI.
+            baseUrl (str): The URL of the API (a local fake server can be used for testing).
+            maxConcurrentUploads (int): The maximum number of files uploaded at the same time.
+            maxInFlight (int): The maximum number of files between the start of their upload and the end of their transcription.
+            pollInterval (float): Seconds between two status checks of the submitted jobs.
+            languageCode (str): The language of the audio.
+            speakerLabels (bool): Whether to separate the utterances by speaker.
+            maxRetries (int): The number of times a rate limited or failed request is retried.
+            rateLimiter (AdaptiveRateLimiter): The rate limiter every request waits for (the process-wide AssemblyAI limiter by default).
+            maxPollFailures (int): The number of status checks of a job in a row that may fail (e.g., the job isn't found)
+                before the job is given up on.
+            jobTimeout (float | None): Seconds after its submission after which a job that hasn't finished is given up on
+                (None waits for as long as it takes).
+        """
+        self.apiKey = apiKey
+        self.baseUrl = baseUrl
+        self.maxConcurrentUploads = maxConcurrentUploads
+        self.maxInFlight = maxInFlight
+        self.pollInterval = pollInterval
+        self.languageCode = languageCode
+        self.speakerLabels = speakerLabels
+        self.maxRetries = maxRetries
+        self.rateLimiter = rateLimiter or get_rate_limiter("assemblyai")
+        self.maxPollFailures = maxPollFailures
+        self.jobTimeout = jobTimeout
+
+    def transcribe(self, audioPaths: list[str], onResult: Callable[[TranscriptionResult], None] = None) -> list[TranscriptionResult]:
+        """Blocking version of `transcribe_all`, for use outside of an event loop."""
+        return asyncio.run(self.transcribe_all(audioPaths, onResult))
+
+    async def transcribe_all(self, audioPaths: list[str], onResult: Callable[[TranscriptionResult], None] = None) -> list[TranscriptionResult]:
+        """
+        Transcribes the audio files.
+
+        Args:
+            audioPaths (list[str]): The paths of the audio files.
+            onResult (Callable): Called with each result as soon as its transcription finishes.
+
+        Returns:
+            list[TranscriptionResult]: The result of every file, in the order of `audioPaths`.
+        """
+        self._uploadSlots = asyncio.Semaphore(self.maxConcurrentUploads)
+        self._inFlightSlots = asyncio.Semaphore(self.maxInFlight)
+        self._pendingJobs: dict[str, _PendingJob] = {}
+        self._pollerError = None
+
+        async with httpx.AsyncClient(base_url=self.baseUrl, headers={"authorization": self.apiKey}, timeout=60) as client:
+            poller = asyncio.create_task(self._poll_jobs(client))
+            poller.add_done_callback(self._on_poller_done)
+            try:
+                return await asyncio.gather(*(self._transcribe_file(client, audioPath, onResult) for audioPath in audioPaths))
+            finally:
+                poller.cancel()
+
+    async def _request(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> dict:
+        """
+        Sends a request once the rate limiter allows it. A rate limited request is queued again behind the limiter's pause,
+        and a failed one is retried with an exponential backoff.
+        """
+        for attempt in range(self.maxRetries + 1):
+            await asyncio.sleep(self.rateLimiter.reserve())
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if attempt == self.maxRetries:
+                    raise
+            else:
+                if response.status_code == 429:
+                    self.rateLimiter.on_rate_limited(response.headers)
+                else:
+                    self.rateLimiter.update_from_headers(response.headers)
+                if response.status_code not in _RETRIED_STATUS_CODES or attempt == self.maxRetries:
+                    response.raise_for_status()
+                    return response.json()
+                if response.status_code == 429:
+                    get_metrics().increment("retries_total", backend="assemblyai")
+                    continue
+            get_metrics().increment("retries_total", backend="assemblyai")
+            await asyncio.sleep(min(2 ** attempt, 60))
+
+    async def _transcribe_file(self, client: httpx.AsyncClient, audioPath: str, onResult: Callable | None) -> TranscriptionResult:
+        """Uploads and submits a file, then waits for the poller to see its job finish."""
+        async with self._inFlightSlots:
+            transcriptId = None
+            startTime = time.perf_counter()
+            try:
+                async with self._uploadSlots:
+                    audioData = await asyncio.to_thread(_read_file, audioPath)
+                    upload = await self._request(client, "POST", "/v2/upload", content=audioData)
+                job = await self._request(client, "POST", "/v2/transcript", json={
+                    "audio_url": upload["upload_url"], "speaker_labels": self.speakerLabels, "language_code": self.languageCode})
+                transcriptId = job["id"]
+
+                if self._pollerError is not None: # Nothing would resolve the job anymore
+                    raise RuntimeError(f"The status of the jobs can't be checked anymore: {self._pollerError!r}")
+                jobFinished = asyncio.get_running_loop().create_future()
+                deadline = time.monotonic() + self.jobTimeout if self.jobTimeout is not None else None
+                self._pendingJobs[transcriptId] = _PendingJob(jobFinished, deadline)
+                transcript = await jobFinished
+                result = TranscriptionResult(audioPath, transcriptId, transcript["status"], transcript.get("utterances") or [], transcript.get("error"))
+                get_metrics().observe("stage_duration_seconds", time.perf_counter() - startTime, stage="transcription")
+            except Exception as e:
+                result = TranscriptionResult(audioPath, transcriptId, "error", error=str(e) or type(e).__name__)
+
+        if onResult is not None:
+            onResult(result)
+        return result
+
+    async def _poll_jobs(self, client: httpx.AsyncClient) -> None:
+        """Checks the status of every submitted job at each interval until the poller is cancelled."""
+        while True:
+            await asyncio.sleep(self.pollInterval)
+            await self._poll_once(client)
+
+    async def _poll_once(self, client: httpx.AsyncClient) -> None:
+        """
+        Checks the status of every submitted job and resolves the ones that have finished. A job whose status can't be read
+        (e.g., it isn't found, or the response has no status) is checked again at the next interval, until it fails
+        `maxPollFailures` times in a row or passes its deadline, after which its transcription fails.
+        """
+        transcriptIds = list(self._pendingJobs)
+        transcripts = await asyncio.gather(*(self._request(client, "GET", f"/v2/transcript/{transcriptId}") for transcriptId in transcriptIds),
+                                           return_exceptions=True)
+        for transcriptId, transcript in zip(transcriptIds, transcripts):
+            job = self._pendingJobs[transcriptId]
+            if job.future.done(): # Cancelled by its caller
+                del self._pendingJobs[transcriptId]
+                continue
+            try:
+                if isinstance(transcript, Exception):
+                    raise transcript
+                status = transcript["status"]
+            except Exception as e:
+                job.pollFailures += 1
+                get_metrics().increment("poll_failures_total", backend="assemblyai")
+                if job.pollFailures >= self.maxPollFailures:
+                    del self._pendingJobs[transcriptId]
+                    job.future.set_exception(RuntimeError(f"The status of the job {transcriptId} couldn't be read "
+                                                          f"{job.pollFailures} times in a row: {e!r}"))
+                    continue
+                status = "unknown"
+            else:
+                job.pollFailures = 0
+                if status in _FINAL_STATUSES:
+                    del self._pendingJobs[transcriptId]
+                    job.future.set_result(transcript)
+                    continue
+
+            if job.deadline is not None and time.monotonic() > job.deadline:
+                del self._pendingJobs[transcriptId]
+                job.future.set_exception(TimeoutError(f"The job {transcriptId} didn't finish in {self.jobTimeout} seconds "
+                                                      f"(last status: {status})."))
+
+    def _on_poller_done(self, poller: asyncio.Task) -> None:
+        """Fails every job that is still waiting if the poller stopped because of an error, as nothing would resolve them."""
+        if poller.cancelled() or poller.exception() is None:
+            return
+        self._pollerError = poller.exception()
+        print(f"Stopped checking the status of the transcription jobs: {self._pollerError!r}")
+        for transcriptId, job in list(self._pendingJobs.items()):
+            if not job.future.done():
+                job.future.set_exception(RuntimeError(f"The status of the job {transcriptId} can't be checked anymore: {self._pollerError!r}"))
+        self._pendingJobs.clear()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
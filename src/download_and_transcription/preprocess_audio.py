@@ -0,0 +1,262 @@
+import concurrent.futures
+import contextlib
+import os
+import subprocess
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.utils.metrics import get_metrics
+
+# The clips are uploaded as mono 16 kHz Opus at a speech bitrate, which is all the transcription needs
+SAMPLE_RATE = 16000
+BITRATE = "24k"
+PREPROCESSED_SUFFIX = ".speech.ogg"
+
+
+@dataclass
+class PreprocessingResult:
+    """
+    The outcome of preprocessing a clip.
+
+    Attributes:
+        inputPath (str): The path of the downloaded clip.
+        outputPath (str): The path of the preprocessed clip.
+        inputBytes (int): The size of the downloaded clip.
+        outputBytes (int): The size of the preprocessed clip (0 if it failed).
+        inputSeconds (float): The length of the downloaded clip.
+        outputSeconds (float): The length of the preprocessed clip, once its silence was trimmed (0 if it failed).
+        trimmedStartSeconds (float): The length of the silence trimmed from the start of the clip, by which the timestamps
+            of its transcript are behind the clip.
+        error (str | None): The error message, or None if the clip was preprocessed successfully.
+    """
+    inputPath: str
+    outputPath: str
+    inputBytes: int = 0
+    outputBytes: int = 0
+    inputSeconds: float = 0.0
+    outputSeconds: float = 0.0
+    trimmedStartSeconds: float = 0.0
+    error: str | None = None
+
+    @property
+    def bytesSaved(self) -> int:
+        return self.inputBytes - self.outputBytes
+
+    @property
+    def secondsSaved(self) -> float:
+        return self.inputSeconds - self.outputSeconds
+
+
+def preprocessed_path(audioPath: str) -> str:
+    """Returns the path the preprocessed version of a clip is saved to (next to the clip)."""
+    return os.path.splitext(audioPath)[0] + PREPROCESSED_SUFFIX
+
+
+def find_speech_bounds(samples: np.ndarray, sampleRate: int, silenceThresholdDb: float = -40.0, frameSeconds: float = 0.03,
+                       paddingSeconds: float = 0.25) -> tuple[int, int]:
+    """
+    Finds the part of a clip between its first and last frames louder than the threshold (an energy-based voice activity detector).
+
+    Args:
+        samples (np.ndarray): The mono 16-bit samples of the clip.
+        sampleRate (int): The sample rate of the clip.
+        silenceThresholdDb (float): The RMS level (in dBFS) under which a frame counts as silence.
+        frameSeconds (float): The length of the frames the level is measured on.
+        paddingSeconds (float): The silence kept before the first and after the last loud frame, so that no word is cut.
+
+    Returns:
+        tuple[int, int]: The first and the last (exclusive) sample to keep (the whole clip if no frame is louder than the threshold).
+    """
+    frameLength = max(int(sampleRate * frameSeconds), 1)
+    frameCount = len(samples) // frameLength
+    if frameCount == 0:
+        return 0, len(samples)
+
+    frames = samples[:frameCount * frameLength].astype(np.float32).reshape(frameCount, frameLength) / 32768
+    levels = 20 * np.log10(np.maximum(np.sqrt(np.mean(frames ** 2, axis=1)), 1e-10))
+    loudFrames = np.flatnonzero(levels > silenceThresholdDb)
+    if loudFrames.size == 0:
+        return 0, len(samples)
+
+    padding = int(sampleRate * paddingSeconds)
+    return max(int(loudFrames[0]) * frameLength - padding, 0), min((int(loudFrames[-1]) + 1) * frameLength + padding, len(samples))
+
+
+def _run_ffmpeg(arguments: list[str], inputBytes: bytes = None) -> bytes:
+    """Runs ffmpeg and returns its output, raising a `RuntimeError` with its error message if it fails."""
+    process = subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *arguments], input=inputBytes, capture_output=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.decode(errors="replace").strip())
+    return process.stdout
+
+
+def preprocess_audio_file(inputPath: str, outputPath: str, sampleRate: int = SAMPLE_RATE, bitrate: str = BITRATE,
+                          trimSilence: bool = True, silenceThresholdDb: float = -40.0, paddingSeconds: float = 0.25) -> PreprocessingResult:
+    """
+    Downmixes a clip to mono, resamples it, optionally trims its leading and trailing silence and re-encodes it at a speech bitrate.
+    Runs in the worker processes of `AudioPreprocessor`, so it only takes and returns picklable values.
+
+    Args:
+        inputPath (str): The path of the downloaded clip.
+        outputPath (str): The path to save the preprocessed clip to.
+        sampleRate (int): The sample rate of the preprocessed clip.
+        bitrate (str): The bitrate of the preprocessed clip (e.g., '24k').
+        trimSilence (bool): Whether to trim the leading and trailing silence.
+        silenceThresholdDb (float): The RMS level (in dBFS) under which a frame counts as silence.
+        paddingSeconds (float): The silence kept around the speech.
+
+    Returns:
+        PreprocessingResult: The sizes and lengths of the clip before and after preprocessing, or the error that occurred.
+    """
+    result = PreprocessingResult(inputPath, outputPath)
+    try:
+        result.inputBytes = os.path.getsize(inputPath)
+        samples = np.frombuffer(_run_ffmpeg(["-i", inputPath, "-vn", "-ac", "1", "-ar", str(sampleRate), "-f", "s16le", "-"]), dtype=np.int16)
+        result.inputSeconds = len(samples) / sampleRate
+
+        if trimSilence:
+            start, end = find_speech_bounds(samples, sampleRate, silenceThresholdDb, paddingSeconds=paddingSeconds)
+            samples = samples[start:end]
+            result.trimmedStartSeconds = start / sampleRate
+
+        _run_ffmpeg(["-f", "s16le", "-ar", str(sampleRate), "-ac", "1", "-i", "-", "-c:a", "libopus", "-b:a", bitrate,
+                     "-application", "voip", outputPath], samples.tobytes())
+        result.outputBytes = os.path.getsize(outputPath)
+        result.outputSeconds = len(samples) / sampleRate
+    except (OSError, RuntimeError) as e:
+        result.error = str(e)
+    return result
+
+
+class AudioPreprocessor():
+    """Preprocesses the downloaded clips in a pool of processes (one per core by default) before they are transcribed."""
+    def __init__(self, maxWorkers: int = None, sampleRate: int = SAMPLE_RATE, bitrate: str = BITRATE, trimSilence: bool = True,
+                 silenceThresholdDb: float = -40.0, paddingSeconds: float = 0.25, keepOriginals: bool = False) -> None:
+        """
+        Args:
+            maxWorkers (int): The number of worker processes (the number of cores by default).
+            sampleRate (int): The sample rate of the preprocessed clips.
+            bitrate (str): The bitrate of the preprocessed clips (e.g., '24k').
+            trimSilence (bool): Whether to trim the leading and trailing silence of the clips.
+            silenceThresholdDb (float): The RMS level (in dBFS) under which a frame counts as silence.
+            paddingSeconds (float): The silence kept around the speech.
+            keepOriginals (bool): Whether to keep the downloaded clips once they are preprocessed.
+        """
+        self.maxWorkers = maxWorkers or os.cpu_count() or 1
+        self.settings = {"sampleRate": sampleRate, "bitrate": bitrate, "trimSilence": trimSilence,
+                         "silenceThresholdDb": silenceThresholdDb, "paddingSeconds": paddingSeconds}
+        self.keepOriginals = keepOriginals
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.maxWorkers)
+        self.preprocessedCount = 0
+        self.failedCount = 0
+        self.bytesSaved = 0
+        self.secondsSaved = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "AudioPreprocessor":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops the worker processes."""
+        self.executor.shutdown()
+
+    def submit(self, audioPath: str) -> concurrent.futures.Future:
+        """Queues a clip to the worker processes, the returned future resolving to its `PreprocessingResult`."""
+        return self.executor.submit(preprocess_audio_file, audioPath, preprocessed_path(audioPath), **self.settings)
+
+    def record(self, VDdb: ViolenceDetectionDatabase, tableName: str, result: PreprocessingResult) -> str:
+        """
+        Points the clip's row to its preprocessed audio and stores the sizes and lengths before and after preprocessing,
+        and the silence trimmed from its start (see `ViolenceDetectionDatabase.store_utterances`).
+        If the preprocessing failed, its error is stored instead, so that the clip isn't preprocessed again and goes on to
+        be transcribed as it was downloaded.
+
+        Args:
+            VDdb (ViolenceDetectionDatabase): The database object to update.
+            tableName (str): Name of the database table of the clip.
+            result (PreprocessingResult): The outcome of preprocessing the clip.
+
+        Returns:
+            str: The path of the audio to transcribe (the downloaded clip itself if the preprocessing failed).
+        """
+        if result.error is not None:
+            # The clip is transcribed as it was downloaded
+            VDdb.update_case_by_audio_path(tableName, result.inputPath, preprocessing_error=str(result.error)).result()
+            get_metrics().increment("stage_items_total", stage="preprocessing", outcome="failure")
+            with self._lock:
+                self.failedCount += 1
+            print(f"Error preprocessing audio {result.inputPath}: {result.error}")
+            return result.inputPath
+
+        # The row must point to the new file before the downloaded one is removed
+        VDdb.update_case_by_audio_path(tableName, result.inputPath, audio_path=os.path.normpath(result.outputPath),
+                                       original_audio_bytes=result.inputBytes, audio_bytes=result.outputBytes,
+                                       original_audio_seconds=result.inputSeconds, audio_seconds=result.outputSeconds,
+                                       audio_offset_ms=round(result.trimmedStartSeconds * 1000)).result()
+        if not self.keepOriginals:
+            os.remove(result.inputPath)
+
+        get_metrics().increment("stage_items_total", stage="preprocessing", outcome="success")
+        get_metrics().increment("audio_bytes_saved_total", result.bytesSaved)
+        get_metrics().increment("audio_seconds_saved_total", result.secondsSaved)
+        with self._lock:
+            self.preprocessedCount += 1
+            self.bytesSaved += result.bytesSaved
+            self.secondsSaved += result.secondsSaved
+        print(f"Preprocessed {result.inputPath}: {result.inputBytes / 2 ** 10:.0f}KB -> {result.outputBytes / 2 ** 10:.0f}KB, "
+              f"{result.inputSeconds:.1f}s -> {result.outputSeconds:.1f}s.")
+        return result.outputPath
+
+    def preprocess_clip(self, VDdb: ViolenceDetectionDatabase, tableName: str, audioPath: str) -> str:
+        """
+        Preprocesses a clip in a worker process (blocking the calling thread until it is done) and updates the database.
+
+        Args:
+            VDdb (ViolenceDetectionDatabase): The database object to update.
+            tableName (str): Name of the database table of the clip.
+            audioPath (str): The path of the downloaded clip.
+
+        Returns:
+            str: The path of the audio to transcribe (the downloaded clip itself if the preprocessing failed).
+        """
+        with get_metrics().time("stage_duration_seconds", stage="preprocessing"):
+            result = self.submit(audioPath).result()
+        return self.record(VDdb, tableName, result)
+
+    def summary(self) -> str:
+        return (f"Audio preprocessing: {self.preprocessedCount} clips preprocessed ({self.failedCount} failed), "
+                f"{self.bytesSaved / 2 ** 20:.1f}MB and {self.secondsSaved / 60:.1f} minutes of audio saved")
+
+
+def preprocess_audio_in_parallel(tableName: str, VDdb: ViolenceDetectionDatabase, preprocessor: AudioPreprocessor = None) -> list[PreprocessingResult]:
+    """
+    Preprocesses the downloaded clips of a table that weren't preprocessed or transcribed yet, across every core.
+    The clips whose preprocessing failed before aren't tried again (they are transcribed as they were downloaded).
+
+    Args:
+        tableName (str): Name of the database table of the clips.
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        preprocessor (AudioPreprocessor): The preprocessor to use (a new one with the default settings if not given).
+
+    Returns:
+        list[PreprocessingResult]: The outcome of preprocessing every clip.
+    """
+    pendingClause, pendingParams = VDdb.pending_clip_clause(tableName)
+    audioPaths = [row[0] for row in VDdb.iter_rows(tableName, ["audio_path"], f"""transcript IS NULL AND audio_path IS NOT NULL AND audio_seconds IS NULL
+                                                                                 AND preprocessing_error IS NULL AND {pendingClause}""", pendingParams)]
+
+    results = []
+    with contextlib.nullcontext(preprocessor) if preprocessor is not None else AudioPreprocessor() as preprocessor:
+        futures = [preprocessor.submit(audioPath) for audioPath in audioPaths]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            preprocessor.record(VDdb, tableName, result)
+            results.append(result)
+        print(preprocessor.summary())
+    return results
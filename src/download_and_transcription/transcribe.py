@@ -1,33 +1,167 @@
 import concurrent.futures
-import threading
+import hashlib
+import json
 import assemblyai as aai
-from os import listdir
 
 import concurrent
+from src.backends.interfaces import TranscriptionBackend
+from src.database.clip_state import TRANSCRIBED
 from src.database.violence_detection_database import ViolenceDetectionDatabase
-import re
+from src.download_and_transcription.async_transcriber import ASSEMBLYAI_BASE_URL, AsyncTranscriptionEngine, TranscriptionResult
+from src.utils.metrics import get_metrics
+from src.utils.rate_limiter import get_rate_limiter
 
-def _update_database(VDdb: ViolenceDetectionDatabase, tableName: str, PATH: str, transcript: str, lock: threading.Lock) -> None:
+def hash_audio_file(PATH: str) -> str:
   """
-    Updates the database with the transcript for a given audio file.
+    Hashes the content of an audio file, so that a clip is recognized even if it was renamed or saved for another table.
+
+    Args:
+        PATH (str): Path to the audio file.
+
+    Returns:
+        str: The SHA-256 hash of the file.
+  """
+  audioHash = hashlib.sha256()
+  with open(PATH, "rb") as file:
+    for chunk in iter(lambda: file.read(1 << 20), b""):
+      audioHash.update(chunk)
+  return audioHash.hexdigest()
+
+def transcription_config_hash(languageCode: str, speakerLabels: bool) -> str:
+  """
+    Hashes the settings that change the transcript of an audio file.
+
+    Args:
+        languageCode (str): The language of the audio.
+        speakerLabels (bool): Whether the utterances are separated by speaker.
+
+    Returns:
+        str: The SHA-256 hash of the settings.
+  """
+  return hashlib.sha256(json.dumps({"language_code": languageCode, "speaker_labels": speakerLabels}, sort_keys=True).encode()).hexdigest()
+
+def _flatten_utterances(utterances: list[dict]) -> str:
+  """
+    Joins the utterances of a transcript into the single string stored in the `transcript` column.
+  """
+  return " | ".join([f"Speaker {utterance['speaker']}: {utterance['text']}" for utterance in utterances])
+
+def _utterance_fields(utterance: dict) -> dict:
+  """
+    Keeps the fields of an utterance that are cached (the word-level details are dropped).
+  """
+  return {key: utterance.get(key) for key in ("speaker", "text", "start", "end")}
+
+def _update_database(VDdb: ViolenceDetectionDatabase, tableName: str, PATH: str, utterances: list[dict]) -> str:
+  """
+    Updates the database with the transcript for a given audio file: its utterances are stored with their speaker and
+    timestamps, and their flattened text in the `transcript` column (which is written last, as it marks the clip as transcribed).
 
     Args:
         VDdb (ViolenceDetectionDatabase): The database object to update.
         tableName (str): Name of the database table to update.
         PATH (str): Path to the audio file.
-        transcript (aai.Transcript): Transcription object containing transcript data.
-        lock (threading.Lock): Lock to ensure thread-safe database access.
+        utterances (list[dict]): The utterances of the transcript ('speaker', 'text', 'start' and 'end').
+
+    Returns:
+        str: The transcript's text as it was stored in the database.
     """
-  with lock:
+  transcriptText = _flatten_utterances(utterances)
+  VDdb.store_utterances(tableName, utterances, audioPath=PATH)
+  VDdb.update_case_by_audio_path(tableName, PATH, transcript=transcriptText, **VDdb.clip_state_fields(tableName, TRANSCRIBED))
+  return transcriptText
+
+def _use_cached_transcripts(VDdb: ViolenceDetectionDatabase, tableName: str, FILE_PATHS: list[str], configHash: str) -> dict[str, str]:
+  """
+    Updates the database with the cached transcripts of the audio files, and returns the files that still need to be transcribed.
+
+    Args:
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        tableName (str): Name of the database table to update.
+        FILE_PATHS (list[str]): Paths to the audio files.
+        configHash (str): The hash of the transcription config.
+
+    Returns:
+        dict[str, str]: The hash of each audio file whose transcript isn't cached, by its path.
+  """
+  audioHashes = {}
+  for PATH in FILE_PATHS:
     try:
-      digitsInPath = re.findall(r"\d+", PATH)
-      episodeNumber, startTime = digitsInPath[0], ":".join(digitsInPath[1:4])
-      transcriptText = " | ".join([f"Speaker {utterance.speaker}: {utterance.text}" for utterance in transcript.utterances])
-      VDdb.update_case(tableName, f"{episodeNumber}:{startTime}", transcript=transcriptText)
-    except Exception as e:
-      print(f"Error updating database for {PATH}: {e}")
+      audioHash = hash_audio_file(PATH)
+    except OSError as e:
+      print(f"Error reading audio {PATH}: {e}")
+      VDdb.record_clip_failure(tableName, e, audioPath=PATH)
+      continue
+    utterances = VDdb.get_cached_transcript(audioHash, configHash)
+    get_metrics().increment("cache_lookups_total", cache="transcript", result="miss" if utterances is None else "hit")
+    if utterances is None:
+      audioHashes[PATH] = audioHash
+    else:
+      _update_database(VDdb, tableName, PATH, utterances)
+      print(f"Reused the cached transcript of {PATH}.")
+  return audioHashes
 
-def _transcribe_audio(PATH: str, VDdb: ViolenceDetectionDatabase, tableName: str, transcriber: aai.Transcriber, config: aai.TranscriptionConfig, lock: threading.Lock) -> None:
+class AssemblyAITranscriptionBackend():
+  """
+    Transcribes audio files with the AssemblyAI SDK, one blocking call per file.
+  """
+  def __init__(self, apiKey: str, languageCode: str = "tr", speakerLabels: bool = True) -> None:
+    """
+      Args:
+          apiKey (str): API key for AssemblyAI.
+          languageCode (str): The language of the audio.
+          speakerLabels (bool): Whether the utterances are separated by speaker.
+    """
+    aai.settings.api_key = apiKey
+    self.apiKey = apiKey
+    self.languageCode = languageCode
+    self.speakerLabels = speakerLabels
+    self.transcriber = aai.Transcriber()
+    self.config = aai.TranscriptionConfig(speaker_labels=speakerLabels, language_code=languageCode)
+
+  def transcribe(self, audioPath: str) -> list[dict]:
+    # The SDK uploads, submits and polls on its own, so the submission is the only request the rate limiter can hold back
+    get_rate_limiter("assemblyai").wait()
+    transcript = self.transcriber.transcribe(audioPath, config=self.config)
+    if transcript.status == aai.TranscriptStatus.error:
+      raise RuntimeError(transcript.error)
+    return [{"speaker": utterance.speaker, "text": utterance.text, "start": utterance.start, "end": utterance.end}
+            for utterance in transcript.utterances]
+
+def transcribe_clip(PATH: str, VDdb: ViolenceDetectionDatabase, tableName: str, backend: TranscriptionBackend) -> str:
+  """
+    Transcribes an audio file (unless the same audio was already transcribed with the same config) and updates the database
+    with the transcript. Any error that occurs is recorded as a failure of the clip and raised.
+
+    Args:
+        PATH (str): Path to the audio file to transcribe.
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        tableName (str): Name of the database table to update.
+        backend (TranscriptionBackend): The backend that transcribes the audio (e.g., `AssemblyAITranscriptionBackend`).
+
+    Returns:
+        str: The transcript's text.
+  """
+  try:
+    audioHash = hash_audio_file(PATH)
+    configHash = transcription_config_hash(backend.languageCode, backend.speakerLabels)
+    utterances = VDdb.get_cached_transcript(audioHash, configHash)
+    get_metrics().increment("cache_lookups_total", cache="transcript", result="miss" if utterances is None else "hit")
+    if utterances is None:
+      try:
+        with get_metrics().time("stage_duration_seconds", stage="transcription"):
+          utterances = [_utterance_fields(utterance) for utterance in backend.transcribe(PATH)]
+      except Exception:
+        get_metrics().increment("stage_items_total", stage="transcription", outcome="failure")
+        raise
+      get_metrics().increment("stage_items_total", stage="transcription", outcome="success")
+      VDdb.cache_transcript(audioHash, configHash, utterances)
+  except Exception as e:
+    VDdb.record_clip_failure(tableName, e, audioPath=PATH)
+    raise
+  return _update_database(VDdb, tableName, PATH, utterances)
+
+def _transcribe_audio(PATH: str, VDdb: ViolenceDetectionDatabase, tableName: str, backend: TranscriptionBackend) -> None:
   """
     Transcribes an audio file and updates the database with the transcript.
 
@@ -35,41 +169,82 @@ def _transcribe_audio(PATH: str, VDdb: ViolenceDetectionDatabase, tableName: str
         PATH (str): Path to the audio file to transcribe.
         VDdb (ViolenceDetectionDatabase): The database object to update.
         tableName (str): Name of the database table to update.
-        transcriber (aai.Transcriber): AssemblyAI transcriber object.
-        config (aai.TranscriptionConfig): Configuration object for transcription.
-        lock (threading.Lock): Lock to ensure thread-safe database access.
+        backend (TranscriptionBackend): The backend that transcribes the audio.
   """
   try:
-    transcript = transcriber.transcribe(PATH, config=config)
-    _update_database(VDdb, tableName, PATH, transcript, lock)
+    transcribe_clip(PATH, VDdb, tableName, backend)
     print(f"Successfully added {PATH}'s transcript to the database.")
   except Exception as e:
         print(f"Error transcribing audio {PATH}: {e}")
 
-def transcribe_audio_in_parallel(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase) -> None:
+def transcribe_audio_in_parallel(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase, backend: TranscriptionBackend = None) -> None:
   """
-    Transcribes multiple audio files in parallel and updates the database.
+    Transcribes the clips of a table that don't have a transcript yet in parallel and updates the database,
+    reusing the cached transcript of the clips whose audio was already transcribed.
 
     Args:
         apiKey (str): API key for AssemblyAI.
         tableName (str): Name of the database table to update.
         VDdb (ViolenceDetectionDatabase): The database object to update.
+        backend (TranscriptionBackend): The backend that transcribes the audio (AssemblyAI by default).
     """
-  # Replace with your API key
-  aai.settings.api_key = apiKey
-
-  # PATHS of the file to transcribe
-  FILE_PATHS = [f"audios/{tableName}Audios/{file}" for file in listdir(f"audios/{tableName}Audios")]
-
-  config = aai.TranscriptionConfig(speaker_labels=True, language_code="tr")
+  backend = backend or AssemblyAITranscriptionBackend(apiKey)
 
-  transcriber = aai.Transcriber()
-  
-  lock = threading.Lock()
+  # PATHS of the clips without a transcript whose audio wasn't transcribed before
+  FILE_PATHS = _use_cached_transcripts(VDdb, tableName, VDdb.get_untranscribed_audio_paths(tableName),
+                                       transcription_config_hash(backend.languageCode, backend.speakerLabels))
 
   with concurrent.futures.ThreadPoolExecutor() as executor:
     for PATH in FILE_PATHS:
-      executor.submit(_transcribe_audio, PATH, VDdb, tableName, transcriber, config, lock)
+      executor.submit(_transcribe_audio, PATH, VDdb, tableName, backend)
+
+  print(get_rate_limiter("assemblyai").summary())
+
+def transcribe_audio_asynchronously(apiKey: str, tableName: str, VDdb: ViolenceDetectionDatabase, maxConcurrentUploads: int = 4, maxInFlight: int = 100,
+                                    backend: TranscriptionBackend = None, baseUrl: str = ASSEMBLYAI_BASE_URL, pollInterval: float = 3.0) -> None:
+  """
+    Transcribes the clips of a table that don't have a transcript yet by submitting all of them and polling the jobs
+    from a single event loop, updating the database as each transcript completes. The clips whose audio was already
+    transcribed reuse the cached transcript.
+
+    The event loop talks to AssemblyAI's API directly, so it is only used with an `AssemblyAITranscriptionBackend`
+    (whose API key, language and speaker labels it uses). Any other backend (a fake, a budgeted wrapper, ...) only has
+    a blocking `transcribe`, so its clips are transcribed with `transcribe_audio_in_parallel` instead.
+
+    Args:
+        apiKey (str): API key for AssemblyAI (used if no backend is given).
+        tableName (str): Name of the database table to update.
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        maxConcurrentUploads (int): The maximum number of files uploaded at the same time.
+        maxInFlight (int): The maximum number of files being transcribed at the same time.
+        backend (TranscriptionBackend): The backend that transcribes the audio (AssemblyAI by default).
+        baseUrl (str): The URL of AssemblyAI's API (a local stand-in can be used for testing).
+        pollInterval (float): Seconds between two status checks of the submitted jobs.
+    """
+  if backend is not None and not isinstance(backend, AssemblyAITranscriptionBackend):
+    print(f"{type(backend).__name__} isn't an AssemblyAI backend, so the clips are transcribed in parallel with its own calls.")
+    transcribe_audio_in_parallel(apiKey, tableName, VDdb, backend)
+    return
+
+  backend = backend or AssemblyAITranscriptionBackend(apiKey)
+  engine = AsyncTranscriptionEngine(backend.apiKey, baseUrl, maxConcurrentUploads=maxConcurrentUploads, maxInFlight=maxInFlight,
+                                    pollInterval=pollInterval, languageCode=backend.languageCode, speakerLabels=backend.speakerLabels)
+  configHash = transcription_config_hash(engine.languageCode, engine.speakerLabels)
 
+  # Hashes of the clips without a transcript whose audio wasn't transcribed before
+  audioHashes = _use_cached_transcripts(VDdb, tableName, VDdb.get_untranscribed_audio_paths(tableName), configHash)
 
+  def write_result(result: TranscriptionResult) -> None:
+    if result.status != "completed":
+      get_metrics().increment("stage_items_total", stage="transcription", outcome="failure")
+      print(f"Error transcribing audio {result.audioPath}: {result.error}")
+      VDdb.record_clip_failure(tableName, result.error, audioPath=result.audioPath)
+      return
+    get_metrics().increment("stage_items_total", stage="transcription", outcome="success")
+    utterances = [_utterance_fields(utterance) for utterance in result.utterances]
+    VDdb.cache_transcript(audioHashes[result.audioPath], configHash, utterances)
+    _update_database(VDdb, tableName, result.audioPath, utterances)
+    print(f"Successfully added {result.audioPath}'s transcript to the database.")
 
+  engine.transcribe(list(audioHashes), write_result)
+  print(engine.rateLimiter.summary())
@@ -0,0 +1,48 @@
+from src.backends.interfaces import ClassificationBackend, DownloadBackend, TranscriptionBackend
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.detection.detect_violence import analyse_transcripts_in_parallel
+from src.detection.pre_classifier import PreClassifier
+from src.detection.token_budget import TokenBudget
+from src.download_and_transcription.add_clips_to_database import download_planned_clips
+from src.download_and_transcription.preprocess_audio import AudioPreprocessor, preprocess_audio_in_parallel
+from src.download_and_transcription.transcribe import transcribe_audio_in_parallel
+
+
+def resume_unfinished_clips(tableName: str, VDdb: ViolenceDetectionDatabase, aaiApiKey: str, openAiApiKey: str,
+                            downloader: DownloadBackend = None, transcriptionBackend: TranscriptionBackend = None,
+                            classificationBackend: ClassificationBackend = None, preClassifier: PreClassifier = None,
+                            preprocessor: AudioPreprocessor = None, tokenBudget: TokenBudget = None) -> dict[str, int]:
+    """
+    Finishes the clips that a previous run left behind (e.g., because it crashed or was stopped), each from the stage it
+    reached: the planned clips are downloaded, the downloaded ones transcribed and the transcribed ones classified.
+    The failed clips are retried as the database's `RetryPolicy` allows, and the finished clips make no request at all.
+
+    Args:
+        tableName (str): Name of the database table of the clips.
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        aaiApiKey (str): API key for AssemblyAI.
+        openAiApiKey (str): API key for OpenAI.
+        downloader (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
+        transcriptionBackend (TranscriptionBackend): The backend that transcribes the clips (AssemblyAI by default).
+        classificationBackend (ClassificationBackend): The backend that classifies the transcripts (OpenAI by default).
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        preprocessor (AudioPreprocessor): The preprocessor of the downloaded clips (None uploads them as they were downloaded).
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a classification request (the `TokenBudget` defaults if not given).
+
+    Returns:
+        dict[str, int]: The number of clips in every state once the clips were resumed.
+    """
+    print(f"Clip states of {tableName} before resuming: {VDdb.count_clip_states(tableName)}")
+
+    download_planned_clips(tableName, VDdb, downloader)
+    VDdb.flush()
+    if preprocessor is not None:
+        preprocess_audio_in_parallel(tableName, VDdb, preprocessor)
+    transcribe_audio_in_parallel(aaiApiKey, tableName, VDdb, transcriptionBackend)
+    VDdb.flush()
+    analyse_transcripts_in_parallel(openAiApiKey, tableName, VDdb, preClassifier=preClassifier, backend=classificationBackend,
+                                    tokenBudget=tokenBudget)
+
+    clipStates = VDdb.count_clip_states(tableName)
+    print(f"Clip states of {tableName} after resuming: {clipStates}")
+    return clipStates
@@ -0,0 +1,188 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+from dataclasses import dataclass, field
+from os import environ
+
+import openai
+import yaml
+
+from src.backends.budgeted import (BudgetedClassificationBackend, BudgetedDownloadBackend, BudgetedMetadataBackend,
+                                   BudgetedTranscriptionBackend)
+from src.backends.interfaces import ClassificationBackend, DownloadBackend, MetadataBackend, TranscriptionBackend
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.detection.detect_violence import MODEL, OpenAIClassificationBackend
+from src.detection.pre_classifier import PreClassifier
+from src.detection.token_budget import TokenBudget
+from src.download_and_transcription.preprocess_audio import AudioPreprocessor
+from src.download_and_transcription.transcribe import AssemblyAITranscriptionBackend
+from src.pipeline.resume import resume_unfinished_clips
+from src.pipeline.streaming_pipeline import PipelineReport
+from src.pipeline.violence_detection_pipeline import run_violence_detection_pipeline
+from src.utils.functions import YtDlpDownloadBackend, expand_playlist
+from src.utils.metrics import METRICS_PATH, MetricsExporter, get_metrics
+from src.utils.resource_budget import ResourceBudget
+from src.utils.video_metadata import VideoMetadataFetcher
+
+# Run from the repository's root with `python -m src.pipeline.series_runner series_manifest.example.yaml`
+
+
+@dataclass
+class SeriesJob:
+    """
+    A series to process.
+
+    Attributes:
+        tableName (str): The name of the series' table in the database.
+        links (list[str]): The links of the episodes.
+        playlist (str | None): The link of a playlist whose videos are added after the `links`.
+    """
+    tableName: str
+    links: list[str] = field(default_factory=list)
+    playlist: str | None = None
+
+    def video_links(self) -> list[str]:
+        """Returns the links of the episodes, expanding the playlist if there is one."""
+        return self.links + (expand_playlist(self.playlist) if self.playlist else [])
+
+
+@dataclass
+class SeriesManifest:
+    """
+    The series to process and the resources they share.
+
+    Attributes:
+        series (list[SeriesJob]): The series, started in this order.
+        budget (ResourceBudget): The slots that the series being processed share.
+        maxConcurrentSeries (int): The maximum number of series processed at the same time (the others wait for their turn).
+    """
+    series: list[SeriesJob]
+    budget: ResourceBudget = field(default_factory=ResourceBudget)
+    maxConcurrentSeries: int = 4
+
+
+def load_manifest(path: str) -> SeriesManifest:
+    """
+    Reads a manifest of series from a YAML file (or a JSON file, if its extension is '.json'), with a `series` list whose
+    entries have a `table` and `links` and/or a `playlist`, and optionally a `budget` (the arguments of `ResourceBudget`)
+    and `maxConcurrentSeries` (see `series_manifest.example.yaml`).
+
+    Args:
+        path (str): The path of the manifest.
+
+    Returns:
+        SeriesManifest: The series, the budget and the number of series processed at the same time.
+    """
+    with open(path, encoding="utf-8") as file:
+        manifest = json.load(file) if path.endswith(".json") else yaml.safe_load(file)
+
+    jobs = []
+    for series in manifest["series"]:
+        if not series.get("links") and not series.get("playlist"):
+            raise ValueError(f"The series {series['table']} has neither links nor a playlist.")
+        jobs.append(SeriesJob(series["table"], list(series.get("links", [])), series.get("playlist")))
+    if len({job.tableName for job in jobs}) != len(jobs):
+        raise ValueError("Every series of the manifest must have its own table.")
+    return SeriesManifest(jobs, ResourceBudget(**manifest.get("budget", {})), manifest.get("maxConcurrentSeries", 4))
+
+
+def _run_series(job: SeriesJob, VDdb: ViolenceDetectionDatabase, budget: ResourceBudget, aaiApiKey: str, openAiApiKey: str,
+                resume: bool, preClassifier: PreClassifier, preprocessor: AudioPreprocessor, metadataBackend: MetadataBackend, downloadBackend: DownloadBackend,
+                transcriptionBackend: TranscriptionBackend, classificationBackend: ClassificationBackend, tokenBudget: TokenBudget) -> PipelineReport:
+    """
+    Processes a single series with the shared backends, every request holding a slot of the budget in the series' name.
+    """
+    backends = {"metadataBackend": BudgetedMetadataBackend(metadataBackend, budget.scrape, job.tableName),
+                "downloadBackend": BudgetedDownloadBackend(downloadBackend, budget.download, job.tableName),
+                "transcriptionBackend": BudgetedTranscriptionBackend(transcriptionBackend, budget.transcription, job.tableName),
+                "classificationBackend": BudgetedClassificationBackend(classificationBackend, budget.classification, job.tableName)}
+
+    VDdb.create_table(job.tableName, **SERIES_TABLE_COLUMNS)
+    VDdb.migrate_clip_keys(job.tableName)
+    VDdb.migrate_clip_states(job.tableName)
+    VDdb.migrate_utterances(job.tableName)
+
+    if resume:
+        resume_unfinished_clips(job.tableName, VDdb, aaiApiKey, openAiApiKey, backends["downloadBackend"],
+                                backends["transcriptionBackend"], backends["classificationBackend"], preClassifier, preprocessor, tokenBudget)
+
+    # A series alone may use the whole budget, so every stage gets as many workers as the budget has slots
+    report = run_violence_detection_pipeline(job.tableName, job.video_links(), VDdb, aaiApiKey, openAiApiKey,
+                                             downloadConcurrency=budget.download.capacity,
+                                             transcriptionConcurrency=budget.transcription.capacity,
+                                             classificationConcurrency=budget.classification.capacity,
+                                             preClassifier=preClassifier, preprocessor=preprocessor, tokenBudget=tokenBudget, **backends)
+    statistics = VDdb.prediction_statistics(job.tableName)
+    print(f"{job.tableName}: Violent Percentage: {statistics['violent_percentage']}% "
+          f"({statistics['violent']} of {statistics['classified']} classified clips)")
+    return report
+
+
+def run_series_jobs(jobs: list[SeriesJob], VDdb: ViolenceDetectionDatabase, aaiApiKey: str, openAiApiKey: str,
+                    budget: ResourceBudget = None, maxConcurrentSeries: int = 4, resume: bool = True, preClassifier: PreClassifier = None,
+                    preprocessor: AudioPreprocessor = None, metadataBackend: MetadataBackend = None, downloadBackend: DownloadBackend = None,
+                    transcriptionBackend: TranscriptionBackend = None, classificationBackend: ClassificationBackend = None,
+                    tokenBudget: TokenBudget = None) -> dict[str, PipelineReport]:
+    """
+    Processes several series at the same time, sharing one budget of scrape, download, transcription and classification
+    slots between them. The free slots go to the series in turn, so a long series doesn't hold up the short ones, and the
+    total use of every resource stays within the budget however many series are queued.
+
+    Args:
+        jobs (list[SeriesJob]): The series to process, started in this order.
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        aaiApiKey (str): API key for AssemblyAI.
+        openAiApiKey (str): API key for OpenAI.
+        budget (ResourceBudget): The slots that the series share (the `ResourceBudget` defaults if not given).
+        maxConcurrentSeries (int): The maximum number of series processed at the same time.
+        resume (bool): Whether to finish the clips that a previous run left behind before processing the links of a series.
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        preprocessor (AudioPreprocessor): The preprocessor of the downloaded clips, whose processes every series shares
+            (None uploads the clips as they were downloaded).
+        metadataBackend (MetadataBackend): The backend that scrapes the videos (YouTube by default).
+        downloadBackend (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
+        transcriptionBackend (TranscriptionBackend): The backend that transcribes the clips (AssemblyAI by default).
+        classificationBackend (ClassificationBackend): The backend that classifies the transcripts (OpenAI by default).
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a classification request (the `TokenBudget` defaults if not given).
+
+    Returns:
+        dict[str, PipelineReport]: The report of every series that was processed, by its table name.
+    """
+    budget = budget or ResourceBudget()
+    tokenBudget = tokenBudget or TokenBudget(model=MODEL)
+    downloadBackend = downloadBackend or YtDlpDownloadBackend()
+    transcriptionBackend = transcriptionBackend or AssemblyAITranscriptionBackend(aaiApiKey)
+    # Retried through the rate limiter
+    classificationBackend = classificationBackend or OpenAIClassificationBackend(openai.OpenAI(api_key=openAiApiKey, max_retries=0))
+    print(f"Processing {len(jobs)} series, {maxConcurrentSeries} at a time, with the budget {budget.summary()}")
+
+    reports = {}
+    with contextlib.nullcontext(metadataBackend) if metadataBackend is not None else VideoMetadataFetcher() as fetcher, \
+         concurrent.futures.ThreadPoolExecutor(maxConcurrentSeries) as executor:
+        futures = {executor.submit(_run_series, job, VDdb, budget, aaiApiKey, openAiApiKey, resume, preClassifier, preprocessor, fetcher,
+                                   downloadBackend, transcriptionBackend, classificationBackend, tokenBudget): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            tableName = futures[future].tableName
+            try:
+                reports[tableName] = future.result()
+            except Exception as e:
+                print(f"Error processing the series {tableName}: {e}")
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Processes the series of a manifest at the same time within a shared budget.")
+    parser.add_argument("manifest", help="The path of the YAML manifest of the series.")
+    parser.add_argument("--no-resume", action="store_true", help="Don't finish the clips that a previous run left behind.")
+    parser.add_argument("--no-preprocessing", action="store_true", help="Upload the clips as they were downloaded, without "
+                                                                        "converting them to mono 16 kHz speech and trimming their silence.")
+    arguments = parser.parse_args()
+
+    manifest = load_manifest(arguments.manifest)
+    with ViolenceDetectionDatabase() as VDdb, MetricsExporter(get_metrics(), METRICS_PATH, interval=60), \
+         contextlib.nullcontext() if arguments.no_preprocessing else AudioPreprocessor() as preprocessor:
+        reports = run_series_jobs(manifest.series, VDdb, environ.get("AAI_API_KEY"), environ.get("OPEN_AI_API_KEY"),
+                                  manifest.budget, manifest.maxConcurrentSeries, resume=not arguments.no_resume, preprocessor=preprocessor)
+    for tableName, report in reports.items():
+        print(f"{tableName}: {report.summary()}")
@@ -0,0 +1,157 @@
+import queue
+import threading
+import time
+import traceback
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+from src.utils.metrics import get_metrics
+
+# Put into a stage's queue once for each of its workers when the previous stage has finished
+_END_OF_STREAM = object()
+
+
+@dataclass
+class PipelineStage:
+    """
+    One step of a streaming pipeline.
+
+    Attributes:
+        name (str): The name of the stage (used in the report).
+        worker (Callable): Processes one item and returns the items to pass to the next stage (an empty list passes nothing on).
+        concurrency (int): The number of items the stage processes at the same time.
+        queueSize (int): The maximum number of items waiting for the stage; a full queue blocks the previous stage.
+    """
+    name: str
+    worker: Callable[[object], Iterable]
+    concurrency: int = 4
+    queueSize: int = 32
+
+
+@dataclass
+class StageFailure:
+    """An item that a stage failed to process."""
+    stageName: str
+    item: object
+    error: Exception
+    traceback: str
+
+
+@dataclass
+class PipelineReport:
+    """
+    What happened during a run of a streaming pipeline.
+
+    Attributes:
+        results (list): The items produced by the last stage.
+        failures (list[StageFailure]): Every item that raised an error, with the stage it failed in.
+        processedCounts (dict[str, int]): The number of items each stage processed successfully.
+        firstResultTime (float | None): Seconds from the start of the run until the last stage produced its first item.
+        totalTime (float): The wall-clock time of the run in seconds.
+        stageLatencies (dict[str, list[float]]): The seconds each stage's worker took for every item it processed.
+    """
+    results: list = field(default_factory=list)
+    failures: list[StageFailure] = field(default_factory=list)
+    processedCounts: dict[str, int] = field(default_factory=dict)
+    firstResultTime: float | None = None
+    totalTime: float = 0.0
+    stageLatencies: dict[str, list[float]] = field(default_factory=dict)
+
+    def latency_percentile(self, stageName: str, percentile: float) -> float | None:
+        """Returns a percentile (0-100) of a stage's latencies in seconds, or None if the stage processed nothing."""
+        latencies = sorted(self.stageLatencies.get(stageName, []))
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def summary(self) -> str:
+        """Returns a human readable summary of the run."""
+        lines = [f"Finished in {self.totalTime:.1f}s" + (f" (first result after {self.firstResultTime:.1f}s)" if self.firstResultTime is not None else "")]
+        for stageName, processedCount in self.processedCounts.items():
+            failedCount = sum(failure.stageName == stageName for failure in self.failures)
+            line = f"  {stageName}: {processedCount} succeeded, {failedCount} failed"
+            if self.stageLatencies.get(stageName):
+                line += f" (p50 {self.latency_percentile(stageName, 50):.2f}s, p95 {self.latency_percentile(stageName, 95):.2f}s)"
+            lines.append(line)
+        for failure in self.failures:
+            lines.append(f"  Failed in {failure.stageName} for {failure.item!r}: {failure.error}")
+        return "\n".join(lines)
+
+
+class StreamingPipeline:
+    """
+    Runs items through a chain of stages connected by bounded queues, so that every item moves on to the next stage as soon as
+    it is ready instead of waiting for the whole previous stage to finish.
+    """
+    def __init__(self, stages: list[PipelineStage]) -> None:
+        self.stages = stages
+
+    def run(self, items: Iterable) -> PipelineReport:
+        """
+        Feeds the items to the first stage and blocks until every stage has finished.
+
+        Args:
+            items (Iterable): The inputs of the first stage.
+
+        Returns:
+            PipelineReport: The results, failures and timings of the run.
+        """
+        report = PipelineReport(processedCounts={stage.name: 0 for stage in self.stages},
+                                stageLatencies={stage.name: [] for stage in self.stages})
+        reportLock = threading.Lock()
+        queues = [queue.Queue(maxsize=stage.queueSize) for stage in self.stages]
+        runningWorkers = [stage.concurrency for stage in self.stages]
+        startTime = time.perf_counter()
+
+        def forward(stageIndex: int, outputs: Iterable) -> None:
+            for output in outputs or []:
+                if stageIndex + 1 < len(self.stages):
+                    queues[stageIndex + 1].put(output) # Blocks while the next stage is behind (backpressure)
+                else:
+                    with reportLock:
+                        if report.firstResultTime is None:
+                            report.firstResultTime = time.perf_counter() - startTime
+                        report.results.append(output)
+
+        def work(stageIndex: int) -> None:
+            stage = self.stages[stageIndex]
+            while (item := queues[stageIndex].get()) is not _END_OF_STREAM:
+                get_metrics().set_gauge("queue_depth", queues[stageIndex].qsize(), queue=stage.name)
+                itemStartTime = time.perf_counter()
+                try:
+                    outputs = stage.worker(item)
+                    with reportLock:
+                        report.stageLatencies[stage.name].append(time.perf_counter() - itemStartTime)
+                    forward(stageIndex, outputs)
+                    with reportLock:
+                        report.processedCounts[stage.name] += 1
+                except Exception as e:
+                    with reportLock:
+                        report.failures.append(StageFailure(stage.name, item, e, traceback.format_exc()))
+
+            # The last worker of a stage to finish tells the workers of the next stage that no more items are coming
+            with reportLock:
+                runningWorkers[stageIndex] -= 1
+                isLastWorker = runningWorkers[stageIndex] == 0
+            if isLastWorker:
+                get_metrics().set_gauge("queue_depth", 0, queue=stage.name)
+            if isLastWorker and stageIndex + 1 < len(self.stages):
+                for _ in range(self.stages[stageIndex + 1].concurrency):
+                    queues[stageIndex + 1].put(_END_OF_STREAM)
+
+        threads = [threading.Thread(target=work, args=(stageIndex,), name=f"{stage.name}-{workerIndex}", daemon=True)
+                   for stageIndex, stage in enumerate(self.stages) for workerIndex in range(stage.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            # Even if the items raised, the stages finish what they were given so that no worker is left waiting
+            for _ in range(self.stages[0].concurrency):
+                queues[0].put(_END_OF_STREAM)
+            for thread in threads:
+                thread.join()
+            report.totalTime = time.perf_counter() - startTime
+        return report
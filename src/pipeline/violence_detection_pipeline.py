@@ -0,0 +1,92 @@
+import contextlib
+
+import openai
+
+from src.backends.interfaces import ClassificationBackend, DownloadBackend, MetadataBackend, TranscriptionBackend
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.detection.detect_violence import MODEL, OpenAIClassificationBackend, classify_transcript, create_classification_cache
+from src.detection.pre_classifier import PreClassifier
+from src.detection.token_budget import TokenBudget
+from src.download_and_transcription.add_clips_to_database import (DEFAULT_GAP_TOLERANCE, DEFAULT_MAX_CLIP_LENGTH,
+                                                                  DEFAULT_METADATA_CACHE_TTL, process_video_link)
+from src.download_and_transcription.preprocess_audio import AudioPreprocessor
+from src.download_and_transcription.transcribe import AssemblyAITranscriptionBackend, transcribe_clip
+from src.pipeline.streaming_pipeline import PipelineReport, PipelineStage, StreamingPipeline
+from src.utils.rate_limiter import get_rate_limiter
+from src.utils.video_metadata import VideoMetadataFetcher
+
+
+def run_violence_detection_pipeline(tableName: str, videoLinks: list[str], VDdb: ViolenceDetectionDatabase, aaiApiKey: str, openAiApiKey: str,
+                                    downloadConcurrency: int = 4, transcriptionConcurrency: int = 16, classificationConcurrency: int = 8,
+                                    queueSize: int = 32, preClassifier: PreClassifier = None, metadataBackend: MetadataBackend = None,
+                                    downloadBackend: DownloadBackend = None, transcriptionBackend: TranscriptionBackend = None,
+                                    classificationBackend: ClassificationBackend = None, preprocessor: AudioPreprocessor = None,
+                                    tokenBudget: TokenBudget = None) -> PipelineReport:
+    """
+    Downloads, transcribes and classifies the clips of the videos as a stream: every downloaded clip is transcribed right away,
+    and every transcript is classified right away, instead of each stage waiting for the previous one to finish.
+    With a preprocessor, every downloaded clip is shrunk on the local cores before it is uploaded for transcription.
+
+    Args:
+        tableName (str): Name of the database table to store the clips in.
+        videoLinks (list[str]): List of video URLs to process.
+        VDdb (ViolenceDetectionDatabase): The database object to update.
+        aaiApiKey (str): API key for AssemblyAI.
+        openAiApiKey (str): API key for OpenAI.
+        downloadConcurrency (int): The number of videos scraped and downloaded at the same time.
+        transcriptionConcurrency (int): The number of clips transcribed at the same time.
+        classificationConcurrency (int): The number of transcripts classified at the same time.
+        queueSize (int): The maximum number of items waiting between two stages.
+        preClassifier (PreClassifier): The local model that marks the clearly non-violent transcripts without asking the LLM.
+        metadataBackend (MetadataBackend): The backend that scrapes the videos (YouTube by default).
+        downloadBackend (DownloadBackend): The backend that downloads the clips (yt-dlp by default).
+        transcriptionBackend (TranscriptionBackend): The backend that transcribes the clips (AssemblyAI by default).
+        classificationBackend (ClassificationBackend): The backend that classifies the transcripts (OpenAI by default).
+        preprocessor (AudioPreprocessor): The preprocessor of the downloaded clips (None uploads them as they were downloaded).
+        tokenBudget (TokenBudget): The maximum number of transcript tokens in a classification request (the `TokenBudget` defaults if not given).
+
+    Returns:
+        PipelineReport: The (episode_timeframe, classification) of every classified clip, the failures and the timings.
+    """
+    transcriptionBackend = transcriptionBackend or AssemblyAITranscriptionBackend(aaiApiKey)
+    # Retried through the rate limiter
+    classificationBackend = classificationBackend or OpenAIClassificationBackend(openai.OpenAI(api_key=openAiApiKey, max_retries=0))
+    classificationCache = create_classification_cache(VDdb)
+    tokenBudget = tokenBudget or TokenBudget(model=MODEL)
+
+    with contextlib.nullcontext(metadataBackend) if metadataBackend is not None else VideoMetadataFetcher() as fetcher:
+        def download(videoLink: str) -> list[tuple[str, str]]:
+            return process_video_link(videoLink, VDdb, tableName, fetcher, DEFAULT_METADATA_CACHE_TTL, False,
+                                      DEFAULT_GAP_TOLERANCE, DEFAULT_MAX_CLIP_LENGTH, downloader=downloadBackend)
+
+        def preprocess(clip: tuple[str, str]) -> list[tuple[str, str]]:
+            episodeAndTimeframe, audioPath = clip
+            return [(episodeAndTimeframe, preprocessor.preprocess_clip(VDdb, tableName, audioPath))]
+
+        def transcribe(clip: tuple[str, str]) -> list[tuple[str, str]]:
+            episodeAndTimeframe, audioPath = clip
+            return [(episodeAndTimeframe, transcribe_clip(audioPath, VDdb, tableName, transcriptionBackend))]
+
+        def classify(clip: tuple[str, str]) -> list[tuple[str, int | None]]:
+            episodeAndTimeframe, transcript = clip
+            return [(episodeAndTimeframe, classify_transcript(transcript, VDdb, tableName, episodeAndTimeframe, classificationBackend,
+                                                              classificationCache, preClassifier, tokenBudget))]
+
+        stages = [PipelineStage("download", download, downloadConcurrency, queueSize),
+                  PipelineStage("transcription", transcribe, transcriptionConcurrency, queueSize),
+                  PipelineStage("classification", classify, classificationConcurrency, queueSize)]
+        if preprocessor is not None:
+            # Every worker of the stage waits for one of the preprocessor's processes
+            stages.insert(1, PipelineStage("preprocessing", preprocess, preprocessor.maxWorkers, queueSize))
+        pipeline = StreamingPipeline(stages)
+        report = pipeline.run(videoLinks)
+
+    VDdb.flush()
+    print(classificationCache.summary())
+    if preprocessor is not None:
+        print(preprocessor.summary())
+    if preClassifier is not None:
+        print(preClassifier.summary())
+    print(get_rate_limiter("assemblyai").summary())
+    print(get_rate_limiter("openai").summary())
+    return report
@@ -0,0 +1,153 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from src.utils.functions import convert, merge_search_ranges
+from src.utils.video_metadata import VideoMetadata
+
+# Rough token counts used to estimate the classification cost of a plan before anything is downloaded
+TRANSCRIPT_TOKENS_PER_MINUTE = 320  # Turkish dialogue is ~130 words per minute, ~2.5 tokens per word
+PROMPT_TOKENS_PER_CLIP = 250        # The system message and the tool schema sent with every clip
+
+
+@dataclass
+class ClipPlan:
+    """
+    The clips chosen for a series and what processing them is expected to cost.
+
+    Attributes:
+        clips (dict[str, dict[tuple[str], list[int]]]): The (start, end) ranges of the clips of each video (keyed by video ID),
+            each mapped to the times of the peaks that it covers.
+        audioMinutes (float): The total length of the clips in minutes (the billed transcription minutes).
+        estimatedTokens (int): The estimated number of prompt tokens needed to classify the clips.
+        coverage (float): The fraction of the series' total heatmap weight that the clips cover.
+    """
+    clips: dict[str, dict[tuple[str], list[int]]] = field(default_factory=dict)
+    audioMinutes: float = 0.0
+    estimatedTokens: int = 0
+    coverage: float = 0.0
+
+
+def _pad(rows: list[list[float]], fillValue: float) -> np.ndarray:
+    """Stacks rows of different lengths into a matrix, filling the missing elements with the given value."""
+    matrix = np.full((len(rows), max(map(len, rows), default=0)), fillValue, dtype=float)
+    for index, row in enumerate(rows):
+        matrix[index, :len(row)] = row
+    return matrix
+
+
+def _union_seconds(videoIndices: np.ndarray, starts: np.ndarray, ends: np.ndarray, gapTolerance: int) -> float:
+    """
+    Returns the number of seconds of audio downloaded for the given windows once the windows of each video are merged.
+    """
+    if len(starts) == 0:
+        return 0.0
+    # Offsetting every video by more than its length lets a single running maximum handle all the videos at once
+    offset = videoIndices * (ends.max() + gapTolerance + 1)
+    order = np.lexsort((starts, videoIndices))
+    starts, ends = (starts + offset)[order], (ends + offset)[order]
+
+    previousEnds = np.concatenate(([-np.inf], np.maximum.accumulate(ends)[:-1]))
+    # A window closer than the gap tolerance to the previous one is merged with it, so the gap is downloaded as well
+    downloadFrom = np.where(starts - previousEnds <= gapTolerance, previousEnds, starts)
+    return float(np.clip(ends - downloadFrom, 0, None).sum())
+
+
+def plan_clips_for_budget(metadataList: list[VideoMetadata], budgetMinutes: float, searchLength: int = 90,
+                          gapTolerance: int = 0, maxClipLength: int = None) -> ClipPlan:
+    """
+    Chooses the peak windows of a whole series that cover as much of the heatmap weight as possible within a transcription budget.
+
+    Every local maximum of every heatmap is a candidate window, scored by the heatmap weight (intensity x seconds) it covers.
+    Each video contributes its highest scoring windows, and the budget is shared between the videos in proportion to
+    their durations, so short episodes are not over-sampled and long ones are not under-sampled. The number of windows
+    taken is the largest one whose merged clips still fit in the budget.
+
+    Args:
+        metadataList (list[VideoMetadata]): The metadata of the videos of the series.
+        budgetMinutes (float): The total length of audio (in minutes) that can be transcribed.
+        searchLength (int): Length of the search window around each peak in seconds.
+        gapTolerance (int): The maximum gap in seconds between two windows for them to be merged.
+        maxClipLength (int): The maximum length of a merged clip in seconds.
+
+    Returns:
+        ClipPlan: The chosen clips and their expected cost.
+    """
+    metadataList = [metadata for metadata in metadataList if metadata.yValues]
+    if not metadataList:
+        return ClipPlan()
+
+    heights = _pad([metadata.yValues for metadata in metadataList], -np.inf)
+    positions = _pad([metadata.xValues for metadata in metadataList], np.nan)
+    durations = np.array([metadata.duration for metadata in metadataList], dtype=float)
+    pointCounts = np.array([len(metadata.yValues) for metadata in metadataList])
+    binSeconds = durations / pointCounts
+
+    # Local maxima (the same strict comparison as find_peak_points)
+    padded = np.pad(heights, ((0, 0), (1, 1)), constant_values=-np.inf)
+    isPeak = (padded[:, 1:-1] > padded[:, :-2]) & (padded[:, 1:-1] > padded[:, 2:])
+
+    # Heatmap weight (intensity x seconds) inside the window around each peak, treating each heatmap point as a constant
+    # segment of the video and interpolating the cumulative weight of each row at the window's borders
+    weights = np.where(np.isfinite(heights), heights, 0) * binSeconds[:, None]
+    cumulativeWeights = np.concatenate((np.zeros((len(weights), 1)), np.cumsum(weights, axis=1)), axis=1)
+    rowIndices, pointIndices = np.nonzero(isPeak)
+    peakTimes = positions[rowIndices, pointIndices] * durations[rowIndices]
+    startTimes, endTimes = peakTimes - searchLength // 2, peakTimes + searchLength // 2
+
+    def cumulative_weight_at(times: np.ndarray) -> np.ndarray:
+        pointPositions = np.clip(times / binSeconds[rowIndices], 0, pointCounts[rowIndices])
+        lowerIndices = np.minimum(np.floor(pointPositions).astype(int), pointCounts[rowIndices] - 1)
+        lowerWeights = cumulativeWeights[rowIndices, lowerIndices]
+        return lowerWeights + (pointPositions - lowerIndices) * (cumulativeWeights[rowIndices, lowerIndices + 1] - lowerWeights)
+
+    scores = cumulative_weight_at(endTimes) - cumulative_weight_at(startTimes)
+    windowStarts = np.clip(np.floor(startTimes / binSeconds[rowIndices]), 0, None).astype(int)
+    windowEnds = np.minimum(np.ceil(endTimes / binSeconds[rowIndices]), pointCounts[rowIndices]).astype(int)
+
+    # Only the windows that fit inside the video (the same rule as find_search_ranges)
+    isValid = (startTimes >= 0) & (endTimes <= durations[rowIndices])
+    rowIndices, pointIndices, scores = rowIndices[isValid], pointIndices[isValid], scores[isValid]
+    windowStarts, windowEnds = windowStarts[isValid], windowEnds[isValid]
+    startTimes, endTimes = startTimes[isValid].astype(int), endTimes[isValid].astype(int)
+
+    # Rank the windows of each video by their weight. YouTube normalizes every heatmap to its own maximum, so the weights
+    # only compare windows of the same video; across videos the windows are apportioned by duration (Sainte-Laguë),
+    # the k-th best window of a video getting the priority (k + 0.5) / duration
+    byVideo = np.lexsort((-scores, rowIndices))
+    firstOfVideo = np.searchsorted(rowIndices[byVideo], rowIndices[byVideo])
+    ranks = np.empty_like(byVideo)
+    ranks[byVideo] = np.arange(len(byVideo)) - firstOfVideo
+    order = np.lexsort((-scores, (ranks + 0.5) / durations[rowIndices]))
+
+    # Take the windows in priority order; the merged length only grows with the number taken, so it is binary searched
+    budgetSeconds = budgetMinutes * 60
+    low, high = 0, len(order)
+    while low < high:
+        middle = (low + high + 1) // 2
+        chosen = order[:middle]
+        if _union_seconds(rowIndices[chosen], startTimes[chosen], endTimes[chosen], gapTolerance) <= budgetSeconds:
+            low = middle
+        else:
+            high = middle - 1
+    chosen = order[:low]
+
+    # Covered weight, marking the points inside the chosen windows with a difference array
+    coverageMarks = np.zeros((len(weights), weights.shape[1] + 1))
+    np.add.at(coverageMarks, (rowIndices[chosen], windowStarts[chosen]), 1)
+    np.add.at(coverageMarks, (rowIndices[chosen], windowEnds[chosen]), -1)
+    isCovered = np.cumsum(coverageMarks, axis=1)[:, :-1] > 0
+    coverage = float(weights[isCovered].sum() / weights.sum()) if weights.sum() else 0.0
+
+    plan = ClipPlan(coverage=coverage)
+    for rowIndex, metadata in enumerate(metadataList):
+        rowChosen = chosen[rowIndices[chosen] == rowIndex]
+        peakPoints = [(positions[rowIndex, pointIndex], heights[rowIndex, pointIndex]) for pointIndex in pointIndices[rowChosen]]
+        if peakPoints:
+            plan.clips[metadata.videoId] = merge_search_ranges(peakPoints, searchLength, metadata.duration, gapTolerance, maxClipLength)
+
+    audioSeconds = sum(convert(end) - convert(start) for videoClips in plan.clips.values() for start, end in videoClips)
+    clipCount = sum(len(videoClips) for videoClips in plan.clips.values())
+    plan.audioMinutes = audioSeconds / 60
+    plan.estimatedTokens = round(plan.audioMinutes * TRANSCRIPT_TOKENS_PER_MINUTE + clipCount * PROMPT_TOKENS_PER_CLIP)
+    return plan
@@ -1,26 +1,8 @@
+import concurrent.futures
+import os
 import subprocess
-import time
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-import chromedriver_autoinstaller
-import re
-import requests as req
-
-chromedriver_autoinstaller.install()  # Check if the current version of chromedriver exists
-                                      # and if it doesn't exist, download it automatically,
-                                      # then add chromedriver to path
-
-def timeToComplete(func: callable) -> callable:
-    """
-    Decorator to measure and return the time taken by a function to execute.
-    """
-    def inner(*args, **kwargs):
-        startTime = time.time()
-        returnValue = func(*args, **kwargs)
-        endTime = time.time()
-        return (returnValue, endTime - startTime)
-    return inner
+import yt_dlp
+from src.utils.video_metadata import VideoMetadata, VideoMetadataFetcher, get_default_fetcher
 
 def convert(time: int | str) -> int | str:
     """
@@ -44,41 +26,32 @@ def convert(time: int | str) -> int | str:
              totalSeconds += 60 ** index * timeElement
         return totalSeconds
     
-def return_search_ranges(videoLink: str) -> list[tuple[str]]:
+def return_search_ranges(videoLink: str, fetcher: VideoMetadataFetcher = None) -> list[tuple[str]]:
     """
     Extracts heatmap data from a YouTube video and calculates search ranges around peak points.
     
     Args:
         videoLink (str): The URL of the YouTube video.
+        fetcher (VideoMetadataFetcher): The fetcher used to scrape the video (the shared fetcher by default).
     
     Returns:
         list[tuple[str]]: A list of time ranges (start, end) where peaks were detected in the heatmap.
     """
-    options = webdriver.ChromeOptions()
-    # Instructs Chrome to run in the background without any GUI
-    options.add_argument("--headless")
-    driver = webdriver.Chrome(options=options)
+    metadata = (fetcher or get_default_fetcher()).fetch(videoLink)
+    return search_ranges_from_metadata(metadata)
 
-    # Opens Video Link
-    driver.get(videoLink)
-    
-    # Wait for the heat-map-path to render
-    time.sleep(2)
-    soup = BeautifulSoup(driver.page_source, "lxml")
-    heatMapData = soup.find("path", class_="ytp-heat-map-path").get("d")
-    videoDuration = convert(soup.find("span", class_="ytp-time-duration").text) # format = hr:min:sec
-
-    # Close the browser
-    driver.quit()
+def search_ranges_from_metadata(metadata: VideoMetadata) -> list[tuple[str]]:
+    """
+    Calculates the search ranges around the peak points of an already scraped heatmap.
 
-    # Extracting the x and y-values from the raw heat map data using regex
-    findings = re.findall(r"[MCL](?: -?\d+[.]\d+,-?\d+[.]\d+){2} (\d+[.]\d+),(\d+[.]\d+)", heatMapData)
-    
-    xValues = [(float(finding[0]) - 5)/1000 for finding in findings]     # We substract 5 to get rid of the offset
-    yValues = [(100-float(finding[1]))/100 for finding in findings]
+    Args:
+        metadata (VideoMetadata): The metadata of the video.
 
-    peaks = find_peak_points(yValues, xValues, 15/100)
-    ranges = find_search_ranges(peaks, 90, videoDuration)
+    Returns:
+        list[tuple[str]]: A list of time ranges (start, end) where peaks were detected in the heatmap.
+    """
+    peaks = find_peak_points(metadata.yValues, metadata.xValues, 15/100)
+    ranges = find_search_ranges(peaks, 90, metadata.duration)
 
     return ranges
 
@@ -124,20 +97,84 @@ def find_search_ranges(peakPoints: list, searchLength: int, duration: int) -> li
             searchRanges.append((convert(int(startTime)), convert(int(endTime))))
     return searchRanges
 
-def get_video_title(link: str) -> str:
+def merge_search_ranges(peakPoints: list, searchLength: int, duration: int, gapTolerance: int = 0, maxClipLength: int = None) -> dict[tuple[str], list[int]]:
+    """
+    Converts peak points into search time ranges, merging the ranges that overlap or are close to each other into a single clip.
+
+    Args:
+        peakPoints (list[tuple]): List of (time, value) tuples for the peaks.
+        searchLength (int): Length of the search window around each peak in seconds.
+        duration (int): Total video duration in seconds.
+        gapTolerance (int): The maximum gap in seconds between two ranges for them to be merged (0 only merges touching ranges).
+        maxClipLength (int): The maximum length of a merged clip in seconds (clips are not limited if not given). It can't
+            be shorter than `searchLength`, since a single search range must fit into a clip.
+
+    Returns:
+        dict[tuple[str], list[int]]: The (start_time, end_time) ranges of the clips in chronological order,
+        each mapped to the times (in seconds) of the peaks that it covers.
+
+    Raises:
+        ValueError: If `maxClipLength` is shorter than `searchLength`.
+    """
+    if maxClipLength is not None and maxClipLength < searchLength:
+        raise ValueError(f"The maximum clip length ({maxClipLength}s) can't be shorter than the search length ({searchLength}s).")
+
+    windows = []
+    for peakPoint in peakPoints:
+        peakTime = peakPoint[0] * duration
+        startTime, endTime = peakTime - searchLength // 2, peakTime + searchLength // 2
+        if startTime >= 0 and endTime <= duration: # Check if the search range is valid
+            windows.append((int(startTime), int(endTime), int(peakTime)))
+    windows.sort()
+
+    # Each clip is a [start, end, peaks] list that grows while the following windows can be merged into it
+    # (a clip starts as a single window, and is never extended past its maximum length)
+    clips = []
+    for startTime, endTime, peakTime in windows:
+        if not clips or startTime - clips[-1][1] > gapTolerance:
+            clips.append([startTime, endTime, [peakTime]])
+            continue
+
+        clipStart, clipEnd, clipPeaks = clips[-1]
+        lengthLimit = clipStart + maxClipLength if maxClipLength is not None else endTime
+        if endTime <= lengthLimit: # The whole window fits into the clip
+            clips[-1][1] = max(endTime, clipEnd)
+            clipPeaks.append(peakTime)
+        elif peakTime <= clipEnd: # The peak itself is already covered, so the clip is only extended up to its maximum length
+            clips[-1][1] = max(lengthLimit, clipEnd)
+            clipPeaks.append(peakTime)
+        else: # Start a new clip where the current one ends so that no audio is processed twice
+            clips.append([max(startTime, clipEnd), endTime, [peakTime]])
+
+    return {(convert(startTime), convert(endTime)): peakTimes for startTime, endTime, peakTimes in clips}
+
+def plan_clips_from_metadata(metadata: VideoMetadata, gapTolerance: int = 0, maxClipLength: int = None) -> dict[tuple[str], list[int]]:
+    """
+    Calculates the clips to download around the peak points of an already scraped heatmap, merging the overlapping search ranges.
+
+    Args:
+        metadata (VideoMetadata): The metadata of the video.
+        gapTolerance (int): The maximum gap in seconds between two search ranges for them to be merged.
+        maxClipLength (int): The maximum length of a merged clip in seconds.
+
+    Returns:
+        dict[tuple[str], list[int]]: The (start_time, end_time) ranges of the clips, each mapped to the times of the peaks it covers.
+    """
+    peaks = find_peak_points(metadata.yValues, metadata.xValues, 15/100)
+    return merge_search_ranges(peaks, 90, metadata.duration, gapTolerance, maxClipLength)
+
+def get_video_title(link: str, fetcher: VideoMetadataFetcher = None) -> str:
     """
     Returns the title of the video specified
 
     Args:
         link (str): The link of the video that you want to get the title of.
+        fetcher (VideoMetadataFetcher): The fetcher used to scrape the video (the shared fetcher by default).
 
     Returns:
         str: The title of the video.
     """
-    html = req.get(link)
-    soup = BeautifulSoup(html.content, "lxml")
-    title = soup.find("title").text
-    return title
+    return (fetcher or get_default_fetcher()).fetch(link).title
 
 def load_audio(tableName: str, link: str, fileType: str, sectionToDownload: tuple[str]) -> None:
     """
@@ -162,6 +199,88 @@ def load_audio(tableName: str, link: str, fileType: str, sectionToDownload: tupl
     else:
         print(f"Audio downloaded successfully for range {start} to {end}.")
 
+def download_stream_ranges(streamUrl: str, outputPaths: dict[tuple[str], str], httpHeaders: dict = None, maxWorkers: int = 4) -> dict[tuple[str], str | None]:
+    """
+    Downloads the specified time intervals of an already resolved media stream with ffmpeg, seeking directly into the stream for each interval.
+
+    Args:
+        streamUrl (str): The direct URL of the media stream (or any URL/path ffmpeg can read).
+        outputPaths (dict[tuple[str], str]): The path to save each interval to, keyed by the interval's (start, end) in a 'HH:MM:SS' format.
+        httpHeaders (dict): The HTTP headers required to read the stream.
+        maxWorkers (int): The maximum number of intervals downloaded at the same time.
+
+    Returns:
+        dict[tuple[str], str | None]: The error message of each interval, or None if it was downloaded successfully.
+    """
+    headerArgs = ["-headers", "".join(f"{key}: {value}\r\n" for key, value in httpHeaders.items())] if httpHeaders else []
+
+    def download_range(section: tuple[str]) -> str | None:
+        start, end = section
+        os.makedirs(os.path.dirname(outputPaths[section]) or ".", exist_ok=True)
+        command = ["ffmpeg", "-y", "-loglevel", "error", *headerArgs, "-ss", start, "-to", end, "-i", streamUrl, "-vn", "-c", "copy", outputPaths[section]]
+        p1 = subprocess.run(command, capture_output=True)
+        return p1.stderr.decode() if p1.returncode != 0 else None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        results = executor.map(download_range, outputPaths.keys())
+        return dict(zip(outputPaths.keys(), results))
+
+def load_audio_ranges(tableName: str, link: str, fileType: str, sectionsToDownload: list[tuple[str]], maxWorkers: int = 4) -> dict[tuple[str], tuple[str, str | None]]:
+    """
+    Downloads all the specified time intervals of the video's audio, resolving the audio stream only once for the whole video.
+    The clips are saved with the same names as the ones `load_audio` gives them.
 
+    Args:
+        tableName (str): The name of the database table (used to give the download directory it's name).
+        link (str): The Youtube video URL.
+        fileType (str): The desired audio file format (e.g., 'm4a').
+        sectionsToDownload (list[tuple[str]]): The start and end times of the time intervals to be downloaded in a 'HH:MM:SS' format.
+        maxWorkers (int): The maximum number of intervals downloaded at the same time.
+
+    Returns:
+        dict[tuple[str], tuple[str, str | None]]: The path each interval was saved to and its error message
+        (None if it was downloaded successfully).
+    """
+    ydlOptions = {"format": f"bestaudio[ext={fileType}]", "paths": {"home": f"audios/{tableName}Audios"}, "quiet": True, "no_warnings": True}
+    try:
+        with yt_dlp.YoutubeDL(ydlOptions) as ydl:
+            info = ydl.extract_info(link, download=False)
+            outputPaths = {section: ydl.prepare_filename(info, outtmpl=f"%(title)s{section[0]}.%(ext)s") for section in sectionsToDownload}
+    except yt_dlp.utils.DownloadError as e:
+        return {section: (None, f"Could not resolve the audio stream: {e}") for section in sectionsToDownload}
+
+    results = download_stream_ranges(info["url"], outputPaths, info.get("http_headers"), maxWorkers)
+    for (start, end), error in results.items():
+        if error is not None:
+            print(f"Error downloading audio: {error}")
+        else:
+            print(f"Audio downloaded successfully for range {start} to {end}.")
+    return {section: (os.path.normpath(outputPaths[section]), error) for section, error in results.items()}
+
+def expand_playlist(playlistLink: str) -> list[str]:
+    """
+    Returns the links of the videos of a YouTube playlist, in the playlist's order, without resolving the videos themselves.
+
+    Args:
+        playlistLink (str): The URL of the playlist.
+
+    Returns:
+        list[str]: The watch links of the videos.
+    """
+    ydlOptions = {"extract_flat": "in_playlist", "quiet": True, "no_warnings": True}
+    with yt_dlp.YoutubeDL(ydlOptions) as ydl:
+        info = ydl.extract_info(playlistLink, download=False)
+    return [f"https://www.youtube.com/watch?v={entry['id']}" for entry in info.get("entries") or [] if entry and entry.get("id")]
 
+class YtDlpDownloadBackend():
+    """Downloads the intervals of a video's audio from YouTube with yt-dlp and ffmpeg (see `load_audio_ranges`)."""
+    def __init__(self, maxWorkers: int = 4) -> None:
+        """
+        Args:
+            maxWorkers (int): The maximum number of intervals of a video downloaded at the same time.
+        """
+        self.maxWorkers = maxWorkers
 
+    def download_ranges(self, tableName: str, videoLink: str, fileType: str,
+                        sectionsToDownload: list[tuple[str]]) -> dict[tuple[str], tuple[str, str | None]]:
+        return load_audio_ranges(tableName, videoLink, fileType, sectionsToDownload, self.maxWorkers)
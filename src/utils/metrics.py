@@ -0,0 +1,208 @@
+import bisect
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+# The upper bounds (in seconds) of the latency buckets, from a DB write to a long transcription
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Where `main.py` exports the metrics of a run (the format follows the extension: '.prom' or '.json')
+METRICS_PATH = "./data/metrics.prom"
+
+
+class Histogram():
+    """Counts the observed values in cumulative buckets, like a Prometheus histogram."""
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self.bucketCounts = [0] * (len(self.buckets) + 1) # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucketCounts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, quantile: float) -> float | None:
+        """Estimates a quantile (0-1) as the upper bound of the bucket it falls in, or None if nothing was observed."""
+        if not self.count:
+            return None
+        rank, cumulativeCount = quantile * self.count, 0
+        for bound, bucketCount in zip(self.buckets + (math.inf,), self.bucketCounts):
+            cumulativeCount += bucketCount
+            if cumulativeCount >= rank:
+                return bound
+        return math.inf
+
+
+class MetricsRegistry():
+    """
+    The counters, gauges and histograms of a run, updated from any thread.
+    Every metric is identified by its name and its labels (e.g., `stage_duration_seconds{stage="download"}`).
+    """
+    def __init__(self) -> None:
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.gauges: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.startTime = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict[str, str]) -> tuple[str, tuple]:
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        """Adds to a counter (e.g., `increment("stage_items_total", stage="download", outcome="success")`)."""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Sets a gauge to its current value (e.g., the depth of a queue)."""
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Adds a value (usually a duration in seconds) to a histogram."""
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Observes the duration of the `with` block, whether it succeeds or raises."""
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - startTime, **labels)
+
+    def snapshot(self) -> dict:
+        """Returns every metric as a JSON serializable dictionary."""
+        def entry(key: tuple[str, tuple], **values) -> dict:
+            return {"name": key[0], "labels": dict(key[1]), **values}
+
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_seconds": time.time() - self.startTime,
+                "counters": [entry(key, value=value) for key, value in sorted(self.counters.items())],
+                "gauges": [entry(key, value=value) for key, value in sorted(self.gauges.items())],
+                "histograms": [entry(key, count=histogram.count, sum=histogram.sum, p50=histogram.quantile(0.5),
+                                     p95=histogram.quantile(0.95), buckets=dict(zip(map(str, histogram.buckets + ("+Inf",)), histogram.bucketCounts)))
+                               for key, histogram in sorted(self.histograms.items())],
+            }
+
+    def to_prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        def series(name: str, labels: tuple, extraLabels: tuple = ()) -> str:
+            labels = labels + extraLabels
+            if not labels:
+                return name
+            return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+        lines, typedNames = [], set()
+        with self._lock:
+            for metricType, metrics in [("counter", self.counters), ("gauge", self.gauges)]:
+                for (name, labels), value in sorted(metrics.items()):
+                    if name not in typedNames:
+                        lines.append(f"# TYPE {name} {metricType}")
+                        typedNames.add(name)
+                    lines.append(f"{series(name, labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typedNames:
+                    lines.append(f"# TYPE {name} histogram")
+                    typedNames.add(name)
+                cumulativeCount = 0
+                for bound, bucketCount in zip(histogram.buckets + (math.inf,), histogram.bucketCounts):
+                    cumulativeCount += bucketCount
+                    lines.append(f"{series(name + '_bucket', labels, (('le', '+Inf' if bound == math.inf else f'{bound:g}'),))} {cumulativeCount}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram.sum:g}")
+                lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str) -> None:
+        """
+        Writes the metrics to a file, as a JSON snapshot if the path ends with '.json' and in the Prometheus text format
+        otherwise. The file is replaced atomically, so that a scraper never reads half of it.
+
+        Args:
+            path (str): The path of the file.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        content = json.dumps(self.snapshot(), indent=2) if path.endswith(".json") else self.to_prometheus()
+        temporaryPath = f"{path}.tmp"
+        with open(temporaryPath, "w") as file:
+            file.write(content)
+        os.replace(temporaryPath, path)
+
+    def summary(self) -> str:
+        """Returns the latency and the outcomes of every stage as human readable lines."""
+        snapshot = self.snapshot()
+        lines = []
+        for histogram in snapshot["histograms"]:
+            labels = ", ".join(f"{label}={value}" for label, value in histogram["labels"].items())
+            lines.append(f"{histogram['name']}({labels}): {histogram['count']} observed, total {histogram['sum']:.1f}s, "
+                         f"p50 <= {histogram['p50']:g}s, p95 <= {histogram['p95']:g}s")
+        for counter in snapshot["counters"]:
+            labels = ", ".join(f"{label}={value}" for label, value in counter["labels"].items())
+            lines.append(f"{counter['name']}({labels}): {counter['value']:g}")
+        return "\n".join(lines)
+
+
+class MetricsExporter():
+    """Exports the metrics to a file every `interval` seconds during a run, and once more when the run ends."""
+    def __init__(self, registry: MetricsRegistry, path: str = METRICS_PATH, interval: float = 60) -> None:
+        """
+        Args:
+            registry (MetricsRegistry): The metrics to export.
+            path (str): The path of the file ('.json' for a JSON snapshot, the Prometheus text format otherwise).
+            interval (float): The number of seconds between two exports.
+        """
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="MetricsExporter", daemon=True)
+
+    def __enter__(self) -> "MetricsExporter":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.registry.export(self.path)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.registry.export(self.path)
+            except OSError as e:
+                print(f"Error exporting the metrics to {self.path}: {e}")
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Returns the metrics registry that every part of the pipeline reports to."""
+    return _metrics
+
+
+def timed(name: str, **labels) -> Callable:
+    """Decorator that observes the duration of every call of a function in a histogram of the shared registry."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with get_metrics().time(name, **labels):
+                return func(*args, **kwargs)
+        return inner
+    return decorator
@@ -0,0 +1,168 @@
+import re
+import threading
+import time
+from collections.abc import Mapping
+
+from src.utils.metrics import get_metrics
+
+# The limits each backend starts with, until the rate-limit headers of its responses tell the real ones
+RATE_LIMIT_DEFAULTS = {
+    "openai": {"requestsPerMinute": 500, "tokensPerMinute": 30_000},
+    "assemblyai": {"requestsPerMinute": 600},
+}
+
+
+def parse_reset_time(value: str) -> float | None:
+    """
+    Parses the time until a rate limit resets, given in seconds (e.g., '12', '0.5') or as a duration (e.g., '6m0s', '20ms').
+
+    Returns:
+        float | None: The number of seconds, or None if the value can't be parsed.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+
+class AdaptiveRateLimiter():
+    """
+    Spaces out the requests sent to a backend from every thread (and event loop) of the process.
+
+    Every request reserves the earliest time slot that keeps the requests (and tokens) per minute within the limits, allowing
+    bursts of up to a second's worth of requests. The slots are handed out in the order they are requested, so the callers
+    queue fairly instead of all retrying at the same moment. The limits follow the rate-limit headers of the responses, and
+    every request is paused after a 429 until the backend accepts requests again.
+    """
+    def __init__(self, name: str, requestsPerMinute: float, tokensPerMinute: float = None, windowSeconds: float = 60) -> None:
+        """
+        Args:
+            name (str): The name of the backend (used in the report).
+            requestsPerMinute (float): The number of requests allowed per minute.
+            tokensPerMinute (float): The number of tokens allowed per minute (None means tokens aren't limited).
+            windowSeconds (float): The window of the limits given by the headers without a unit (e.g., `x-ratelimit-limit`).
+        """
+        self.name = name
+        self.requestsPerMinute = requestsPerMinute
+        self.tokensPerMinute = tokensPerMinute
+        self.windowSeconds = windowSeconds
+        self._slowdown = 1.0 # Grows after the 429s received while the real limits are unknown
+        self._limitsFromHeaders = False
+        self._requestTime = 0.0 # The theoretical time of the next request if there were no bursts
+        self._tokenTime = 0.0
+        self._pausedUntil = 0.0
+        self._lock = threading.Lock()
+
+        self.requestCount = 0
+        self.rateLimitedCount = 0
+        self.totalWaitTime = 0.0
+        self.maxWaitTime = 0.0
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserves the next time slot for a request.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+
+        Returns:
+            float: The number of seconds to wait before sending the request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            requestInterval = 60 / self.requestsPerMinute * self._slowdown
+            requestBurst = max(self.requestsPerMinute / 60, 1) * requestInterval
+            startTime = max(now, self._pausedUntil, self._requestTime - requestBurst)
+            self._requestTime = max(self._requestTime, startTime) + requestInterval
+
+            if self.tokensPerMinute and tokens:
+                tokenInterval = 60 / self.tokensPerMinute * self._slowdown
+                tokenBurst = self.tokensPerMinute / 60 * tokenInterval
+                startTime = max(startTime, self._tokenTime - tokenBurst)
+                self._tokenTime = max(self._tokenTime, startTime) + tokens * tokenInterval
+
+            waitTime = startTime - now
+            self.requestCount += 1
+            self.totalWaitTime += waitTime
+            self.maxWaitTime = max(self.maxWaitTime, waitTime)
+            return waitTime
+
+    def wait(self, tokens: int = 0) -> float:
+        """Blocks until the request can be sent, returning the number of seconds waited."""
+        waitTime = self.reserve(tokens)
+        if waitTime > 0:
+            time.sleep(waitTime)
+        return waitTime
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Adjusts the limits to the rate-limit headers of a response, pausing the requests if no more are allowed until a reset.
+        Both OpenAI's headers (`x-ratelimit-limit-requests`, `x-ratelimit-remaining-tokens`, ...) and the generic ones
+        (`x-ratelimit-limit`, `x-ratelimit-remaining`, `x-ratelimit-reset`) are read.
+
+        Args:
+            headers (Mapping[str, str]): The headers of the response.
+        """
+        headers = {key.lower(): value for key, value in headers.items()}
+        with self._lock:
+            for suffix, windowSeconds, limitAttribute in [("-requests", 60, "requestsPerMinute"), ("-tokens", 60, "tokensPerMinute"),
+                                                          ("", self.windowSeconds, "requestsPerMinute")]:
+                limit = headers.get(f"x-ratelimit-limit{suffix}")
+                if limit is not None and limit.replace(".", "", 1).isdigit() and float(limit) > 0:
+                    setattr(self, limitAttribute, float(limit) * 60 / windowSeconds)
+                    self._limitsFromHeaders = True
+                    self._slowdown = 1.0
+
+                remaining, reset = headers.get(f"x-ratelimit-remaining{suffix}"), headers.get(f"x-ratelimit-reset{suffix}")
+                if remaining is not None and reset is not None and remaining.strip() in ("0", "0.0"):
+                    resetTime = parse_reset_time(reset)
+                    if resetTime is not None:
+                        self._pausedUntil = max(self._pausedUntil, time.monotonic() + resetTime)
+
+    def on_rate_limited(self, headers: Mapping[str, str] = None) -> None:
+        """
+        Pauses every request after a 429, for `Retry-After` seconds if the backend gave it.
+        While the real limits are unknown, the rate is also lowered for the rest of the run.
+
+        Args:
+            headers (Mapping[str, str]): The headers of the 429 response.
+        """
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        retryAfter = parse_reset_time(headers.get("retry-after", "")) or 1.0
+        get_metrics().increment("rate_limited_total", backend=self.name)
+        self.update_from_headers(headers)
+        with self._lock:
+            self.rateLimitedCount += 1
+            self._pausedUntil = max(self._pausedUntil, time.monotonic() + retryAfter)
+            if not self._limitsFromHeaders:
+                self._slowdown = min(self._slowdown * 1.5, 60.0)
+
+    def summary(self) -> str:
+        """Returns how long the requests waited in the queue as a human readable line."""
+        with self._lock:
+            averageWaitTime = self.totalWaitTime / self.requestCount if self.requestCount else 0.0
+            return (f"{self.name} rate limiter: {self.requestCount} requests waited {self.totalWaitTime:.1f}s in total "
+                    f"(average {averageWaitTime:.2f}s, longest {self.maxWaitTime:.2f}s), {self.rateLimitedCount} were rate limited")
+
+
+_rateLimiters: dict[str, AdaptiveRateLimiter] = {}
+_rateLimitersLock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> AdaptiveRateLimiter:
+    """
+    Returns the rate limiter that every caller of a backend shares, creating it with the default limits of the backend.
+
+    Args:
+        name (str): The name of the backend (e.g., 'openai' or 'assemblyai').
+
+    Returns:
+        AdaptiveRateLimiter: The rate limiter of the backend.
+    """
+    with _rateLimitersLock:
+        if name not in _rateLimiters:
+            _rateLimiters[name] = AdaptiveRateLimiter(name, **RATE_LIMIT_DEFAULTS.get(name, {"requestsPerMinute": 60}))
+        return _rateLimiters[name]
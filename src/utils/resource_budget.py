@@ -0,0 +1,89 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from src.utils.metrics import get_metrics
+
+
+class FairSemaphore():
+    """
+    A semaphore whose free slots are handed to the waiting owners (e.g., the series being processed) in turn, so that an
+    owner with many waiting requests can't starve the ones with a few. An owner that is alone can use every slot.
+    """
+    def __init__(self, name: str, capacity: int) -> None:
+        """
+        Args:
+            name (str): The name of the resource, used in the metrics (`budget_in_use` and `budget_waiting`).
+            capacity (int): The maximum number of slots in use at the same time.
+        """
+        if capacity < 1:
+            raise ValueError(f"The capacity of {name} must be at least 1.")
+        self.name = name
+        self.capacity = capacity
+        self.inUse = 0
+        self._waiters: dict[str, deque[threading.Event]] = {}
+        self._turns: deque[str] = deque() # The owners with waiting requests, in the order they are served
+        self._lock = threading.Lock()
+
+    def _report(self) -> None:
+        get_metrics().set_gauge("budget_in_use", self.inUse, resource=self.name)
+        get_metrics().set_gauge("budget_waiting", sum(len(waiters) for waiters in self._waiters.values()), resource=self.name)
+
+    def acquire(self, owner: str) -> None:
+        """Blocks until a slot is free and it is the owner's turn."""
+        with self._lock:
+            if self.inUse < self.capacity and not self._turns:
+                self.inUse += 1
+                self._report()
+                return
+            event = threading.Event()
+            if owner not in self._waiters:
+                self._waiters[owner] = deque()
+                self._turns.append(owner)
+            self._waiters[owner].append(event)
+            self._report()
+        event.wait()
+
+    def release(self) -> None:
+        """Hands the slot to the next owner in turn, or frees it if nobody is waiting."""
+        with self._lock:
+            if self._turns:
+                owner = self._turns.popleft()
+                event = self._waiters[owner].popleft()
+                if self._waiters[owner]:
+                    self._turns.append(owner) # The owner waits for its next turn behind the others
+                else:
+                    del self._waiters[owner]
+                event.set()
+            else:
+                self.inUse -= 1
+            self._report()
+
+    @contextmanager
+    def slot(self, owner: str):
+        """Holds a slot for the `with` block."""
+        self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ResourceBudget():
+    """The slots that every series being processed at the same time shares, capping the total use of each resource."""
+    def __init__(self, scrapeSlots: int = 4, downloadSlots: int = 4, transcriptionSlots: int = 16, classificationSlots: int = 8) -> None:
+        """
+        Args:
+            scrapeSlots (int): The maximum number of videos scraped at the same time (with HTTP or the browser fallback).
+            downloadSlots (int): The maximum number of videos whose clips are downloaded at the same time.
+            transcriptionSlots (int): The maximum number of clips being transcribed at the same time.
+            classificationSlots (int): The maximum number of LLM requests in flight at the same time.
+        """
+        self.scrape = FairSemaphore("scrape", scrapeSlots)
+        self.download = FairSemaphore("download", downloadSlots)
+        self.transcription = FairSemaphore("transcription", transcriptionSlots)
+        self.classification = FairSemaphore("classification", classificationSlots)
+
+    def summary(self) -> str:
+        return ", ".join(f"{semaphore.name}: {semaphore.capacity} slots"
+                         for semaphore in (self.scrape, self.download, self.transcription, self.classification))
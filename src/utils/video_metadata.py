@@ -0,0 +1,306 @@
+import json
+import queue
+import re
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import chromedriver_autoinstaller
+import requests as req
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Sent with every request so that YouTube serves the watch page itself instead of the consent wall
+_REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0 Safari/537.36",
+    "Accept-Language": "tr-TR,tr;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+_REQUEST_COOKIES = {"CONSENT": "YES+cb", "SOCS": "CAI"}
+
+
+@dataclass
+class VideoMetadata:
+    """
+    Everything the pipeline needs to know about a video before downloading it.
+
+    Attributes:
+        videoId (str): The YouTube video ID.
+        title (str): The title of the video.
+        duration (int): The duration of the video in seconds.
+        xValues (list[float]): Normalized positions (0-1) of the heatmap points.
+        yValues (list[float]): Normalized intensities (0-1) of the heatmap points.
+        rawHeatMap (str): The heatmap as it was scraped (the JSON markers or the SVG path data).
+    """
+    videoId: str
+    title: str
+    duration: int
+    xValues: list[float] = field(default_factory=list)
+    yValues: list[float] = field(default_factory=list)
+    rawHeatMap: str | None = None
+
+
+class MetadataExtractionError(Exception):
+    """Raised when the heatmap, duration or title cannot be found in a video page."""
+
+
+def extract_video_id(videoLink: str) -> str:
+    """
+    Extracts the video ID from a YouTube link.
+
+    Args:
+        videoLink (str): The URL of the YouTube video (e.g., 'https://www.youtube.com/watch?v=7H4jvc3ERrc').
+
+    Returns:
+        str: The video ID (e.g., '7H4jvc3ERrc').
+    """
+    match = re.search(r"(?:v=|youtu\.be/|/shorts/|/embed/)([\w-]{11})", videoLink)
+    return match.group(1) if match else videoLink
+
+
+def _find_json_object(html: str, variableName: str) -> dict | None:
+    """Finds and decodes the JSON object assigned to the given variable in the page's scripts."""
+    match = re.search(rf"{variableName}\s*=\s*{{", html)
+    if match is None:
+        return None
+    try:
+        jsonObject, _ = json.JSONDecoder().raw_decode(html, match.end() - 1)
+    except json.JSONDecodeError:
+        return None
+    return jsonObject
+
+
+def _iter_heat_markers(node) -> Iterator[tuple[int, float]]:
+    """Walks the decoded ytInitialData and yields the (start millis, intensity) pairs of the heatmap markers."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            if "intensityScoreNormalized" in current and "startMillis" in current: # Current page layout
+                yield int(current["startMillis"]), float(current["intensityScoreNormalized"])
+            elif "heatMarkerIntensityScoreNormalized" in current: # Older page layout
+                yield int(current["timeRangeStartMillis"]), float(current["heatMarkerIntensityScoreNormalized"])
+            else:
+                stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+
+
+def parse_heatmap_path(heatMapData: str) -> tuple[list[float], list[float]]:
+    """
+    Extracts the heatmap points from the path data of the rendered `ytp-heat-map-path` element.
+
+    Args:
+        heatMapData (str): The `d` attribute of the heatmap's SVG path.
+
+    Returns:
+        tuple[list[float], list[float]]: The normalized x-values and y-values of the heatmap.
+    """
+    # Extracting the x and y-values from the raw heat map data using regex
+    findings = re.findall(r"[MCL](?: -?\d+[.]\d+,-?\d+[.]\d+){2} (\d+[.]\d+),(\d+[.]\d+)", heatMapData)
+
+    xValues = [(float(finding[0]) - 5)/1000 for finding in findings]     # We substract 5 to get rid of the offset
+    yValues = [(100-float(finding[1]))/100 for finding in findings]
+    return xValues, yValues
+
+
+def parse_video_page(html: str, videoId: str = "") -> VideoMetadata:
+    """
+    Extracts the heatmap, duration and title of a video from its watch page.
+
+    Works both on the HTML served to a plain HTTP request (the heatmap markers are embedded in
+    `ytInitialData`) and on the page source of a rendered page (the heatmap is an SVG path).
+
+    Args:
+        html (str): The HTML of the watch page.
+        videoId (str): The ID of the video the page belongs to.
+
+    Returns:
+        VideoMetadata: The metadata of the video.
+
+    Raises:
+        MetadataExtractionError: If the page does not contain a heatmap, a duration or a title.
+    """
+    soup = BeautifulSoup(html, "lxml")
+
+    # Title
+    titleTag = soup.find("title")
+    if titleTag is None or not titleTag.text.strip():
+        raise MetadataExtractionError(f"No title found for the video {videoId}.")
+    title = titleTag.text
+
+    # Duration
+    lengthMatch = re.search(r'"lengthSeconds"\s*:\s*"(\d+)"', html)
+    durationSpan = soup.find("span", class_="ytp-time-duration")
+    if lengthMatch:
+        duration = int(lengthMatch.group(1))
+    elif durationSpan is not None and durationSpan.text:
+        duration = sum(60 ** index * int(element) for index, element in enumerate(durationSpan.text.split(":")[::-1]))
+    else:
+        raise MetadataExtractionError(f"No duration found for the video {videoId}.")
+
+    # Heatmap
+    heatMapPath = soup.find("path", class_="ytp-heat-map-path")
+    markers = sorted(set(_iter_heat_markers(_find_json_object(html, "ytInitialData") or {})))
+    if heatMapPath is not None and heatMapPath.get("d"):
+        rawHeatMap = heatMapPath.get("d")
+        xValues, yValues = parse_heatmap_path(rawHeatMap)
+    elif markers:
+        rawHeatMap = json.dumps(markers)
+        xValues = [startMillis / (duration * 1000) for startMillis, _ in markers]
+        yValues = [intensity for _, intensity in markers]
+    else:
+        raise MetadataExtractionError(f"No heatmap found for the video {videoId}.")
+
+    return VideoMetadata(videoId, title, duration, xValues, yValues, rawHeatMap)
+
+
+class ChromeDriverPool:
+    """
+    A small pool of long-lived headless Chrome drivers, used only when a page cannot be parsed without rendering it.
+    """
+    def __init__(self, size: int = 2, timeout: float = 10) -> None:
+        self.size = size
+        self.timeout = timeout
+        self._idleDrivers = queue.Queue()
+        self._createdCount = 0
+        self._lock = threading.Lock()
+
+    def _create_driver(self) -> webdriver.Chrome:
+        chromedriver_autoinstaller.install()  # Check if the current version of chromedriver exists
+                                              # and if it doesn't exist, download it automatically,
+                                              # then add chromedriver to path
+        options = webdriver.ChromeOptions()
+        # Instructs Chrome to run in the background without any GUI
+        options.add_argument("--headless")
+        return webdriver.Chrome(options=options)
+
+    @contextmanager
+    def driver(self):
+        """Lends a driver from the pool, creating one if the pool has not reached its size yet."""
+        with self._lock:
+            createNew = self._idleDrivers.empty() and self._createdCount < self.size
+            if createNew:
+                self._createdCount += 1
+        try:
+            driver = self._create_driver() if createNew else self._idleDrivers.get()
+        except Exception:
+            with self._lock:
+                self._createdCount -= 1
+            raise
+
+        try:
+            yield driver
+        except MetadataExtractionError:
+            self._idleDrivers.put(driver)
+            raise
+        except Exception:
+            # The driver may be in a broken state, so it is replaced instead of being reused
+            driver.quit()
+            with self._lock:
+                self._createdCount -= 1
+            raise
+        else:
+            self._idleDrivers.put(driver)
+
+    def fetch_page_source(self, videoLink: str) -> str:
+        """
+        Opens the video in a browser and returns the page source once the heatmap is rendered.
+
+        Args:
+            videoLink (str): The URL of the YouTube video.
+
+        Returns:
+            str: The rendered page source.
+        """
+        with self.driver() as driver:
+            driver.get(videoLink)
+            # Wait for the heat-map-path to render
+            try:
+                WebDriverWait(driver, self.timeout, ignored_exceptions=(Exception,)).until(
+                    lambda driver: driver.find_element(By.CSS_SELECTOR, "path.ytp-heat-map-path").get_attribute("d"))
+            except TimeoutException:
+                raise MetadataExtractionError(f"The heatmap of {videoLink} did not render in {self.timeout} seconds.")
+            return driver.page_source
+
+    def close(self) -> None:
+        """Quits every driver in the pool."""
+        while not self._idleDrivers.empty():
+            self._idleDrivers.get().quit()
+        self._createdCount = 0
+
+
+class VideoMetadataFetcher:
+    """
+    Fetches the heatmap, duration and title of YouTube videos with one pooled HTTP request per video,
+    falling back to a pool of headless browsers when the served HTML does not contain the heatmap.
+    """
+    def __init__(self, poolSize: int = 16, browserPoolSize: int = 2, timeout: float = 15, useBrowserFallback: bool = True) -> None:
+        """
+        Args:
+            poolSize (int): The maximum number of pooled HTTP connections.
+            browserPoolSize (int): The maximum number of Chrome drivers kept for the fallback.
+            timeout (float): Timeout in seconds for a request or for the heatmap to render.
+            useBrowserFallback (bool): Whether to render the page in Chrome when the HTML cannot be parsed.
+        """
+        self.timeout = timeout
+        self.session = req.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, max_retries=3)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(_REQUEST_HEADERS)
+        self.session.cookies.update(_REQUEST_COOKIES)
+        self.browserPool = ChromeDriverPool(browserPoolSize, timeout) if useBrowserFallback else None
+
+    def __enter__(self) -> "VideoMetadataFetcher":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def fetch_html(self, videoLink: str) -> str:
+        """Returns the HTML served for the video link."""
+        response = self.session.get(videoLink, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def fetch(self, videoLink: str) -> VideoMetadata:
+        """
+        Returns the metadata of the video.
+
+        Args:
+            videoLink (str): The URL of the YouTube video.
+
+        Returns:
+            VideoMetadata: The heatmap, duration and title of the video.
+        """
+        videoId = extract_video_id(videoLink)
+        try:
+            return parse_video_page(self.fetch_html(videoLink), videoId)
+        except (MetadataExtractionError, req.RequestException) as e:
+            if self.browserPool is None:
+                raise
+            print(f"Falling back to the browser for {videoLink}: {e}")
+            return parse_video_page(self.browserPool.fetch_page_source(videoLink), videoId)
+
+    def close(self) -> None:
+        """Closes the HTTP session and the browsers."""
+        self.session.close()
+        if self.browserPool is not None:
+            self.browserPool.close()
+
+
+_defaultFetcher = None
+_defaultFetcherLock = threading.Lock()
+
+def get_default_fetcher() -> VideoMetadataFetcher:
+    """Returns a process-wide fetcher, creating it on first use."""
+    global _defaultFetcher
+    with _defaultFetcherLock:
+        if _defaultFetcher is None:
+            _defaultFetcher = VideoMetadataFetcher()
+        return _defaultFetcher
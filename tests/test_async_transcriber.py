@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from src.backends.fake_servers import FakeAssemblyAIServer
+from src.backends.fakes import fake_utterances
+from src.download_and_transcription.async_transcriber import AsyncTranscriptionEngine
+from src.utils.rate_limiter import AdaptiveRateLimiter
+
+API_KEY = "test-key"
+
+
+@pytest.fixture
+def server():
+    with FakeAssemblyAIServer(API_KEY) as server:
+        yield server
+
+
+def make_engine(server: FakeAssemblyAIServer, **kwargs) -> AsyncTranscriptionEngine:
+    # A limiter of its own, so that the 429s of a test don't slow down the others
+    rateLimiter = AdaptiveRateLimiter("assemblyai-test", requestsPerMinute=60000)
+    return AsyncTranscriptionEngine(kwargs.pop("apiKey", API_KEY), baseUrl=server.url, pollInterval=0.02, maxRetries=3,
+                                    rateLimiter=rateLimiter, **kwargs)
+
+
+def write_audios(directory, contents: list[bytes]) -> list[str]:
+    paths = []
+    for index, content in enumerate(contents):
+        path = directory / f"clip{index}.wav"
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths
+
+
+def transcribe(engine: AsyncTranscriptionEngine, audioPaths: list[str], onResult=None, timeout: float = 10) -> list:
+    # A hanging job fails the test instead of blocking it
+    return asyncio.run(asyncio.wait_for(engine.transcribe_all(audioPaths, onResult), timeout))
+
+
+def test_every_file_is_transcribed_in_order(tmp_path, server):
+    contents = [f"audio of clip {index}".encode() for index in range(6)]
+    audioPaths = write_audios(tmp_path, contents)
+    reported = []
+
+    results = transcribe(make_engine(server), audioPaths, reported.append)
+
+    assert [result.audioPath for result in results] == audioPaths
+    for result, content in zip(results, contents):
+        assert result.status == "completed" and result.error is None
+        assert result.utterances == fake_utterances(content)
+    assert sorted(result.audioPath for result in reported) == sorted(audioPaths)
+
+
+def test_failed_job_doesnt_fail_the_others(tmp_path, server):
+    audioPaths = write_audios(tmp_path, [FakeAssemblyAIServer.UNREADABLE_AUDIO, b"audio of a clip"])
+
+    failed, completed = transcribe(make_engine(server), audioPaths)
+
+    assert failed.status == "error" and "Transcoding failed" in failed.error
+    assert completed.status == "completed"
+
+
+@pytest.mark.parametrize("content", [FakeAssemblyAIServer.LOST_AUDIO, FakeAssemblyAIServer.MALFORMED_AUDIO])
+def test_job_whose_status_cant_be_read_fails_after_the_allowed_failures(tmp_path, server, content):
+    audioPaths = write_audios(tmp_path, [content, b"audio of a clip"])
+
+    unreadable, completed = transcribe(make_engine(server, maxPollFailures=3), audioPaths)
+
+    assert unreadable.status == "error" and "3 times in a row" in unreadable.error
+    assert completed.status == "completed"
+    assert server.requestCounts[("GET", "/v2/transcript/<id>")] >= 3
+
+
+def test_job_that_doesnt_finish_times_out(tmp_path, server):
+    audioPaths = write_audios(tmp_path, [FakeAssemblyAIServer.STUCK_AUDIO])
+
+    result, = transcribe(make_engine(server, jobTimeout=0.2), audioPaths)
+
+    assert result.status == "error" and "didn't finish" in result.error
+
+
+def test_poller_error_fails_every_waiting_job(tmp_path, server, monkeypatch):
+    audioPaths = write_audios(tmp_path, [b"first clip", b"second clip"])
+    engine = make_engine(server)
+
+    async def crash(client):
+        raise KeyError("status")
+
+    monkeypatch.setattr(engine, "_poll_once", crash)
+    results = transcribe(engine, audioPaths)
+
+    for result in results:
+        assert result.status == "error" and "can't be checked anymore" in result.error
+
+
+def test_rate_limited_requests_are_retried(tmp_path):
+    with FakeAssemblyAIServer(API_KEY, rateLimitedRequests=3) as server:
+        audioPaths = write_audios(tmp_path, [b"first clip", b"second clip"])
+
+        results = transcribe(make_engine(server), audioPaths)
+
+    assert all(result.status == "completed" for result in results)
+
+
+def test_uploads_and_jobs_in_flight_are_limited(tmp_path):
+    with FakeAssemblyAIServer(API_KEY, processingSeconds=0.1, uploadSeconds=0.05) as server:
+        audioPaths = write_audios(tmp_path, [f"audio of clip {index}".encode() for index in range(10)])
+
+        results = transcribe(make_engine(server, maxConcurrentUploads=2, maxInFlight=3), audioPaths)
+
+    assert all(result.status == "completed" for result in results)
+    assert server.peakUploads == 2
+    assert server.peakOpenJobs <= 3
+
+
+def test_wrong_api_key_fails_every_file(tmp_path, server):
+    audioPaths = write_audios(tmp_path, [b"first clip", b"second clip"])
+
+    results = transcribe(make_engine(server, apiKey="wrong-key"), audioPaths)
+
+    for result in results:
+        assert result.status == "error" and "401" in result.error
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+from src.backends.fake_servers import FakeOpenAIServer
+from src.backends.fakes import NON_VIOLENT_SENTENCES, VIOLENT_SENTENCES
+from src.database.clip_state import CLASSIFIED, FAILED
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.detection.batch_classification import PART_SEPARATOR, classify_transcripts_in_batch, parse_batch_output, parse_batch_usage
+from src.detection.token_budget import UTTERANCE_SEPARATOR, TokenBudget, TokenUsage
+
+API_KEY = "test-key"
+TABLE_NAME = "YalıÇapkını"
+TRANSCRIPTS = {"1:00:00:00:00:01:30": NON_VIOLENT_SENTENCES[0], "1:00:02:00:00:03:30": VIOLENT_SENTENCES[0],
+               "1:00:04:00:00:05:30": NON_VIOLENT_SENTENCES[1], "2:00:00:00:00:01:30": VIOLENT_SENTENCES[2]}
+# A transcript of many utterances, whose only violent one is at the end
+LONG_TRANSCRIPT = UTTERANCE_SEPARATOR.join([f"Speaker A: {index}. {sentence}" for index, sentence in enumerate(NON_VIOLENT_SENTENCES * 4)]
+                                           + [f"Speaker B: {VIOLENT_SENTENCES[0]}"])
+
+
+@pytest.fixture
+def VDdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        for episodeAndTimeframe, transcript in TRANSCRIPTS.items():
+            VDdb.add_case(TABLE_NAME, episodeAndTimeframe, "https://www.youtube.com/watch?v=-u_RlLqmopg", transcript=transcript)
+        yield VDdb
+
+
+def predictions(VDdb: ViolenceDetectionDatabase) -> dict[str, int | None]:
+    return dict(VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "llm_violence_prediction"]))
+
+
+def test_every_transcript_is_classified_with_one_batch(VDdb):
+    with FakeOpenAIServer(API_KEY) as server:
+        classifications = classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02)
+
+    expected = {"1:00:00:00:00:01:30": 0, "1:00:02:00:00:03:30": 1, "1:00:04:00:00:05:30": 0, "2:00:00:00:00:01:30": 1}
+    assert classifications == expected
+    assert predictions(VDdb) == expected
+    assert server.requestCounts[("POST", "/v1/batches")] == 1
+    assert sorted(body["messages"][-1]["content"] for body in server.requestBodies) == sorted(TRANSCRIPTS.values())
+    assert VDdb.count_clip_states(TABLE_NAME) == {CLASSIFIED: len(TRANSCRIPTS)}
+
+
+def test_cached_transcripts_arent_sent_again(VDdb):
+    with FakeOpenAIServer(API_KEY) as server:
+        classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02)
+        VDdb.update_cases(TABLE_NAME, {episodeAndTimeframe: {"llm_violence_prediction": None} for episodeAndTimeframe in TRANSCRIPTS}).result()
+
+        classifications = classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02)
+
+    assert len(classifications) == len(TRANSCRIPTS)
+    assert server.requestCounts[("POST", "/v1/batches")] == 1 # Only the first run submitted a batch
+
+
+def test_failed_requests_are_recorded_and_the_others_applied(VDdb):
+    failingKey = "1:00:04:00:00:05:30"
+    VDdb.update_case(TABLE_NAME, failingKey, transcript=f"{FakeOpenAIServer.FAILING_MARKER} {NON_VIOLENT_SENTENCES[1]}").result()
+
+    with FakeOpenAIServer(API_KEY) as server:
+        classifications = classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02)
+
+    assert failingKey not in classifications and len(classifications) == len(TRANSCRIPTS) - 1
+    state, lastError = next(VDdb.iter_rows(TABLE_NAME, ["state", "last_error"], "episode_timeframe = ?", (failingKey,)))
+    assert state == FAILED and "couldn't be processed" in lastError
+
+
+def test_requests_left_by_an_expired_batch_stay_pending(VDdb):
+    with FakeOpenAIServer(API_KEY, processedLimit=2) as server:
+        classifications = classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02)
+
+    assert len(classifications) == 2
+    assert list(predictions(VDdb).values()).count(None) == len(TRANSCRIPTS) - 2
+
+
+def test_batch_output_errors_are_reported_by_custom_id():
+    outputText = "\n".join(json.dumps(line) for line in [
+        {"custom_id": "a", "response": {"status_code": 200, "body": {"choices": [{"message": {"tool_calls": [
+            {"function": {"arguments": json.dumps({"classification": 1})}}]}}]}}},
+        {"custom_id": "b", "response": {"status_code": 500, "body": {}}},
+        {"custom_id": "c", "response": None, "error": {"message": "Expired"}}])
+
+    classifications, errors = parse_batch_output(outputText)
+
+    assert classifications == {"a": 1}
+    assert errors == {"b": "Status code 500", "c": "Expired"}
+
+
+def test_tokens_of_every_clip_are_stored(VDdb):
+    with FakeOpenAIServer(API_KEY) as server:
+        classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02)
+
+    rows = dict((key, (promptTokens, completionTokens)) for key, promptTokens, completionTokens in
+                VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "prompt_tokens", "completion_tokens"]))
+    assert all(promptTokens > 0 and completionTokens > 0 for promptTokens, completionTokens in rows.values())
+    assert sum(promptTokens for promptTokens, _ in rows.values()) == sum(usage["prompt_tokens"] for usage in server.batchUsages.values())
+
+
+def test_split_transcript_is_sent_as_parts_and_combined(VDdb):
+    longKey = "3:00:00:00:00:01:30"
+    VDdb.add_case(TABLE_NAME, longKey, "https://www.youtube.com/watch?v=-u_RlLqmopg", transcript=LONG_TRANSCRIPT).result()
+    splitBudget = TokenBudget(maxTranscriptTokens=40, overflow="split")
+    parts = splitBudget.fit(LONG_TRANSCRIPT)
+    assert len(parts) > 2
+
+    with FakeOpenAIServer(API_KEY) as server:
+        classifications = classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02, tokenBudget=splitBudget)
+
+    assert classifications[longKey] == 1 # Only the last part is violent
+    sentContents = [body["messages"][-1]["content"] for body in server.requestBodies]
+    assert LONG_TRANSCRIPT not in sentContents and all(part in sentContents for part in parts)
+    promptTokens, = next(VDdb.iter_rows(TABLE_NAME, ["prompt_tokens"], "episode_timeframe = ?", (longKey,)))
+    assert promptTokens == sum(usage["prompt_tokens"] for customId, usage in server.batchUsages.items()
+                               if customId.startswith(longKey + PART_SEPARATOR))
+
+
+def test_trimmed_transcript_sends_only_its_first_part(VDdb):
+    longKey = "3:00:00:00:00:01:30"
+    VDdb.add_case(TABLE_NAME, longKey, "https://www.youtube.com/watch?v=-u_RlLqmopg", transcript=LONG_TRANSCRIPT).result()
+    trimBudget = TokenBudget(maxTranscriptTokens=40, overflow="trim")
+
+    with FakeOpenAIServer(API_KEY) as server:
+        classifications = classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02, tokenBudget=trimBudget)
+
+    assert classifications[longKey] == 0 # The violent utterance is trimmed away
+    assert trimBudget.fit(LONG_TRANSCRIPT)[0] in [body["messages"][-1]["content"] for body in server.requestBodies]
+    assert len(server.requestBodies) == len(TRANSCRIPTS) + 1
+
+
+def test_batch_usage_is_read_by_custom_id():
+    outputText = "\n".join(json.dumps(line) for line in [
+        {"custom_id": "a", "response": {"status_code": 200, "body": {"usage": {"prompt_tokens": 120, "completion_tokens": 9,
+                                                                               "prompt_tokens_details": {"cached_tokens": 64}}}}},
+        {"custom_id": "b", "response": None, "error": {"message": "Expired"}}])
+
+    assert parse_batch_usage(outputText) == {"a": TokenUsage(120, 9, 64)}
@@ -0,0 +1,63 @@
+import pytest
+
+from src.backends.fakes import NON_VIOLENT_SENTENCES, VIOLENT_SENTENCES, FakeClassificationBackend
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.detection.detect_violence import create_classification_cache, request_classification
+from src.detection.token_budget import UTTERANCE_SEPARATOR, TokenBudget
+
+# A transcript of many utterances, whose only violent one is at the end
+TRANSCRIPT = UTTERANCE_SEPARATOR.join([f"Speaker A: {index}. {sentence}" for index, sentence in enumerate(NON_VIOLENT_SENTENCES * 4)]
+                                      + [f"Speaker B: {VIOLENT_SENTENCES[0]}"])
+
+
+@pytest.fixture
+def VDdb(tmp_path):
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        yield VDdb
+
+
+@pytest.fixture
+def backend():
+    return FakeClassificationBackend(noise=0)
+
+
+def request_count(backend: FakeClassificationBackend) -> int:
+    return len(backend.service.latencies)
+
+
+def test_trimmed_transcript_doesnt_share_the_entry_of_the_whole_transcript(VDdb, backend):
+    cache = create_classification_cache(VDdb)
+    trimBudget = TokenBudget(maxTranscriptTokens=40, overflow="trim")
+
+    assert request_classification(TRANSCRIPT, backend, cache)[0] == 1
+    # Only the first, non-violent part is sent under the budget, so the whole transcript's answer isn't reused
+    assert request_classification(TRANSCRIPT, backend, cache, tokenBudget=trimBudget)[0] == 0
+    assert request_count(backend) == 2
+
+    assert request_classification(TRANSCRIPT, backend, cache, tokenBudget=trimBudget)[0] == 0
+    assert request_classification(TRANSCRIPT, backend, cache)[0] == 1
+    assert request_count(backend) == 2
+
+
+def test_split_transcript_is_cached_by_part(VDdb, backend):
+    cache = create_classification_cache(VDdb)
+    splitBudget = TokenBudget(maxTranscriptTokens=40, overflow="split")
+    partCount = len(splitBudget.fit(TRANSCRIPT))
+    assert partCount > 2
+
+    assert request_classification(TRANSCRIPT, backend, cache, tokenBudget=splitBudget)[0] == 1
+    assert request_count(backend) == partCount # The violent part is the last one
+
+    answer, usage = request_classification(TRANSCRIPT, backend, cache, tokenBudget=splitBudget)
+    assert answer == 1 and usage.promptTokens == 0
+    assert request_count(backend) == partCount
+
+
+def test_only_the_uncached_parts_are_sent(VDdb, backend):
+    cache = create_classification_cache(VDdb)
+    splitBudget = TokenBudget(maxTranscriptTokens=40, overflow="split")
+    parts = splitBudget.fit(TRANSCRIPT)
+    cache.put(parts[0], 0)
+
+    assert request_classification(TRANSCRIPT, backend, cache, tokenBudget=splitBudget)[0] == 1
+    assert request_count(backend) == len(parts) - 1
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from src.backends.fakes import FakeClassificationBackend, FakeDownloadBackend, FakeSeries, FakeTranscriptionBackend
+from src.database.clip_state import CLASSIFIED, CLIP_STATE_COLUMNS, DOWNLOADED, FAILED, PLANNED, TRANSCRIBED, RetryPolicy
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.pipeline.resume import resume_unfinished_clips
+
+TABLE_NAME = "YalıÇapkını"
+
+
+@pytest.fixture
+def openDatabase(tmp_path, monkeypatch):
+    """Opens the test database with a retry policy, closing it at the end of the test."""
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    databases = []
+
+    def open_database(retryPolicy: RetryPolicy = None, **columns) -> ViolenceDetectionDatabase:
+        VDdb = ViolenceDetectionDatabase(str(tmp_path / "test.db"), retryPolicy=retryPolicy)
+        VDdb.create_table(TABLE_NAME, **(columns or SERIES_TABLE_COLUMNS))
+        databases.append(VDdb)
+        return VDdb
+
+    yield open_database
+    for VDdb in databases:
+        VDdb.close()
+
+
+def pending_keys(VDdb: ViolenceDetectionDatabase) -> set[str]:
+    pendingClause, pendingParams = VDdb.pending_clip_clause(TABLE_NAME)
+    return {key for key, in VDdb.iter_rows(TABLE_NAME, ["episode_timeframe"], pendingClause, pendingParams)}
+
+
+def clip_state(VDdb: ViolenceDetectionDatabase) -> tuple:
+    return next(VDdb.iter_rows(TABLE_NAME, ["state", "attempts", "last_error"]))
+
+
+def test_failed_clips_are_retried_after_a_doubling_backoff(openDatabase):
+    VDdb = openDatabase(RetryPolicy(maxAttempts=3, backoffSeconds=100))
+    now = time.time()
+    clips = {"waiting": (FAILED, 1, now - 50), "due": (FAILED, 1, now - 150), "waitingLonger": (FAILED, 2, now - 150),
+             "dueAgain": (FAILED, 2, now - 250), "givenUp": (FAILED, 3, now - 10 ** 6), "downloaded": (DOWNLOADED, 0, now),
+             "untracked": (None, 0, None)}
+    for key, (state, attempts, updatedAt) in clips.items():
+        VDdb.add_case(TABLE_NAME, key, "link", state=state, attempts=attempts, state_updated_at=updatedAt)
+    VDdb.flush()
+
+    assert pending_keys(VDdb) == {"due", "dueAgain", "downloaded", "untracked"}
+    assert VDdb.count_clip_states(TABLE_NAME) == {FAILED: 4, "given_up": 1, DOWNLOADED: 1, None: 1}
+
+
+def test_failures_are_counted_until_the_clip_is_given_up(openDatabase):
+    VDdb = openDatabase(RetryPolicy(maxAttempts=2, backoffSeconds=0))
+    VDdb.add_case(TABLE_NAME, "1:00:00:00:00:01:30", "link", audio_path="clip.wav", **VDdb.clip_state_fields(TABLE_NAME, DOWNLOADED))
+    VDdb.flush()
+
+    VDdb.record_clip_failure(TABLE_NAME, "Upload failed", audioPath="clip.wav").result()
+    assert clip_state(VDdb) == (FAILED, 1, "Upload failed")
+    assert pending_keys(VDdb) == {"1:00:00:00:00:01:30"}
+
+    VDdb.record_clip_failure(TABLE_NAME, TimeoutError("Timed out"), "1:00:00:00:00:01:30").result()
+    assert clip_state(VDdb) == (FAILED, 2, "Timed out")
+    assert pending_keys(VDdb) == set()
+    assert VDdb.count_clip_states(TABLE_NAME) == {"given_up": 1}
+
+    # A stage that succeeds starts the count again
+    VDdb.update_case(TABLE_NAME, "1:00:00:00:00:01:30", transcript="Speaker A: Çay demlendi.",
+                     **VDdb.clip_state_fields(TABLE_NAME, TRANSCRIBED)).result()
+    assert clip_state(VDdb) == (TRANSCRIBED, 0, None)
+
+
+def test_tables_without_clip_states_are_left_as_they_are(openDatabase):
+    columns = {name: sqlType for name, sqlType in SERIES_TABLE_COLUMNS.items() if name not in CLIP_STATE_COLUMNS}
+    VDdb = openDatabase(**columns)
+    VDdb.add_case(TABLE_NAME, "1:00:00:00:00:01:30", "link", audio_path="clip.wav")
+    VDdb.flush()
+
+    assert VDdb.pending_clip_clause(TABLE_NAME) == ("1", ())
+    assert pending_keys(VDdb) == {"1:00:00:00:00:01:30"}
+    assert VDdb.clip_state_fields(TABLE_NAME, TRANSCRIBED) == {}
+    assert VDdb.record_clip_failure(TABLE_NAME, "Upload failed", "1:00:00:00:00:01:30") is None
+
+
+def test_migrated_rows_get_the_furthest_state_they_reached(openDatabase):
+    columns = {name: sqlType for name, sqlType in SERIES_TABLE_COLUMNS.items() if name not in CLIP_STATE_COLUMNS}
+    VDdb = openDatabase(**columns)
+    VDdb.add_case(TABLE_NAME, "1:00:00:00:00:01:30", "link", audio_path="a.wav")
+    VDdb.add_case(TABLE_NAME, "1:00:02:00:00:03:30", "link", audio_path="b.wav", transcript="Speaker A: Çay demlendi.")
+    VDdb.add_case(TABLE_NAME, "1:00:04:00:00:05:30", "link", audio_path="c.wav", transcript="Speaker A: Seni öldürürüm!",
+                  llm_violence_prediction=1)
+    VDdb.flush()
+
+    VDdb.migrate_clip_states(TABLE_NAME)
+    VDdb.record_clip_failure(TABLE_NAME, "Upload failed", "1:00:00:00:00:01:30").result()
+    VDdb.migrate_clip_states(TABLE_NAME) # Running it again keeps the states of the tracked clips
+
+    states = dict(VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "state"]))
+    assert states == {"1:00:00:00:00:01:30": FAILED, "1:00:02:00:00:03:30": TRANSCRIBED, "1:00:04:00:00:05:30": CLASSIFIED}
+    assert VDdb.pending_clip_clause(TABLE_NAME)[0] != "1"
+
+
+class CrashingClassificationBackend(FakeClassificationBackend):
+    """Fails the requests after the first few, as if the run had stopped halfway through the classification."""
+    def __init__(self, successfulRequests: int) -> None:
+        super().__init__(noise=0)
+        self.successfulRequests = successfulRequests
+        self._lock = threading.Lock() # The transcripts are classified by several threads
+
+    def classify(self, transcript: str) -> int | None:
+        with self._lock:
+            isCrashed = self.successfulRequests <= 0
+            self.successfulRequests -= 1
+        if isCrashed:
+            raise ConnectionError("The connection was reset")
+        return super().classify(transcript)
+
+
+def test_a_restart_does_no_repeated_work(openDatabase):
+    VDdb = openDatabase(RetryPolicy(maxAttempts=3, backoffSeconds=0))
+    videoLink = FakeSeries(1).links[0]
+    clipKeys = [f"1:00:0{minute}:00:00:0{minute}:30" for minute in range(5)]
+    for minute, clipKey in enumerate(clipKeys):
+        VDdb.add_case(TABLE_NAME, clipKey, videoLink, episode=1, start_second=minute * 60, end_second=minute * 60 + 30,
+                      **VDdb.clip_state_fields(TABLE_NAME, PLANNED))
+    VDdb.flush()
+
+    def run(classificationBackend: FakeClassificationBackend) -> tuple[dict, dict]:
+        backends = {"downloader": FakeDownloadBackend(), "transcriptionBackend": FakeTranscriptionBackend(),
+                    "classificationBackend": classificationBackend}
+        clipStates = resume_unfinished_clips(TABLE_NAME, VDdb, None, None, **backends)
+        VDdb.flush()
+        return clipStates, {name: len(backend.service.latencies) for name, backend in backends.items()}
+
+    firstStates, firstCalls = run(CrashingClassificationBackend(successfulRequests=2))
+    assert firstCalls == {"downloader": 5, "transcriptionBackend": 5, "classificationBackend": 2}
+    assert firstStates == {CLASSIFIED: 2, FAILED: 3}
+
+    # The restart only classifies the clips that failed, without downloading or transcribing anything again
+    secondStates, secondCalls = run(FakeClassificationBackend(noise=0))
+    assert secondCalls == {"downloader": 0, "transcriptionBackend": 0, "classificationBackend": 3}
+    assert secondStates == {CLASSIFIED: 5}
+
+    _, thirdCalls = run(FakeClassificationBackend(noise=0))
+    assert thirdCalls == {"downloader": 0, "transcriptionBackend": 0, "classificationBackend": 0}
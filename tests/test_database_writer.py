@@ -0,0 +1,107 @@
+import sqlite3 as sq
+
+import pytest
+
+from src.database import database_writer
+from src.database.database_writer import DatabaseWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = DatabaseWriter(str(tmp_path / "test.db"), flushInterval=0.01)
+    writer.submit("CREATE TABLE clips (episode_timeframe TEXT PRIMARY KEY, transcript TEXT)").result()
+    yield writer
+    writer.close()
+
+
+def read_keys(writer: DatabaseWriter) -> list[str]:
+    with sq.connect(writer.dbPath) as conn:
+        return [row[0] for row in conn.execute("SELECT episode_timeframe FROM clips ORDER BY episode_timeframe")]
+
+
+def test_failing_statement_only_fails_its_own_future(writer):
+    first = writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:00:00:00:01:30", "a"))
+    duplicate = writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:00:00:00:01:30", "b"))
+    second = writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:02:00:00:03:30", "c"))
+
+    assert first.result() is None and second.result() is None
+    with pytest.raises(sq.IntegrityError):
+        duplicate.result()
+    assert read_keys(writer) == ["1:00:00:00:00:01:30", "1:00:02:00:00:03:30"]
+
+
+def test_unexpected_error_fails_the_batch_and_the_writer_keeps_serving(writer, monkeypatch):
+    failingWrites = []
+    writeBatch = writer._write_batch
+
+    def write_batch(conn, batch):
+        if not failingWrites:
+            failingWrites.append(batch)
+            conn.execute("BEGIN")
+            raise ValueError("Not an SQLite error")
+        writeBatch(conn, batch)
+
+    monkeypatch.setattr(writer, "_write_batch", write_batch)
+    failed = writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:00:00:00:01:30", "a"))
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+
+    writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:02:00:00:03:30", "b")).result(timeout=5)
+    writer.flush()
+    assert read_keys(writer) == ["1:00:02:00:00:03:30"]
+
+
+def test_metrics_error_doesnt_stop_the_writer(writer, monkeypatch):
+    class BrokenMetrics():
+        def __getattr__(self, name):
+            raise RuntimeError("The metrics are broken")
+
+    monkeypatch.setattr(database_writer, "get_metrics", lambda: BrokenMetrics())
+    with pytest.raises(RuntimeError, match="metrics"):
+        writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:00:00:00:01:30", "a")).result(timeout=5)
+
+    monkeypatch.undo()
+    writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:02:00:00:03:30", "b")).result(timeout=5)
+    assert read_keys(writer) == ["1:00:02:00:00:03:30"]
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_writer_fails_the_waiting_and_later_requests(writer, monkeypatch):
+    def kill_thread(conn, batch):
+        raise SystemExit # Ends the thread without being caught as an ordinary error
+
+    monkeypatch.setattr(writer, "_write_batch", kill_thread)
+    with pytest.raises(RuntimeError, match="died"):
+        writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:00:00:00:01:30", "a")).result(timeout=5)
+    writer._thread.join(timeout=5)
+
+    with pytest.raises(RuntimeError, match="has stopped"):
+        writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:02:00:00:03:30", "b"))
+    with pytest.raises(RuntimeError, match="has stopped"):
+        writer.flush()
+
+
+def test_closed_writer_commits_the_pending_writes_and_refuses_new_ones(tmp_path):
+    writer = DatabaseWriter(str(tmp_path / "test.db"), flushInterval=10)
+    writer.submit("CREATE TABLE clips (episode_timeframe TEXT PRIMARY KEY, transcript TEXT)")
+    pending = writer.submit_atomic("INSERT INTO clips VALUES (?, ?)", [("1:00:00:00:00:01:30", "a"), ("1:00:02:00:00:03:30", "b")])
+    writer.close()
+
+    assert pending.result(timeout=0) is None
+    assert read_keys(writer) == ["1:00:00:00:00:01:30", "1:00:02:00:00:03:30"]
+    with pytest.raises(RuntimeError, match="closed"):
+        writer.submit("DELETE FROM clips")
+
+
+def test_transaction_is_written_all_or_nothing(writer):
+    writer.submit("INSERT INTO clips VALUES (?, ?)", ("1:00:00:00:00:01:30", "a")).result()
+
+    failed = writer.submit_transaction([("DELETE FROM clips WHERE episode_timeframe = ?", [("1:00:00:00:00:01:30",)]),
+                                        ("INSERT INTO clips VALUES (?, ?)", [("1:00:02:00:00:03:30", "b"), ("1:00:02:00:00:03:30", "c")])])
+    with pytest.raises(sq.IntegrityError):
+        failed.result(timeout=5)
+    assert read_keys(writer) == ["1:00:00:00:00:01:30"]
+
+    writer.submit_transaction([("DELETE FROM clips WHERE episode_timeframe = ?", [("1:00:00:00:00:01:30",)]),
+                               ("INSERT INTO clips VALUES (?, ?)", [("1:00:02:00:00:03:30", "b")])]).result(timeout=5)
+    assert read_keys(writer) == ["1:00:02:00:00:03:30"]
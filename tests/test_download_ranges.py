@@ -0,0 +1,134 @@
+import os
+import shutil
+import wave
+
+import httpx
+import pytest
+import yt_dlp
+
+from src.backends.fake_servers import LocalMediaServer
+from src.utils import functions
+from src.utils.functions import download_stream_ranges, load_audio_ranges
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg isn't installed")
+
+SAMPLE_RATE = 8000
+EPISODE_SECONDS = 20
+# The headers that yt-dlp resolves along with the stream URL and that the media server requires
+STREAM_HEADERS = {"User-Agent": "Mozilla/5.0 (stand-in)", "X-Stream-Token": "resolved-once"}
+
+
+def write_episode(path: str, seconds: int = EPISODE_SECONDS) -> None:
+    with wave.open(path, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        file.writeframes(bytes(range(256)) * (seconds * SAMPLE_RATE * 2 // 256))
+
+
+def clip_seconds(path: str) -> float:
+    with wave.open(path, "rb") as file:
+        return file.getnframes() / file.getframerate()
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    mediaDirectory = tmp_path / "media"
+    mediaDirectory.mkdir()
+    write_episode(str(mediaDirectory / "episode.wav"))
+    with LocalMediaServer(str(mediaDirectory), STREAM_HEADERS) as server:
+        yield server
+
+
+class FakeYoutubeDL():
+    """Resolves every link to the episode on the local media server, counting the resolutions."""
+    extractedLinks = []
+    streamUrl = None
+
+    def __init__(self, options: dict) -> None:
+        self.options = options
+
+    def __enter__(self) -> "FakeYoutubeDL":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def extract_info(self, link: str, download: bool = True) -> dict:
+        assert not download
+        FakeYoutubeDL.extractedLinks.append(link)
+        if "unavailable" in link:
+            raise yt_dlp.utils.DownloadError("ERROR: Video unavailable")
+        return {"title": "Yalı Çapkını 1. Bölüm", "ext": "wav", "url": FakeYoutubeDL.streamUrl, "http_headers": STREAM_HEADERS}
+
+    def prepare_filename(self, info: dict, outtmpl: str) -> str:
+        fileName = outtmpl.replace("%(title)s", info["title"]).replace("%(ext)s", info["ext"])
+        return os.path.join(self.options["paths"]["home"], fileName)
+
+
+@pytest.fixture
+def fake_youtube_dl(monkeypatch, media_server):
+    FakeYoutubeDL.extractedLinks = []
+    FakeYoutubeDL.streamUrl = media_server.file_url("episode.wav")
+    monkeypatch.setattr(functions.yt_dlp, "YoutubeDL", FakeYoutubeDL)
+    return FakeYoutubeDL
+
+
+@requires_ffmpeg
+def test_stream_ranges_are_cut_from_the_served_stream(tmp_path, media_server):
+    sections = {("00:00:01", "00:00:04"): str(tmp_path / "first.wav"), ("00:00:10", "00:00:15"): str(tmp_path / "second.wav")}
+
+    errors = download_stream_ranges(media_server.file_url("episode.wav"), sections, STREAM_HEADERS)
+
+    assert errors == {section: None for section in sections}
+    assert clip_seconds(str(tmp_path / "first.wav")) == pytest.approx(3, abs=0.1)
+    assert clip_seconds(str(tmp_path / "second.wav")) == pytest.approx(5, abs=0.1)
+
+
+@requires_ffmpeg
+def test_stream_ranges_report_the_error_of_every_range(tmp_path, media_server):
+    sections = {("00:00:01", "00:00:04"): str(tmp_path / "first.wav")}
+
+    # Without the resolved headers the server refuses the stream
+    errors = download_stream_ranges(media_server.file_url("episode.wav"), sections)
+
+    assert errors[("00:00:01", "00:00:04")] is not None
+    assert not os.path.exists(tmp_path / "first.wav")
+    assert media_server.requestCounts[("GET", "/episode.wav")] >= 1
+
+
+@requires_ffmpeg
+def test_audio_ranges_resolve_the_stream_once_per_video(tmp_path, monkeypatch, fake_youtube_dl):
+    monkeypatch.chdir(tmp_path)
+    sections = [("00:00:01", "00:00:04"), ("00:00:05", "00:00:07"), ("00:00:12", "00:00:18")]
+
+    results = load_audio_ranges("YalıÇapkını", "https://www.youtube.com/watch?v=-u_RlLqmopg", "wav", sections)
+
+    assert fake_youtube_dl.extractedLinks == ["https://www.youtube.com/watch?v=-u_RlLqmopg"]
+    for section, (path, error) in results.items():
+        # Saved with the same name as `load_audio` gives the clip
+        assert path == os.path.normpath(f"audios/YalıÇapkınıAudios/Yalı Çapkını 1. Bölüm{section[0]}.wav")
+        assert error is None
+        assert clip_seconds(path) == pytest.approx(functions.convert(section[1]) - functions.convert(section[0]), abs=0.1)
+
+
+def test_audio_ranges_report_a_stream_that_cant_be_resolved(tmp_path, monkeypatch, fake_youtube_dl):
+    monkeypatch.chdir(tmp_path)
+    sections = [("00:00:01", "00:00:04"), ("00:00:05", "00:00:07")]
+
+    results = load_audio_ranges("YalıÇapkını", "https://www.youtube.com/watch?v=unavailable", "wav", sections)
+
+    assert set(results) == set(sections)
+    for path, error in results.values():
+        assert path is None
+        assert "Could not resolve the audio stream" in error
+
+
+def test_media_server_serves_byte_ranges_only_with_the_resolved_headers(media_server):
+    url = media_server.file_url("episode.wav")
+    assert httpx.get(url).status_code == 403
+    response = httpx.get(url, headers={**STREAM_HEADERS, "Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert len(response.content) == 10
+    assert response.headers["Content-Range"].startswith("bytes 10-19/")
+    assert httpx.get(media_server.file_url("missing.wav"), headers=STREAM_HEADERS).status_code == 404
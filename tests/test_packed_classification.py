@@ -0,0 +1,130 @@
+import openai
+import pytest
+
+from src.backends.fake_servers import FakeOpenAIServer
+from src.backends.fakes import NON_VIOLENT_SENTENCES, VIOLENT_SENTENCES
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.detection.packed_classification import PackedClassifier, analyse_transcripts_packed
+from src.detection.token_budget import UTTERANCE_SEPARATOR, TokenBudget, TokenUsage
+
+API_KEY = "test-key"
+TABLE_NAME = "YalıÇapkını"
+
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer(API_KEY) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    return openai.OpenAI(api_key=API_KEY, base_url=server.baseUrl, max_retries=0)
+
+
+def make_transcripts(clipCount: int) -> dict[str, str]:
+    sentences = NON_VIOLENT_SENTENCES + VIOLENT_SENTENCES
+    return {f"1:{index:08d}": f"Speaker A: {sentences[index % len(sentences)]}" for index in range(clipCount)}
+
+
+def expected_classification(transcript: str) -> int:
+    return int(any(sentence in transcript for sentence in VIOLENT_SENTENCES))
+
+
+def test_every_clip_is_classified_in_packs(client, server):
+    transcripts = make_transcripts(30)
+    classifier = PackedClassifier(client, maxPackSize=5, maxWorkers=2)
+
+    results = classifier.classify(transcripts)
+
+    assert results == {clipKey: expected_classification(transcript) for clipKey, transcript in transcripts.items()}
+    assert classifier.packedRequests == len(server.chatRequestBodies) == 6
+    assert classifier.fallbackRequests == 0
+
+
+def test_clip_left_out_of_a_pack_is_classified_alone(client, server):
+    transcripts = make_transcripts(4)
+    transcripts["1:00000002"] = f"{FakeOpenAIServer.FAILING_MARKER} {transcripts['1:00000002']}"
+    classifier = PackedClassifier(client, maxPackSize=4, maxWorkers=1)
+
+    results = classifier.classify(transcripts)
+
+    assert results["1:00000002"] is None # The single-clip prompt gets no classification either
+    assert all(results[clipKey] == expected_classification(transcript) for clipKey, transcript in transcripts.items() if clipKey != "1:00000002")
+    assert classifier.fallbackRequests == 1
+
+
+def test_transcripts_are_read_as_the_packs_are_made(client):
+    transcripts = make_transcripts(200)
+    readCount, answeredCount, maxHeldCount = 0, 0, 0
+
+    def read_transcripts():
+        nonlocal readCount, maxHeldCount
+        for clip in transcripts.items():
+            readCount += 1
+            maxHeldCount = max(maxHeldCount, readCount - answeredCount)
+            yield clip
+
+    def count_answer(clipKey: str, classification: int | None, usage: TokenUsage) -> None:
+        nonlocal answeredCount
+        answeredCount += 1
+
+    classifier = PackedClassifier(client, maxPackSize=5, maxWorkers=2)
+    results = classifier.classify(read_transcripts(), count_answer)
+
+    assert len(results) == answeredCount == len(transcripts)
+    # At most a pack for every worker being answered and as many waiting
+    assert maxHeldCount <= 2 * classifier.maxWorkers * classifier.maxPackSize
+
+
+def total_usage(usages) -> TokenUsage:
+    return sum(usages, TokenUsage())
+
+
+def test_usage_of_the_packed_requests_is_shared_by_their_clips(client, server):
+    transcripts = make_transcripts(12)
+    usages = {}
+    classifier = PackedClassifier(client, maxPackSize=4, maxWorkers=2)
+
+    classifier.classify(transcripts, lambda clipKey, classification, usage: usages.__setitem__(clipKey, usage))
+
+    serverUsage = total_usage(TokenUsage(usage["prompt_tokens"], usage["completion_tokens"], usage["prompt_tokens_details"]["cached_tokens"])
+                              for usage in server.chatUsages)
+    assert set(usages) == set(transcripts)
+    assert all(usage.promptTokens > 0 for usage in usages.values())
+    assert total_usage(usages.values()) == classifier.tokenUsage == serverUsage
+
+
+def test_trimmed_transcript_is_packed_and_split_transcript_is_classified_alone(client, server):
+    longTranscript = UTTERANCE_SEPARATOR.join(f"Speaker A: {index}. {sentence}" for index, sentence in enumerate(NON_VIOLENT_SENTENCES * 4))
+    transcripts = make_transcripts(3)
+    transcripts["2:00000000"] = longTranscript
+
+    trimBudget = TokenBudget(maxTranscriptTokens=40, overflow="trim")
+    PackedClassifier(client, maxPackSize=4, maxWorkers=1, tokenBudget=trimBudget).classify(transcripts)
+    packedContent, = [body["messages"][-1]["content"] for body in server.chatRequestBodies]
+    assert trimBudget.fit(longTranscript)[0] in packedContent and longTranscript not in packedContent
+
+    splitBudget = TokenBudget(maxTranscriptTokens=40, overflow="split")
+    classifier = PackedClassifier(client, maxPackSize=4, maxWorkers=1, tokenBudget=splitBudget)
+    results = classifier.classify(transcripts)
+    assert results == {clipKey: expected_classification(transcript) for clipKey, transcript in transcripts.items()}
+    assert classifier.packedRequests == 1 and classifier.fallbackRequests == 1
+    sentParts = [body["messages"][-1]["content"] for body in server.chatRequestBodies[1:]]
+    assert sentParts.count(longTranscript) == 0 and len(sentParts) == 1 + len(splitBudget.fit(longTranscript))
+
+
+def test_tokens_are_stored_with_the_classifications(tmp_path, monkeypatch, server):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    transcripts = make_transcripts(6)
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        for episodeAndTimeframe, transcript in transcripts.items():
+            VDdb.add_case(TABLE_NAME, episodeAndTimeframe, "https://www.youtube.com/watch?v=-u_RlLqmopg", transcript=transcript)
+
+        analyse_transcripts_packed(API_KEY, TABLE_NAME, VDdb, maxPackSize=3, baseUrl=server.baseUrl)
+        VDdb.flush()
+        rows = list(VDdb.iter_rows(TABLE_NAME, ["llm_violence_prediction", "prompt_tokens", "completion_tokens"]))
+
+    assert all(prediction is not None and promptTokens > 0 and completionTokens > 0 for prediction, promptTokens, completionTokens in rows)
+    assert sum(promptTokens for _, promptTokens, _ in rows) == sum(usage["prompt_tokens"] for usage in server.chatUsages)
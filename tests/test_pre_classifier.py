@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from src.backends.fake_servers import FakeOpenAIServer
+from src.backends.fakes import NON_VIOLENT_SENTENCES, VIOLENT_SENTENCES, FakeClassificationBackend
+from src.database.violence_detection_database import (LLM_PREDICTION, PRE_CLASSIFIER_PREDICTION, SERIES_TABLE_COLUMNS,
+                                                      ViolenceDetectionDatabase)
+from src.detection.batch_classification import classify_transcripts_in_batch
+from src.detection.detect_violence import classify_transcript
+from src.detection.packed_classification import analyse_transcripts_packed
+from src.detection.pre_classifier import HashedNgramFeaturizer, PreClassifier
+
+API_KEY = "test-key"
+TABLE_NAME = "YalıÇapkını"
+FEATURE_COUNT = 2 ** 12
+
+
+def make_training_data() -> tuple[list[str], list[int]]:
+    transcripts = [f"Speaker A: {first} Speaker B: {second}" for first in NON_VIOLENT_SENTENCES for second in NON_VIOLENT_SENTENCES]
+    transcripts += [f"Speaker A: {first} Speaker B: {violent}" for first in NON_VIOLENT_SENTENCES for violent in VIOLENT_SENTENCES]
+    return transcripts, [0] * len(NON_VIOLENT_SENTENCES) ** 2 + [1] * len(NON_VIOLENT_SENTENCES) * len(VIOLENT_SENTENCES)
+
+
+@pytest.fixture(scope="module")
+def preClassifier():
+    return PreClassifier(threshold=0.5, featureCount=FEATURE_COUNT).fit(*make_training_data())
+
+
+@pytest.fixture
+def VDdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS, violence="INT")
+        yield VDdb
+
+
+def add_transcripts(VDdb: ViolenceDetectionDatabase, transcripts: dict[str, str]) -> None:
+    for episodeAndTimeframe, transcript in transcripts.items():
+        VDdb.add_case(TABLE_NAME, episodeAndTimeframe, "https://www.youtube.com/watch?v=-u_RlLqmopg", transcript=transcript, violence=0)
+    VDdb.flush()
+
+
+def prediction_sources(VDdb: ViolenceDetectionDatabase) -> dict[str, tuple]:
+    return {key: (prediction, source) for key, prediction, source in
+            VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "llm_violence_prediction", "prediction_source"])}
+
+
+def test_featurizer_is_deterministic_and_normalized():
+    featurizer = HashedNgramFeaturizer(FEATURE_COUNT)
+
+    rowPointers, indices, values = featurizer.transform(["Speaker A: IRMAK ışıl ışıl", "Speaker B: ırmak ışıl ışıl", ""])
+
+    assert rowPointers[2] == 2 * rowPointers[1]
+    # The speaker labels are dropped and the Turkish capital I's are lowercased to their dotless form
+    assert np.array_equal(indices[:rowPointers[1]], indices[rowPointers[1]:rowPointers[2]])
+    assert np.linalg.norm(values[:rowPointers[1]]) == pytest.approx(1)
+    assert rowPointers[3] == rowPointers[2] # An empty transcript has no features
+    assert np.array_equal(featurizer.transform(["Çay demlendi"])[1], featurizer.transform(["Çay demlendi"])[1])
+    assert indices.max() < FEATURE_COUNT
+
+
+def test_fit_separates_the_training_clips(preClassifier):
+    transcripts, labels = make_training_data()
+
+    probabilities = preClassifier.predict_proba(transcripts)
+
+    assert np.all((probabilities > 0.5) == np.array(labels, dtype=bool))
+    assert preClassifier.is_clearly_non_violent(transcripts[0]) and not preClassifier.is_clearly_non_violent(transcripts[-1])
+    assert (preClassifier.skippedCount, preClassifier.passedCount) == (1, 1)
+
+
+def test_saved_model_gives_the_same_scores(preClassifier, tmp_path):
+    transcripts, _ = make_training_data()
+    path = str(tmp_path / "models" / "pre_classifier.npz")
+
+    preClassifier.save(path)
+    loaded = PreClassifier.load(path)
+
+    assert loaded.threshold == preClassifier.threshold
+    assert np.allclose(loaded.predict_proba(transcripts), preClassifier.predict_proba(transcripts))
+    assert PreClassifier.load(path, threshold=0.05).threshold == 0.05
+
+
+def test_pre_classified_clips_are_marked_and_left_out_of_the_llm_accuracy(VDdb, preClassifier):
+    benignKey, violentKey = "1:00:00:00:00:01:30", "1:00:02:00:00:03:30"
+    transcripts = {benignKey: f"Speaker A: {NON_VIOLENT_SENTENCES[0]}", violentKey: f"Speaker A: {VIOLENT_SENTENCES[0]}"}
+    add_transcripts(VDdb, transcripts)
+    backend = FakeClassificationBackend(noise=0)
+
+    for episodeAndTimeframe, transcript in transcripts.items():
+        classify_transcript(transcript, VDdb, TABLE_NAME, episodeAndTimeframe, backend, preClassifier=preClassifier)
+    VDdb.flush()
+
+    assert prediction_sources(VDdb) == {benignKey: (0, PRE_CLASSIFIER_PREDICTION), violentKey: (1, LLM_PREDICTION)}
+    assert len(backend.service.latencies) == 1
+    assert VDdb.prediction_statistics(TABLE_NAME)["pre_classified"] == 1
+    assert VDdb.accuracy_statistics(TABLE_NAME)["true_negative"] == 1
+    assert VDdb.accuracy_statistics(TABLE_NAME, llmOnly=True)["true_negative"] == 0
+
+
+@pytest.mark.parametrize("mode", ["packed", "batch"])
+def test_pre_classified_clips_arent_sent_in_packed_and_batch_modes(VDdb, preClassifier, mode):
+    transcripts = {f"1:00:0{index}:00:00:0{index}:30": f"Speaker A: {sentence}" for index, sentence in
+                   enumerate(NON_VIOLENT_SENTENCES[:3] + VIOLENT_SENTENCES[:2])}
+    add_transcripts(VDdb, transcripts)
+
+    with FakeOpenAIServer(API_KEY) as server:
+        if mode == "packed":
+            analyse_transcripts_packed(API_KEY, TABLE_NAME, VDdb, baseUrl=server.baseUrl, preClassifier=preClassifier)
+            sentContent = "\n".join(body["messages"][-1]["content"] for body in server.chatRequestBodies)
+        else:
+            classify_transcripts_in_batch(API_KEY, TABLE_NAME, VDdb, server.baseUrl, pollInterval=0.02, preClassifier=preClassifier)
+            sentContent = "\n".join(body["messages"][-1]["content"] for body in server.requestBodies)
+    VDdb.flush()
+
+    sources = prediction_sources(VDdb)
+    for episodeAndTimeframe, transcript in transcripts.items():
+        isViolent = any(sentence in transcript for sentence in VIOLENT_SENTENCES)
+        assert sources[episodeAndTimeframe] == (int(isViolent), LLM_PREDICTION if isViolent else PRE_CLASSIFIER_PREDICTION)
+        assert (transcript in sentContent) == isViolent
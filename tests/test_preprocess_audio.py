@@ -0,0 +1,101 @@
+import shutil
+import wave
+
+import numpy as np
+import pytest
+
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.download_and_transcription.preprocess_audio import AudioPreprocessor, preprocess_audio_file, preprocess_audio_in_parallel, preprocessed_path
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg isn't installed")
+
+SAMPLE_RATE = 16000
+TABLE_NAME = "YalıÇapkını"
+EPISODE_AND_TIMEFRAME = "1:00:00:00:00:01:30"
+UTTERANCES = [{"speaker": "A", "text": "Çay demlendi, gel otur.", "start": 0, "end": 1500},
+              {"speaker": "B", "text": "Annem seni çok özledi.", "start": 1600, "end": 2900}]
+
+
+def write_clip(path: str, leadingSilence: float, speech: float, trailingSilence: float) -> None:
+    """Writes a clip of a tone between two silences."""
+    time = np.arange(int(speech * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = (np.sin(2 * np.pi * 440 * time) * 12000).astype(np.int16)
+    samples = np.concatenate([np.zeros(int(leadingSilence * SAMPLE_RATE), np.int16), tone, np.zeros(int(trailingSilence * SAMPLE_RATE), np.int16)])
+    with wave.open(path, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        file.writeframes(samples.tobytes())
+
+
+@pytest.fixture
+def VDdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        yield VDdb
+
+
+def test_utterances_are_shifted_by_the_trimmed_silence(VDdb):
+    VDdb.add_case(TABLE_NAME, EPISODE_AND_TIMEFRAME, "link", audio_path="clip.speech.ogg", audio_offset_ms=1250)
+
+    VDdb.store_utterances(TABLE_NAME, UTTERANCES + [{"speaker": "A", "text": "Migrated", "start": None, "end": None}],
+                          audioPath="clip.speech.ogg").result()
+
+    utterances = VDdb.get_utterances(TABLE_NAME, EPISODE_AND_TIMEFRAME)
+    assert [(utterance["start"], utterance["end"]) for utterance in utterances] == [(1250, 2750), (2850, 4150), (None, None)]
+
+
+def test_utterances_of_a_clip_that_wasnt_trimmed_arent_shifted(VDdb):
+    VDdb.add_case(TABLE_NAME, EPISODE_AND_TIMEFRAME, "link", audio_path="clip.wav")
+
+    VDdb.store_utterances(TABLE_NAME, UTTERANCES, EPISODE_AND_TIMEFRAME).result()
+
+    assert VDdb.get_utterances(TABLE_NAME, EPISODE_AND_TIMEFRAME) == UTTERANCES
+
+
+@requires_ffmpeg
+def test_trimmed_start_is_returned_and_stored(VDdb, tmp_path):
+    audioPath = str(tmp_path / "clip.wav")
+    write_clip(audioPath, leadingSilence=2.0, speech=1.0, trailingSilence=1.5)
+    VDdb.add_case(TABLE_NAME, EPISODE_AND_TIMEFRAME, "link", audio_path=audioPath)
+
+    result = preprocess_audio_file(audioPath, preprocessed_path(audioPath), paddingSeconds=0.25)
+    assert result.error is None
+    # The padding is kept before the speech
+    assert result.trimmedStartSeconds == pytest.approx(1.75, abs=0.05)
+    assert result.outputSeconds == pytest.approx(1.5, abs=0.1)
+
+    with AudioPreprocessor(maxWorkers=1) as preprocessor:
+        preprocessor.record(VDdb, TABLE_NAME, result)
+    VDdb.store_utterances(TABLE_NAME, UTTERANCES, audioPath=preprocessed_path(audioPath)).result()
+
+    # The utterances are placed where they are in the downloaded clip
+    firstUtterance = VDdb.get_utterances(TABLE_NAME, EPISODE_AND_TIMEFRAME)[0]
+    assert firstUtterance["start"] == round(result.trimmedStartSeconds * 1000)
+
+
+@requires_ffmpeg
+def test_untrimmed_clip_has_no_offset(tmp_path):
+    audioPath = str(tmp_path / "clip.wav")
+    write_clip(audioPath, leadingSilence=2.0, speech=1.0, trailingSilence=1.5)
+
+    result = preprocess_audio_file(audioPath, preprocessed_path(audioPath), trimSilence=False)
+
+    assert result.error is None and result.trimmedStartSeconds == 0.0
+
+
+def test_clip_that_cant_be_preprocessed_is_only_tried_once(VDdb, tmp_path):
+    audioPath = str(tmp_path / "broken.wav")
+    with open(audioPath, "wb") as file:
+        file.write(b"not an audio file")
+    VDdb.add_case(TABLE_NAME, EPISODE_AND_TIMEFRAME, "link", audio_path=audioPath)
+
+    with AudioPreprocessor(maxWorkers=1) as preprocessor:
+        result, = preprocess_audio_in_parallel(TABLE_NAME, VDdb, preprocessor)
+        assert result.error is not None
+        # The next run (e.g., a resumed one) leaves the clip to be transcribed as it was downloaded
+        assert preprocess_audio_in_parallel(TABLE_NAME, VDdb, preprocessor) == []
+
+    (storedPath, error), = VDdb.iter_rows(TABLE_NAME, ["audio_path", "preprocessing_error"])
+    assert storedPath == audioPath and error == result.error
@@ -0,0 +1,59 @@
+import pytest
+
+from src.utils.functions import convert, merge_search_ranges, plan_clips_from_metadata
+from src.utils.video_metadata import VideoMetadata
+
+DURATION = 1000
+
+
+def peaks_at(*seconds: int) -> list[tuple[float, float]]:
+    """Returns the heatmap peaks at the given seconds of the video."""
+    return [(second / DURATION, 1.0) for second in seconds]
+
+
+def clip_lengths(clips: dict[tuple[str], list[int]]) -> list[int]:
+    return [convert(end) - convert(start) for start, end in clips]
+
+
+def test_overlapping_windows_are_merged_into_one_clip():
+    clips = merge_search_ranges(peaks_at(100, 130, 400), 90, DURATION)
+
+    assert clips == {("00:00:55", "00:02:55"): [100, 130], ("00:05:55", "00:07:25"): [400]}
+
+
+def test_windows_closer_than_the_gap_tolerance_are_merged():
+    # The windows of 100 and 200 are 10 seconds apart
+    assert len(merge_search_ranges(peaks_at(100, 200), 90, DURATION, gapTolerance=5)) == 2
+    assert merge_search_ranges(peaks_at(100, 200), 90, DURATION, gapTolerance=10) == {("00:00:55", "00:04:05"): [100, 200]}
+
+
+def test_windows_outside_the_video_are_left_out():
+    assert merge_search_ranges(peaks_at(20, 500, 980), 90, DURATION) == {("00:07:35", "00:09:05"): [500]}
+
+
+def test_merged_clips_stay_within_the_maximum_length():
+    clips = merge_search_ranges(peaks_at(100, 110, 150, 200, 230, 300), 90, DURATION, gapTolerance=15, maxClipLength=120)
+
+    assert max(clip_lengths(clips)) <= 120
+    # Every peak is covered once, by a clip that contains it
+    assert sorted(peak for peaks in clips.values() for peak in peaks) == [100, 110, 150, 200, 230, 300]
+    for (start, end), peaks in clips.items():
+        assert all(convert(start) <= peak <= convert(end) for peak in peaks)
+    # The clips don't overlap, so no audio is downloaded twice
+    bounds = sorted((convert(start), convert(end)) for start, end in clips)
+    assert all(previous[1] <= following[0] for previous, following in zip(bounds, bounds[1:]))
+
+
+def test_maximum_length_shorter_than_a_window_is_rejected():
+    with pytest.raises(ValueError):
+        merge_search_ranges(peaks_at(100, 110, 500), 90, DURATION, maxClipLength=60)
+
+
+def test_planned_clips_keep_the_peaks_they_cover():
+    # Seven local maxima, of which the top 15% (one) is kept
+    yValues = [0.1, 0.5, 0.2, 0.6, 0.1, 0.3, 0.2, 0.9, 0.1, 0.4, 0.2, 0.7, 0.1, 0.35, 0.1]
+    metadata = VideoMetadata("videoId", "1. Bölüm", DURATION, [index / len(yValues) for index in range(len(yValues))], yValues)
+
+    clips = plan_clips_from_metadata(metadata, gapTolerance=15, maxClipLength=180)
+
+    assert list(clips.values()) == [[int(7 / len(yValues) * DURATION)]]
@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+
+import pytest
+import yaml
+
+from src.backends.fakes import (FakeClassificationBackend, FakeDownloadBackend, FakeMetadataBackend, FakeSeries, FakeServiceProfile,
+                                FakeTranscriptionBackend)
+from src.database.violence_detection_database import ViolenceDetectionDatabase
+from src.pipeline import series_runner
+from src.pipeline.series_runner import SeriesJob, load_manifest, run_series_jobs
+from src.utils.resource_budget import FairSemaphore, ResourceBudget
+
+
+class RecordingSemaphore(FairSemaphore):
+    """A `FairSemaphore` that records the owner of every slot it hands out and the most slots held at the same time."""
+    def __init__(self, name: str, capacity: int) -> None:
+        super().__init__(name, capacity)
+        self.owners = []
+        self.holders = 0
+        self.maxHolders = 0
+        self._recordLock = threading.Lock()
+
+    def acquire(self, owner: str) -> None:
+        super().acquire(owner)
+        with self._recordLock:
+            self.owners.append(owner)
+            self.holders += 1
+            self.maxHolders = max(self.maxHolders, self.holders)
+
+    def release(self) -> None:
+        with self._recordLock:
+            self.holders -= 1
+        super().release()
+
+
+def waiting_count(semaphore: FairSemaphore) -> int:
+    with semaphore._lock:
+        return sum(len(waiters) for waiters in semaphore._waiters.values())
+
+
+def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.001)
+
+
+def test_a_large_owner_cant_starve_a_small_one():
+    semaphore = RecordingSemaphore("transcription", 2)
+    started = threading.Event()
+
+    def hold(owner: str) -> None:
+        with semaphore.slot(owner):
+            started.wait(5)
+            time.sleep(0.001)
+
+    # The large owner's requests are all queued before the small owner's
+    largeThreads = [threading.Thread(target=hold, args=("large",)) for _ in range(20)]
+    for thread in largeThreads:
+        thread.start()
+    wait_until(lambda: waiting_count(semaphore) == 18)
+    smallThreads = [threading.Thread(target=hold, args=("small",)) for _ in range(3)]
+    for thread in smallThreads:
+        thread.start()
+    wait_until(lambda: waiting_count(semaphore) == 21)
+    started.set()
+    for thread in largeThreads + smallThreads:
+        thread.join(10)
+
+    assert semaphore.owners.count("large") == 20 and semaphore.owners.count("small") == 3
+    assert semaphore.maxHolders == 2 and semaphore.inUse == 0
+    # The free slots alternate between the owners, so the small owner is done long before the large one
+    # (served in turn from the third slot on, instead of after the large owner's 20 requests)
+    assert semaphore.owners[:2] == ["large", "large"] and semaphore.owners[:10].count("small") == 3
+
+
+def test_an_owner_alone_uses_every_slot():
+    semaphore = RecordingSemaphore("classification", 3)
+    for _ in range(3):
+        semaphore.acquire("alone")
+    blocked = threading.Thread(target=semaphore.acquire, args=("alone",))
+    blocked.start()
+    wait_until(lambda: waiting_count(semaphore) == 1)
+
+    semaphore.release() # The slot is handed to the waiting request instead of being freed
+    blocked.join(5)
+
+    assert not blocked.is_alive()
+    assert semaphore.maxHolders == 3 and semaphore.inUse == 3
+    with pytest.raises(ValueError):
+        FairSemaphore("scrape", 0)
+
+
+class SeriesMetadataBackend():
+    """Serves the pages of several fake series."""
+    def __init__(self, *series: FakeSeries) -> None:
+        self.backends = {link: FakeMetadataBackend(fakeSeries, FakeServiceProfile(0.005)) for fakeSeries in series for link in fakeSeries.links}
+
+    def fetch(self, videoLink: str):
+        return self.backends[videoLink].fetch(videoLink)
+
+
+def test_series_share_the_budget_without_starving_the_small_one(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directories of the tables are created in the working directory
+    largeSeries, smallSeries = FakeSeries(6, episodeMinutes=30, seed=1), FakeSeries(1, episodeMinutes=30, seed=2)
+    budget = ResourceBudget()
+    budget.scrape, budget.download = RecordingSemaphore("scrape", 1), RecordingSemaphore("download", 1)
+    budget.transcription, budget.classification = RecordingSemaphore("transcription", 2), RecordingSemaphore("classification", 2)
+    jobs = [SeriesJob("Large", largeSeries.links), SeriesJob("Small", smallSeries.links)]
+
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        reports = run_series_jobs(jobs, VDdb, None, None, budget, maxConcurrentSeries=2,
+                                  metadataBackend=SeriesMetadataBackend(largeSeries, smallSeries),
+                                  downloadBackend=FakeDownloadBackend(FakeServiceProfile(0.005)),
+                                  transcriptionBackend=FakeTranscriptionBackend(FakeServiceProfile(0.01)),
+                                  classificationBackend=FakeClassificationBackend(FakeServiceProfile(0.005), noise=0))
+        unclassifiedCounts = {tableName: VDdb.count_rows(tableName, "llm_violence_prediction IS ?", (None,)) for tableName in reports}
+
+    assert set(reports) == {"Large", "Small"} and unclassifiedCounts == {"Large": 0, "Small": 0}
+    assert all(not report.failures for report in reports.values())
+    for semaphore in (budget.scrape, budget.download, budget.transcription, budget.classification):
+        assert semaphore.maxHolders <= semaphore.capacity
+        assert semaphore.inUse == 0
+    # The small series' transcriptions don't wait for the large series' ones
+    owners = budget.transcription.owners
+    lastSlots = {tableName: len(owners) - 1 - owners[::-1].index(tableName) for tableName in reports}
+    assert lastSlots["Small"] < lastSlots["Large"]
+
+
+def write_manifest(path, manifest: dict) -> str:
+    with open(path, "w", encoding="utf-8") as file:
+        if str(path).endswith(".json"):
+            json.dump(manifest, file)
+        else:
+            yaml.safe_dump(manifest, file, allow_unicode=True)
+    return str(path)
+
+
+@pytest.mark.parametrize("fileName", ["manifest.yaml", "manifest.json"])
+def test_manifest_is_read_from_yaml_and_json(tmp_path, monkeypatch, fileName):
+    monkeypatch.setattr(series_runner, "expand_playlist", lambda playlist: [f"{playlist}&index={index}" for index in (1, 2)])
+    path = write_manifest(tmp_path / fileName, {"series": [{"table": "YalıÇapkını", "links": ["https://www.youtube.com/watch?v=-u_RlLqmopg"]},
+                                                           {"table": "Playlist", "links": ["first"], "playlist": "list"}],
+                                                "budget": {"transcriptionSlots": 3}, "maxConcurrentSeries": 2})
+
+    manifest = load_manifest(path)
+
+    assert [job.tableName for job in manifest.series] == ["YalıÇapkını", "Playlist"]
+    assert manifest.series[0].video_links() == ["https://www.youtube.com/watch?v=-u_RlLqmopg"]
+    # The playlist's videos come after the links
+    assert manifest.series[1].video_links() == ["first", "list&index=1", "list&index=2"]
+    assert (manifest.budget.transcription.capacity, manifest.budget.classification.capacity) == (3, 8)
+    assert manifest.maxConcurrentSeries == 2
+
+
+def test_invalid_manifests_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match="neither links nor a playlist"):
+        load_manifest(write_manifest(tmp_path / "empty.yaml", {"series": [{"table": "Empty"}]}))
+    with pytest.raises(ValueError, match="its own table"):
+        load_manifest(write_manifest(tmp_path / "duplicate.json", {"series": [{"table": "Same", "links": ["a"]},
+                                                                            {"table": "Same", "links": ["b"]}]}))
@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+
+from src.backends.fakes import (VIOLENT_SENTENCES, FakeClassificationBackend, FakeDownloadBackend, FakeMetadataBackend, FakeSeries,
+                                FakeTranscriptionBackend)
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.pipeline.streaming_pipeline import PipelineStage, StreamingPipeline
+from src.pipeline.violence_detection_pipeline import run_violence_detection_pipeline
+
+TABLE_NAME = "YalıÇapkını"
+
+
+def run_with_timeout(pipeline: StreamingPipeline, items, timeout: float = 10):
+    """Runs the pipeline in a thread so that a pipeline that never finishes fails the test instead of hanging it."""
+    outcome = {}
+
+    def run() -> None:
+        try:
+            outcome["report"] = pipeline.run(items)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "The pipeline didn't finish"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["report"]
+
+
+def test_end_of_stream_reaches_stages_with_different_concurrency():
+    pipeline = StreamingPipeline([PipelineStage("split", lambda item: [item, item + 0.5], concurrency=3, queueSize=2),
+                                  PipelineStage("double", lambda item: [item * 2], concurrency=5, queueSize=1),
+                                  PipelineStage("collect", lambda item: [item], concurrency=1, queueSize=4)])
+
+    report = run_with_timeout(pipeline, range(20))
+
+    assert sorted(report.results) == sorted(value * 2 for item in range(20) for value in (item, item + 0.5))
+    assert report.processedCounts == {"split": 20, "double": 40, "collect": 40}
+    assert [len(report.stageLatencies[name]) for name in ("split", "double", "collect")] == [20, 40, 40]
+    assert report.failures == []
+
+
+def test_a_slow_stage_holds_back_the_items_fed_to_the_pipeline():
+    lock = threading.Lock()
+    counts = {"fed": 0, "finished": 0, "maxInFlight": 0}
+
+    def feed():
+        for item in range(30):
+            with lock:
+                counts["fed"] += 1
+                counts["maxInFlight"] = max(counts["maxInFlight"], counts["fed"] - counts["finished"])
+            yield item
+
+    def slow(item: int) -> list[int]:
+        time.sleep(0.01)
+        with lock:
+            counts["finished"] += 1
+        return [item]
+
+    pipeline = StreamingPipeline([PipelineStage("fast", lambda item: [item], concurrency=1, queueSize=1),
+                                  PipelineStage("slow", slow, concurrency=1, queueSize=1)])
+
+    report = run_with_timeout(pipeline, feed())
+
+    assert sorted(report.results) == list(range(30))
+    # At most one item in each queue, one in each worker and the one being put into the first queue
+    assert counts["maxInFlight"] <= 5
+
+
+def test_failures_are_collected_and_the_other_items_go_on():
+    def check(item: int) -> list[int]:
+        if item % 3 == 0:
+            raise ValueError(f"Bad item {item}")
+        return [item]
+
+    pipeline = StreamingPipeline([PipelineStage("check", check, concurrency=2), PipelineStage("square", lambda item: [item ** 2])])
+
+    report = run_with_timeout(pipeline, range(10))
+
+    assert sorted(report.results) == [item ** 2 for item in range(10) if item % 3]
+    assert sorted(failure.item for failure in report.failures) == [0, 3, 6, 9]
+    assert {failure.stageName for failure in report.failures} == {"check"}
+    assert all(isinstance(failure.error, ValueError) and "Bad item" in failure.traceback for failure in report.failures)
+    assert report.processedCounts == {"check": 6, "square": 6}
+    assert "check: 6 succeeded, 4 failed" in report.summary()
+
+
+def test_first_result_time_is_before_the_end_of_the_run():
+    def slow(item: int) -> list[int]:
+        time.sleep(0.01 * item)
+        return [item]
+
+    pipeline = StreamingPipeline([PipelineStage("slow", slow, concurrency=1)])
+
+    report = run_with_timeout(pipeline, range(10))
+
+    assert report.firstResultTime is not None
+    assert report.firstResultTime < report.totalTime / 2
+    assert StreamingPipeline([PipelineStage("filter", lambda item: [])]).run(range(3)).firstResultTime is None
+
+
+def test_items_that_raise_still_end_the_stream():
+    processed = []
+
+    def items():
+        yield from range(3)
+        raise RuntimeError("The links couldn't be read")
+
+    pipeline = StreamingPipeline([PipelineStage("first", lambda item: [item], concurrency=2),
+                                  PipelineStage("record", lambda item: processed.append(item), concurrency=3)])
+
+    with pytest.raises(RuntimeError, match="couldn't be read"):
+        run_with_timeout(pipeline, items())
+    # The items fed before the error went through every stage
+    assert sorted(processed) == [0, 1, 2]
+
+
+@pytest.fixture
+def VDdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        VDdb.migrate_clip_keys(TABLE_NAME)
+        VDdb.migrate_clip_states(TABLE_NAME)
+        yield VDdb
+
+
+def test_violence_detection_pipeline_classifies_every_clip_with_the_fakes(VDdb):
+    series = FakeSeries(2, episodeMinutes=30)
+    classificationBackend = FakeClassificationBackend(noise=0)
+
+    report = run_violence_detection_pipeline(TABLE_NAME, series.links, VDdb, None, None, downloadConcurrency=2,
+                                             transcriptionConcurrency=3, classificationConcurrency=2, queueSize=2,
+                                             metadataBackend=FakeMetadataBackend(series), downloadBackend=FakeDownloadBackend(),
+                                             transcriptionBackend=FakeTranscriptionBackend(violentShare=0.5),
+                                             classificationBackend=classificationBackend)
+
+    rows = {key: (transcript, prediction) for key, transcript, prediction in
+            VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "transcript", "llm_violence_prediction"])}
+    assert rows and report.failures == []
+    assert dict(report.results) == {key: prediction for key, (_, prediction) in rows.items()}
+    for transcript, prediction in rows.values():
+        assert prediction == int(any(sentence in transcript for sentence in VIOLENT_SENTENCES))
+    assert report.processedCounts["download"] == 2
+    assert report.processedCounts["transcription"] == report.processedCounts["classification"] == len(rows)
+    assert len(classificationBackend.service.latencies) == len(rows)
+    assert 0 < report.firstResultTime <= report.totalTime
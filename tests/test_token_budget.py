@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from src.detection import token_budget
+from src.detection.token_budget import CHARACTERS_PER_TOKEN, TokenUsage, count_tokens
+
+
+class OfflineTiktoken():
+    """Stands in for tiktoken without the encoding files in its cache and without network access."""
+    def __init__(self) -> None:
+        self.loadCount = 0
+
+    def encoding_for_model(self, model: str):
+        self.loadCount += 1
+        raise ConnectionError("Name or service not known")
+
+
+@pytest.fixture
+def offlineTiktoken(monkeypatch):
+    tiktoken = OfflineTiktoken()
+    monkeypatch.setattr(token_budget, "tiktoken", tiktoken)
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+    token_budget._encoding.cache_clear()
+    yield tiktoken
+    token_budget._encoding.cache_clear()
+
+
+def test_tokens_are_estimated_without_the_tokenizer_and_reported_once(offlineTiktoken, capsys):
+    text = "Çay demlendi, gel otur."
+
+    counts = [count_tokens(text, "test-model") for _ in range(3)]
+
+    assert counts == [len(text) // CHARACTERS_PER_TOKEN + 1] * 3
+    assert offlineTiktoken.loadCount == 1
+    output = capsys.readouterr().out
+    assert output.count("Estimating the tokens of test-model") == 1
+    # The encoding is looked for in the project's cache
+    assert os.environ["TIKTOKEN_CACHE_DIR"] == os.path.abspath(token_budget.TIKTOKEN_CACHE_DIR)
+    assert os.environ["TIKTOKEN_CACHE_DIR"] in output
+
+
+def test_usage_is_shared_in_proportion_and_adds_up():
+    usage = TokenUsage(promptTokens=1000, completionTokens=7, cachedPromptTokens=333)
+
+    shares = usage.split([1, 2, 0, 1])
+
+    assert sum(shares, TokenUsage()) == usage
+    assert [share.promptTokens for share in shares] == [250, 500, 0, 250]
+    assert sum(share.promptTokens for share in TokenUsage(10, 1).split([0, 0, 0])) == 10
@@ -0,0 +1,48 @@
+import pytest
+
+from src.backends.fake_servers import FakeAssemblyAIServer
+from src.backends.fakes import FakeTranscriptionBackend, fake_utterances
+from src.database.violence_detection_database import SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+from src.download_and_transcription.transcribe import AssemblyAITranscriptionBackend, transcribe_audio_asynchronously
+
+API_KEY = "test-key"
+TABLE_NAME = "YalıÇapkını"
+AUDIO_CONTENTS = {"1:00:00:00:00:01:30": b"first clip", "1:00:02:00:00:03:30": b"second clip"}
+
+
+@pytest.fixture
+def VDdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        for index, (episodeAndTimeframe, content) in enumerate(AUDIO_CONTENTS.items()):
+            audioPath = f"audios/{TABLE_NAME}Audios/clip{index}.wav"
+            with open(audioPath, "wb") as file:
+                file.write(content)
+            VDdb.add_case(TABLE_NAME, episodeAndTimeframe, "https://www.youtube.com/watch?v=-u_RlLqmopg", audio_path=audioPath)
+        yield VDdb
+
+
+def assert_transcribed(VDdb: ViolenceDetectionDatabase) -> None:
+    for episodeAndTimeframe, content in AUDIO_CONTENTS.items():
+        assert VDdb.get_utterances(TABLE_NAME, episodeAndTimeframe) == fake_utterances(content)
+    assert VDdb.get_untranscribed_audio_paths(TABLE_NAME) == []
+
+
+def test_assemblyai_backend_is_transcribed_by_the_event_loop(VDdb):
+    with FakeAssemblyAIServer(API_KEY) as server:
+        transcribe_audio_asynchronously("unused-key", TABLE_NAME, VDdb, backend=AssemblyAITranscriptionBackend(API_KEY),
+                                        baseUrl=server.url, pollInterval=0.02)
+
+    assert_transcribed(VDdb)
+    # The backend's API key was used, and every file was uploaded once
+    assert server.requestCounts[("POST", "/v2/upload")] == len(AUDIO_CONTENTS)
+
+
+def test_other_backends_are_transcribed_with_their_own_calls(VDdb):
+    backend = FakeTranscriptionBackend(violentShare=0.15)
+
+    transcribe_audio_asynchronously(API_KEY, TABLE_NAME, VDdb, backend=backend)
+
+    assert_transcribed(VDdb)
+    assert len(backend.service.latencies) == len(AUDIO_CONTENTS)
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from src.utils.video_metadata import MetadataExtractionError, extract_video_id, parse_heatmap_path, parse_video_page
+
+# Watch pages saved from YouTube (trimmed to the parts the parser reads), so that the extraction is tested offline
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures", "watch_pages")
+
+
+def read_fixture(fileName: str) -> str:
+    with open(os.path.join(FIXTURES_DIRECTORY, fileName), encoding="utf-8") as file:
+        return file.read()
+
+
+def test_served_page_markers_are_sorted_and_normalized():
+    metadata = parse_video_page(read_fixture("served_with_markers.html"), "-u_RlLqmopg")
+
+    assert metadata.videoId == "-u_RlLqmopg"
+    assert metadata.title == "Yalı Çapkını 1. Bölüm - YouTube"
+    assert metadata.duration == 8000
+    assert metadata.xValues == [0.0, 0.25, 0.5, 0.75]
+    assert metadata.yValues == [1.0, 0.25, 0.5, 0.75]
+    assert json.loads(metadata.rawHeatMap) == [[0, 1.0], [2000000, 0.25], [4000000, 0.5], [6000000, 0.75]]
+
+
+def test_served_page_with_the_older_marker_layout():
+    metadata = parse_video_page(read_fixture("served_with_markers_older_layout.html"), "DehYOOQiLgI")
+
+    assert metadata.title == "Kızılcık Şerbeti 12. Bölüm - YouTube"
+    assert metadata.duration == 600
+    assert metadata.xValues == [0.0, 0.5]
+    assert metadata.yValues == [0.4, 1.0]
+
+
+def test_rendered_page_reads_the_svg_path_and_the_displayed_duration():
+    metadata = parse_video_page(read_fixture("rendered_with_heatmap_path.html"), "JgY_nQAagfA")
+
+    assert metadata.title == "Yalı Çapkını 2. Bölüm - YouTube"
+    assert metadata.duration == 2 * 3600 + 13 * 60 + 20
+    assert metadata.rawHeatMap.startswith("M 0.0,100.0")
+    assert metadata.xValues == pytest.approx([0.0, 0.25, 1.0, 1.0])
+    assert metadata.yValues == pytest.approx([0.3, 0.6, 1.0, 0.0])
+
+
+def test_page_without_a_heatmap_raises():
+    with pytest.raises(MetadataExtractionError, match="No heatmap"):
+        parse_video_page(read_fixture("served_without_heatmap.html"), "60CyQKY3_GU")
+
+
+def test_page_without_a_duration_raises():
+    html = read_fixture("served_with_markers.html").replace('"lengthSeconds":"8000",', "")
+    with pytest.raises(MetadataExtractionError, match="No duration"):
+        parse_video_page(html, "-u_RlLqmopg")
+
+
+def test_page_without_a_title_raises():
+    with pytest.raises(MetadataExtractionError, match="No title"):
+        parse_video_page("<html><body><p>Before you continue to YouTube</p></body></html>", "-u_RlLqmopg")
+
+
+def test_heatmap_path_skips_the_move_command():
+    xValues, yValues = parse_heatmap_path("M 0.0,100.0 C 1.0,90.0 2.0,80.0 5.0,70.0")
+    assert xValues == [0.0]
+    assert yValues == pytest.approx([0.3])
+
+
+@pytest.mark.parametrize("videoLink", ["https://www.youtube.com/watch?v=-u_RlLqmopg", "https://youtu.be/-u_RlLqmopg?t=30",
+                                       "https://www.youtube.com/watch?list=PL1&v=-u_RlLqmopg&index=2", "-u_RlLqmopg"])
+def test_extract_video_id(videoLink):
+    assert extract_video_id(videoLink) == "-u_RlLqmopg"
@@ -0,0 +1,144 @@
+import sqlite3 as sq
+
+import pytest
+
+from src.database.violence_detection_database import PRE_CLASSIFIER_PREDICTION, SERIES_TABLE_COLUMNS, ViolenceDetectionDatabase
+
+TABLE_NAME = "YalıÇapkını"
+EPISODE_AND_TIMEFRAME = "1:00:00:00:00:01:30"
+
+
+@pytest.fixture
+def VDdb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The audio directory of the table is created in the working directory
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        VDdb.add_case(TABLE_NAME, EPISODE_AND_TIMEFRAME, "link", audio_path="clip.wav")
+        yield VDdb
+
+
+def test_failed_utterances_keep_the_previous_ones(VDdb):
+    previousUtterances = [{"speaker": "A", "text": "Çay demlendi, gel otur.", "start": 0, "end": 1500}]
+    VDdb.store_utterances(TABLE_NAME, previousUtterances, EPISODE_AND_TIMEFRAME).result()
+
+    # An utterance without text can't be stored, so none of the new ones replace the previous ones
+    failed = VDdb.store_utterances(TABLE_NAME, [{"speaker": "B", "text": "Annem seni çok özledi.", "start": 0, "end": 1200},
+                                                {"speaker": "A", "text": None, "start": 1300, "end": 1500}], audioPath="clip.wav")
+    with pytest.raises(sq.IntegrityError):
+        failed.result(timeout=5)
+
+    assert VDdb.get_utterances(TABLE_NAME, EPISODE_AND_TIMEFRAME) == previousUtterances
+
+
+def test_stored_utterances_replace_the_previous_ones(VDdb):
+    VDdb.store_utterances(TABLE_NAME, [{"speaker": "A", "text": "Çay demlendi, gel otur.", "start": 0, "end": 1500},
+                                       {"speaker": "B", "text": "Geliyorum.", "start": 1600, "end": 2000}], EPISODE_AND_TIMEFRAME)
+    newUtterances = [{"speaker": "B", "text": "Annem seni çok özledi.", "start": 0, "end": 1200}]
+
+    VDdb.store_utterances(TABLE_NAME, newUtterances, audioPath="clip.wav").result()
+
+    assert VDdb.get_utterances(TABLE_NAME, EPISODE_AND_TIMEFRAME) == newUtterances
+    if VDdb.searchEnabled:
+        # The search index follows the replacement
+        assert [result["text"] for result in VDdb.search_utterances("Geliyorum OR özledi")] == ["Annem seni çok özledi."]
+
+
+@pytest.fixture
+def labelledVDdb(VDdb):
+    """The fixture's table with a known set of predictions and labels over two episodes (the fixture's clip isn't classified)."""
+    VDdb.create_table(TABLE_NAME, violence="INT")
+    clips = {"1:00:02:00:00:03:30": dict(llm_violence_prediction=1, peak_count=5, violence=1), # True positive
+             "1:00:04:00:00:05:30": dict(llm_violence_prediction=0, violence=0, episode=1), # True negative without a peak count
+             "1:00:06:00:00:07:30": dict(llm_violence_prediction=0, peak_count=2, violence=1), # False negative
+             "1:00:08:00:00:09:30": dict(llm_violence_prediction=1, peak_count=1, violence=1, episode=1), # True positive
+             "2:00:02:00:00:03:30": dict(llm_violence_prediction=1, peak_count=1, violence=0, episode=2), # False positive
+             "2:00:04:00:00:05:30": dict(llm_violence_prediction=0, episode=2), # Not labelled
+             "2:00:06:00:00:07:30": dict(llm_violence_prediction=0, peak_count=4, violence=0, episode=2,
+                                         prediction_source=PRE_CLASSIFIER_PREDICTION), # True negative
+             "2:00:08:00:00:09:30": dict(llm_violence_prediction=0, violence=1, episode=2)} # False negative
+    for episodeAndTimeframe, fields in clips.items():
+        VDdb.add_case(TABLE_NAME, episodeAndTimeframe, "link", **fields)
+    VDdb.flush()
+    return VDdb
+
+
+def test_prediction_statistics_weight_the_clips_by_their_peaks(labelledVDdb):
+    statistics = labelledVDdb.prediction_statistics(TABLE_NAME)
+
+    assert {key: statistics[key] for key in ("clips", "classified", "pre_classified", "violent")} == \
+           {"clips": 9, "classified": 8, "pre_classified": 1, "violent": 3}
+    # The violent clips cover 5 + 1 + 1 of the 16 peaks of the classified clips (a clip without a peak count covers one)
+    assert statistics["violent_percentage"] == pytest.approx(7 / 16 * 100)
+    assert statistics["clip_violent_percentage"] == pytest.approx(3 / 8 * 100)
+
+    # The clips without an episode number are grouped by the one in their identifier
+    byEpisode = labelledVDdb.prediction_statistics(TABLE_NAME, byEpisode=True)
+    assert list(byEpisode) == [1, 2]
+    assert (byEpisode[1]["clips"], byEpisode[1]["classified"], byEpisode[1]["violent"]) == (5, 4, 2)
+    assert byEpisode[1]["violent_percentage"] == pytest.approx(6 / 9 * 100)
+    assert (byEpisode[2]["clips"], byEpisode[2]["classified"], byEpisode[2]["pre_classified"]) == (4, 4, 1)
+    assert byEpisode[2]["violent_percentage"] == pytest.approx(1 / 7 * 100)
+    assert byEpisode[2]["clip_violent_percentage"] == pytest.approx(25)
+
+
+def test_accuracy_statistics_compare_the_labelled_clips(labelledVDdb):
+    statistics = labelledVDdb.accuracy_statistics(TABLE_NAME)
+
+    assert {key: statistics[key] for key in ("true_positive", "false_positive", "true_negative", "false_negative")} == \
+           {"true_positive": 2, "false_positive": 1, "true_negative": 2, "false_negative": 2}
+    assert statistics["accuracy"] == pytest.approx(4 / 7)
+    assert statistics["precision"] == pytest.approx(2 / 3)
+    assert statistics["recall"] == pytest.approx(1 / 2)
+    assert statistics["f1"] == pytest.approx(2 * (2 / 3) * (1 / 2) / (2 / 3 + 1 / 2))
+
+    assert labelledVDdb.accuracy_statistics(TABLE_NAME, llmOnly=True)["true_negative"] == 1
+    byEpisode = labelledVDdb.accuracy_statistics(TABLE_NAME, byEpisode=True)
+    assert (byEpisode[1]["precision"], byEpisode[1]["recall"], byEpisode[1]["f1"]) == (1, pytest.approx(2 / 3), pytest.approx(0.8))
+    # Without a true positive, the F1 score is undefined
+    assert (byEpisode[2]["accuracy"], byEpisode[2]["precision"], byEpisode[2]["recall"], byEpisode[2]["f1"]) == \
+           (pytest.approx(1 / 3), 0, 0, None)
+
+
+def test_series_statistics_compare_the_tables(labelledVDdb):
+    labelledVDdb.create_table("SenAnlatKaradeniz", **SERIES_TABLE_COLUMNS)
+    labelledVDdb.create_table("Empty", **SERIES_TABLE_COLUMNS)
+    labelledVDdb.add_case("SenAnlatKaradeniz", "3:00:02:00:00:03:30", "link", llm_violence_prediction=1, peak_count=2)
+    labelledVDdb.flush()
+
+    statistics = labelledVDdb.series_statistics([TABLE_NAME, "SenAnlatKaradeniz", "Empty"])
+
+    assert list(statistics) == [TABLE_NAME, "SenAnlatKaradeniz", "Empty"]
+    assert statistics[TABLE_NAME] == labelledVDdb.prediction_statistics(TABLE_NAME)
+    assert (statistics["SenAnlatKaradeniz"]["classified"], statistics["SenAnlatKaradeniz"]["violent_percentage"]) == (1, 100)
+    assert statistics["Empty"] == {"clips": 0, "classified": 0, "pre_classified": 0, "violent": 0, "violent_percentage": None,
+                                   "clip_violent_percentage": None}
+
+
+def test_long_transcripts_are_compressed_and_read_back_as_text(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    longTranscript = " | ".join(["Speaker A: Çay demlendi, gel otur.", "Speaker B: Annem seni çok özledi."] * 20)
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db"), compressionThreshold=100) as VDdb:
+        VDdb.create_table(TABLE_NAME, **SERIES_TABLE_COLUMNS)
+        VDdb.add_case(TABLE_NAME, "1:00:00:00:00:01:30", "link", transcript=longTranscript)
+        VDdb.add_case(TABLE_NAME, "1:00:02:00:00:03:30", "link", audio_path="short.wav")
+        VDdb.add_case(TABLE_NAME, "1:00:04:00:00:05:30", "link")
+        VDdb.update_case_by_audio_path(TABLE_NAME, "short.wav", transcript="Speaker A: Geliyorum.")
+        VDdb.update_cases(TABLE_NAME, {"1:00:04:00:00:05:30": {"transcript": longTranscript[::-1], "llm_violence_prediction": 0}})
+        VDdb.flush()
+
+        # Only the transcripts over the threshold are stored compressed
+        storedTypes = VDdb._read(f"SELECT typeof(transcript) FROM {TABLE_NAME} ORDER BY episode_timeframe")
+        assert [row[0] for row in storedTypes] == ["blob", "text", "blob"]
+        expected = {"1:00:00:00:00:01:30": longTranscript, "1:00:02:00:00:03:30": "Speaker A: Geliyorum.",
+                    "1:00:04:00:00:05:30": longTranscript[::-1]}
+        for keyset in (True, False):
+            assert dict(VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "transcript"], "transcript IS NOT NULL", keyset=keyset)) == expected
+        transcriptIndex = list(SERIES_TABLE_COLUMNS).index("transcript")
+        assert [row[transcriptIndex] for row in VDdb.select_all(TABLE_NAME)] == list(expected.values())
+        assert VDdb.select_page(TABLE_NAME, ["transcript"], limit=1)[0] == [(longTranscript,)]
+        assert VDdb.migrate_utterances(TABLE_NAME) == 3
+        assert len(VDdb.get_utterances(TABLE_NAME, "1:00:00:00:00:01:30")) == 40
+
+    # A database opened without the threshold reads the compressed transcripts too
+    with ViolenceDetectionDatabase(str(tmp_path / "test.db")) as VDdb:
+        assert dict(VDdb.iter_rows(TABLE_NAME, ["episode_timeframe", "transcript"])) == expected